@@ -32,12 +32,38 @@
 TG_BOT_TOKEN = os_getenv('TG_BOT_TOKEN')
 YANDEX_API_KEY = os_getenv('YANDEX_API_KEY')
 DB_PASSWORD = os_getenv('DB_PASSWORD')
+# Connections pool: seconds to wait for a free connection and seconds of a checkout to consider it as a leak
+DB_POOL_TIMEOUT = float(os_getenv('DB_POOL_TIMEOUT', 30))
+DB_LEAK_SECONDS = float(os_getenv('DB_LEAK_SECONDS', 300))
+DB_BACKEND = os_getenv('DB_BACKEND', 'psycopg2')  # Or 'psycopg3' - prepared statements and the pipeline mode
+DB_PREPARE_THRESHOLD = int(os_getenv('DB_PREPARE_THRESHOLD', 5))  # psycopg3: executions of a statement to prepare it
+DB_STREAM_ITERSIZE = int(os_getenv('DB_STREAM_ITERSIZE', 2000))  # Rows per fetch of a streamed read, see Postgres.stream
 LANGUAGE = os_getenv('LANGUAGE_', "en")  # Don't use "LANGUAGE" name cuz it's already used by unix system
 
 # Use path because tg_fle_id correct only for bot chat
 DEFAULT_PHOTO = os_getenv('DEFAULT_PHOTO_TG_FILE_ID', 'AgADAgADWqwxG2mlAAFIDtF_p9eVWNcS2bkPAAQBAAMCAAN4AAMKFQcAARYE')
 
 DEBUG = os_getenv('DEBUG', 'False') == 'True'  # True only if 'True' passed
+MATCHER_MODE = os_getenv('MATCHER_MODE', 'TEMP_TABLES')  # Name of Matcher.Mode member, per deployment
+# Approximate matcher (MINHASH mode): more bands or fewer rows - higher recall but more candidates to count
+MINHASH_BANDS = int(os_getenv('MINHASH_BANDS', 32))
+MINHASH_ROWS = int(os_getenv('MINHASH_ROWS', 2))
+# Name of Matcher.Scoring member, per deployment, only the single query modes are ranked (see Matcher.check_config)
+MATCHER_SCORING = os_getenv('MATCHER_SCORING', 'COMMON_COUNT')
+# Search results cache (single query modes), results count and seconds to keep the result
+SEARCH_CACHE_SIZE = int(os_getenv('SEARCH_CACHE_SIZE', 10_000))
+SEARCH_CACHE_TTL = int(os_getenv('SEARCH_CACHE_TTL', 300))
+# Milliseconds for the whole search, the partial result is returned if the time is over, 0 - no limit
+SEARCH_BUDGET_MS = int(os_getenv('SEARCH_BUDGET_MS', 3000))
+# Search in the background (True only if 'True' passed), the user is notified when it's done
+SEARCH_JOBS = os_getenv('SEARCH_JOBS', 'False') == 'True'
+SEARCH_JOBS_WORKERS = int(os_getenv('SEARCH_JOBS_WORKERS', 4))
+SEARCH_JOBS_QUEUE_SIZE = int(os_getenv('SEARCH_JOBS_QUEUE_SIZE', 100))  # Waiting for a free worker
+# Next matches to load and prepare in the background while the user looks at the current one, 0 - disabled
+MATCHES_PREFETCH = int(os_getenv('MATCHES_PREFETCH', 2))
+MATCHES_PREFETCH_WORKERS = int(os_getenv('MATCHES_PREFETCH_WORKERS', 4))
+SEARCH_TIMINGS_WINDOW = int(os_getenv('SEARCH_TIMINGS_WINDOW', 1000))  # Recent searches for the stages percentiles
+NEARBY_RADIUS_KM = int(os_getenv('NEARBY_RADIUS_KM', 50))  # Radius of the "nearby" search checkbox
 
 LOG_ERROR_FILENAME = 'error.log'
 LOG_VIEW_FILENAME = 'views.log'
@@ -48,6 +74,11 @@
 LOG_ERROR_FILEPATH = Path(f'{PROJECT_ROOT_PATH}/logs/{LOG_ERROR_FILENAME}')
 LOG_VIEW_FILEPATH = Path(f'{PROJECT_ROOT_PATH}/logs/{LOG_VIEW_FILENAME}')
 Path(PROJECT_ROOT_PATH / 'db_backups/').mkdir(parents=True, exist_ok=True)
+# Votes snapshot (engine modes), read on start to not load all the votes from DB, written every interval (minutes)
+MATCHER_SNAPSHOT_PATH = Path(os_getenv('MATCHER_SNAPSHOT_PATH', PROJECT_ROOT_PATH / 'snapshots' / 'votes.snapshot'))
+MATCHER_SNAPSHOT_INTERVAL = int(os_getenv('MATCHER_SNAPSHOT_INTERVAL', 30))
+# Top matches mode, the table is trimmed back to K rows per user every interval (minutes)
+MATCHER_TOP_MATCHES_TRIM_INTERVAL = int(os_getenv('MATCHER_TOP_MATCHES_TRIM_INTERVAL', 60))
 
 
 DEFAULT_POSTS = {  # Move to ptb config ?
@@ -207,6 +207,7 @@ class Checkboxes:
         COUNTRY_SPECIFIED = translators.search("COUNTRY_SPECIFIED")
         CITY_SPECIFIED = translators.search("CITY_SPECIFIED")
         PHOTO_SPECIFIED = translators.search("PHOTO_SPECIFIED")
+        NEARBY = translators.search("NEARBY")
 
     class Buttons:
         MALE = translators.search('MALE')
@@ -223,6 +224,11 @@ class Buttons:
 
     class Result:
         NO_MATCHES_WITH_FILTERS = translators.search("NO_MATCHES_WITH_FILTERS")
+        PARTIAL_MATCHES = translators.search("PARTIAL_MATCHES")
+        SEARCHING = translators.search("SEARCHING")
+        STILL_SEARCHING = translators.search("STILL_SEARCHING")
+        SEARCH_STAGES = translators.search("SEARCH_STAGES")  # format(SEARCHES_COUNT, )
+        NO_SEARCHES = translators.search("NO_SEARCHES")
         FOUND_MATCHES_COUNT = translators.search("FOUND_MATCHES_COUNT")  # format(FOUND_MATCHES_COUNT, )
         HERE_MATCH = translators.search("HERE_MATCH")  # format(SHARED_INTERESTS_PERCENTAGE, SHARED_INTERESTS_COUNT, )
         NO_MORE_MATCHES = translators.search("NO_MORE_MATCHES")
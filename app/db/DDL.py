@@ -15,6 +15,8 @@
 
 """Better ro match the table names with the variable names"""
 
+from app.db.postgres_sqls import Matches as MatchesSQLS
+
 USERS = (
     'CREATE TABLE IF NOT EXISTS users('
     'id serial PRIMARY KEY,'
@@ -26,6 +28,9 @@
     'country VARCHAR(64) DEFAULT NULL,'
     'city VARCHAR(64) DEFAULT NULL,'
     'comment VARCHAR(1024) DEFAULT NULL,'
+    'latitude DOUBLE PRECISION DEFAULT NULL,'  # Only if the user shared the geolocation
+    'longitude DOUBLE PRECISION DEFAULT NULL,'
+    'geo_cell INT DEFAULT NULL,'  # Grid cell of the coordinates, see app.models.base._matches.geo
     'created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)'
 )
 
@@ -35,7 +40,7 @@
     'tg_user_id BIGINT,'
     'tg_photo_file_id VARCHAR(512),'
     'FOREIGN KEY (tg_user_id) REFERENCES users (tg_user_id) ON DELETE CASCADE ON UPDATE CASCADE,'
-    'UNIQUE (tg_user_id, tg_photo_file_id)'
+    'UNIQUE (tg_user_id, tg_photo_file_id)'  # Also the index to check that user has photo
     ')')
 
 POSTS_BASE = (
@@ -129,7 +134,56 @@
     'UNIQUE (tg_user_id, shown_id)'
     ')')
 
+# Common votes count of the top K matches of every user (both directions), updated incrementally on every accepted
+# public vote (TOP_MATCHES mode) and trimmed back to K rows per user periodically (see Matcher.create_top_matches_trim_task).
+# A trimmed pair that comes back is recounted. Not maintained in the other modes, so after switching to this one
+# run "python -m app.repair --top-matches".
+USER_TOP_MATCHES = (
+    'CREATE TABLE IF NOT EXISTS user_top_matches ('
+    'tg_user_id BIGINT,'
+    'match_id BIGINT,'
+    'count_common_interests INT NOT NULL,'
+    'PRIMARY KEY (tg_user_id, match_id)'
+    ')')
+
+USER_TOP_MATCHES_INDEX = (
+    'CREATE INDEX IF NOT EXISTS user_top_matches_count_idx '
+    'ON user_top_matches (tg_user_id, count_common_interests DESC)'
+)
+
+# Users that got the new top matches rows since the last trim, the trim ranks only them and consumes the marks.
+USER_TOP_MATCHES_TOUCHED = (
+    'CREATE TABLE IF NOT EXISTS user_top_matches_touched ('
+    'tg_user_id BIGINT PRIMARY KEY'
+    ')')
+
+# Not zero public votes of every voter, updated on every accepted vote (see Matcher.handle_vote).
+# The scoring reads candidates totals by the primary key instead of the votes aggregation.
+USERS_VOTES_COUNTS = (
+    'CREATE TABLE IF NOT EXISTS users_votes_counts ('
+    'tg_user_id BIGINT PRIMARY KEY,'
+    'votes_count INT NOT NULL'
+    ')')
+
+# Top matches of every voter, written by the precompute job (python -m app.precompute) for digests and warming.
+# Rows of the previous runs (computed_at is older) are removed at the end of the run.
+PRECOMPUTED_MATCHES = (
+    'CREATE TABLE IF NOT EXISTS precomputed_matches ('
+    'tg_user_id BIGINT,'
+    'match_id BIGINT,'
+    'count_common_interests INT NOT NULL,'
+    'computed_at TIMESTAMP NOT NULL,'
+    'PRIMARY KEY (tg_user_id, match_id)'
+    ')')
+
+SCHEMA_VERSION = (
+    'CREATE TABLE IF NOT EXISTS schema_version ('
+    'version INT PRIMARY KEY,'
+    'applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP'
+    ')')
+
 TABLES = (
+    SCHEMA_VERSION,
     USERS,
     PHOTOS,
     POSTS_BASE,
@@ -140,4 +194,51 @@
     PUBLIC_VOTES,
     PERSONAL_VOTES,
     SHOWN_USERS,
+    USER_TOP_MATCHES,
+    USER_TOP_MATCHES_INDEX,
+    USER_TOP_MATCHES_TOUCHED,
+    USERS_VOTES_COUNTS,
+    PRECOMPUTED_MATCHES,
 )
+
+# Numbered steps for the existing DBs, applied once by Postgres.migrate in the order of the numbers.
+# The last applied number is stored in schema_version table. Never edit an applied step, add a new one.
+# Steps are executed in autocommit mode, so CREATE INDEX CONCURRENTLY is allowed (a statement per item).
+# If a concurrent build fails, the index is left invalid, drop it manually before the next run.
+MIGRATIONS: dict[int, tuple[str, ...]] = {
+    1: (
+        # Covote counting: "WHERE (post_id, value) IN (user votes)", index only scan.
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS public_votes_covotes_idx '
+        'ON public_votes (post_id, value, tg_user_id)',
+        # Default collections prefix scans: "name LIKE 'prefix%'" (unique (author, name) index has no pattern ops).
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS collections_name_pattern_idx '
+        'ON collections (author, name text_pattern_ops)',
+    ),
+    2: (
+        # Votes snapshot replay: "WHERE updated_at >= mark", only the votes since the last snapshot are read.
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS public_votes_updated_at_idx ON public_votes (updated_at)',
+    ),
+    3: (
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION DEFAULT NULL',
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION DEFAULT NULL',
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS geo_cell INT DEFAULT NULL',
+        # Proximity filter: "WHERE geo_cell = ANY(cells around the searcher)", index only scan.
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS users_geo_cell_idx '
+        'ON users (geo_cell) INCLUDE (tg_user_id, latitude, longitude) WHERE geo_cell IS NOT NULL',
+    ),
+    4: (
+        # One-off backfill of the votes counters, the votes keep them in sync since (see Matcher.handle_vote).
+        # A single upsert: atomic in autocommit, the readers never see an empty or a partial table.
+        MatchesSQLS.Public.FILL_USERS_VOTES_COUNTS,
+    ),
+    5: (
+        # The search filters use range predicates on birthdate (not computed age), so the index is used.
+        # INCLUDE tg_user_id to get covoters ids by index only scan.
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS users_filters_idx '
+        'ON users (goal, gender, birthdate) INCLUDE (tg_user_id)',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS users_has_country_idx '
+        'ON users (tg_user_id) WHERE country IS NOT NULL',
+        'CREATE INDEX CONCURRENTLY IF NOT EXISTS users_has_city_idx '
+        'ON users (tg_user_id) WHERE city IS NOT NULL',
+    ),
+}
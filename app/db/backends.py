@@ -0,0 +1,151 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+DB drivers behind Postgres (DB_BACKEND), the statements are the same for both.
+psycopg2 sends every statement as a text, so it's parsed and planned every time.
+psycopg3 binds the values on the server side, prepares a statement executed prepare_threshold times
+on the connection and supports the pipeline mode (see Postgres.pipeline).
+Bulk writes (see Postgres.execute_values and Postgres.copy) are implemented by the every driver on its own way.
+Large reads are streamed by the server-side (named) cursors of the drivers (see Postgres.stream).
+"""
+
+from __future__ import annotations
+from enum import Enum
+from io import StringIO
+from itertools import count
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator
+
+import psycopg
+import psycopg2
+from psycopg.rows import dict_row, tuple_row
+from psycopg2 import extras as pg_extras, errors as pg_errors
+from psycopg2.errorcodes import READ_ONLY_SQL_TRANSACTION as READ_ONLY_SQL_TRANSACTION_CODE
+
+if TYPE_CHECKING:
+    from psycopg2.extensions import connection as pg_ext_connection, cursor as pg_ext_cursor
+    from app.db.manager import Postgres
+
+
+class Backend(str, Enum):
+    PSYCOPG2 = 'psycopg2'
+    PSYCOPG3 = 'psycopg3'
+
+
+# Errors of both the drivers, a connection of any of them may be passed to Postgres.execute
+QUERY_CANCELED = (pg_errors.QueryCanceled, psycopg.errors.QueryCanceled,)
+READ_ONLY_SQL_TRANSACTION = (pg_errors.lookup(READ_ONLY_SQL_TRANSACTION_CODE), psycopg.errors.ReadOnlySqlTransaction,)
+cursors_names = count()  # Name of a server-side cursor is unique per the session, see stream
+ROWS_PLACEHOLDER = 'VALUES %s'  # Of the bulk statement, replaced by the rows, see execute_values
+
+
+def connect_psycopg2(config: Postgres.Config, ) -> pg_ext_connection:
+    return psycopg2.connect(cursor_factory=pg_extras.RealDictCursor, **vars(config), )
+
+
+def connect_psycopg3(config: Postgres.Config, prepare_threshold: int | None, ) -> psycopg.Connection:
+    """prepare_threshold None - never prepare, 0 - prepare every statement at once"""
+    return psycopg.connect(row_factory=dict_row, prepare_threshold=prepare_threshold, **vars(config), )
+
+
+def get_connect(
+        backend: Backend,
+        config: Postgres.Config,
+        prepare_threshold: int | None,
+) -> Callable[[], pg_ext_connection | psycopg.Connection]:
+    if backend == Backend.PSYCOPG3:
+        return lambda: connect_psycopg3(config=config, prepare_threshold=prepare_threshold, )
+    return lambda: connect_psycopg2(config=config, )
+
+
+def is_pipeline_supported(connection: pg_ext_connection | psycopg.Connection, ) -> bool:
+    return isinstance(connection, psycopg.Connection, )
+
+
+def execute_values(
+        cursor: pg_ext_cursor | psycopg.Cursor,
+        statement: str,
+        rows: list[tuple],
+        template: str | None,
+        page_size: int,
+        fetch: bool,
+) -> list:
+    """
+    Statement with a single "VALUES %s" placeholder is executed once per page of rows,
+    the placeholder is replaced by the rows of the page (see psycopg2.extras.execute_values).
+    Only the placeholder is replaced, not the first "%s" of the statement.
+    """
+    if statement.count(ROWS_PLACEHOLDER, ) != 1:
+        raise ValueError(f'Statement should have a single "{ROWS_PLACEHOLDER}" placeholder: {statement}', )
+    if not isinstance(cursor, psycopg.Cursor, ):
+        return pg_extras.execute_values(cursor, statement, rows, template=template, page_size=page_size, fetch=fetch, )
+    head, tail = statement.split(ROWS_PLACEHOLDER, )
+    template = template or f'({", ".join(["%s"] * len(rows[0]))})'
+    result = []
+    for i in range(0, len(rows), page_size, ):
+        page = rows[i:i + page_size]
+        cursor.execute(
+            f'{head}VALUES {", ".join([template] * len(page))}{tail}',
+            [value for row in page for value in row],
+        )
+        if fetch:
+            result.extend(cursor.fetchall())
+    return result
+
+
+def escape_copy_value(value) -> str:
+    """Text format of COPY: NULL is \\N, the delimiters and the escape char are escaped"""
+    if value is None:
+        return '\\N'
+    return (
+        str(value, )
+        .replace('\\', '\\\\', )
+        .replace('\t', '\\t', )
+        .replace('\n', '\\n', )
+        .replace('\r', '\\r', )
+    )
+
+
+def copy(cursor: pg_ext_cursor | psycopg.Cursor, statement: str, rows: Iterable[tuple], ) -> None:
+    """COPY ... FROM STDIN, the rows are streamed to the server"""
+    if isinstance(cursor, psycopg.Cursor, ):
+        with cursor.copy(statement, ) as stream:
+            for row in rows:
+                stream.write_row(row, )
+        return
+    buffer = StringIO('\n'.join('\t'.join(map(escape_copy_value, row, )) for row in rows) + '\n', )
+    cursor.copy_expert(statement, buffer, )
+
+
+def stream(
+        connection: pg_ext_connection | psycopg.Connection,
+        statement: str,
+        values: tuple | None,
+        itersize: int,
+) -> Iterator[tuple]:
+    """
+    Rows of the statement as the plain tuples (not the dicts of the connection),
+    fetched from the server-side cursor by itersize rows, so only a single batch is in the memory.
+    The cursor lives inside the transaction of the connection, it's closed at the end of the iteration.
+    """
+    name = f'stream_{next(cursors_names)}'
+    if isinstance(connection, psycopg.Connection, ):
+        cursor = connection.cursor(name=name, row_factory=tuple_row, )
+    else:
+        cursor = connection.cursor(name=name, cursor_factory=psycopg2.extensions.cursor, )
+    cursor.itersize = itersize
+    with cursor:
+        cursor.execute(statement, values, )
+        yield from cursor
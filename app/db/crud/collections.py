@@ -45,6 +45,20 @@ def create_2m2_collection_post(cls, collection_id: int, post_id: int, connection
             connection=connection,
         )
 
+    @classmethod
+    def create_m2m_collection_posts(
+            cls,
+            collection_id: int,
+            posts_ids: list[int],
+            connection: pg_ext_connection,
+    ) -> None:
+        """Bulk insert into table, already linked posts are skipped"""
+        return cls.db.execute_values(
+            statement=cls.db.sqls.Collections.CREATE_M2M_COLLECTIONS_POSTS_MANY,
+            rows=[(collection_id, post_id,) for post_id in posts_ids],
+            connection=connection,
+        )
+
     @classmethod
     def read_id_by_name(
             cls,
@@ -68,7 +82,7 @@ def read_by_ids(
         """Will not fill the posts because it's a separate table"""
         collections: list[app.structures.base.CollectionDB] = cls.db.read(
             statement=cls.db.sqls.Collections.READ_COLLECTIONS_BY_IDS,
-            values=(tuple(ids),),  # list of ids should be tuple
+            values=(list(ids),),
             connection=connection,
             fetch='fetchall'
         )
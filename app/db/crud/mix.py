@@ -20,6 +20,7 @@
 import app.db.manager
 
 if TYPE_CHECKING:
+    from typing import Iterator
     from psycopg2.extensions import connection as pg_ext_connection
     import app.structures.base
 
@@ -28,23 +29,35 @@ class System:
     db = app.db.manager.Postgres
 
     @classmethod
-    def read_bots_ids(cls, connection: pg_ext_connection, ) -> list[int]:
-        bots_ids = cls.db.read(
-            statement=cls.db.sqls.System.READ_BOTS_IDS,
-            values=(app.constants.I_AM_BOT,),
-            connection=connection,
-            fetch='fetchall',
-        )
-        return bots_ids
+    def read_bots_ids(cls, connection: pg_ext_connection, ) -> Iterator[int]:
+        """Streamed, see Postgres.stream"""
+        for tg_user_id, in cls.db.stream(
+                statement=cls.db.sqls.System.READ_BOTS_IDS,
+                values=(app.constants.I_AM_BOT,),
+                connection=connection,
+        ):
+            yield tg_user_id
 
     @classmethod
-    def read_all_users_ids(cls, connection: pg_ext_connection, ) -> list[int]:
-        result = cls.db.read(
-            statement=cls.db.sqls.System.READ_ALL_USERS_IDS,
+    def read_all_users_ids(cls, connection: pg_ext_connection, ) -> Iterator[int]:
+        """Streamed, see Postgres.stream"""
+        for tg_user_id, in cls.db.stream(statement=cls.db.sqls.System.READ_ALL_USERS_IDS, connection=connection, ):
+            yield tg_user_id
+
+    @classmethod
+    def read_users_ids_page(
+            cls,
+            after_tg_user_id: int | None,
+            limit: int,
+            connection: pg_ext_connection,
+    ) -> list[int]:
+        """Ordered by tg_user_id, the first page if after_tg_user_id is None"""
+        return cls.db.read(
+            statement=cls.db.sqls.System.READ_USERS_IDS_PAGE,
+            values={'after_tg_user_id': after_tg_user_id, 'limit': limit, },
             connection=connection,
             fetch='fetchall',
         )
-        return result
 
 
 class MatchStats:
@@ -125,6 +138,20 @@ def create(cls, tg_user_id: int, photo: str, connection: pg_ext_connection, ) ->
         )
         return result
 
+    @classmethod
+    def create_many(cls, tg_user_id: int, photos: list[str], connection: pg_ext_connection, ) -> None:
+        """Already existing photos of the user are skipped"""
+        return cls.db.execute_values(
+            statement=cls.db.sqls.Photos.CREATE_PHOTOS,
+            rows=[(tg_user_id, photo,) for photo in photos],
+            connection=connection,
+        )
+
+    @classmethod
+    def copy(cls, rows: list[tuple[int, str]], connection: pg_ext_connection, ) -> None:
+        """Photos of many users at once (tg_user_id, photo), fails on the existing photo"""
+        return cls.db.copy(statement=cls.db.sqls.Photos.COPY_PHOTOS, rows=rows, connection=connection, )
+
     @classmethod
     def read(cls, tg_user_id: int, connection: pg_ext_connection, ) -> list[str]:
         result = cls.db.read(
@@ -143,3 +170,11 @@ def delete_user_photos(cls, tg_user_id: int, connection: pg_ext_connection, ) ->
             connection=connection,
         )
         return result
+
+    @classmethod
+    def delete_users_photos(cls, tg_user_ids: list[int], connection: pg_ext_connection, ) -> None:
+        return cls.db.delete(
+            statement=cls.db.sqls.Photos.DELETE_USERS_PHOTOS,
+            values=(tg_user_ids,),
+            connection=connection,
+        )
@@ -17,10 +17,12 @@
 from typing import TYPE_CHECKING
 
 from app.db import manager as db_manager
+import app.structures.base
 
 if TYPE_CHECKING:
+    from typing import ContextManager, Iterator
+    from datetime import datetime as datetime_datetime
     from psycopg2.extensions import connection as pg_ext_connection
-    import app.structures.base
 
 
 class User:
@@ -54,6 +56,16 @@ def read(cls, tg_user_id: int, connection: pg_ext_connection, ) -> app.structure
         )
         return user_row
 
+    @classmethod
+    def read_many(cls, tg_user_ids: list[int], connection: pg_ext_connection, ) -> list[app.structures.base.UserRaw]:
+        """Users with photos by a single query, not existing users are missed"""
+        return cls.db.read(
+            statement=cls.db.sqls.Users.READ_USERS_WITH_PHOTOS,
+            values=(tg_user_ids,),
+            connection=connection,
+            fetch='fetchall',
+        )
+
     @classmethod
     def upsert(
             cls,
@@ -73,6 +85,34 @@ def upsert(
             connection=connection
         )
 
+    @classmethod
+    def upsert_many(cls, rows: list[tuple], connection: pg_ext_connection, ) -> None:
+        """
+        Users with the location at once, a row is
+        (tg_user_id, fullname, goal, gender, age, country, city, comment, latitude, longitude, geo_cell)
+        """
+        return cls.db.execute_values(
+            statement=cls.db.sqls.Users.UPSERT_USERS,
+            rows=rows,
+            template=cls.db.sqls.Users.UPSERT_USERS_TEMPLATE,
+            connection=connection,
+        )
+
+    @classmethod
+    def update_location(
+            cls,
+            tg_user_id: int,
+            latitude: float | None,
+            longitude: float | None,
+            geo_cell: int | None,
+            connection: pg_ext_connection,
+    ) -> None:
+        return cls.db.update(
+            statement=cls.db.sqls.Users.UPDATE_USER_LOCATION,
+            values=(latitude, longitude, geo_cell, tg_user_id,),
+            connection=connection,
+        )
+
     @classmethod
     def delete(cls, tg_user_id: int, connection: pg_ext_connection, ) -> None:  # Not in use
         return cls.db.delete(
@@ -123,18 +163,33 @@ def create_user_votes(cls, tg_user_id: int, connection: pg_ext_connection, ) ->
         )
 
     @classmethod
-    def create_user_covotes(cls, tg_user_id: int, connection: pg_ext_connection, ) -> None:
-        """Create and fill"""
+    def create_user_covotes(
+            cls,
+            tg_user_id: int,
+            connection: pg_ext_connection,
+            covotes: tuple[list[int], list[int]] | None = None,
+    ) -> None:
+        """
+        Create and fill
+        covotes - (tg_user_ids, counts) already counted by the engine, otherwise DB will count them.
+        """
         # Will be executed only if table not exists
         cls.db.create(
             statement=cls.db.sqls.Matches.Public.CREATE_TEMP_TABLE_USER_COVOTES,
             connection=connection,
         )
-        cls.db.create(
-            statement=cls.db.sqls.Matches.Public.FILL_TEMP_TABLE_USER_COVOTES,
-            values=(tg_user_id,),
-            connection=connection,
-        )
+        if covotes is not None:
+            cls.db.create(
+                statement=cls.db.sqls.Matches.Public.FILL_TEMP_TABLE_USER_COVOTES_FROM_ENGINE,
+                values=covotes,
+                connection=connection,
+            )
+        else:
+            cls.db.create(
+                statement=cls.db.sqls.Matches.Public.FILL_TEMP_TABLE_USER_COVOTES,
+                values=(tg_user_id,),
+                connection=connection,
+            )
 
     @classmethod
     def read_user_votes_count(cls, connection: pg_ext_connection, ) -> int:
@@ -171,8 +226,12 @@ def read_user_covotes(
             tg_user_id: int,
             connection: pg_ext_connection,
             new: bool = False,
-    ) -> list[app.structures.base.Covote]:
-        """Will create a temporary table with user covotes"""
+    ) -> list[app.structures.base.Covote] | Iterator[tuple[int, int, int]]:
+        """
+        The new covotes are read at once.
+        All the covotes of the user may be very many, so they are streamed as the plain tuples
+        (id, tg_user_id, count_common_interests), see Postgres.stream.
+        """
         # Will be executed only if table not exists
         if new is True:
             return cls.db.read(
@@ -181,12 +240,42 @@ def read_user_covotes(
                 connection=connection,
                 fetch='fetchall',
             )
-        else:
-            return cls.db.read(
-                statement=cls.db.sqls.Matches.Public.READ_ALL_MATCHES,
-                connection=connection,
-                fetch='fetchall',
-            )
+        return cls.db.stream(statement=cls.db.sqls.Matches.Public.READ_ALL_MATCHES, connection=connection, )
+
+    @classmethod
+    def read_matches_counts(cls, tg_user_id: int, connection: pg_ext_connection, ) -> app.structures.base.MatchesCounts:
+        return cls.db.read(
+            statement=cls.db.sqls.Matches.Public.READ_MATCHES_COUNTS,
+            values={'tg_user_id': tg_user_id, },
+            connection=connection,
+        )
+
+    @classmethod
+    def read_matches_page(
+            cls,
+            tg_user_id: int,
+            limit: int,
+            connection: pg_ext_connection,
+            new: bool = False,
+            keyset: tuple[int, int] | None = None,
+    ) -> list[app.structures.base.Covote]:
+        """
+        The best matches first.
+        keyset - (count_common_interests, tg_user_id) of the last match from the previous page.
+        """
+        last_count, last_tg_user_id = keyset or (None, None)
+        return cls.db.read(
+            statement=cls.db.sqls.Matches.Public.READ_MATCHES_PAGE,
+            values={
+                'tg_user_id': tg_user_id,
+                'new': new,
+                'last_count': last_count,
+                'last_tg_user_id': last_tg_user_id,
+                'limit': limit,
+            },
+            connection=connection,
+            fetch='fetchall',
+        )
 
     @classmethod
     def apply_goal_filter(cls, goal: int, connection: pg_ext_connection, ):
@@ -223,3 +312,264 @@ def apply_checkboxes_city_filter(cls, connection: pg_ext_connection, ):
     @classmethod
     def apply_checkboxes_photo_filter(cls, connection: pg_ext_connection, ):
         cls.db.execute(statement=cls.db.sqls.Matches.Public.USE_CHECKBOX_PHOTO_FILTER, connection=connection, )
+
+    @classmethod
+    def apply_nearby_filter(cls, nearby_ids: list[int], connection: pg_ext_connection, ):
+        cls.db.execute(
+            statement=cls.db.sqls.Matches.Public.USE_NEARBY_FILTER,
+            values=(nearby_ids,),
+            connection=connection,
+        )
+
+    @classmethod
+    def track_statements(cls, connection: pg_ext_connection, ) -> ContextManager[app.structures.base.StatementsCounter]:
+        """Round trips and rows of the search statements, see db.track"""
+        return cls.db.track(connection=connection, )
+
+    @classmethod
+    def read_user_votes_stats(cls, tg_user_id: int, connection: pg_ext_connection, ) -> app.structures.base.VotesStats:
+        """Votes count and covotes presence by single query (without temporary tables)"""
+        return cls.db.read(
+            statement=cls.db.sqls.Matches.Public.READ_USER_VOTES_STATS,
+            values={'tg_user_id': tg_user_id, },
+            connection=connection,
+        )
+
+    @classmethod
+    def read_filtered_matches(
+            cls,
+            tg_user_id: int,
+            connection: pg_ext_connection,
+            goal: int | None = None,
+            gender: int | None = None,
+            age_range: tuple[int, int] | None = None,
+            photo: bool = False,
+            country: bool = False,
+            city: bool = False,
+            covotes: tuple[list[int], list[int]] | None = None,
+            top_matches_limit: int | None = None,
+            votes_limit: int | None = None,
+            nearby_ids: list[int] | None = None,
+    ) -> list[app.structures.base.FilteredCovote]:
+        """
+        Scored, filtered and ordered matches by single query (without temporary tables).
+        None (or False for checkboxes) means that filter is disabled.
+        covotes - (tg_user_ids, counts) already counted by the engine, will be only filtered.
+        top_matches_limit - read only this count of the best candidates from the top matches table.
+        votes_limit - count covotes only by this count of the latest votes of the user (partial search).
+        nearby_ids - only these users are matched (proximity filter).
+        """
+        min_age, max_age = age_range or (None, None)
+        statement = cls.db.sqls.Matches.Public.READ_FILTERED_MATCHES
+        values = {
+            'tg_user_id': tg_user_id,
+            'goal': goal,
+            'gender': gender,
+            'min_age': min_age,
+            'max_age': max_age,
+            'photo': photo,
+            'country': country,
+            'city': city,
+            'nearby_ids': nearby_ids,
+        }
+        if covotes is not None:
+            statement = cls.db.sqls.Matches.Public.READ_FILTERED_ENGINE_MATCHES
+            values['covotes_ids'], values['covotes_counts'] = covotes
+        elif top_matches_limit is not None:
+            statement = cls.db.sqls.Matches.Public.READ_FILTERED_TOP_MATCHES
+            values['limit'] = top_matches_limit
+        elif votes_limit is not None:
+            statement = cls.db.sqls.Matches.Public.READ_FILTERED_RECENT_MATCHES
+            values['votes_limit'] = votes_limit
+        return cls.db.read(statement=statement, values=values, connection=connection, fetch='fetchall', )
+
+    @classmethod
+    def update_top_matches(
+            cls,
+            tg_user_id: int,
+            post_id: int,
+            old_value: int,
+            new_value: int,
+            connection: pg_ext_connection,
+    ) -> None:
+        """Decrease pairs with the old vote value and increase pairs with the new one"""
+        if old_value:  # Zero value has no covotes
+            cls.db.create(
+                statement=cls.db.sqls.Matches.Public.DECREASE_TOP_MATCHES,
+                values={'tg_user_id': tg_user_id, 'post_id': post_id, 'value': int(old_value), },
+                connection=connection,
+            )
+        if new_value:
+            cls.db.create(
+                statement=cls.db.sqls.Matches.Public.UPDATE_TOP_MATCHES,
+                values={'tg_user_id': tg_user_id, 'post_id': post_id, 'value': int(new_value), 'delta': 1, },
+                connection=connection,
+            )
+
+    @classmethod
+    def update_top_matches_many(cls, rows: list[tuple[int, int, int]], connection: pg_ext_connection, ) -> None:
+        """
+        Bulk update_top_matches of the votes for the same post, a row is (tg_user_id, post_id, old_value).
+        The rows are a single page, the pairs of the batch voters are counted together.
+        """
+        cls.db.execute_values(
+            statement=cls.db.sqls.Matches.Public.UPDATE_TOP_MATCHES_MANY,
+            rows=rows,
+            template=cls.db.sqls.Matches.Public.UPDATE_TOP_MATCHES_MANY_TEMPLATE,
+            page_size=len(rows),
+            connection=connection,
+        )
+
+    @classmethod
+    def rebuild_top_matches(cls, connection: pg_ext_connection, ) -> None:
+        with cls.db.transaction(connection=connection, ):  # The readers never see the empty table
+            cls.db.execute(statement=cls.db.sqls.Matches.Public.TRUNCATE_TOP_MATCHES, connection=connection, )
+            cls.db.create(statement=cls.db.sqls.Matches.Public.FILL_TOP_MATCHES, connection=connection, )
+
+    @classmethod
+    def trim_top_matches(cls, connection: pg_ext_connection, ) -> None:
+        cls.db.create(statement=cls.db.sqls.Matches.Public.TRIM_TOP_MATCHES, connection=connection, )
+
+    @classmethod
+    def update_votes_count(cls, tg_user_id: int, delta: int, connection: pg_ext_connection, ) -> None:
+        cls.db.create(
+            statement=cls.db.sqls.Matches.Public.UPDATE_USER_VOTES_COUNT,
+            values={'tg_user_id': tg_user_id, 'delta': delta, },
+            connection=connection,
+        )
+
+    @classmethod
+    def update_votes_counts(cls, rows: list[tuple[int, int]], connection: pg_ext_connection, ) -> None:
+        """Bulk update_votes_count, a row is (tg_user_id, delta), a user per row"""
+        cls.db.execute_values(
+            statement=cls.db.sqls.Matches.Public.UPDATE_USERS_VOTES_COUNTS,
+            rows=rows,
+            template=cls.db.sqls.Matches.Public.UPDATE_USERS_VOTES_COUNTS_TEMPLATE,
+            connection=connection,
+        )
+
+    @classmethod
+    def rebuild_votes_counts(cls, connection: pg_ext_connection, ) -> None:
+        with cls.db.transaction(connection=connection, ):  # The readers never see the empty table
+            cls.db.execute(statement=cls.db.sqls.Matches.Public.TRUNCATE_USERS_VOTES_COUNTS, connection=connection, )
+            cls.db.create(statement=cls.db.sqls.Matches.Public.FILL_USERS_VOTES_COUNTS, connection=connection, )
+
+    @classmethod
+    def read_users_votes_counts(
+            cls,
+            tg_user_ids: list[int],
+            connection: pg_ext_connection,
+    ) -> list[app.structures.base.UserVotesCount]:
+        return cls.db.read(
+            statement=cls.db.sqls.Matches.Public.READ_USERS_VOTES_COUNTS,
+            values={'tg_user_ids': tg_user_ids, },
+            connection=connection,
+            fetch='fetchall',
+        )
+
+    @classmethod
+    def read_users_count(cls, connection: pg_ext_connection, ) -> int:
+        return cls.db.read(statement=cls.db.sqls.Matches.Public.READ_USERS_COUNT, connection=connection, )
+
+    @classmethod
+    def read_covotes_posts(
+            cls,
+            tg_user_id: int,
+            tg_user_ids: list[int],
+            connection: pg_ext_connection,
+    ) -> list[app.structures.base.CovotePost]:
+        """Every common vote of the user with the candidates (tg_user_ids)"""
+        return cls.db.read(
+            statement=cls.db.sqls.Matches.Public.READ_COVOTES_POSTS,
+            values={'tg_user_id': tg_user_id, 'tg_user_ids': tg_user_ids, },
+            connection=connection,
+            fetch='fetchall',
+        )
+
+    @classmethod
+    def read_user_location(
+            cls,
+            tg_user_id: int,
+            connection: pg_ext_connection,
+    ) -> app.structures.base.UserLocation | None:
+        """None if the user has not shared the geolocation"""
+        return cls.db.read(
+            statement=cls.db.sqls.Matches.Public.READ_USER_LOCATION,
+            values=(tg_user_id,),
+            connection=connection,
+        )
+
+    @classmethod
+    def read_users_locations(
+            cls,
+            cells: list[int],
+            connection: pg_ext_connection,
+    ) -> list[app.structures.base.UserLocation]:
+        return cls.db.read(
+            statement=cls.db.sqls.Matches.Public.READ_USERS_LOCATIONS,
+            values=(cells,),
+            connection=connection,
+            fetch='fetchall',
+        )
+
+    @classmethod
+    def read_all_votes(cls, connection: pg_ext_connection, ) -> list[app.structures.base.PublicVoteValue]:
+        """All the non-zero public votes, to load the in-memory engine"""
+        return cls.db.read(
+            statement=cls.db.sqls.Matches.Public.READ_ALL_VOTES,
+            connection=connection,
+            fetch='fetchall',
+        )
+
+    @classmethod
+    def stream_all_votes(cls, connection: pg_ext_connection, ) -> Iterator[tuple[int, int, int]]:
+        """All the non-zero public votes (tg_user_id, post_id, value), streamed, see Postgres.stream"""
+        yield from cls.db.stream(statement=cls.db.sqls.Matches.Public.READ_ALL_VOTES, connection=connection, )
+
+    @classmethod
+    def upsert_precomputed_matches(
+            cls,
+            tg_user_ids: list[int],
+            match_ids: list[int],
+            counts: list[int],
+            computed_at: datetime_datetime,
+            connection: pg_ext_connection,
+    ) -> None:
+        """Pair per item of the lists"""
+        cls.db.upsert(
+            statement=cls.db.sqls.Matches.Public.UPSERT_PRECOMPUTED_MATCHES,
+            values={
+                'tg_user_ids': tg_user_ids,
+                'match_ids': match_ids,
+                'counts': counts,
+                'computed_at': computed_at,
+            },
+            connection=connection,
+        )
+
+    @classmethod
+    def delete_stale_precomputed_matches(cls, computed_at: datetime_datetime, connection: pg_ext_connection, ) -> None:
+        cls.db.delete(
+            statement=cls.db.sqls.Matches.Public.DELETE_STALE_PRECOMPUTED_MATCHES,
+            values={'computed_at': computed_at, },
+            connection=connection,
+        )
+
+    @classmethod
+    def read_votes_mark(cls, connection: pg_ext_connection, ) -> datetime_datetime | None:
+        """Replay the votes updated since it over the snapshot of the votes read after it, see READ_VOTES_MARK"""
+        return cls.db.read(statement=cls.db.sqls.Matches.Public.READ_VOTES_MARK, connection=connection, )
+
+    @classmethod
+    def read_votes_since(
+            cls,
+            mark: datetime_datetime | None,
+            connection: pg_ext_connection,
+    ) -> list[app.structures.base.PublicVoteValue]:
+        """The votes updated since the mark (inclusive) with the zero ones, to replay over the snapshot"""
+        return cls.db.read(
+            statement=cls.db.sqls.Matches.Public.READ_VOTES_SINCE,
+            values={'mark': mark, },
+            connection=connection,
+            fetch='fetchall',
+        )
@@ -59,6 +59,24 @@ def read(
             vote_row['value'] = vote_row['value'] or 0  # Convert None to 0
             return vote_row
 
+    @classmethod
+    def read_users_votes(
+            cls,
+            post_id: int,
+            tg_user_ids: list[int],
+            connection: pg_ext_connection,
+    ) -> list[app.structures.base.PublicVoteDB]:
+        """Votes of the users for the post, not voted users are absent"""
+        vote_rows: list[app.structures.base.PublicVoteDB] = cls.db.read(
+            statement=cls.db.sqls.PublicVotes.READ_USERS_PUBLIC_VOTES_FOR_POST,
+            values=(post_id, tg_user_ids,),
+            connection=connection,
+            fetch='fetchall',
+        )
+        for vote_row in vote_rows:
+            vote_row['value'] = vote_row['value'] or 0  # Convert None to 0
+        return vote_rows
+
     @classmethod
     def update(cls, tg_user_id: int, post_id: int, value: int, connection: pg_ext_connection, ) -> None:
         return cls.db.update(
@@ -82,6 +100,15 @@ def upsert_value(
             connection=connection,
         )
 
+    @classmethod
+    def upsert_values(cls, rows: list[tuple[int, int, int, int]], connection: pg_ext_connection, ) -> None:
+        """Bulk upsert_value, a row is (tg_user_id, post_id, message_id, value)"""
+        return cls.db.execute_values(
+            statement=cls.db.sqls.PublicVotes.UPSERT_PUBLIC_VOTES_VALUES,
+            rows=rows,
+            connection=connection,
+        )
+
     @classmethod
     def upsert(  # Not in use
             cls,
@@ -158,6 +185,33 @@ def read(
             return vote_row
         return None
 
+    @classmethod
+    def read_users_votes(
+            cls,
+            post_id: int,
+            tg_user_ids: list[int],
+            connection: pg_ext_connection,
+    ) -> list[app.structures.base.PersonalVoteDB]:
+        """Votes of the users for the post, not voted users are absent"""
+        vote_rows: list[app.structures.base.PersonalVoteDB] = cls.db.read(
+            statement=cls.db.sqls.PersonalVotes.READ_USERS_PERSONAL_VOTES_FOR_POST,
+            values=(post_id, tg_user_ids,),
+            connection=connection,
+            fetch='fetchall',
+        )
+        for vote_row in vote_rows:
+            vote_row['value'] = vote_row['value'] or 0  # Convert None to 0
+        return vote_rows
+
+    @classmethod
+    def upsert_many(cls, rows: list[tuple[int, int, int, int]], connection: pg_ext_connection, ) -> None:
+        """Bulk upsert, a row is (tg_user_id, post_id, message_id, value)"""
+        return cls.db.execute_values(
+            statement=cls.db.sqls.PersonalVotes.UPSERT_PERSONAL_VOTES,
+            rows=rows,
+            connection=connection,
+        )
+
     @classmethod
     def upsert(
             cls,
@@ -17,20 +17,27 @@
 from typing import TYPE_CHECKING
 from types import SimpleNamespace
 from dataclasses import dataclass
+from contextlib import contextmanager
+from threading import local
+from time import monotonic
 
-from psycopg2 import extras as pg_extras, ProgrammingError, errors as pg_errors, connect
-from psycopg2.pool import SimpleConnectionPool
+from psycopg2 import extras as pg_extras, ProgrammingError, connect
 from psycopg2.extensions import connection as pg_ext_connection, cursor as pg_ext_cursor
-from psycopg2.errorcodes import READ_ONLY_SQL_TRANSACTION
 
 from app.db.postgres_sqls import PostgresSQLS
-from app.config import DB_PASSWORD
-from app.db.DDL import TABLES
+from app.config import (
+    DB_PASSWORD, DB_POOL_TIMEOUT, DB_LEAK_SECONDS, DB_BACKEND, DB_PREPARE_THRESHOLD, DB_STREAM_ITERSIZE,
+)
+from app.db.DDL import TABLES, MIGRATIONS
+from app.db.pool import ConnectionPool
+from app.db.transactions import TransactionsMeter, Outcome
+from app.db import backends
 import app.postconfig
 import app.structures.base
+import app.exceptions
 
 if TYPE_CHECKING:
-    pass
+    from typing import Iterator, Iterable, Callable
 
 
 class Postgres:
@@ -43,8 +50,11 @@ class Postgres:
     sqls = PostgresSQLS
     cursor_factory = pg_extras.RealDictCursor
     tables = TABLES
+    migrations = MIGRATIONS
 
     DB_MAX_CONNECTIONS = 100
+    POOL_CHECK_INTERVAL = 1  # Minutes, see create_pool_check_task
+    BULK_PAGE_SIZE = 1000  # Rows per statement, see execute_values
 
     @dataclass
     class Config:
@@ -56,30 +66,70 @@ class Config:
         connect_timeout: int = 1800
 
     CONFIG = Config()
+    backend = backends.Backend(DB_BACKEND)
 
-    connection_pool = SimpleConnectionPool(
-        minconn=1,
+    connection_pool = ConnectionPool(
+        connect=backends.get_connect(backend=backend, config=CONFIG, prepare_threshold=DB_PREPARE_THRESHOLD, ),
         maxconn=DB_MAX_CONNECTIONS,
-        cursor_factory=cursor_factory,
-        **vars(CONFIG),
+        timeout=DB_POOL_TIMEOUT,
+        leak_seconds=DB_LEAK_SECONDS,
+        reset_statement=sqls.System.DISCARD_TEMP,
     )
-    connection: pg_ext_connection
+    connection: pg_ext_connection  # System connection, shared
+    units = local()  # Connection of the current unit of work of the thread, see borrow
+    deadlines: dict[pg_ext_connection, float] = {}  # Connection: monotonic time, see deadline
+    trackers: dict[pg_ext_connection, app.structures.base.StatementsCounter] = {}  # See track
+    transactions: dict[pg_ext_connection, bool] = {}  # Connection: is read only, see transaction
+    pipelines: set[pg_ext_connection] = set()  # See pipeline
+    commit_callbacks: dict[pg_ext_connection, list[Callable[[], None]]] = {}  # See after_commit
+    transactions_meter = TransactionsMeter()
 
     @classmethod
     def get_connection(cls, config: Config | None = None, ) -> pg_ext_connection:
+        """Long-lived connection (pinned in the pool), for the units of work use borrow"""
         if config is None:
-            connection = cls.connection_pool.getconn()
+            connection = cls.connection_pool.getconn(pinned=True, )
         else:
             connection = connect(**vars(config))
         return connection
 
     @classmethod
-    def get_user_connection(cls, ) -> pg_ext_connection:
+    def get_user_connection(cls, default: pg_ext_connection | None = None, ) -> pg_ext_connection:
         """
-        Proxy method to make special actions on user (not a system) connection.
-        no actions currently but there usage in the code (legacy)
+        Connection of the current unit of work (see borrow).
+        Outside a unit of work (scripts, system jobs) the default or the system connection is used.
         """
-        return cls.get_connection()
+        return getattr(cls.units, 'connection', None) or default or cls.connection
+
+    @classmethod
+    @contextmanager
+    def borrow(cls, owner: str | None = None, ) -> Iterator[pg_ext_connection]:
+        """
+        Unit of work (an update handling, a background job): the connection is lent by the pool
+        for the block and is returned after it anyway. Nested block uses the connection of the outer one.
+        """
+        if (connection := getattr(cls.units, 'connection', None)) is not None:
+            yield connection
+            return
+        with cls.connection_pool.borrow(owner=owner, ) as connection:
+            cls.units.connection = connection
+            try:
+                yield connection
+            finally:
+                cls.units.connection = None
+
+    @classmethod
+    def check_pool(cls, ) -> None:
+        """Log the connections held too long (not returned, see borrow)"""
+        for checkout in cls.connection_pool.find_leaks():
+            app.postconfig.logger.warning(
+                f'DB connection is held by {checkout["owner"]} for {monotonic() - checkout["since"]:.0f}s, '
+                f'pool: {cls.connection_pool.stats()}'
+            )
+
+    @classmethod
+    def create_pool_check_task(cls, ) -> None:
+        app.postconfig.scheduler.add_job(func=cls.check_pool, trigger='interval', minutes=cls.POOL_CHECK_INTERVAL, )
 
     @classmethod
     def create(cls, *args, **kwargs, ):  # pragma: no cover
@@ -109,27 +159,280 @@ def execute(
             values: tuple | None = None,
             fetch: str = 'fetchone',
     ):
-        with connection.cursor() as cursor:  # type: pg_ext_cursor
+        with connection.cursor() as cursor, cls.handle_errors(connection=connection, ):
             try:
                 result = None
+                if connection in cls.deadlines:
+                    cls.set_statement_timeout(cursor=cursor, deadline=cls.deadlines[connection], )
                 # Real execution
                 cursor.execute(statement, values, )  # No keyword args cuz psycopg v2 and v3 keywords not match
+                if connection in cls.pipelines:  # The result is not received yet, committed by the pipeline
+                    return None
+                if (counter := cls.trackers.get(connection)) is not None:
+                    counter['round_trips'] += 1 + (connection in cls.deadlines)  # Statement timeout is the extra one
+                    counter['rows'] += max(cursor.rowcount, 0, )  # -1 if not applicable
                 if cursor.description:  # Prevent error "no result to fetch"
                     result = getattr(cursor, fetch)()
                     result = cls.extract_result(result=result, )
-                connection.commit()  # Commit even "read" ?
+                if connection not in cls.transactions:  # Otherwise committed once by the end of the scope
+                    connection.commit()
                 return result
-            except pg_errors.lookup(READ_ONLY_SQL_TRANSACTION):  # Not in use?
-                connection.rollback()
-                app.postconfig.logger.error('READ_ONLY_SQL_TRANSACTION')
-            except (ProgrammingError, Exception) as e:
-                connection.rollback()
-                app.postconfig.logger.error(e)
-                raise e
             finally:
                 # "with" contex manager will close cursor anyway (even in case of error) but it's easiest for tests
                 cursor.close()  # Do nothing
 
+    @classmethod
+    def execute_values(
+            cls,
+            statement: str,
+            rows: list[tuple],
+            connection: pg_ext_connection,
+            template: str | None = None,
+            page_size: int = BULK_PAGE_SIZE,
+            fetch: bool = False,
+    ) -> list | None:
+        """
+        Multi-row insert/upsert, the statement has a single "VALUES %s" placeholder which is replaced by the rows,
+        so it's a round trip per page_size rows instead of a round trip per row.
+        The template is the placeholder of a row, e.g. "(%s, %s + 1)", plain "(%s, ...)" by default.
+        Returns the rows of RETURNING if fetch.
+        """
+        if not rows:
+            return [] if fetch else None
+        with connection.cursor() as cursor, cls.handle_errors(connection=connection, ):
+            if connection in cls.deadlines:
+                cls.set_statement_timeout(cursor=cursor, deadline=cls.deadlines[connection], )
+            result = backends.execute_values(
+                cursor=cursor,
+                statement=statement,
+                rows=rows,
+                template=template,
+                page_size=page_size,
+                fetch=fetch,
+            )
+            if connection in cls.pipelines:
+                return None
+            if (counter := cls.trackers.get(connection)) is not None:
+                counter['round_trips'] += -(-len(rows) // page_size) + (connection in cls.deadlines)
+                counter['rows'] += len(rows)
+            if connection not in cls.transactions:
+                connection.commit()
+            return cls.extract_result(result=result, ) if fetch else None
+
+    @classmethod
+    def copy(cls, statement: str, rows: Iterable[tuple], connection: pg_ext_connection, ) -> None:
+        """
+        "COPY table (columns) FROM STDIN", the fastest load of the very many rows (the bots generation).
+        No ON CONFLICT, a duplicate fails the whole load, so clear the conflicting rows before.
+        Not for the pipeline block.
+        """
+        rows = list(rows)
+        if not rows:
+            return None
+        with connection.cursor() as cursor, cls.handle_errors(connection=connection, ):
+            if connection in cls.deadlines:
+                cls.set_statement_timeout(cursor=cursor, deadline=cls.deadlines[connection], )
+            backends.copy(cursor=cursor, statement=statement, rows=rows, )
+            if (counter := cls.trackers.get(connection)) is not None:
+                counter['round_trips'] += 1 + (connection in cls.deadlines)
+                counter['rows'] += len(rows)
+            if connection not in cls.transactions:
+                connection.commit()
+
+    @classmethod
+    def stream(
+            cls,
+            statement: str,
+            connection: pg_ext_connection,
+            values: tuple | None = None,
+            itersize: int = DB_STREAM_ITERSIZE,
+    ) -> Iterator[tuple]:
+        """
+        Read of the very many rows (all the covotes), the rows are the plain tuples fetched by the server-side cursor
+        itersize rows per round trip, so the memory doesn't depend on the result size.
+        The cursor lives in the transaction of the connection and a commit closes it,
+        so don't execute the other statements on the connection while iterating (stream on a separate one).
+        The transaction (and its snapshot, which holds back the vacuum) is open till the last row,
+        so consume the stream at once, for a long iteration (network requests per row) read by the keyset pages.
+        The transaction is finished after the last row if it's not a part of a transaction scope.
+        Not for the pipeline block.
+        """
+        count_rows = 0
+        with cls.handle_errors(connection=connection, ):
+            if connection in cls.deadlines:
+                with connection.cursor() as cursor:
+                    cls.set_statement_timeout(cursor=cursor, deadline=cls.deadlines[connection], )
+            rows = backends.stream(connection=connection, statement=statement, values=values, itersize=itersize, )
+            try:
+                for row in rows:
+                    count_rows += 1
+                    yield row
+            except GeneratorExit:  # Not all the rows are read, just close the cursor
+                rows.close()
+                if connection not in cls.transactions:
+                    connection.rollback()
+                raise
+            finally:
+                if (counter := cls.trackers.get(connection)) is not None:
+                    # The declaration and the fetches, the last fetch is not full (maybe empty)
+                    counter['round_trips'] += 2 + count_rows // itersize + (connection in cls.deadlines)
+                    counter['rows'] += count_rows
+            if connection not in cls.transactions:
+                connection.commit()
+
+    @classmethod
+    @contextmanager
+    def handle_errors(cls, connection: pg_ext_connection, ) -> Iterator[None]:
+        """Rollback the failed statement, DeadlineExceeded if it's canceled by the deadline, see execute"""
+        try:
+            yield
+        except app.exceptions.DeadlineExceeded:
+            connection.rollback()
+            raise
+        except backends.QUERY_CANCELED as e:
+            connection.rollback()
+            if connection in cls.deadlines:  # Expected, the caller decides what to do with the time over
+                raise app.exceptions.DeadlineExceeded(e) from e
+            app.postconfig.logger.error(e)
+            raise e
+        except backends.READ_ONLY_SQL_TRANSACTION:  # Not in use?
+            connection.rollback()
+            app.postconfig.logger.error('READ_ONLY_SQL_TRANSACTION')
+        except (ProgrammingError, Exception) as e:
+            connection.rollback()
+            app.postconfig.logger.error(e)
+            raise e
+
+    @classmethod
+    @contextmanager
+    def deadline(cls, connection: pg_ext_connection, deadline: float, ) -> Iterator[None]:
+        """
+        Every statement of the connection inside the block is limited by the time left till the deadline
+        (monotonic time), DeadlineExceeded is raised if the time is over.
+        """
+        cls.deadlines[connection] = deadline
+        try:
+            yield
+        finally:
+            del cls.deadlines[connection]
+
+    @classmethod
+    @contextmanager
+    def transaction(
+            cls,
+            connection: pg_ext_connection | None = None,
+            read_only: bool = False,
+    ) -> Iterator[pg_ext_connection]:
+        """
+        All the statements of the connection (the current unit of work by default) inside the block
+        are executed in a single transaction, committed once at the end or rolled back on error.
+        Read only scope is finished without the commit. Nested scope is a part of the outer one.
+        Note: a failed statement rolls back the whole transaction, so if the error is handled inside the block,
+        the next statements are executed in a new one.
+        """
+        connection = connection or cls.get_user_connection()
+        if connection in cls.transactions:
+            if cls.transactions[connection] and not read_only:
+                raise app.exceptions.UnexpectedException('Write transaction scope inside the read only one')
+            yield connection
+            return
+        cls.transactions[connection] = read_only
+        start = monotonic()
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            cls.commit_callbacks.pop(connection, None, )  # Nothing is committed
+            cls.transactions_meter.record(seconds=monotonic() - start, outcome=Outcome.ROLLBACK, )
+            raise
+        else:
+            if read_only:
+                connection.rollback()  # Just finish the transaction, nothing to flush
+                cls.transactions_meter.record(seconds=monotonic() - start, outcome=Outcome.READ_ONLY, )
+            else:
+                connection.commit()
+                cls.transactions_meter.record(seconds=monotonic() - start, outcome=Outcome.COMMIT, )
+        finally:
+            del cls.transactions[connection]
+        cls.run_commit_callbacks(connection=connection, )
+
+    @classmethod
+    def after_commit(cls, callback: Callable[[], None], connection: pg_ext_connection, ) -> None:
+        """
+        Call once the statements of the connection are committed: at the end of the transaction scope
+        or of the pipeline (its errors are raised only on the exit), right now outside of them
+        (every statement is committed by execute). Dropped if rolled back.
+        For the in-memory state which should follow DB (caches, engines), so it's never ahead of it.
+        """
+        if connection in cls.transactions or connection in cls.pipelines:
+            cls.commit_callbacks.setdefault(connection, [], ).append(callback)
+        else:
+            callback()
+
+    @classmethod
+    def run_commit_callbacks(cls, connection: pg_ext_connection, ) -> None:
+        for callback in cls.commit_callbacks.pop(connection, [], ):
+            callback()
+
+    @classmethod
+    @contextmanager
+    def pipeline(cls, connection: pg_ext_connection, ) -> Iterator[None]:
+        """
+        Statements of the connection inside the block are sent without waiting for each other results,
+        the results are received at the end at once (single round trip), so execute returns nothing for them.
+        Only for the independent statements which results are not in use (writes).
+        Committed at the end if not inside a transaction scope.
+        psycopg3 only, the statements are executed one by one as usual with psycopg2.
+        """
+        if connection in cls.pipelines or not backends.is_pipeline_supported(connection=connection, ):
+            yield
+            return
+        cls.pipelines.add(connection)
+        try:
+            with connection.pipeline():
+                yield
+            if connection not in cls.transactions:
+                connection.commit()
+        except app.exceptions.DeadlineExceeded:
+            connection.rollback()
+            raise
+        except backends.QUERY_CANCELED as e:  # Errors of the statements are raised only on the results receiving
+            connection.rollback()
+            if connection in cls.deadlines:
+                raise app.exceptions.DeadlineExceeded(e) from e
+            app.postconfig.logger.error(e)
+            raise e
+        except Exception as e:
+            connection.rollback()
+            app.postconfig.logger.error(e)
+            raise e
+        finally:
+            cls.pipelines.discard(connection)
+            # Run below only if committed, the transaction scope runs them otherwise
+            callbacks = [] if connection in cls.transactions else cls.commit_callbacks.pop(connection, [], )
+        if (counter := cls.trackers.get(connection)) is not None:
+            counter['round_trips'] += 1
+        for callback in callbacks:
+            callback()
+
+    @classmethod
+    @contextmanager
+    def track(cls, connection: pg_ext_connection, ) -> Iterator[app.structures.base.StatementsCounter]:
+        """Count the statements of the connection inside the block, the counter is updated on the fly"""
+        counter = cls.trackers[connection] = app.structures.base.StatementsCounter(round_trips=0, rows=0, )
+        try:
+            yield counter
+        finally:
+            del cls.trackers[connection]
+
+    @classmethod
+    def set_statement_timeout(cls, cursor: pg_ext_cursor, deadline: float, ) -> None:
+        """For the current transaction only, so it's set before every statement (see execute and transaction)"""
+        milliseconds = int((deadline - monotonic()) * 1000)
+        if milliseconds <= 0:
+            raise app.exceptions.DeadlineExceeded('The deadline is over before the statement')
+        cursor.execute(cls.sqls.System.SET_STATEMENT_TIMEOUT, (milliseconds,), )
+
     @staticmethod
     def extract_value(item):
         """
@@ -177,5 +480,29 @@ def create_app_tables(cls, connection: pg_ext_connection | None = None):
         for table in list(cls.tables):  # table is string with sql
             cls.execute(statement=table, connection=connection or cls.connection, )
 
+    @classmethod
+    def migrate(cls, connection: pg_ext_connection | None = None) -> int:
+        """Apply the not applied yet migrations (call after create_app_tables), returns the current schema version"""
+        connection = connection or cls.connection
+        version = cls.execute(statement=cls.sqls.Migrations.READ_SCHEMA_VERSION, connection=connection, )
+        for step_version, statements in sorted(cls.migrations.items()):
+            if step_version <= version:
+                continue
+            autocommit = connection.autocommit
+            connection.autocommit = True  # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+            try:
+                for statement in statements:
+                    cls.execute(statement=statement, connection=connection, )
+            finally:
+                connection.autocommit = autocommit
+            cls.execute(
+                statement=cls.sqls.Migrations.CREATE_SCHEMA_VERSION,
+                values=(step_version,),
+                connection=connection,
+            )
+            version = step_version
+            app.postconfig.logger.info(f'DB schema is migrated to version {version}')
+        return version
+
 
 Postgres.connection = Postgres.get_connection()  # set default connection
@@ -0,0 +1,194 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Thread-safe pool of the DB connections.
+A connection is lent for one unit of work (see Postgres.borrow) and is returned at the end of it,
+a long-lived lease (the system connection, the search session) is pinned and is not considered as a leak.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager
+from threading import Condition, current_thread
+from time import monotonic
+from typing import TYPE_CHECKING, TypedDict, Callable, Iterator
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+
+from app.exceptions import PoolExhausted
+
+if TYPE_CHECKING:
+    from psycopg2.extensions import connection as pg_ext_connection
+
+
+class Checkout(TypedDict):
+    owner: str  # Thread name by default
+    since: float
+    pinned: bool
+    is_leak_reported: bool
+
+
+class PoolStats(TypedDict):
+    opened: int
+    idle: int
+    in_use: int
+    pinned: int
+    checkouts: int  # Since the start
+    waits: int  # Checkouts which waited for a free connection
+    wait_seconds: float  # Total
+    max_wait_seconds: float
+    timeouts: int  # Checkouts failed by the wait timeout
+    leaks: int  # Not pinned checkouts held longer than leak_seconds (every one is counted once)
+
+
+class ConnectionPool:
+    """
+    At most maxconn connections, they are opened on demand. If all the connections are in use,
+    getconn waits up to timeout seconds for a returned one and raises PoolExhausted after.
+    Session state of a returned connection is reset by reset_statement (temporary tables of the search).
+    """
+
+    def __init__(
+            self,
+            connect: Callable[[], pg_ext_connection],
+            maxconn: int,
+            timeout: float,
+            leak_seconds: float,
+            reset_statement: str | None = None,
+            timer: Callable[[], float] = monotonic,
+    ):
+        self.connect = connect
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.leak_seconds = leak_seconds
+        self.reset_statement = reset_statement
+        self.timer = timer
+        self.condition = Condition()
+        self.idle: list[pg_ext_connection] = []
+        self.checkouts: dict[pg_ext_connection, Checkout] = {}
+        self.opened = 0
+        self.count_checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+        self.leaks = 0
+
+    def getconn(self, pinned: bool = False, owner: str | None = None, ) -> pg_ext_connection:
+        """Don't forget to putconn, prefer borrow"""
+        start = self.timer()
+        connection, is_waited = None, False
+        with self.condition:
+            while not self.idle and self.opened >= self.maxconn:
+                is_waited = True
+                remaining = self.timeout - (self.timer() - start)
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolExhausted(f'No free DB connection in {self.timeout}s, {self.maxconn} are in use')
+                self.condition.wait(timeout=remaining, )
+            if self.idle:
+                connection = self.idle.pop()
+            else:
+                self.opened += 1  # Reserve the place, the connection is opened outside the lock
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                with self.condition:
+                    self.opened -= 1
+                    self.condition.notify()
+                raise
+        with self.condition:
+            self.count_checkouts += 1
+            if is_waited:
+                waited = self.timer() - start
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited, )
+            self.checkouts[connection] = Checkout(
+                owner=owner or current_thread().name,
+                since=self.timer(),
+                pinned=pinned,
+                is_leak_reported=False,
+            )
+        return connection
+
+    def putconn(self, connection: pg_ext_connection, close: bool = False, ) -> None:
+        with self.condition:
+            del self.checkouts[connection]  # KeyError if the connection is not from the pool or already returned
+        if not close and not connection.closed:
+            try:
+                self.reset(connection=connection, )
+            except Exception:
+                close = True  # Broken connection, the next checkout will open a new one
+        if close or connection.closed:
+            if not connection.closed:
+                connection.close()
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            return
+        with self.condition:
+            self.idle.append(connection)
+            self.condition.notify()
+
+    def reset(self, connection: pg_ext_connection, ) -> None:
+        """Rollback the not finished transaction and reset the session state"""
+        status = connection.info.transaction_status
+        if status == TRANSACTION_STATUS_UNKNOWN:
+            raise ConnectionError('Connection is broken')
+        if status != TRANSACTION_STATUS_IDLE:
+            connection.rollback()
+        if self.reset_statement is not None:
+            with connection.cursor() as cursor:
+                cursor.execute(self.reset_statement, )
+            connection.commit()
+
+    @contextmanager
+    def borrow(self, pinned: bool = False, owner: str | None = None, ) -> Iterator[pg_ext_connection]:
+        connection = self.getconn(pinned=pinned, owner=owner, )
+        try:
+            yield connection
+        finally:
+            self.putconn(connection=connection, )
+
+    def find_leaks(self, ) -> list[Checkout]:
+        """Not pinned checkouts held longer than leak_seconds, the new ones are counted as leaks"""
+        now = self.timer()
+        result = []
+        with self.condition:
+            for checkout in self.checkouts.values():
+                if not checkout['pinned'] and now - checkout['since'] > self.leak_seconds:
+                    if not checkout['is_leak_reported']:
+                        checkout['is_leak_reported'] = True
+                        self.leaks += 1
+                    result.append(checkout)
+        return result
+
+    def stats(self, ) -> PoolStats:
+        with self.condition:
+            pinned = sum(checkout['pinned'] for checkout in self.checkouts.values())
+            return PoolStats(
+                opened=self.opened,
+                idle=len(self.idle),
+                in_use=len(self.checkouts),
+                pinned=pinned,
+                checkouts=self.count_checkouts,
+                waits=self.waits,
+                wait_seconds=self.wait_seconds,
+                max_wait_seconds=self.max_wait_seconds,
+                timeouts=self.timeouts,
+                leaks=self.leaks,
+            )
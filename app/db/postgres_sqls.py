@@ -45,36 +45,44 @@ class Public:
             f'GROUP BY tg_user_id'
         )
 
-        USE_GOAL_FILTER = (
-            f'DELETE FROM {TMP_COVOTES_TABLE_NAME} WHERE tg_user_id NOT IN '
-            '(SELECT tg_user_id FROM users WHERE goal = %s)'
+        FILL_TEMP_TABLE_USER_COVOTES_FROM_ENGINE = (  # Covotes are already counted by the in-memory engine
+            f'INSERT INTO {TMP_COVOTES_TABLE_NAME} (tg_user_id, count_common_interests) '
+            'SELECT * FROM unnest(%s::bigint[], %s::int[])'
         )
 
-        USE_GENDER_FILTER = (
-            f'DELETE FROM {TMP_COVOTES_TABLE_NAME} WHERE tg_user_id NOT IN '
-            '(SELECT tg_user_id FROM users WHERE gender = %s)'
+        # Filters are anti joins (NOT EXISTS) instead of "NOT IN (subselect)":
+        # Postgres may probe the users indexes per covoter or scan only the users who pass the filter (see DDL).
+        USE_FILTER_PATTERN = (
+            f'DELETE FROM {TMP_COVOTES_TABLE_NAME} WHERE NOT EXISTS '
+            f'(SELECT 1 FROM users WHERE users.tg_user_id = {TMP_COVOTES_TABLE_NAME}.tg_user_id AND'
         )
 
-        # First is min_age, second is max_age
-        USE_AGE_FILTER = (
-            f"DELETE FROM {TMP_COVOTES_TABLE_NAME} WHERE tg_user_id NOT IN "
-            "(SELECT tg_user_id FROM users WHERE "
-            "date_part('year', age(birthdate)) >=  %s and date_part('year', age(birthdate)) <= %s)"
+        USE_GOAL_FILTER = f'{USE_FILTER_PATTERN} users.goal = %s)'
+
+        USE_GENDER_FILTER = f'{USE_FILTER_PATTERN} users.gender = %s)'
+
+        # Age between min_age and max_age is the same as birthdate between 2 dates, the index on birthdate is used.
+        # Person is min_age years old at least if born before (or at) the date min_age years ago,
+        # and max_age years old at most if born after the date (max_age + 1) years ago.
+        BIRTHDATE_RANGE_CONDITION = (
+            'users.birthdate <= (CURRENT_DATE - make_interval(years => {min_age}::int))::date AND '
+            'users.birthdate > (CURRENT_DATE - make_interval(years => {max_age}::int + 1))::date'
         )
 
+        # First is min_age, second is max_age
+        USE_AGE_FILTER = f"{USE_FILTER_PATTERN} {BIRTHDATE_RANGE_CONDITION.format(min_age='%s', max_age='%s')})"
+
         USE_CHECKBOX_PHOTO_FILTER = (
-            f'DELETE FROM {TMP_COVOTES_TABLE_NAME} WHERE tg_user_id NOT IN (SELECT DISTINCT tg_user_id FROM photos)'
+            f'DELETE FROM {TMP_COVOTES_TABLE_NAME} WHERE NOT EXISTS '
+            f'(SELECT 1 FROM photos WHERE photos.tg_user_id = {TMP_COVOTES_TABLE_NAME}.tg_user_id)'
         )
 
-        USE_CHECKBOX_COUNTRY_FILTER = (
-            f'DELETE FROM {TMP_COVOTES_TABLE_NAME} WHERE tg_user_id NOT IN '
-            '(SELECT tg_user_id FROM users WHERE country IS NOT NULL)'
-        )
+        USE_CHECKBOX_COUNTRY_FILTER = f'{USE_FILTER_PATTERN} users.country IS NOT NULL)'
 
-        USE_CHECKBOX_CITY_FILTER = (
-            f'DELETE FROM {TMP_COVOTES_TABLE_NAME} WHERE tg_user_id NOT IN '
-            '(SELECT tg_user_id FROM users WHERE city IS NOT NULL)'
-        )
+        USE_CHECKBOX_CITY_FILTER = f'{USE_FILTER_PATTERN} users.city IS NOT NULL)'
+
+        # Ids of the users in the radius are found beforehand by the grid cells (see READ_USERS_LOCATIONS)
+        USE_NEARBY_FILTER = f'DELETE FROM {TMP_COVOTES_TABLE_NAME} WHERE tg_user_id != ALL(%s::bigint[])'
 
         IS_USER_HAS_COVOTES = f'SELECT 1 FROM {TMP_COVOTES_TABLE_NAME} LIMIT 1'
 
@@ -104,10 +112,326 @@ class Public:
             f'ORDER BY count_common_interests ASC'
         )
 
+        READ_MATCHES_COUNTS = (
+            f'SELECT COUNT(*) AS count_all, COUNT(*) FILTER (WHERE shown_users.shown_id IS NULL) AS count_new '
+            f'FROM {TMP_COVOTES_TABLE_NAME} LEFT JOIN shown_users ON '
+            f'{TMP_COVOTES_TABLE_NAME}.tg_user_id = shown_users.shown_id AND shown_users.tg_user_id = %(tg_user_id)s'
+        )
+
+        # Keyset pagination: the best matches first, tg_user_id is a tiebreak (stable order between the pages).
+        # Page starts after the last fetched match (last_count, last_tg_user_id), NULL means the first page.
+        READ_MATCHES_PAGE = (
+            f'{READ_MATCHES_PATTERN} LEFT JOIN shown_users ON '
+            f'{TMP_COVOTES_TABLE_NAME}.tg_user_id = shown_users.shown_id AND shown_users.tg_user_id = %(tg_user_id)s '
+            f'WHERE (NOT %(new)s::bool OR shown_users.shown_id IS NULL) AND '
+            f'(%(last_count)s::int IS NULL OR '
+            f'({TMP_COVOTES_TABLE_NAME}.count_common_interests, {TMP_COVOTES_TABLE_NAME}.tg_user_id) < '
+            f'(%(last_count)s::int, %(last_tg_user_id)s::bigint)) '
+            f'ORDER BY {TMP_COVOTES_TABLE_NAME}.count_common_interests DESC, {TMP_COVOTES_TABLE_NAME}.tg_user_id DESC '
+            f'LIMIT %(limit)s'
+        )
+
         DROP_TEMP_TABLE_USER_VOTES = f'DROP TABLE IF EXISTS {TMP_VOTES_TABLE_NAME}'
 
         DROP_TEMP_TABLE_USER_COVOTES = f'DROP TABLE IF EXISTS {TMP_COVOTES_TABLE_NAME}'
 
+        # # # Single statement search (no temporary tables, no DELETE filters).
+        # Named placeholders cuz the same value is used several times inside the statement.
+        # Disabled filter is passed as NULL (goal, gender, age) or False (checkboxes),
+        # the planner just drops "NULL IS NULL OR ..." branches. Casts are required for server side binding (psycopg3).
+
+        USER_VOTES_CTE = (
+            'user_votes AS '
+            '(SELECT post_id, value FROM public_votes WHERE tg_user_id = %(tg_user_id)s AND value != 0)'
+        )
+
+        COVOTES_CTE = (
+            'covotes AS ('
+            'SELECT public_votes.tg_user_id, COUNT(*) AS count_common_interests FROM public_votes '
+            'JOIN user_votes ON public_votes.post_id = user_votes.post_id AND public_votes.value = user_votes.value '
+            'WHERE public_votes.tg_user_id != %(tg_user_id)s '
+            'GROUP BY public_votes.tg_user_id)'
+        )
+
+        # LEFT JOIN users cuz voter may have no profile, such covoter is filtered out only if some filter is active.
+        FILTERS_CONDITION = (
+            '(%(goal)s::int IS NULL OR users.goal = %(goal)s::int) AND '
+            '(%(gender)s::int IS NULL OR users.gender = %(gender)s::int) AND '
+            '(%(min_age)s::int IS NULL OR '
+            f"{BIRTHDATE_RANGE_CONDITION.format(min_age='%(min_age)s', max_age='%(max_age)s')}) AND "
+            '(NOT %(photo)s::bool OR EXISTS (SELECT 1 FROM photos WHERE photos.tg_user_id = covotes.tg_user_id)) AND '
+            '(NOT %(country)s::bool OR users.country IS NOT NULL) AND '
+            '(NOT %(city)s::bool OR users.city IS NOT NULL) AND '
+            '(%(nearby_ids)s::bigint[] IS NULL OR covotes.tg_user_id = ANY(%(nearby_ids)s::bigint[]))'
+        )
+
+        # Requires "covotes" CTE (tg_user_id, count_common_interests) to be declared before.
+        # "id" is a position in ascending order, the same as serial id of the temporary table was used for.
+        READ_FILTERED_COVOTES_PATTERN = (
+            'SELECT '
+            '(row_number() OVER (ORDER BY covotes.count_common_interests, covotes.tg_user_id))::int AS id, '
+            'covotes.tg_user_id, '
+            'covotes.count_common_interests::int AS count_common_interests, '
+            'shown_users.shown_id IS NULL AS is_new '
+            'FROM covotes '
+            'LEFT JOIN users ON covotes.tg_user_id = users.tg_user_id '
+            'LEFT JOIN shown_users ON '
+            'covotes.tg_user_id = shown_users.shown_id AND shown_users.tg_user_id = %(tg_user_id)s '
+            f'WHERE {FILTERS_CONDITION} '
+            'ORDER BY id ASC'
+        )
+
+        READ_FILTERED_MATCHES = f'WITH {USER_VOTES_CTE}, {COVOTES_CTE} {READ_FILTERED_COVOTES_PATTERN}'
+
+        # Partial search: covoters are scanned only by the latest votes of the user.
+        USER_RECENT_VOTES_CTE = (
+            'user_votes AS ('
+            'SELECT post_id, value FROM public_votes WHERE tg_user_id = %(tg_user_id)s AND value != 0 '
+            'ORDER BY updated_at DESC LIMIT %(votes_limit)s::int)'
+        )
+
+        READ_FILTERED_RECENT_MATCHES = f'WITH {USER_RECENT_VOTES_CTE}, {COVOTES_CTE} {READ_FILTERED_COVOTES_PATTERN}'
+
+        # Covotes are already counted by the in-memory engine, DB only applies the filters.
+        ENGINE_COVOTES_CTE = (
+            'covotes AS ('
+            'SELECT * FROM unnest(%(covotes_ids)s::bigint[], %(covotes_counts)s::int[]) '
+            'AS covotes (tg_user_id, count_common_interests))'
+        )
+
+        READ_FILTERED_ENGINE_MATCHES = f'WITH {ENGINE_COVOTES_CTE} {READ_FILTERED_COVOTES_PATTERN}'
+
+        READ_USER_LOCATION = (
+            'SELECT tg_user_id, latitude, longitude, geo_cell FROM users '
+            'WHERE tg_user_id = %s AND geo_cell IS NOT NULL'
+        )
+
+        # Located users of the cells around the searcher, index only scan (see DDL users_geo_cell_idx).
+        READ_USERS_LOCATIONS = (
+            'SELECT tg_user_id, latitude, longitude, geo_cell FROM users '
+            'WHERE geo_cell = ANY(%s::int[]) AND geo_cell IS NOT NULL'
+        )
+
+        READ_ALL_VOTES = 'SELECT tg_user_id, post_id, value FROM public_votes WHERE value != 0'  # To load the engine
+
+        # Mark of the votes snapshot, the start of the oldest transaction in progress (this one included).
+        # A vote is updated at the start of its transaction (CURRENT_TIMESTAMP), so if the mark is read before the votes,
+        # every vote committed after they are read is updated since the mark. MAX(updated_at) is not safe for that,
+        # a vote updated before it may be committed later. The sessions of the other DB roles are not visible.
+        READ_VOTES_MARK = (
+            'SELECT MIN(xact_start)::timestamp AS mark FROM pg_stat_activity '
+            'WHERE datname = current_database() AND xact_start IS NOT NULL'
+        )
+
+        # Votes to replay over the snapshot, zero (canceled) votes are included. NULL mark - all the votes.
+        READ_VOTES_SINCE = (
+            'SELECT tg_user_id, post_id, COALESCE(value, 0) AS value FROM public_votes '
+            'WHERE %(mark)s::timestamp IS NULL OR updated_at >= %(mark)s::timestamp'
+        )
+
+        # # # Scoring of the candidates (see Matcher.Scoring)
+        READ_USERS_VOTES_COUNTS = (
+            'SELECT tg_user_id, votes_count FROM users_votes_counts '
+            'WHERE tg_user_id = ANY(%(tg_user_ids)s::bigint[])'
+        )
+
+        # The same as READ_USERS_VOTES_COUNTS but by the votes aggregation (the counters source, see benchmarks).
+        COUNT_USERS_VOTES = (
+            'SELECT tg_user_id, COUNT(*)::int AS votes_count FROM public_votes '
+            'WHERE tg_user_id = ANY(%(tg_user_ids)s::bigint[]) AND value != 0 '
+            'GROUP BY tg_user_id'
+        )
+
+        # Delta is +1 for a new not zero vote and -1 for a canceled one.
+        UPDATE_USER_VOTES_COUNT = (
+            'INSERT INTO users_votes_counts (tg_user_id, votes_count) VALUES (%(tg_user_id)s, %(delta)s::int) '
+            'ON CONFLICT (tg_user_id) DO UPDATE SET votes_count = users_votes_counts.votes_count + EXCLUDED.votes_count'
+        )
+
+        UPDATE_USERS_VOTES_COUNTS = (  # Bulk, a row is (tg_user_id, delta), a user per row
+            'INSERT INTO users_votes_counts (tg_user_id, votes_count) VALUES %s '
+            'ON CONFLICT (tg_user_id) DO UPDATE SET votes_count = users_votes_counts.votes_count + EXCLUDED.votes_count'
+        )
+
+        UPDATE_USERS_VOTES_COUNTS_TEMPLATE = '(%s, %s::int)'
+
+        TRUNCATE_USERS_VOTES_COUNTS = 'TRUNCATE users_votes_counts'
+
+        # Full recount: the migration backfill and "python -m app.repair" only.
+        # Upsert, so a single atomic statement overwrites the counters written in between, no TRUNCATE needed.
+        FILL_USERS_VOTES_COUNTS = (
+            'INSERT INTO users_votes_counts (tg_user_id, votes_count) '
+            'SELECT tg_user_id, COUNT(*) FROM public_votes WHERE value != 0 GROUP BY tg_user_id '
+            'ON CONFLICT (tg_user_id) DO UPDATE SET votes_count = EXCLUDED.votes_count'
+        )
+
+        # Total of the IDF weights (see Matcher.get_users_count), read once per TTL, not per covote.
+        READ_USERS_COUNT = 'SELECT COUNT(*)::int FROM users'
+
+        # Every common vote of the candidates with voters count of the post (how popular the post is).
+        READ_COVOTES_POSTS = (
+            f'WITH {USER_VOTES_CTE}, '
+            'posts AS ('
+            'SELECT public_votes.post_id, COUNT(*) AS voters_count FROM public_votes '
+            'JOIN user_votes ON public_votes.post_id = user_votes.post_id '
+            'WHERE public_votes.value != 0 '
+            'GROUP BY public_votes.post_id) '
+            'SELECT '
+            'public_votes.tg_user_id, '
+            'posts.voters_count::int AS voters_count '
+            'FROM public_votes '
+            'JOIN user_votes ON public_votes.post_id = user_votes.post_id AND public_votes.value = user_votes.value '
+            'JOIN posts ON public_votes.post_id = posts.post_id '
+            'WHERE public_votes.tg_user_id = ANY(%(tg_user_ids)s::bigint[])'
+        )
+
+        # # # Top matches, materialized in user_top_matches table (see DDL).
+        TOP_MATCHES_TABLE_NAME = 'user_top_matches'
+        TOP_MATCHES_TOUCHED_TABLE_NAME = 'user_top_matches_touched'
+        TOP_MATCHES_KEPT = 1_000  # K, rows per user kept in the table, also the read limit (Matcher.TOP_MATCHES_LIMIT)
+
+        # Pairs with zero count (canceled votes) are kept, just skipped.
+        TOP_MATCHES_CTE = (
+            'covotes AS ('
+            f'SELECT match_id AS tg_user_id, count_common_interests FROM {TOP_MATCHES_TABLE_NAME} '
+            'WHERE tg_user_id = %(tg_user_id)s AND count_common_interests > 0 '
+            'ORDER BY count_common_interests DESC LIMIT %(limit)s)'
+        )
+
+        READ_FILTERED_TOP_MATCHES = f'WITH {TOP_MATCHES_CTE} {READ_FILTERED_COVOTES_PATTERN}'
+
+        # Vote value of the user on the post was changed: +1 to the pairs of the new value (delta) and -1 to the pairs
+        # of the old one (DECREASE_TOP_MATCHES, only the kept rows, a trimmed pair is not inserted back as negative).
+        # Only the pairs with the same value on this post are affected, both directions of every pair.
+        # A pair that is not in the table (new or trimmed before) is inserted with its full count, not with the delta.
+        # The users that got the new rows are marked, only their top matches may exceed K (see TRIM_TOP_MATCHES).
+        UPDATE_TOP_MATCHES = (
+            'WITH upserted AS ('
+            f'INSERT INTO {TOP_MATCHES_TABLE_NAME} (tg_user_id, match_id, count_common_interests) '
+            'SELECT pairs.tg_user_id, pairs.match_id, CASE WHEN kept.tg_user_id IS NULL THEN ('
+            'SELECT COUNT(*)::int FROM public_votes AS votes '
+            'JOIN public_votes AS covotes ON votes.post_id = covotes.post_id AND votes.value = covotes.value '
+            'WHERE votes.tg_user_id = pairs.tg_user_id AND covotes.tg_user_id = pairs.match_id AND votes.value != 0'
+            ') ELSE %(delta)s::int END FROM public_votes '
+            'CROSS JOIN LATERAL (VALUES '
+            '(%(tg_user_id)s::bigint, public_votes.tg_user_id), '
+            '(public_votes.tg_user_id, %(tg_user_id)s::bigint)'
+            ') AS pairs (tg_user_id, match_id) '
+            f'LEFT JOIN {TOP_MATCHES_TABLE_NAME} AS kept '
+            'ON kept.tg_user_id = pairs.tg_user_id AND kept.match_id = pairs.match_id '
+            'WHERE public_votes.post_id = %(post_id)s AND public_votes.value = %(value)s '
+            'AND public_votes.tg_user_id != %(tg_user_id)s '
+            'ON CONFLICT (tg_user_id, match_id) DO UPDATE SET count_common_interests = '
+            f'{TOP_MATCHES_TABLE_NAME}.count_common_interests + %(delta)s::int '
+            'RETURNING tg_user_id, xmax = 0 AS is_inserted'  # Zero xmax - inserted, not updated row
+            f') INSERT INTO {TOP_MATCHES_TOUCHED_TABLE_NAME} (tg_user_id) '
+            'SELECT DISTINCT tg_user_id FROM upserted WHERE is_inserted ON CONFLICT DO NOTHING'
+        )
+
+        # Bulk UPDATE_TOP_MATCHES + DECREASE_TOP_MATCHES of the votes of the different users for the same post,
+        # a row is (tg_user_id, post_id, old_value) of a changed vote, the new values are already saved.
+        # The old value of a voter is the one of the row if the voter is in the batch, the saved one otherwise,
+        # so a pair of two voters of the batch is counted once: +1 if the values are equal now, -1 if were before.
+        UPDATE_TOP_MATCHES_MANY = (
+            'WITH batch (tg_user_id, post_id, old_value) AS (VALUES %s), '
+            'voters AS ('
+            'SELECT public_votes.tg_user_id, public_votes.value AS new_value, '
+            'COALESCE(batch.old_value, public_votes.value) AS old_value, batch.tg_user_id IS NOT NULL AS is_changed '
+            'FROM public_votes LEFT JOIN batch ON batch.tg_user_id = public_votes.tg_user_id '
+            'WHERE public_votes.post_id = (SELECT post_id FROM batch LIMIT 1)), '
+            'deltas AS ('
+            'SELECT changed.tg_user_id AS tg_user_id, other.tg_user_id AS match_id, '
+            '(changed.new_value = other.new_value AND changed.new_value != 0)::int - '
+            '(changed.old_value = other.old_value AND changed.old_value != 0)::int AS delta '
+            'FROM voters AS changed JOIN voters AS other ON other.tg_user_id != changed.tg_user_id '
+            'WHERE changed.is_changed), '
+            'pairs AS ('
+            'SELECT tg_user_id, match_id, delta FROM deltas WHERE delta != 0 '
+            'UNION SELECT match_id, tg_user_id, delta FROM deltas WHERE delta != 0), '
+            'upserted AS ('
+            f'INSERT INTO {TOP_MATCHES_TABLE_NAME} (tg_user_id, match_id, count_common_interests) '
+            'SELECT pairs.tg_user_id, pairs.match_id, CASE WHEN kept.tg_user_id IS NULL THEN ('
+            'SELECT COUNT(*)::int FROM public_votes AS votes '
+            'JOIN public_votes AS covotes ON votes.post_id = covotes.post_id AND votes.value = covotes.value '
+            'WHERE votes.tg_user_id = pairs.tg_user_id AND covotes.tg_user_id = pairs.match_id AND votes.value != 0'
+            ') ELSE pairs.delta END FROM pairs '
+            f'LEFT JOIN {TOP_MATCHES_TABLE_NAME} AS kept '
+            'ON kept.tg_user_id = pairs.tg_user_id AND kept.match_id = pairs.match_id '
+            'WHERE pairs.delta > 0 OR kept.tg_user_id IS NOT NULL '  # A trimmed pair is not inserted back as negative
+            'ON CONFLICT (tg_user_id, match_id) DO UPDATE SET count_common_interests = '
+            f'{TOP_MATCHES_TABLE_NAME}.count_common_interests + EXCLUDED.count_common_interests '
+            'RETURNING tg_user_id, xmax = 0 AS is_inserted'
+            f') INSERT INTO {TOP_MATCHES_TOUCHED_TABLE_NAME} (tg_user_id) '
+            'SELECT DISTINCT tg_user_id FROM upserted WHERE is_inserted ON CONFLICT DO NOTHING'
+        )
+
+        UPDATE_TOP_MATCHES_MANY_TEMPLATE = '(%s::bigint, %s::int, %s::int)'  # Typed, the CTE has no table
+
+        DECREASE_TOP_MATCHES = (
+            f'UPDATE {TOP_MATCHES_TABLE_NAME} SET count_common_interests = count_common_interests - 1 '
+            'FROM public_votes '
+            'CROSS JOIN LATERAL (VALUES '
+            '(%(tg_user_id)s::bigint, public_votes.tg_user_id), '
+            '(public_votes.tg_user_id, %(tg_user_id)s::bigint)'
+            ') AS pairs (tg_user_id, match_id) '
+            'WHERE public_votes.post_id = %(post_id)s AND public_votes.value = %(value)s '
+            'AND public_votes.tg_user_id != %(tg_user_id)s '
+            f'AND {TOP_MATCHES_TABLE_NAME}.tg_user_id = pairs.tg_user_id '
+            f'AND {TOP_MATCHES_TABLE_NAME}.match_id = pairs.match_id'
+        )
+
+        TRUNCATE_TOP_MATCHES = f'TRUNCATE {TOP_MATCHES_TABLE_NAME}, {TOP_MATCHES_TOUCHED_TABLE_NAME}'
+
+        # Full recount of the top K per user, heavy: "python -m app.repair --top-matches" only.
+        FILL_TOP_MATCHES = (
+            f'INSERT INTO {TOP_MATCHES_TABLE_NAME} (tg_user_id, match_id, count_common_interests) '
+            'SELECT tg_user_id, match_id, count_common_interests FROM ('
+            'SELECT votes.tg_user_id, covotes.tg_user_id AS match_id, COUNT(*) AS count_common_interests, '
+            'ROW_NUMBER() OVER (PARTITION BY votes.tg_user_id ORDER BY COUNT(*) DESC) AS rank FROM public_votes AS votes '
+            'JOIN public_votes AS covotes ON votes.post_id = covotes.post_id AND votes.value = covotes.value '
+            'WHERE votes.value != 0 AND votes.tg_user_id != covotes.tg_user_id '
+            'GROUP BY votes.tg_user_id, covotes.tg_user_id'
+            f') AS pairs WHERE rank <= {TOP_MATCHES_KEPT}'
+        )
+
+        # The incremental updates add the new pairs, the periodic trim keeps the table at K rows per user.
+        # Only the users marked since the last trim are ranked (see UPDATE_TOP_MATCHES), the marks are consumed.
+        # A mark committed after the start of the trim is not visible to it, so it's left for the next trim.
+        TRIM_TOP_MATCHES = (
+            f'WITH touched AS (DELETE FROM {TOP_MATCHES_TOUCHED_TABLE_NAME} RETURNING tg_user_id) '
+            f'DELETE FROM {TOP_MATCHES_TABLE_NAME} USING ('
+            'SELECT tg_user_id, match_id, count_common_interests, '
+            'ROW_NUMBER() OVER (PARTITION BY tg_user_id ORDER BY count_common_interests DESC) AS rank '
+            f'FROM {TOP_MATCHES_TABLE_NAME} WHERE tg_user_id IN (SELECT tg_user_id FROM touched)) AS ranked '
+            f'WHERE {TOP_MATCHES_TABLE_NAME}.tg_user_id = ranked.tg_user_id '
+            f'AND {TOP_MATCHES_TABLE_NAME}.match_id = ranked.match_id '
+            f'AND (ranked.rank > {TOP_MATCHES_KEPT} OR ranked.count_common_interests <= 0)'
+        )
+
+        # # # Precomputed matches (see DDL), a bulk write of the worker chunk as the parallel arrays.
+        UPSERT_PRECOMPUTED_MATCHES = (
+            'INSERT INTO precomputed_matches (tg_user_id, match_id, count_common_interests, computed_at) '
+            'SELECT pairs.tg_user_id, pairs.match_id, pairs.count_common_interests, %(computed_at)s::timestamp '
+            'FROM unnest(%(tg_user_ids)s::bigint[], %(match_ids)s::bigint[], %(counts)s::int[]) '
+            'AS pairs (tg_user_id, match_id, count_common_interests) '
+            'ON CONFLICT (tg_user_id, match_id) DO UPDATE SET '
+            'count_common_interests = EXCLUDED.count_common_interests, computed_at = EXCLUDED.computed_at'
+        )
+
+        DELETE_STALE_PRECOMPUTED_MATCHES = 'DELETE FROM precomputed_matches WHERE computed_at < %(computed_at)s::timestamp'
+
+        # Replaces "create user_votes + count + create user_covotes + count" before the search.
+        READ_USER_VOTES_STATS = (
+            f'WITH {USER_VOTES_CTE} '
+            'SELECT '
+            '(SELECT COUNT(*) FROM user_votes) AS votes_count, '
+            'EXISTS ('
+            'SELECT 1 FROM public_votes '
+            'JOIN user_votes ON public_votes.post_id = user_votes.post_id AND public_votes.value = user_votes.value '
+            'WHERE public_votes.tg_user_id != %(tg_user_id)s'
+            ') AS has_covotes'
+        )
+
     class Personal:
         TMP_PERSONAL_VOTES_TABLE_NAME = 'user_personal_votes'
         TMP_PERSONAL_COVOTES_TABLE_NAME = 'my_and_covote_personal_votes'
@@ -243,12 +567,17 @@ class Collections:
         'INSERT INTO m2m_collections_posts (collection_id, post_id) VALUES (%s, %s) RETURNING id'
     )
 
+    CREATE_M2M_COLLECTIONS_POSTS_MANY = (  # Bulk
+        'INSERT INTO m2m_collections_posts (collection_id, post_id) VALUES %s '
+        'ON CONFLICT (collection_id, post_id) DO NOTHING'
+    )
+
     READ_USER_COLLECTION_ID_BY_NAME = (
         'SELECT id as collection_id FROM collections WHERE author = %s and name = %s LIMIT 1'
     )
 
-    READ_COLLECTIONS_BY_IDS = (  # IN %s - to pass list of values
-        'SELECT id as collection_id, author, name FROM collections WHERE id IN %s'
+    READ_COLLECTIONS_BY_IDS = (  # ANY - a list is adapted to an array by psycopg v2 and v3
+        'SELECT id as collection_id, author, name FROM collections WHERE id = ANY(%s::int[])'
     )
 
     READ_USER_COLLECTIONS = (
@@ -283,14 +612,27 @@ class PublicVotes:
 
     READ_USERS_IDS_VOTED_FOR_PUBLIC_POST = "SELECT tg_user_id FROM public_votes WHERE post_id = %s"
 
+    READ_USERS_PUBLIC_VOTES_FOR_POST = (
+        'SELECT tg_user_id, post_id, message_id, value FROM public_votes '
+        'WHERE post_id = %s AND tg_user_id = ANY(%s)'
+    )
+
     READ_USER_PUBLIC_VOTES_COUNT = 'SELECT COUNT(*) FROM public_votes WHERE tg_user_id = %s'
 
     UPSERT_PUBLIC_VOTE_VALUE = (  # Not in use
         'INSERT INTO public_votes (tg_user_id, post_id, message_id, value) '
-        'VALUES (%s, %s, %s, %s) ON CONFLICT  (tg_user_id, post_id) DO UPDATE SET value = %s'
+        'VALUES (%s, %s, %s, %s) ON CONFLICT  (tg_user_id, post_id) DO UPDATE SET value = %s, '
+        'updated_at = CURRENT_TIMESTAMP'
+    )
+
+    UPSERT_PUBLIC_VOTES_VALUES = (  # Bulk
+        'INSERT INTO public_votes (tg_user_id, post_id, message_id, value) VALUES %s '
+        'ON CONFLICT (tg_user_id, post_id) DO UPDATE SET value = EXCLUDED.value, updated_at = CURRENT_TIMESTAMP'
     )
 
-    UPDATE_PUBLIC_VOTE_VALUE = 'UPDATE public_votes SET value = %s WHERE tg_user_id = %s AND post_id = %s'
+    UPDATE_PUBLIC_VOTE_VALUE = (
+        'UPDATE public_votes SET value = %s, updated_at = CURRENT_TIMESTAMP WHERE tg_user_id = %s AND post_id = %s'
+    )
 
     # User may vote only if vote present in DB -  that's condition of app (insertion during sending)
     UPSERT_PUBLIC_VOTE_MESSAGE_ID = (
@@ -314,12 +656,22 @@ class PersonalVotes:
 
     READ_USER_PERSONAL_VOTES = 'SELECT tg_user_id, post_id, message_id, value FROM personal_votes WHERE tg_user_id = %s'
 
+    READ_USERS_PERSONAL_VOTES_FOR_POST = (
+        'SELECT tg_user_id, post_id, message_id, value FROM personal_votes '
+        'WHERE post_id = %s AND tg_user_id = ANY(%s)'
+    )
+
     UPSERT_PERSONAL_VOTE = (
         'INSERT INTO personal_votes (tg_user_id, post_id, message_id, value) '
         'VALUES (%s, %s, %s, %s) '
         'ON CONFLICT (tg_user_id, post_id) DO UPDATE SET message_id = %s, value = %s'
     )
 
+    UPSERT_PERSONAL_VOTES = (  # Bulk
+        'INSERT INTO personal_votes (tg_user_id, post_id, message_id, value) VALUES %s '
+        'ON CONFLICT (tg_user_id, post_id) DO UPDATE SET message_id = EXCLUDED.message_id, value = EXCLUDED.value'
+    )
+
     UPSERT_PERSONAL_VOTE_MESSAGE_ID = (  # Not in use
         'INSERT INTO personal_votes (tg_user_id, post_id, message_id) VALUES (%s, %s, %s) '
         'ON CONFLICT (tg_user_id, post_id) DO UPDATE SET message_id = %s'
@@ -329,14 +681,28 @@ class PersonalVotes:
 class Users:
     CREATE_USER = (
         'INSERT INTO users (tg_user_id, fullname, goal, gender, birthdate, country, city, comment) '
-        "VALUES (%s, %s, %s, %s, CURRENT_DATE - INTERVAL '%s YEAR', %s, %s, %s)"
+        'VALUES (%s, %s, %s, %s, CURRENT_DATE - make_interval(years => %s), %s, %s, %s)'
     )
 
     UPSERT_USER = '''INSERT INTO users (tg_user_id, fullname, goal, gender, birthdate, country, city, comment)
-                     VALUES (%s, %s, %s, %s, CURRENT_DATE - INTERVAL '%s YEAR', %s, %s, %s) 
+                     VALUES (%s, %s, %s, %s, CURRENT_DATE - make_interval(years => %s), %s, %s, %s) 
                      ON CONFLICT (tg_user_id) DO UPDATE SET 
                      tg_user_id = %s, fullname = %s, goal = %s, gender = %s, 
-                     birthdate = CURRENT_DATE - INTERVAL '%s YEAR', country = %s, city = %s, comment = %s'''
+                     birthdate = CURRENT_DATE - make_interval(years => %s), country = %s, city = %s, comment = %s'''
+
+    # Bulk (see Postgres.execute_values), with the location
+    UPSERT_USERS = (
+        'INSERT INTO users '
+        '(tg_user_id, fullname, goal, gender, birthdate, country, city, comment, latitude, longitude, geo_cell) '
+        'VALUES %s ON CONFLICT (tg_user_id) DO UPDATE SET '
+        'fullname = EXCLUDED.fullname, goal = EXCLUDED.goal, gender = EXCLUDED.gender, '
+        'birthdate = EXCLUDED.birthdate, country = EXCLUDED.country, city = EXCLUDED.city, '
+        'comment = EXCLUDED.comment, latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude, '
+        'geo_cell = EXCLUDED.geo_cell'
+    )
+    UPSERT_USERS_TEMPLATE = '(%s, %s, %s, %s, CURRENT_DATE - make_interval(years => %s), %s, %s, %s, %s, %s, %s)'
+
+    UPDATE_USER_LOCATION = 'UPDATE users SET latitude = %s, longitude = %s, geo_cell = %s WHERE tg_user_id = %s'
 
     IS_REGISTERED = 'SELECT 1 from users WHERE tg_user_id = %s'
 
@@ -355,18 +721,48 @@ class Users:
 
     READ_USER = f'{READ_USER_PATTERN} WHERE tg_user_id = %s'
 
+    # Profiles of the several users with their photos at once, users without photos get an empty array.
+    # Grouping by the primary key allows to select the rest of the users columns.
+    READ_USERS_WITH_PHOTOS = (
+        "SELECT "
+        "users.tg_user_id, "
+        "fullname, "
+        "goal, "
+        "gender, "
+        "date_part('year', age(birthdate))::smallint as age, "
+        "country, "
+        "city, "
+        "comment, "
+        "COALESCE("
+        "array_agg(photos.tg_photo_file_id ORDER BY photos.id) FILTER (WHERE photos.tg_photo_file_id IS NOT NULL), "
+        "'{}'"
+        ") AS photos "
+        "FROM users LEFT JOIN photos ON users.tg_user_id = photos.tg_user_id "
+        "WHERE users.tg_user_id = ANY(%s::bigint[]) "
+        "GROUP BY users.id"
+    )
+
     DELETE_USER = 'DELETE FROM users WHERE tg_user_id = %s'
 
 
 class Photos:
     CREATE_PHOTO = 'INSERT INTO photos (tg_user_id, tg_photo_file_id) VALUES (%s, %s) RETURNING id'
 
+    CREATE_PHOTOS = (  # Bulk
+        'INSERT INTO photos (tg_user_id, tg_photo_file_id) VALUES %s '
+        'ON CONFLICT (tg_user_id, tg_photo_file_id) DO NOTHING'
+    )
+
+    COPY_PHOTOS = 'COPY photos (tg_user_id, tg_photo_file_id) FROM STDIN'
+
     READ_PHOTOS = 'SELECT tg_photo_file_id FROM photos WHERE tg_user_id = %s'
 
     DELETE_PHOTO = 'DELETE FROM photos WHERE id = %s'
 
     DELETE_USER_PHOTOS = 'DELETE FROM photos WHERE tg_user_id = %s'
 
+    DELETE_USERS_PHOTOS = 'DELETE FROM photos WHERE tg_user_id = ANY(%s)'
+
 
 class ShownUsers:
 
@@ -378,9 +774,24 @@ class ShownUsers:
     # Read inside search query
 
 
+class Migrations:
+    READ_SCHEMA_VERSION = 'SELECT COALESCE(MAX(version), 0) FROM schema_version'
+
+    CREATE_SCHEMA_VERSION = 'INSERT INTO schema_version (version) VALUES (%s)'
+
+
 class System:
     READ_BOTS_IDS = f'SELECT tg_user_id FROM users WHERE tg_user_id < 100 AND comment = %s'
     READ_ALL_USERS_IDS = "SELECT tg_user_id FROM users"
+    # Keyset pagination, the page starts after the last read user (NULL means the first page)
+    READ_USERS_IDS_PAGE = (
+        'SELECT tg_user_id FROM users '
+        'WHERE %(after_tg_user_id)s::bigint IS NULL OR tg_user_id > %(after_tg_user_id)s::bigint '
+        'ORDER BY tg_user_id LIMIT %(limit)s'
+    )
+    # Local - only for the current transaction, set_config cuz "SET" can't be parametrized (psycopg3)
+    SET_STATEMENT_TIMEOUT = "SELECT set_config('statement_timeout', %s::text, true)"
+    DISCARD_TEMP = 'DISCARD TEMP'  # Temporary tables of the previous borrower of the pooled connection
 
 
 class PostgresSQLS:
@@ -394,4 +805,5 @@ class PostgresSQLS:
     Users: Type[Users] = Users
     Photos: Type[Photos] = Photos
     ShownUsers: Type[ShownUsers] = ShownUsers
+    Migrations: Type[Migrations] = Migrations
     System: Type[System] = System
@@ -0,0 +1,78 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Metrics of the transaction scopes (see Postgres.transaction).
+Every finished scope is recorded with its outcome and duration, rates and percentiles are calculated on demand.
+"""
+
+from __future__ import annotations
+from collections import deque, Counter
+from enum import Enum
+from threading import Lock
+from time import monotonic
+from typing import TypedDict, Callable
+
+import numpy as np
+
+
+class Outcome(str, Enum):
+    COMMIT = 'commit'
+    READ_ONLY = 'read_only'  # Finished without the commit
+    ROLLBACK = 'rollback'  # Failed
+
+
+class TransactionsStats(TypedDict):
+    commits: int  # Since the start
+    read_only: int
+    rollbacks: int
+    commits_per_second: float  # Over the window
+    p50_ms: float  # Duration of the recent scopes (any outcome)
+    p95_ms: float
+    max_ms: float
+
+
+class TransactionsMeter:
+    def __init__(self, window: int = 1000, timer: Callable[[], float] = monotonic, ):
+        self.timer = timer
+        self.lock = Lock()
+        self.counts: Counter[Outcome] = Counter()
+        self.recent: deque[tuple[float, float, Outcome]] = deque(maxlen=window, )  # Finish time, seconds, outcome
+
+    def record(self, seconds: float, outcome: Outcome, ) -> None:
+        with self.lock:
+            self.counts[outcome] += 1
+            self.recent.append((self.timer(), seconds, outcome,), )
+
+    def stats(self, ) -> TransactionsStats:
+        with self.lock:
+            counts, recent = self.counts.copy(), list(self.recent)
+        commits_per_second, p50, p95, max_ = 0.0, 0.0, 0.0, 0.0
+        if recent:
+            commits_times = [finish for finish, _, outcome in recent if outcome == Outcome.COMMIT]
+            if len(commits_times) > 1 and (elapsed := commits_times[-1] - commits_times[0]) > 0:
+                commits_per_second = (len(commits_times) - 1) / elapsed
+            milliseconds = [seconds * 1000 for _, seconds, _ in recent]
+            p50, p95 = map(float, np.percentile(milliseconds, (50, 95,), ), )
+            max_ = max(milliseconds)
+        return TransactionsStats(
+            commits=counts[Outcome.COMMIT],
+            read_only=counts[Outcome.READ_ONLY],
+            rollbacks=counts[Outcome.ROLLBACK],
+            commits_per_second=commits_per_second,
+            p50_ms=p50,
+            p95_ms=p95,
+            max_ms=max_,
+        )
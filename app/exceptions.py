@@ -72,6 +72,14 @@ class ReqRequired(KnownException, ):
     pass
 
 
+class DeadlineExceeded(KnownException, TimeoutError, ):
+    pass
+
+
+class SearchQueueFull(KnownException, OverflowError, ):
+    pass
+
+
 class UnexpectedException(Exception, ):
     pass
 
@@ -90,6 +98,18 @@ def __init__(self, post_type: Type | None = None, ):
         super(UnknownPostType, self).__init__(message)
 
 
+class BadSnapshot(UnexpectedException, ValueError, ):
+    pass
+
+
+class BadMatcherConfig(UnexpectedException, ValueError, ):
+    pass
+
+
+class PoolExhausted(UnexpectedException, TimeoutError, ):
+    pass
+
+
 class DevException(Exception):
     pass
 
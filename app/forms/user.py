@@ -15,6 +15,7 @@
 
 from __future__ import annotations
 from typing import TYPE_CHECKING, Protocol, TypeAlias
+from functools import partial
 from abc import ABC, abstractmethod
 
 from app.utils import get_num_from_text
@@ -24,11 +25,12 @@
 import app.models.users
 import app.models.matches
 import app.models.mix  # To create photo
+from app.models.base._matches import geo
 
 from app.models.matches import Matcher
 
 if TYPE_CHECKING:
-    pass
+    from psycopg2.extensions import connection as pg_ext_connection
 
 NewUserGoal: TypeAlias = app.models.users.User.Goal  # Just type for mypy
 NewUserGender: TypeAlias = app.models.users.User.Gender  # Just type for mypy
@@ -274,11 +276,17 @@ def remove_photos(self, ) -> bool:
     def create(self, ) -> None:
         ...
 
+    @classmethod
+    @abstractmethod
+    def create_many(cls, new_users: list[NewUserInterface], connection: pg_ext_connection, ) -> None:
+        ...
+
 
 class NewUser(app.models.base.users.UserBaseProperties, NewUserInterface, ):
     """Base NewUser Logic across whole app. Should be inherited `for frameworks"""
 
     class Mapper:
+        User: app.models.users.User = app.models.users.User
         Photo: app.models.mix.Photo = app.models.mix.Photo
 
     Goal: NewUserGoal = app.models.users.User.Goal
@@ -309,6 +317,8 @@ def __init__(
             photos=photos or [],
         )
         self.user: app.models.users.User = user
+        self.latitude: float | None = None  # Only if the location is shared by the geolocation
+        self.longitude: float | None = None
 
     def _repr(self, ) -> dict:
         return app.models.base.users.UserBaseProperties._repr(self=self, ) | {'tg_user_id': self.user.tg_user_id, }
@@ -348,6 +358,7 @@ def handle_age(self, text: str, ) -> None:
     def handle_location_text(self, text: str, ) -> None:
         text = text.strip()
         if not app.constants.Regexp.BACK_R.match(text) or self.back_btn_disabled:
+            self.latitude = self.longitude = None  # Text location has no coordinates
             if app.constants.Regexp.SKIP_R.match(text):
                 self.country = None
                 self.city = None
@@ -380,18 +391,74 @@ def remove_photos(self, ) -> bool:
 
     def create(self, ) -> None:
         """... to distinct between unfilled value and intentionally filled with None value"""
-        self.user.CRUD.upsert(
-            tg_user_id=self.user.tg_user_id,
-            fullname=self.fullname,
-            goal=self.goal,
-            gender=self.gender,
-            age=self.age,
-            country=self.country,
-            city=self.city,
-            comment=self.comment,
-            connection=self.user.connection,
-        )
-        self.user.delete_photos()  # Delete old user_photos
-        for photo in self.photos:
-            self.Mapper.Photo.create(user=self.user, photo=photo, )
-        self.user.is_registered = True
+        with self.user.CRUD.db.transaction(connection=self.user.connection, ):  # All or nothing
+            self.user.CRUD.upsert(
+                tg_user_id=self.user.tg_user_id,
+                fullname=self.fullname,
+                goal=self.goal,
+                gender=self.gender,
+                age=self.age,
+                country=self.country,
+                city=self.city,
+                comment=self.comment,
+                connection=self.user.connection,
+            )
+            geo_cell = None
+            if self.latitude is not None:
+                geo_cell = geo.get_cell(latitude=self.latitude, longitude=self.longitude, )
+            self.user.CRUD.update_location(  # Old coordinates are cleared if the location is not shared this time
+                tg_user_id=self.user.tg_user_id,
+                latitude=self.latitude,
+                longitude=self.longitude,
+                geo_cell=geo_cell,
+                connection=self.user.connection,
+            )
+            self.user.delete_photos()  # Delete old user_photos
+            self.Mapper.Photo.create_many(user=self.user, photos=self.photos, )
+            self.user.CRUD.db.after_commit(  # Not registered if rolled back
+                callback=partial(setattr, self.user, 'is_registered', True, ),
+                connection=self.user.connection,
+            )
+
+    @classmethod
+    def create_many(cls, new_users: list[NewUser], connection: pg_ext_connection, ) -> None:
+        """
+        As create but for the many users at once (the bots generation):
+        the users with the locations are saved by a single statement and the photos are loaded by COPY.
+        """
+        if not new_users:
+            return
+        with cls.Mapper.User.CRUD.db.transaction(connection=connection, ):  # All or nothing
+            rows = []
+            for new_user in new_users:
+                geo_cell = None
+                if new_user.latitude is not None:
+                    geo_cell = geo.get_cell(latitude=new_user.latitude, longitude=new_user.longitude, )
+                rows.append((
+                    new_user.user.tg_user_id,
+                    new_user.fullname,
+                    new_user.goal,
+                    new_user.gender,
+                    new_user.age,
+                    new_user.country,
+                    new_user.city,
+                    new_user.comment,
+                    new_user.latitude,
+                    new_user.longitude,
+                    geo_cell,
+                ))
+            cls.Mapper.User.CRUD.upsert_many(rows=rows, connection=connection, )
+            tg_user_ids = [new_user.user.tg_user_id for new_user in new_users]
+            cls.Mapper.Photo.CRUD.delete_users_photos(tg_user_ids=tg_user_ids, connection=connection, )
+            cls.Mapper.Photo.CRUD.copy(
+                rows=[
+                    (new_user.user.tg_user_id, photo,)
+                    for new_user in new_users for photo in dict.fromkeys(new_user.photos)  # COPY fails on duplicate
+                ],
+                connection=connection,
+            )
+            for new_user in new_users:  # Not registered if the outer scope rolls back
+                cls.Mapper.User.CRUD.db.after_commit(
+                    callback=partial(setattr, new_user.user, 'is_registered', True, ),
+                    connection=connection,
+                )
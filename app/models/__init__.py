@@ -85,6 +85,7 @@ class CollectionMapper(Mapper):
 
 class PublicVoteMapper(Mapper):
     Post = posts.PublicPost
+    Matcher = matches.Matcher
 
 
 class PersonalVoteMapper(Mapper):
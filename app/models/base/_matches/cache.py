@@ -0,0 +1,110 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+from itertools import count
+from threading import Lock
+from time import monotonic
+from typing import TypedDict, Hashable, Any, Callable
+
+from cachetools import Cache, TTLCache, LRUCache
+
+
+class SearchCacheStats(TypedDict):
+    size: int
+    maxsize: int
+    hits: int
+    misses: int
+    hit_rate: float
+    evictions: int  # Least recently used, removed to free a space
+    expirations: int  # Removed by TTL
+
+
+class SearchCache(TTLCache):
+    """
+    Process-wide search results, the least recently used result is evicted first, every result lives ttl seconds.
+    Cachetools caches are not thread-safe, so use only get_result and set_result.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, timer: Callable[[], float] = monotonic, ):
+        super().__init__(maxsize=maxsize, ttl=ttl, timer=timer, )
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self, ):
+        """Called by the cache itself when it's full"""
+        result = super().popitem()
+        self.evictions += 1
+        return result
+
+    def expire(self, time=None, ):
+        """Called by the cache itself on every set"""
+        size = Cache.currsize.fget(self, )  # TTLCache.currsize expires itself
+        result = super().expire(time, )
+        self.expirations += size - Cache.currsize.fget(self, )
+        return result
+
+    def get_result(self, key: Hashable, ) -> Any | None:
+        with self.lock:
+            result = self.get(key, )
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def set_result(self, key: Hashable, value: Any, ) -> None:
+        with self.lock:
+            self[key] = value
+
+    def stats(self, ) -> SearchCacheStats:
+        with self.lock:
+            self.expire()
+            requests = self.hits + self.misses
+            return SearchCacheStats(
+                size=len(self),
+                maxsize=self.maxsize,
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=self.hits / requests if requests else 0.0,
+                evictions=self.evictions,
+                expirations=self.expirations,
+            )
+
+
+class Versions:
+    """
+    Version of the state of every user (votes, shown users) as a part of the cache key, a change invalidates the results.
+    Versions are unique process-wide, so the least recently used user may be evicted:
+    the next read gives him a new version, that's a cache miss, never a stale hit.
+    """
+
+    def __init__(self, maxsize: int, ):
+        self.lock = Lock()
+        self.versions = LRUCache(maxsize=maxsize, )
+        self.counter = count(1, )
+
+    def get(self, key: Hashable, ) -> int:
+        with self.lock:
+            if (version := self.versions.get(key, )) is None:
+                version = self.versions[key] = next(self.counter, )
+            return version
+
+    def bump(self, key: Hashable, ) -> None:
+        with self.lock:
+            self.versions[key] = next(self.counter, )
@@ -0,0 +1,462 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from threading import RLock
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from app.config import MINHASH_BANDS, MINHASH_ROWS
+import app.db.crud.users
+from . import snapshot
+
+if TYPE_CHECKING:
+    from pathlib import Path
+    from psycopg2.extensions import connection as pg_ext_connection
+    import app.structures.base
+
+
+class EngineInterface(ABC, ):
+    """
+    In-memory covotes counter, an alternative to the temporary tables.
+    Postgres is the source of truth, engine is loaded on start and kept in sync on every accepted vote.
+    """
+
+    CRUD: app.db.crud.users.Matcher
+
+    def load(self, connection: pg_ext_connection, ) -> None:
+        """Read all the votes from DB, replaces the current state"""
+        self.load_votes(votes=self.CRUD.read_all_votes(connection=connection, ), )
+
+    def load_snapshot(self, path: Path, connection: pg_ext_connection, ) -> None:
+        """
+        Map the snapshot and replay the votes updated since it was written, replaces the current state.
+        Raises FileNotFoundError or BadSnapshot, the state is untouched in this case.
+        Deleted votes are not replayed (as well as not handled by set_vote), the full load drops them.
+        """
+        votes_snapshot = snapshot.read(path=path, )
+        tg_user_ids, post_ids, values = votes_snapshot.get_votes()
+        self.load_arrays(tg_user_ids=tg_user_ids, post_ids=post_ids, values=values, )
+        for vote in self.CRUD.read_votes_since(mark=votes_snapshot.mark, connection=connection, ):
+            self.set_vote(tg_user_id=vote['tg_user_id'], post_id=vote['post_id'], value=vote['value'], )
+
+    def load_votes(self, votes: list[app.structures.base.PublicVoteValue], ) -> None:
+        """Replaces the current state"""
+        self.load_arrays(
+            tg_user_ids=np.fromiter((vote['tg_user_id'] for vote in votes), dtype=np.int64, count=len(votes), ),
+            post_ids=np.fromiter((vote['post_id'] for vote in votes), dtype=np.int64, count=len(votes), ),
+            values=np.fromiter((vote['value'] for vote in votes), dtype=np.int8, count=len(votes), ),
+        )
+
+    @abstractmethod
+    def load_arrays(self, tg_user_ids: np.ndarray, post_ids: np.ndarray, values: np.ndarray, ) -> None:
+        """Vote per item, replaces the current state"""
+        ...
+
+    @abstractmethod
+    def set_vote(self, tg_user_id: int, post_id: int, value: int, ) -> None:
+        ...
+
+    @abstractmethod
+    def read_user_votes_count(self, tg_user_id: int, ) -> int:
+        ...
+
+    @abstractmethod
+    def count_covotes(self, tg_user_id: int, ) -> tuple[np.ndarray, np.ndarray]:
+        ...
+
+
+class Plane:
+    """
+    Boolean sparse matrix (users x posts) in CSR format without data array (every stored element is True).
+    Updates are cheap: removed elements are masked and added ones are kept aside until the next compaction.
+    """
+
+    def __init__(self, rows: np.ndarray | None = None, cols: np.ndarray | None = None, n_rows: int = 0, ):
+        self.indptr = np.zeros(1, dtype=np.int64, )
+        self.indices = np.empty(0, dtype=np.int32, )  # Columns (posts), sorted inside every row
+        self.rows = np.empty(0, dtype=np.int32, )  # Row of every stored element (expanded indptr for bincount)
+        self.alive = np.empty(0, dtype=bool, )
+        self.added: dict[int, set[int]] = {}  # Row: columns; not compacted yet
+        self.added_count = 0
+        self.build(
+            rows=np.empty(0, dtype=np.int32, ) if rows is None else rows,
+            cols=np.empty(0, dtype=np.int32, ) if cols is None else cols,
+            n_rows=n_rows,
+        )
+
+    def build(self, rows: np.ndarray, cols: np.ndarray, n_rows: int, ) -> None:
+        order = np.lexsort((cols, rows,), )
+        self.rows = rows[order].astype(np.int32, )
+        self.indices = cols[order].astype(np.int32, )
+        self.indptr = np.zeros(n_rows + 1, dtype=np.int64, )
+        np.cumsum(np.bincount(self.rows, minlength=n_rows, ), out=self.indptr[1:], )
+        self.alive = np.ones(len(self.indices), dtype=bool, )
+        self.added = {}
+        self.added_count = 0
+
+    def compact(self, n_rows: int, ) -> None:
+        """Merge added elements and drop the masked ones"""
+        added_rows = [row for row, cols in self.added.items() for _ in cols]
+        added_cols = [col for cols in self.added.values() for col in cols]
+        self.build(
+            rows=np.concatenate((self.rows[self.alive], np.array(added_rows, dtype=np.int32, ),), ),
+            cols=np.concatenate((self.indices[self.alive], np.array(added_cols, dtype=np.int32, ),), ),
+            n_rows=n_rows,
+        )
+
+    def _find(self, row: int, col: int, ) -> int | None:
+        """Position of the element inside the compacted part"""
+        if row + 1 >= len(self.indptr):  # Row is newer than the last compaction
+            return None
+        start, stop = self.indptr[row], self.indptr[row + 1]
+        position = start + np.searchsorted(self.indices[start:stop], col, )
+        if position < stop and self.indices[position] == col:
+            return int(position)
+        return None
+
+    def add(self, row: int, col: int, ) -> None:
+        position = self._find(row=row, col=col, )
+        if position is not None:
+            self.alive[position] = True
+        elif col not in self.added.setdefault(row, set(), ):
+            self.added[row].add(col)
+            self.added_count += 1
+
+    def remove(self, row: int, col: int, ) -> None:
+        position = self._find(row=row, col=col, )
+        if position is not None:
+            self.alive[position] = False
+        elif col in self.added.get(row, (), ):
+            self.added[row].remove(col)
+            self.added_count -= 1
+
+    def get_row(self, row: int, ) -> np.ndarray:
+        """Columns of the row"""
+        result = np.empty(0, dtype=np.int32, )
+        if row + 1 < len(self.indptr):
+            start, stop = self.indptr[row], self.indptr[row + 1]
+            result = self.indices[start:stop][self.alive[start:stop]]
+        if self.added.get(row, ):
+            result = np.concatenate((result, np.fromiter(self.added[row], dtype=np.int32, ),), )
+        return result
+
+    def dot(self, vector: np.ndarray, n_rows: int, ) -> np.ndarray:
+        """Matrix-vector product with boolean vector (length of posts), result is count per row (user)"""
+        mask = vector[self.indices]
+        mask &= self.alive
+        result = np.bincount(self.rows[mask], minlength=n_rows, )
+        for row, cols in self.added.items():
+            for col in cols:
+                result[row] += vector[col]
+        return result
+
+
+class VoteMatrix(EngineInterface, ):
+    """
+    Public votes as a users x posts sparse matrix, likes and dislikes are separate boolean planes.
+    Covotes of the user are a single matrix-vector product per plane:
+    likes @ user_likes_row + dislikes @ user_dislikes_row.
+    """
+
+    CRUD = app.db.crud.users.Matcher
+    COMPACT_THRESHOLD = 10_000  # Added (not compacted) elements of the plane
+
+    def __init__(self, ):
+        self.lock = RLock()  # Handlers are executed by several workers
+        self.users: dict[int, int] = {}  # tg_user_id: row
+        self.posts: dict[int, int] = {}  # post_id: column
+        self.tg_user_ids = np.empty(0, dtype=np.int64, )  # Row: tg_user_id
+        self.planes: dict[int, Plane] = {1: Plane(), -1: Plane(), }  # Vote value: plane
+
+    def load_arrays(self, tg_user_ids: np.ndarray, post_ids: np.ndarray, values: np.ndarray, ) -> None:
+        unique_users, rows = np.unique(tg_user_ids, return_inverse=True, )
+        unique_posts, cols = np.unique(post_ids, return_inverse=True, )
+        with self.lock:
+            self.tg_user_ids = unique_users
+            self.users = {tg_user_id: row for row, tg_user_id in enumerate(unique_users.tolist())}
+            self.posts = {post_id: col for col, post_id in enumerate(unique_posts.tolist())}
+            self.planes = {
+                value: Plane(rows=rows[values == value], cols=cols[values == value], n_rows=len(unique_users), )
+                for value in self.planes
+            }
+
+    def _get_row(self, tg_user_id: int, ) -> int:
+        if tg_user_id not in self.users:
+            self.users[tg_user_id] = len(self.users)
+            self.tg_user_ids = np.append(self.tg_user_ids, tg_user_id, )
+        return self.users[tg_user_id]
+
+    def set_vote(self, tg_user_id: int, post_id: int, value: int, ) -> None:
+        """Value is the final (accepted) vote value, zero removes the vote"""
+        with self.lock:
+            row = self._get_row(tg_user_id=tg_user_id, )
+            col = self.posts.setdefault(post_id, len(self.posts), )
+            for plane_value, plane in self.planes.items():
+                if plane_value == value:
+                    plane.add(row=row, col=col, )
+                    if plane.added_count > self.COMPACT_THRESHOLD:
+                        plane.compact(n_rows=len(self.users), )
+                else:
+                    plane.remove(row=row, col=col, )
+
+    def read_user_votes_count(self, tg_user_id: int, ) -> int:
+        with self.lock:
+            if tg_user_id not in self.users:
+                return 0
+            return sum(len(plane.get_row(row=self.users[tg_user_id], )) for plane in self.planes.values())
+
+    def count_covotes(self, tg_user_id: int, ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns tg_user_ids of covoters and count of common votes for each of them (unordered)"""
+        with self.lock:
+            if tg_user_id not in self.users:
+                return np.empty(0, dtype=np.int64, ), np.empty(0, dtype=np.int64, )
+            row = self.users[tg_user_id]
+            counts = np.zeros(len(self.users), dtype=np.int64, )
+            for plane in self.planes.values():
+                vector = np.zeros(len(self.posts), dtype=bool, )
+                vector[plane.get_row(row=row, )] = True
+                counts += plane.dot(vector=vector, n_rows=len(self.users), )
+            counts[row] = 0  # Exclude the user himself
+            covoters = np.flatnonzero(counts, )
+            return self.tg_user_ids[covoters], counts[covoters]
+
+
+class CovoteIndex(EngineInterface, ):
+    """
+    Inverted index: (post_id, value) -> sorted array of voters (posting list).
+    Covotes of the user are a merge of his k posting lists - O(sum of lengths), the rest of the votes are not touched.
+    Updates are cheap (as of Plane): added and removed voters are kept aside until the next compaction,
+    which merges them into the touched posting lists at once.
+    The votes of a user (to find his posting lists) are a packed forward index, a vote is an item (see get_item).
+    """
+
+    CRUD = app.db.crud.users.Matcher
+    COMPACT_THRESHOLD = 10_000  # Changed (not compacted) votes
+
+    def __init__(self, ):
+        self.lock = RLock()  # Handlers are executed by several workers
+        self.postings: dict[tuple[int, int], np.ndarray] = {}  # (post_id, value): sorted tg_user_ids
+        self.added: dict[tuple[int, int], set[int]] = {}  # (post_id, value): tg_user_ids; not compacted yet
+        self.removed: dict[tuple[int, int], set[int]] = {}  # The same, masked in the posting list
+        # Forward index in CSR format: items of users[i] are items[indptr[i]:indptr[i + 1]], sorted
+        self.users = np.empty(0, dtype=np.int64, )  # Sorted tg_user_ids
+        self.indptr = np.zeros(1, dtype=np.int64, )
+        self.items = np.empty(0, dtype=np.int64, )
+        self.changed: dict[int, dict[int, int]] = {}  # tg_user_id: {post_id: value, zero if removed}; not compacted
+        self.changed_count = 0
+
+    @staticmethod
+    def get_item(post_id: int, value: int, ) -> int:
+        return post_id * 2 + (value > 0)
+
+    def _get_items(self, tg_user_id: int, ) -> np.ndarray:
+        """Compacted votes of the user as items"""
+        i = np.searchsorted(self.users, tg_user_id, )
+        if i < len(self.users) and self.users[i] == tg_user_id:
+            return self.items[self.indptr[i]:self.indptr[i + 1]]
+        return np.empty(0, dtype=np.int64, )
+
+    def _get_votes(self, tg_user_id: int, ) -> dict[int, int]:
+        """post_id: value of every vote of the user"""
+        items = self._get_items(tg_user_id=tg_user_id, ).tolist()
+        votes = {item >> 1: 1 if item & 1 else -1 for item in items} | self.changed.get(tg_user_id, {}, )
+        return {post_id: value for post_id, value in votes.items() if value}
+
+    def _get_vote(self, tg_user_id: int, post_id: int, ) -> int:
+        if post_id in self.changed.get(tg_user_id, {}, ):
+            return self.changed[tg_user_id][post_id]
+        items = self._get_items(tg_user_id=tg_user_id, )
+        position = np.searchsorted(items, post_id * 2, )
+        if position < len(items) and items[position] >> 1 == post_id:
+            return 1 if items[position] & 1 else -1
+        return 0
+
+    def _get_posting(self, key: tuple[int, int], ) -> np.ndarray:
+        """Voters of the posting list with the not compacted changes, not sorted if there are added ones"""
+        posting = self.postings.get(key, np.empty(0, dtype=np.int64, ), )
+        if self.removed.get(key, ):
+            posting = posting[~np.isin(posting, np.fromiter(self.removed[key], dtype=np.int64, ), )]
+        if self.added.get(key, ):
+            posting = np.concatenate((posting, np.fromiter(self.added[key], dtype=np.int64, ),), )
+        return posting
+
+    def _build_items(self, tg_user_ids: np.ndarray, items: np.ndarray, ) -> None:
+        order = np.lexsort((items, tg_user_ids,), )
+        self.users, counts = np.unique(tg_user_ids[order], return_counts=True, )
+        self.indptr = np.zeros(len(self.users) + 1, dtype=np.int64, )
+        np.cumsum(counts, out=self.indptr[1:], )
+        self.items = items[order]
+
+    def load_arrays(self, tg_user_ids: np.ndarray, post_ids: np.ndarray, values: np.ndarray, ) -> None:
+        values = values.astype(np.int64, )
+        order = np.lexsort((tg_user_ids, values, post_ids,), )  # Voters are sorted inside every posting list
+        tg_user_ids, post_ids, values = tg_user_ids[order], post_ids[order], values[order]
+        starts = np.flatnonzero(np.r_[True, (post_ids[1:] != post_ids[:-1]) | (values[1:] != values[:-1])], )
+        starts = starts[:len(values)]  # No votes - no posting lists
+        with self.lock:
+            self.postings = {
+                (int(post_ids[start]), int(values[start]),): posting
+                for start, posting in zip(starts.tolist(), np.split(tg_user_ids, starts[1:], ), )
+            }
+            self.added, self.removed, self.changed, self.changed_count = {}, {}, {}, 0
+            self._build_items(tg_user_ids=tg_user_ids, items=post_ids * 2 + (values > 0), )
+
+    def compact(self, ) -> None:
+        """Merge the changes into the touched posting lists and the forward index"""
+        with self.lock:
+            for key in self.added.keys() | self.removed.keys():
+                posting = np.sort(self._get_posting(key=key, ), )
+                if len(posting):
+                    self.postings[key] = posting
+                else:
+                    self.postings.pop(key, None, )
+            new_votes = [
+                (tg_user_id, self.get_item(post_id=post_id, value=value, ),)
+                for tg_user_id in self.changed for post_id, value in self._get_votes(tg_user_id=tg_user_id, ).items()
+            ]
+            tg_user_ids = np.repeat(self.users, np.diff(self.indptr, ), )  # Of every item
+            kept = ~np.isin(tg_user_ids, np.fromiter(self.changed, dtype=np.int64, count=len(self.changed), ), )
+            self._build_items(
+                tg_user_ids=np.concatenate((
+                    tg_user_ids[kept],
+                    np.array([tg_user_id for tg_user_id, _ in new_votes], dtype=np.int64, ),
+                ), ),
+                items=np.concatenate((
+                    self.items[kept],
+                    np.array([item for _, item in new_votes], dtype=np.int64, ),
+                ), ),
+            )
+            self.added, self.removed, self.changed, self.changed_count = {}, {}, {}, 0
+
+    def set_vote(self, tg_user_id: int, post_id: int, value: int, ) -> None:
+        """Value is the final (accepted) vote value, zero removes the vote"""
+        with self.lock:
+            old_value = self._get_vote(tg_user_id=tg_user_id, post_id=post_id, )
+            if old_value == value:
+                return
+            if old_value:
+                key = (post_id, old_value,)
+                if tg_user_id in self.added.get(key, (), ):
+                    self.added[key].remove(tg_user_id)
+                else:
+                    self.removed.setdefault(key, set(), ).add(tg_user_id)
+            if value:
+                key = (post_id, value,)
+                if tg_user_id in self.removed.get(key, (), ):
+                    self.removed[key].remove(tg_user_id)
+                else:
+                    self.added.setdefault(key, set(), ).add(tg_user_id)
+            self.changed.setdefault(tg_user_id, {}, )[post_id] = value
+            self.changed_count += 1
+            if self.changed_count > self.COMPACT_THRESHOLD:
+                self.compact()
+
+    def read_user_votes_count(self, tg_user_id: int, ) -> int:
+        with self.lock:
+            return len(self._get_votes(tg_user_id=tg_user_id, ))
+
+    def count_covotes(self, tg_user_id: int, ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns tg_user_ids of covoters and count of common votes for each of them (sorted by tg_user_id)"""
+        with self.lock:
+            postings = [self._get_posting(key=key, ) for key in self._get_votes(tg_user_id=tg_user_id, ).items()]
+        if not postings:
+            return np.empty(0, dtype=np.int64, ), np.empty(0, dtype=np.int64, )
+        # Timsort finds the sorted runs, so it's a k-way merge of the posting lists
+        merged = np.sort(np.concatenate(postings, ), kind='stable', )
+        starts = np.flatnonzero(np.r_[True, merged[1:] != merged[:-1]], )[:len(merged)]  # Posting lists may be empty
+        covoters, counts = merged[starts], np.diff(np.r_[starts, len(merged)], )
+        mask = covoters != tg_user_id  # Exclude the user himself
+        return covoters[mask], counts[mask]
+
+
+class MinHashLSH(EngineInterface, ):
+    """
+    Approximate engine: MinHash signature of every user votes set (like and dislike of a post are different items)
+    and LSH buckets (signature is split on bands) to fetch a small set of candidates.
+    Exact common votes count is calculated only for the candidates.
+    A pair with Jaccard similarity s becomes a candidate with probability 1 - (1 - s ** rows) ** bands.
+    """
+
+    CRUD = app.db.crud.users.Matcher
+    PRIME = (1 << 31) - 1  # Mersenne prime, (a * item + b) fits into int64
+
+    def __init__(self, bands: int = MINHASH_BANDS, rows: int = MINHASH_ROWS, seed: int = 0, ):
+        self.lock = RLock()  # Handlers are executed by several workers
+        self.bands = bands
+        self.rows = rows
+        random = np.random.default_rng(seed, )
+        self.a = random.integers(1, self.PRIME, size=bands * rows, dtype=np.int64, )
+        self.b = random.integers(0, self.PRIME, size=bands * rows, dtype=np.int64, )
+        self.items: dict[int, set[int]] = {}  # tg_user_id: votes as items (see get_item)
+        self.keys: dict[int, list[tuple[int, bytes]]] = {}  # tg_user_id: LSH buckets keys
+        self.buckets: dict[tuple[int, bytes], set[int]] = {}  # (band, band of signature): tg_user_ids
+
+    @staticmethod
+    def get_item(post_id: int, value: int, ) -> int:
+        return post_id * 2 + (value > 0)
+
+    def get_signature(self, items: set[int], ) -> np.ndarray:
+        items = np.fromiter(items, dtype=np.int64, count=len(items), )
+        return ((self.a[:, None] * items[None, :] + self.b[:, None]) % self.PRIME).min(axis=1, )
+
+    def _set_buckets(self, tg_user_id: int, ) -> None:
+        """(Re)place the user to the buckets according to his current votes"""
+        for key in self.keys.pop(tg_user_id, [], ):
+            self.buckets[key].discard(tg_user_id)
+        if self.items.get(tg_user_id, ):
+            signature = self.get_signature(items=self.items[tg_user_id], )
+            self.keys[tg_user_id] = [
+                (band, signature[band * self.rows:(band + 1) * self.rows].tobytes(),) for band in range(self.bands)
+            ]
+            for key in self.keys[tg_user_id]:
+                self.buckets.setdefault(key, set(), ).add(tg_user_id)
+
+    def load_arrays(self, tg_user_ids: np.ndarray, post_ids: np.ndarray, values: np.ndarray, ) -> None:
+        with self.lock:
+            self.items, self.keys, self.buckets = {}, {}, {}
+            for tg_user_id, post_id, value in zip(tg_user_ids.tolist(), post_ids.tolist(), values.tolist(), ):
+                self.items.setdefault(tg_user_id, set(), ).add(self.get_item(post_id=post_id, value=value, ))
+            for tg_user_id in self.items:
+                self._set_buckets(tg_user_id=tg_user_id, )
+
+    def set_vote(self, tg_user_id: int, post_id: int, value: int, ) -> None:
+        """Value is the final (accepted) vote value, zero removes the vote"""
+        with self.lock:
+            items = self.items.setdefault(tg_user_id, set(), )
+            items.discard(self.get_item(post_id=post_id, value=1, ), )
+            items.discard(self.get_item(post_id=post_id, value=-1, ), )
+            if value:
+                items.add(self.get_item(post_id=post_id, value=value, ))
+            self._set_buckets(tg_user_id=tg_user_id, )
+
+    def read_user_votes_count(self, tg_user_id: int, ) -> int:
+        with self.lock:
+            return len(self.items.get(tg_user_id, (), ))
+
+    def count_covotes(self, tg_user_id: int, ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns tg_user_ids of candidates and exact count of common votes for each of them (unordered)"""
+        with self.lock:
+            candidates = set().union(*(self.buckets[key] for key in self.keys.get(tg_user_id, [], )), )
+            candidates.discard(tg_user_id)
+            items = self.items.get(tg_user_id, set(), )
+            covotes = {candidate: len(items & self.items[candidate]) for candidate in candidates}
+        covotes = {candidate: count for candidate, count in covotes.items() if count}
+        return (
+            np.fromiter(covotes.keys(), dtype=np.int64, count=len(covotes), ),
+            np.fromiter(covotes.values(), dtype=np.int64, count=len(covotes), ),
+        )
@@ -0,0 +1,109 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Grid spatial index for the proximity filter.
+The globe is split by the fixed degree cells, users.geo_cell is the cell of the user (indexed, see DDL).
+Circle around the searcher is covered by the cells:
+inner cell lies in the circle entirely (no math for its users), edge cell is crossed by the circle (exact distance).
+"""
+
+from __future__ import annotations
+from math import asin, cos, degrees, floor, radians, sin
+from typing import TYPE_CHECKING, NamedTuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import app.structures.base
+
+CELL_DEGREES = 0.1  # About 11 km of latitude. Never change it for a filled DB, stored cells will be wrong
+ROWS = round(180 / CELL_DEGREES)
+COLUMNS = round(360 / CELL_DEGREES)
+EARTH_RADIUS_KM = 6371.0088
+
+
+class Cells(NamedTuple):
+    inner: list[int]
+    edge: list[int]
+
+
+def haversine(latitude: float, longitude: float, latitudes: np.ndarray, longitudes: np.ndarray, ) -> np.ndarray:
+    """Great circle distance in km from the point to the every point of the arrays (degrees)"""
+    latitude, longitude, latitudes, longitudes = map(np.radians, (latitude, longitude, latitudes, longitudes,), )
+    a = (
+            np.sin((latitudes - latitude) / 2) ** 2 +
+            np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1, ), ), )
+
+
+def get_cell(latitude: float, longitude: float, ) -> int:
+    row = min(floor((latitude + 90) / CELL_DEGREES), ROWS - 1, )  # North pole belongs to the last row
+    column = floor((longitude + 180) / CELL_DEGREES) % COLUMNS  # 180 is the same meridian as -180
+    return row * COLUMNS + column
+
+
+def get_cells(latitude: float, longitude: float, radius_km: float, ) -> Cells:
+    """
+    Cells which cover the circle.
+    The farthest point of a cell is one of its corners, so the cell is inner if all the corners are in the circle.
+    """
+    angle = radius_km / EARTH_RADIUS_KM
+    min_row = max(floor((latitude - degrees(angle) + 90) / CELL_DEGREES), 0, )
+    max_row = min(floor((latitude + degrees(angle) + 90) / CELL_DEGREES), ROWS - 1, )
+    # Longitude half width of the circle, the whole parallel if the circle contains a pole
+    max_latitude = radians(abs(latitude)) + angle
+    if angle >= radians(90) or max_latitude >= radians(90) or sin(angle) >= cos(radians(latitude)):
+        columns = np.arange(COLUMNS, )
+    else:
+        half_width = degrees(asin(sin(angle) / cos(radians(latitude))))
+        first = floor((longitude - half_width + 180) / CELL_DEGREES)
+        last = floor((longitude + half_width + 180) / CELL_DEGREES)
+        columns = np.unique(np.arange(first, last + 1, ) % COLUMNS, )
+    rows_grid, columns_grid = np.meshgrid(np.arange(min_row, max_row + 1, ), columns, indexing='ij', )
+    rows, columns = rows_grid.ravel(), columns_grid.ravel()
+    south, west = rows * CELL_DEGREES - 90, columns * CELL_DEGREES - 180
+    is_inner = np.ones(len(rows), dtype=bool, )
+    for corner_latitudes in (south, south + CELL_DEGREES,):
+        for corner_longitudes in (west, west + CELL_DEGREES,):
+            is_inner &= haversine(latitude, longitude, corner_latitudes, corner_longitudes, ) <= radius_km
+    cells = rows * COLUMNS + columns
+    return Cells(inner=cells[is_inner].tolist(), edge=cells[~is_inner].tolist(), )
+
+
+def select_nearby(
+        latitude: float,
+        longitude: float,
+        radius_km: float,
+        locations: list[app.structures.base.UserLocation],
+        inner_cells: list[int],
+) -> list[int]:
+    """tg_user_ids of the located users in the radius, the distance is calculated only for the edge cells users"""
+    if not locations:
+        return []
+    tg_user_ids = np.array([location['tg_user_id'] for location in locations], dtype=np.int64, )
+    cells = np.array([location['geo_cell'] for location in locations], dtype=np.int64, )
+    is_nearby = np.isin(cells, inner_cells, )
+    edge = np.flatnonzero(~is_nearby, )
+    if len(edge):
+        distances = haversine(
+            latitude,
+            longitude,
+            np.array([locations[i]['latitude'] for i in edge.tolist()], dtype=np.float64, ),
+            np.array([locations[i]['longitude'] for i in edge.tolist()], dtype=np.float64, ),
+        )
+        is_nearby[edge] = distances <= radius_km
+    return tg_user_ids[is_nearby].tolist()
@@ -0,0 +1,109 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Lock
+from time import monotonic
+from typing import TypedDict, Hashable, Any, Callable
+
+from app.exceptions import SearchQueueFull
+
+
+class SearchJobsStats(TypedDict):
+    queued: int  # Waiting for a free worker
+    running: int
+    completed: int
+    merged: int  # Submitted while the job with the same key was in progress
+    rejected: int  # Submitted while the queue was full
+    mean_latency: float  # Seconds from the submit to the end, of the latest jobs
+    max_latency: float
+
+
+class SearchExecutor:
+    """
+    Process-wide bounded thread pool for the searches, at most workers + queue_size jobs at once.
+    A job with the key already in progress is not submitted, the future of the job in progress is returned instead.
+    """
+
+    LATENCIES_SIZE = 1_000  # The latest jobs to calculate the latency by
+
+    def __init__(self, workers: int, queue_size: int, timer: Callable[[], float] = monotonic, ):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='search', )
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timer = timer
+        self.lock = Lock()
+        self.jobs: dict[Hashable, Future] = {}  # In progress, queued or running
+        self.running = 0
+        self.completed = 0
+        self.merged = 0
+        self.rejected = 0
+        self.latencies: deque[float] = deque(maxlen=self.LATENCIES_SIZE, )
+
+    def run(self, key: Hashable, func: Callable[[], Any], submitted_at: float, ) -> Any:
+        with self.lock:
+            self.running += 1
+        try:
+            return func()
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.completed += 1
+                self.latencies.append(self.timer() - submitted_at)
+                del self.jobs[key]
+
+    def submit(
+            self,
+            key: Hashable,
+            func: Callable[[], Any],
+            on_done: Callable[[Future], Any] | None = None,
+    ) -> Future:
+        """
+        on_done is called with the done future in the worker thread (immediately if it's already done).
+        on_done of the merged job is not added to not notify twice.
+        """
+        with self.lock:
+            if (future := self.jobs.get(key)) is not None:
+                self.merged += 1
+                return future
+            if len(self.jobs) >= self.workers + self.queue_size:
+                self.rejected += 1
+                raise SearchQueueFull(f'{len(self.jobs)} search jobs are in progress')
+            # The job can't finish (and delete itself) before it's saved cuz the lock is still held
+            future = self.executor.submit(self.run, key, func, self.timer(), )
+            self.jobs[key] = future
+        if on_done is not None:
+            future.add_done_callback(on_done, )
+        return future
+
+    def is_running(self, key: Hashable, ) -> bool:
+        """Queued or running"""
+        with self.lock:
+            return key in self.jobs
+
+    def stats(self, ) -> SearchJobsStats:
+        with self.lock:
+            return SearchJobsStats(
+                queued=len(self.jobs) - self.running,
+                running=self.running,
+                completed=self.completed,
+                merged=self.merged,
+                rejected=self.rejected,
+                mean_latency=sum(self.latencies) / len(self.latencies) if self.latencies else 0.0,
+                max_latency=max(self.latencies, default=0.0, ),
+            )
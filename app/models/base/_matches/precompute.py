@@ -0,0 +1,167 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Top matches of every voter at once, the users are split on chunks between the processes of a pool.
+The covotes are counted against the inverted index of the votes snapshot, built once in the parent process
+and shared with the forked workers (read-only arrays are never copied, see multiprocessing "fork").
+Every worker writes the results of its chunk by a single statement through its own connection.
+"""
+
+from __future__ import annotations
+from datetime import datetime
+from functools import partial
+from multiprocessing import get_context
+from multiprocessing.util import Finalize
+from typing import TYPE_CHECKING, Callable, Iterable, TypedDict
+
+import numpy as np
+
+from app.db import manager as db_manager
+import app.db.crud.users
+from . import snapshot
+
+if TYPE_CHECKING:
+    from pathlib import Path
+    from psycopg2.extensions import connection as pg_ext_connection
+
+
+class PrecomputeStats(TypedDict):
+    users: int
+    matches: int
+
+
+class CovoteCounter:
+    """
+    Inverted index of the snapshot: item (like or dislike of a post) -> voters (rows of the snapshot).
+    Covotes of the user are the voters of his items, counted.
+    """
+
+    def __init__(self, votes_snapshot: snapshot.Snapshot, ):
+        self.tg_user_ids = votes_snapshot.tg_user_ids
+        self.indptr = votes_snapshot.indptr
+        # Like and dislike of a post are different items
+        self.items = votes_snapshot.indices.astype(np.int64, ) * 2 + (votes_snapshot.values > 0)
+        rows = np.repeat(np.arange(len(self.tg_user_ids), dtype=np.int32, ), np.diff(self.indptr, ), )
+        self.voters = rows[np.argsort(self.items, kind='stable', )]  # Rows are sorted inside every item
+        self.voters_indptr = np.zeros(len(votes_snapshot.post_ids) * 2 + 1, dtype=np.int64, )
+        np.cumsum(np.bincount(self.items, minlength=len(self.voters_indptr) - 1, ), out=self.voters_indptr[1:], )
+
+    @property
+    def users_count(self, ) -> int:
+        return len(self.tg_user_ids)
+
+    def get_top(self, row: int, top_k: int | None = None, ) -> tuple[np.ndarray, np.ndarray]:
+        """Returns tg_user_ids of the covoters and count of common votes for each of them (unordered)"""
+        items = self.items[self.indptr[row]:self.indptr[row + 1]]
+        voters = np.concatenate(
+            [self.voters[self.voters_indptr[item]:self.voters_indptr[item + 1]] for item in items.tolist()]
+            or [np.empty(0, dtype=np.int32, )],
+        )
+        covoters, counts = np.unique(voters, return_counts=True, )
+        mask = covoters != row  # Exclude the user himself
+        covoters, counts = covoters[mask], counts[mask]
+        if top_k and len(covoters) > top_k:
+            best = np.argpartition(-counts, top_k - 1, )[:top_k]
+            covoters, counts = covoters[best], counts[best]
+        return self.tg_user_ids[covoters], counts
+
+
+# State of the worker process, see init_worker
+counter: CovoteCounter | None = None
+worker_connection: pg_ext_connection | None = None
+
+
+def init_worker(path: Path, ) -> None:
+    """
+    The counter is inherited on fork, but rebuilt if the process is spawned.
+    The connection is closed when the worker exits (the pool is closed, not terminated, see run).
+    """
+    global counter, worker_connection
+    if counter is None:
+        counter = CovoteCounter(votes_snapshot=snapshot.read(path=path, ), )
+    worker_connection = db_manager.Postgres.get_connection(config=db_manager.Postgres.CONFIG, )
+    Finalize(None, worker_connection.close, exitpriority=0, )
+
+
+def process_chunk(chunk: tuple[int, int], top_k: int | None, computed_at: datetime, ) -> PrecomputeStats:
+    """Count and write the matches of the snapshot rows from start to stop (chunk)"""
+    tg_user_ids, match_ids, counts = [], [], []
+    for row in range(*chunk, ):
+        row_match_ids, row_counts = counter.get_top(row=row, top_k=top_k, )
+        tg_user_ids += [int(counter.tg_user_ids[row])] * len(row_match_ids)
+        match_ids += row_match_ids.tolist()
+        counts += row_counts.tolist()
+    if tg_user_ids:
+        app.db.crud.users.Matcher.upsert_precomputed_matches(
+            tg_user_ids=tg_user_ids,
+            match_ids=match_ids,
+            counts=counts,
+            computed_at=computed_at,
+            connection=worker_connection,
+        )
+    return PrecomputeStats(users=chunk[1] - chunk[0], matches=len(match_ids), )
+
+
+def collect_stats(
+        chunks_stats: Iterable[PrecomputeStats],
+        total: int,
+        on_progress: Callable[[PrecomputeStats, int], None] | None = None,
+) -> PrecomputeStats:
+    result = PrecomputeStats(users=0, matches=0, )
+    for chunk_stats in chunks_stats:
+        result['users'] += chunk_stats['users']
+        result['matches'] += chunk_stats['matches']
+        if on_progress is not None:
+            on_progress(result, total, )
+    return result
+
+
+def run(
+        path: Path,
+        connection: pg_ext_connection,
+        processes: int | None = None,
+        top_k: int | None = None,
+        chunk_size: int = 1_000,
+        on_progress: Callable[[PrecomputeStats, int], None] | None = None,
+) -> PrecomputeStats:
+    """
+    Precompute the matches of all the users of the snapshot, the matches of the previous run are replaced.
+    processes - pool size (None - CPUs count), 1 - in the current process (by the passed connection) without a pool.
+    on_progress - called with the stats of the done part and the total users count after every chunk.
+    """
+    global counter, worker_connection
+    counter = CovoteCounter(votes_snapshot=snapshot.read(path=path, ), )
+    computed_at = datetime.now()
+    total = counter.users_count
+    chunks = [(start, min(start + chunk_size, total),) for start in range(0, total, chunk_size, )]
+    task = partial(process_chunk, top_k=top_k, computed_at=computed_at, )
+    try:
+        if processes == 1:
+            worker_connection = connection
+            result = collect_stats(chunks_stats=map(task, chunks, ), total=total, on_progress=on_progress, )
+        else:
+            with get_context('fork', ).Pool(processes=processes, initializer=init_worker, initargs=(path,), ) as pool:
+                result = collect_stats(
+                    chunks_stats=pool.imap_unordered(task, chunks, ),
+                    total=total,
+                    on_progress=on_progress,
+                )
+                pool.close()  # The workers exit by themselves and close their connections
+                pool.join()
+    finally:
+        counter = worker_connection = None
+    app.db.crud.users.Matcher.delete_stale_precomputed_matches(computed_at=computed_at, connection=connection, )
+    return result
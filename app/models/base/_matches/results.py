@@ -0,0 +1,112 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+from collections.abc import Sequence
+from sys import getsizeof
+from typing import TYPE_CHECKING, Callable, TypeVar
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import app.structures.base
+
+T = TypeVar('T')
+
+
+class MatchesArray(Sequence[T]):
+    """
+    Matches of the search as parallel arrays in the order of the raw matches (the best is the last, popped first).
+    The match objects are created by create_match(id, tg_user_id, count_common_interests) only on access
+    and are kept until popped, so only the matches near the end (the shown and the loaded ones) exist as objects.
+    """
+
+    def __init__(
+            self,
+            ids: np.ndarray,
+            tg_user_ids: np.ndarray,
+            counts: np.ndarray,
+            create_match: Callable[[int, int, int], T],
+    ):
+        self.ids = ids
+        self.tg_user_ids = tg_user_ids
+        self.counts = counts
+        self.create_match = create_match
+        self.size = len(ids)  # Pop only decreases the size, the arrays are not copied
+        self.created: dict[int, T] = {}  # Index: match
+
+    @classmethod
+    def from_raw(
+            cls,
+            raw_matches: list[app.structures.base.Covote],
+            create_match: Callable[[int, int, int], T],
+    ) -> MatchesArray[T]:
+        return cls(
+            ids=np.fromiter((raw_match['id'] for raw_match in raw_matches), dtype=np.int32, count=len(raw_matches), ),
+            tg_user_ids=np.fromiter(
+                (raw_match['tg_user_id'] for raw_match in raw_matches), dtype=np.int64, count=len(raw_matches),
+            ),
+            counts=np.fromiter(
+                (raw_match['count_common_interests'] for raw_match in raw_matches),
+                dtype=np.int32,
+                count=len(raw_matches),
+            ),
+            create_match=create_match,
+        )
+
+    def __repr__(self, ) -> str:
+        return f'{type(self).__name__}(size={self.size}, created={len(self.created)}, nbytes={self.nbytes})'
+
+    def __len__(self, ) -> int:
+        return self.size
+
+    def __getitem__(self, index: int | slice, ) -> T | list[T]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.size))]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError('matches index out of range')
+        if (match := self.created.get(index)) is None:
+            match = self.created[index] = self.create_match(
+                int(self.ids[index]),
+                int(self.tg_user_ids[index]),
+                int(self.counts[index]),
+            )
+        return match
+
+    def pop(self, ) -> T:
+        if not self.size:
+            raise IndexError('pop from empty matches')
+        match = self[-1]
+        self.size -= 1
+        del self.created[self.size]
+        return match
+
+    def select(self, ids: set[int], ) -> MatchesArray[T]:
+        """The matches with these ids in the same order, the not popped only"""
+        mask = np.isin(self.ids[:self.size], list(ids), )
+        return type(self)(
+            ids=self.ids[:self.size][mask],
+            tg_user_ids=self.tg_user_ids[:self.size][mask],
+            counts=self.counts[:self.size][mask],
+            create_match=self.create_match,
+        )
+
+    @property
+    def nbytes(self, ) -> int:
+        """Memory footprint of the arrays and of the index of the created matches (not of the matches themselves)"""
+        return self.ids.nbytes + self.tg_user_ids.nbytes + self.counts.nbytes + getsizeof(self.created, )
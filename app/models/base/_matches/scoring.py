@@ -0,0 +1,60 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Similarity of the searcher with the all candidates at once.
+common - covotes count of every candidate (votes with the same post and value),
+user_votes_count - votes count of the searcher, candidates_votes_counts - votes count of every candidate.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+
+def jaccard(common: np.ndarray, user_votes_count: int, candidates_votes_counts: np.ndarray, ) -> np.ndarray:
+    """Intersection over union of the votes"""
+    return common / (user_votes_count + candidates_votes_counts - common)
+
+
+def cosine(common: np.ndarray, user_votes_count: int, candidates_votes_counts: np.ndarray, ) -> np.ndarray:
+    return common / np.sqrt(user_votes_count * candidates_votes_counts)
+
+
+def overlap(common: np.ndarray, user_votes_count: int, candidates_votes_counts: np.ndarray, ) -> np.ndarray:
+    """Intersection over the smaller votes set, a light voter may get the max score"""
+    return common / np.minimum(user_votes_count, candidates_votes_counts)
+
+
+def reciprocal(common: np.ndarray, user_votes_count: int, candidates_votes_counts: np.ndarray, ) -> np.ndarray:
+    """
+    Harmonic mean of the both one-sided scores (common share of the searcher votes and of the candidate votes).
+    A heavy voter candidate gets the low score even with the same common count.
+    """
+    return 2 * common / (user_votes_count + candidates_votes_counts)
+
+
+def idf_weighted(
+        candidates_indexes: np.ndarray,
+        voters_counts: np.ndarray,
+        users_count: int,
+        candidates_count: int,
+) -> np.ndarray:
+    """
+    Sum of the common posts weights, a rarely voted post weights more than a popular one (inverse document frequency).
+    Every covote is a pair: candidates_indexes - index of the candidate, voters_counts - voters count of the post.
+    """
+    weights = np.log1p(users_count / voters_counts)
+    return np.bincount(candidates_indexes, weights=weights, minlength=candidates_count, )
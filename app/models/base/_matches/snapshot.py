@@ -0,0 +1,143 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Public votes snapshot, a single memory-mappable file for the warm start of the in-memory engines.
+Layout (little endian):
+    header - magic, format version, crc32 of the rest of the file, meta size (see HEADER),
+    meta - JSON with the high-water mark and the offset and the length of every array,
+    arrays - users x posts matrix in CSR format (indptr, indices, values) and the id maps (tg_user_ids, post_ids),
+    every array is aligned to ALIGNMENT bytes.
+"""
+
+from __future__ import annotations
+import json
+import mmap
+import os
+import struct
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from app.exceptions import BadSnapshot
+
+MAGIC = b'RUBIKVOT'
+VERSION = 1  # Increase on any layout change, a snapshot of another version is ignored
+HEADER = struct.Struct('<8sIIQ', )  # magic, version, checksum, meta size
+ALIGNMENT = 64
+ARRAYS = {  # Name: dtype, the order is the order in the file
+    'tg_user_ids': np.int64,  # Row: tg_user_id
+    'post_ids': np.int64,  # Column: post_id
+    'indptr': np.int64,
+    'indices': np.int32,  # Columns, sorted inside every row
+    'values': np.int8,
+}
+VOTE = np.dtype([('tg_user_id', np.int64, ), ('post_id', np.int64, ), ('value', np.int8, ), ], )  # Streamed vote
+
+
+def get_padding(size: int, ) -> int:
+    return -size % ALIGNMENT
+
+
+@dataclass
+class Snapshot:
+    tg_user_ids: np.ndarray
+    post_ids: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    values: np.ndarray
+    mark: datetime | None  # The votes updated since may be not in the snapshot, see READ_VOTES_MARK
+
+    def get_votes(self, ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """tg_user_id, post_id and value of every vote"""
+        rows = np.repeat(np.arange(len(self.tg_user_ids), ), np.diff(self.indptr, ), )
+        return self.tg_user_ids[rows], self.post_ids[self.indices], self.values
+
+
+def write(
+        path: Path,
+        tg_user_ids: np.ndarray,
+        post_ids: np.ndarray,
+        values: np.ndarray,
+        mark: datetime | None,
+) -> None:
+    """The file is replaced atomically, a reader never sees a partially written snapshot"""
+    unique_users, rows = np.unique(tg_user_ids, return_inverse=True, )
+    unique_posts, cols = np.unique(post_ids, return_inverse=True, )
+    order = np.lexsort((cols, rows,), )
+    indptr = np.zeros(len(unique_users) + 1, dtype=np.int64, )
+    np.cumsum(np.bincount(rows, minlength=len(unique_users), ), out=indptr[1:], )
+    arrays = {
+        'tg_user_ids': unique_users,
+        'post_ids': unique_posts,
+        'indptr': indptr,
+        'indices': cols[order],
+        'values': values[order],
+    }
+    meta = {'mark': None if mark is None else mark.isoformat(), 'arrays': {}, }
+    offset = 0
+    for name, dtype in ARRAYS.items():
+        arrays[name] = np.ascontiguousarray(arrays[name], dtype=dtype, )
+        meta['arrays'][name] = {'offset': offset, 'length': len(arrays[name]), }
+        offset += arrays[name].nbytes + get_padding(size=arrays[name].nbytes, )
+    meta = json.dumps(meta, ).encode()
+    parts = [meta, bytes(get_padding(size=HEADER.size + len(meta), ), ), ]
+    for array in arrays.values():
+        parts += [memoryview(array, ), bytes(get_padding(size=array.nbytes, ), ), ]
+    checksum = 0
+    for part in parts:
+        checksum = zlib.crc32(part, checksum, )
+    path.parent.mkdir(parents=True, exist_ok=True, )
+    tmp_path = path.with_name(f'{path.name}.tmp', )
+    with open(tmp_path, 'wb', ) as f:
+        f.write(HEADER.pack(MAGIC, VERSION, checksum, len(meta), ), )
+        for part in parts:
+            f.write(part, )
+        f.flush()
+        os.fsync(f.fileno(), )
+    os.replace(tmp_path, path, )
+
+
+def read(path: Path, ) -> Snapshot:
+    """
+    Arrays are read-only views of the mapped file (no copy), raises FileNotFoundError or BadSnapshot.
+    The checksum is verified on every read, it touches every page once.
+    """
+    with open(path, 'rb', ) as f:
+        if os.fstat(f.fileno(), ).st_size < HEADER.size:
+            raise BadSnapshot(f'Snapshot {path} is truncated')
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ, )  # The map outlives the file descriptor
+    magic, version, checksum, meta_size = HEADER.unpack_from(buffer, )
+    if magic != MAGIC:
+        raise BadSnapshot(f'{path} is not a votes snapshot')
+    if version != VERSION:
+        raise BadSnapshot(f'Snapshot {path} version is {version}, expected {VERSION}')
+    if zlib.crc32(memoryview(buffer, )[HEADER.size:], ) != checksum:
+        raise BadSnapshot(f'Snapshot {path} checksum mismatch')
+    meta = json.loads(buffer[HEADER.size:HEADER.size + meta_size], )
+    data_offset = HEADER.size + meta_size + get_padding(size=HEADER.size + meta_size, )
+    arrays = {
+        name: np.frombuffer(
+            buffer,
+            dtype=dtype,
+            count=meta['arrays'][name]['length'],
+            offset=data_offset + meta['arrays'][name]['offset'],
+        )
+        for name, dtype in ARRAYS.items()
+    }
+    return Snapshot(**arrays, mark=None if meta['mark'] is None else datetime.fromisoformat(meta['mark'], ), )
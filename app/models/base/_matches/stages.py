@@ -0,0 +1,141 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Timing of the search stages (covotes, every filter, matches reading, conversion to the objects).
+Every search produces the list of the stages, the list is reported to the sink.
+"""
+
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import TYPE_CHECKING, TypedDict, Callable, Iterator
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import app.structures.base
+
+TOTAL = 'total'  # Stage name of the whole search
+BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1_000, 5_000,)  # Upper bounds of the histogram buckets, the last is +inf
+
+
+class Stage(TypedDict):
+    name: str
+    seconds: float
+    rows: int
+    round_trips: int
+
+
+class StageStats(TypedDict):
+    count: int  # Searches with the stage
+    p50_ms: float
+    p95_ms: float
+    p99_ms: float
+    rows: float  # Mean per search
+    round_trips: float  # Mean per search
+    histogram: list[int]  # Count of all the stages per bucket (BUCKETS_MS) since the start
+
+
+class SearchTimings:
+    """Stages of a single search, statements are counted by the counter of the searcher connection"""
+
+    def __init__(self, counter: app.structures.base.StatementsCounter, timer: Callable[[], float] = perf_counter, ):
+        self.counter = counter
+        self.timer = timer
+        self.start = timer()
+        self.stages: list[Stage] = []
+
+    @contextmanager
+    def stage(self, name: str, ) -> Iterator[None]:
+        start, rows, round_trips = self.timer(), self.counter['rows'], self.counter['round_trips']
+        try:
+            yield
+        finally:
+            self.stages.append(Stage(
+                name=name,
+                seconds=self.timer() - start,
+                rows=self.counter['rows'] - rows,
+                round_trips=self.counter['round_trips'] - round_trips,
+            ))
+
+    def finish(self, ) -> list[Stage]:
+        """Stages with the whole search as the last"""
+        return self.stages + [Stage(
+            name=TOTAL,
+            seconds=self.timer() - self.start,
+            rows=self.counter['rows'],
+            round_trips=self.counter['round_trips'],
+        )]
+
+
+class SinkInterface(ABC, ):
+    @abstractmethod
+    def record(self, stages: list[Stage], ) -> None:
+        ...
+
+    def report(self, ) -> dict[str, StageStats]:
+        """Sink without the aggregation (just exports the stages) reports nothing"""
+        return {}
+
+
+class HistogramSink(SinkInterface, ):
+    """
+    Process-wide timings of the recent searches (window), percentiles are calculated on demand.
+    Stage met several times in a search (partial search after the time out) is summed up.
+    """
+
+    def __init__(self, window: int, ):
+        self.window = window
+        self.lock = Lock()
+        self.searches: dict[str, deque[Stage]] = defaultdict(lambda: deque(maxlen=self.window, ), )
+        self.histograms: dict[str, np.ndarray] = defaultdict(lambda: np.zeros(len(BUCKETS_MS) + 1, dtype=np.int64, ))
+
+    def record(self, stages: list[Stage], ) -> None:
+        summed: dict[str, Stage] = {}
+        for stage in stages:
+            if stage['name'] in summed:
+                for key in ('seconds', 'rows', 'round_trips',):
+                    summed[stage['name']][key] += stage[key]
+            else:
+                summed[stage['name']] = Stage(**stage, )
+        with self.lock:
+            for name, stage in summed.items():
+                self.searches[name].append(stage)
+                self.histograms[name][np.searchsorted(BUCKETS_MS, stage['seconds'] * 1000, )] += 1
+
+    def report(self, ) -> dict[str, StageStats]:
+        """Stats of the every stage, the stages are in order of the first occurrence, TOTAL is the last"""
+        with self.lock:
+            searches = {name: list(stages) for name, stages in self.searches.items() if name != TOTAL}
+            if TOTAL in self.searches:
+                searches[TOTAL] = list(self.searches[TOTAL])
+            histograms = {name: histogram.tolist() for name, histogram in self.histograms.items()}
+        result = {}
+        for name, stages in searches.items():
+            p50, p95, p99 = np.percentile([stage['seconds'] * 1000 for stage in stages], (50, 95, 99,), )
+            result[name] = StageStats(
+                count=len(stages),
+                p50_ms=float(p50),
+                p95_ms=float(p95),
+                p99_ms=float(p99),
+                rows=float(np.mean([stage['rows'] for stage in stages])),
+                round_trips=float(np.mean([stage['round_trips'] for stage in stages])),
+                histogram=histograms[name],
+            )
+        return result
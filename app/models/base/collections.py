@@ -79,7 +79,7 @@ def create(
         Flow:
         1. Create collection itself.
         2. If exists - read existing collection id.
-        3. Create m2m map of collection and passed posts_ids in params.
+        3. Create m2m map of collection and passed posts_ids in params (single statement).
         """
         newly_created_collection_id = cls.CRUD.create(  # Returns None if already exists
             author=author.tg_user_id,
@@ -92,12 +92,11 @@ def create(
                 name=name,
                 connection=author.connection,
             )
-        for post_id in posts_ids:
-            cls.CRUD.create_2m2_collection_post(
-                collection_id=newly_created_collection_id,
-                post_id=post_id,
-                connection=author.connection,
-            )
+        cls.CRUD.create_m2m_collection_posts(
+            collection_id=newly_created_collection_id,
+            posts_ids=posts_ids,
+            connection=author.connection,
+        )
 
     @classmethod
     def get_defaults_names(cls, prefix: str, connection: pg_ext_connection, ) -> list[str]:
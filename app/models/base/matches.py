@@ -16,17 +16,45 @@
 from __future__ import annotations
 from enum import IntEnum
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING, Protocol, TypedDict, Type
+from typing import TYPE_CHECKING, Protocol, TypedDict, Type, Callable
 from dataclasses import dataclass, asdict, field
+from contextlib import contextmanager
+from functools import partial
 from pprint import pformat
+from time import monotonic
+from concurrent.futures import wait as futures_wait
+
+import numpy as np
 
 from app.utils import get_perc
+from app.config import (
+    MATCHER_MODE,
+    MATCHER_SCORING,
+    SEARCH_CACHE_SIZE,
+    SEARCH_CACHE_TTL,
+    SEARCH_BUDGET_MS,
+    SEARCH_JOBS,
+    SEARCH_JOBS_WORKERS,
+    SEARCH_JOBS_QUEUE_SIZE,
+    SEARCH_TIMINGS_WINDOW,
+    NEARBY_RADIUS_KM,
+    MATCHER_SNAPSHOT_PATH,
+    MATCHER_SNAPSHOT_INTERVAL,
+    MATCHER_TOP_MATCHES_TRIM_INTERVAL,
+)
+from app.postconfig import scheduler, logger
+from app.exceptions import BadSnapshot, BadMatcherConfig, DeadlineExceeded
 
 import app.db.crud.users
 import app.structures.base
+from ._matches import engines, cache, scoring as scoring_kernels, snapshot, precompute, jobs, results, geo, stages
 
 if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from typing import Iterator
     from datetime import datetime as datetime_datetime
+    from pathlib import Path
+    from psycopg2.extensions import connection as pg_ext_connection
     import app.models.base.users
 
 
@@ -65,6 +93,7 @@ def __init__(
         self.id = id
         self.owner = owner  # User who get this match
         self.user = user
+        self.is_loaded = False  # Is user profile data loaded from DB
         self.stats = self.Stats(
             common_posts_count=common_posts_count,
             common_posts_perc=common_posts_perc,
@@ -80,11 +109,16 @@ def __repr__(self, ):
         return repr({k: v for k, v in d.items() if v is not None}) + '\n'
 
     def create(self, ) -> None:
-        return self.CRUD.create(
+        """Mark the match as shown, the cached results of the owner are invalidated (the match is not new anymore)"""
+        self.CRUD.create(
             tg_user_id=self.owner.tg_user_id,
             matched_tg_user_id=self.user.tg_user_id,
             connection=self.owner.connection,
         )
+        self.CRUD.db.after_commit(
+            callback=partial(Matcher.versions.bump, key=self.owner.tg_user_id, ),
+            connection=self.owner.connection,
+        )
 
 
 class MatcherDCProtocol(Protocol, ):
@@ -92,6 +126,22 @@ class Limit(Protocol):
         min: int
         average: int
 
+    class Mode(IntEnum):
+        TEMP_TABLES: int
+        SINGLE_QUERY: int
+        VOTE_MATRIX: int
+        TOP_MATCHES: int
+        COVOTE_INDEX: int
+        MINHASH: int
+
+    class Scoring(IntEnum):
+        COMMON_COUNT: int
+        JACCARD: int
+        COSINE: int
+        OVERLAP: int
+        IDF: int
+        RECIPROCAL: int
+
     class Filters(ABC):
         Goal: app.structures.base.Goal
 
@@ -107,11 +157,13 @@ class Checkbox(TypedDict):
             photo: bool
             country: bool
             city: bool
+            nearby: bool
 
         checkboxes: Checkbox
         gender: Gender
         goal: app.structures.base.Goal
         age_range: tuple[MatcherDCProtocol.Filters.Age.MIN, Age.MAX]
+        radius: int
 
     class MatchesRaw(ABC, ):
         covotes: list[app.structures.base.Covote]
@@ -135,6 +187,10 @@ class Matches(ABC):
         current: list[MatchInterface]
         count_all: int | None
         count_new: int | None
+        keyset: tuple[int, int] | None
+        count_fetched: int
+        is_exhausted: bool
+        is_partial: bool
 
     class SearchResult(ABC):  # Use me
         id: int
@@ -143,6 +199,21 @@ class SearchResult(ABC):  # Use me
         datetime: datetime_datetime
 
     CRUD: app.db.crud.users.Matcher
+    mode: Mode
+    ENGINES: dict[Mode, Type[engines.EngineInterface]]
+    SINGLE_QUERY_MODES: tuple[Mode, ...]
+    engine: engines.EngineInterface | None
+    SNAPSHOT_PATH: Path
+    SNAPSHOT_INTERVAL: int
+    SEARCH_BUDGET_MS: int
+    SEARCH_JOBS: bool
+    search_executor: jobs.SearchExecutor
+    search_job: Future | None
+    is_search_cancelled: bool
+    timings_sink: stages.SinkInterface
+    timings: stages.SearchTimings | None
+    session: pg_ext_connection | None
+    connection: pg_ext_connection
 
 
 class MatcherInterface(MatcherDCProtocol, ):
@@ -151,6 +222,84 @@ class MatcherInterface(MatcherDCProtocol, ):
     def __repr__(self, ) -> str:
         ...
 
+    @classmethod
+    @abstractmethod
+    def check_config(cls, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def set_engine(cls, connection: pg_ext_connection, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def save_snapshot(cls, connection: pg_ext_connection | None = None, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def create_snapshot_task(cls, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def precompute_matches(
+            cls,
+            connection: pg_ext_connection,
+            processes: int | None = None,
+            refresh_snapshot: bool = True,
+            on_progress: Callable[[precompute.PrecomputeStats, int], None] | None = None,
+    ) -> precompute.PrecomputeStats:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def rebuild_top_matches(cls, connection: pg_ext_connection, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def trim_top_matches(cls, connection: pg_ext_connection | None = None, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def create_top_matches_trim_task(cls, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def rebuild_votes_counts(cls, connection: pg_ext_connection, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def handle_vote(
+            cls,
+            tg_user_id: int,
+            post_id: int,
+            old_value: int,
+            new_value: int,
+            connection: pg_ext_connection,
+    ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def handle_votes(cls, post_id: int, votes: list[tuple[int, int, int]], connection: pg_ext_connection, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def apply_vote(cls, tg_user_id: int, post_id: int, value: int, ) -> None:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def apply_votes(cls, post_id: int, votes: list[tuple[int, int]], ) -> None:
+        ...
+
     @abstractmethod
     def drop_votes_table(self, ) -> None:
         ...
@@ -172,7 +321,11 @@ def get_user_votes(self, ) -> list[app.structures.base.UserPublicVote]:
         ...
 
     @abstractmethod
-    def get_user_matches(self, new: bool = False) -> list[app.structures.base.Covote]:
+    def get_user_matches(
+            self,
+            new: bool = False,
+            reuse: dict[int, app.structures.base.Covote] | None = None,
+    ) -> list[app.structures.base.Covote]:
         ...
 
     @abstractmethod
@@ -203,6 +356,14 @@ def apply_checkboxes_city_filter(self, update: bool = False):
     def apply_checkboxes_photo_filter(self, update: bool = False):
         ...
 
+    @abstractmethod
+    def apply_checkboxes_nearby_filter(self, update: bool = False):
+        ...
+
+    @abstractmethod
+    def get_nearby_ids(self, ) -> list[int] | None:
+        ...
+
     @abstractmethod
     def filter_matches(self, update: bool = False) -> None:
         ...
@@ -211,6 +372,47 @@ def filter_matches(self, update: bool = False) -> None:
     def set_matches_raw(self, ):
         ...
 
+    @abstractmethod
+    def get_filtered_matches(self, ) -> list[app.structures.base.FilteredCovote]:
+        ...
+
+    @classmethod
+    @abstractmethod
+    def get_users_count(cls, connection: pg_ext_connection, ) -> int:
+        ...
+
+    @abstractmethod
+    def get_scores(self, raw_matches: list[app.structures.base.Covote], ) -> np.ndarray:
+        ...
+
+    @abstractmethod
+    def rank_matches(self, raw_matches: list[app.structures.base.Covote], ) -> list[app.structures.base.Covote]:
+        ...
+
+    @abstractmethod
+    def get_cache_key(self, ) -> tuple:
+        ...
+
+    @abstractmethod
+    def set_filtered_matches_raw(self, ) -> None:
+        ...
+
+    @abstractmethod
+    def set_partial_matches_raw(self, ) -> None:
+        ...
+
+    @abstractmethod
+    def set_matches_counts(self, ) -> None:
+        ...
+
+    @abstractmethod
+    def reset_pages(self, ) -> None:
+        ...
+
+    @abstractmethod
+    def get_next_page(self, ) -> list[app.structures.base.Covote]:
+        ...
+
     @abstractmethod
     def set_current_matches(self, ):
         ...
@@ -219,6 +421,55 @@ def set_current_matches(self, ):
     def get_common_interests_perc(self, common_posts_count: int, ) -> int:
         ...
 
+    @abstractmethod
+    def open_session(self, ) -> None:
+        ...
+
+    @abstractmethod
+    def close_session(self, ) -> None:
+        ...
+
+    @abstractmethod
+    def cancel_search(self, ) -> None:
+        ...
+
+    @abstractmethod
+    def measure_search(self, ) -> Iterator[None]:
+        ...
+
+    @abstractmethod
+    def measure_stage(self, name: str, ) -> Iterator[None]:
+        ...
+
+    @abstractmethod
+    def search(
+            self,
+            drop_old_votes: bool = False,
+            drop_old_matches: bool = False,
+    ) -> list[app.structures.base.Covote]:
+        ...
+
+    @abstractmethod
+    def make_search(
+            self,
+            drop_old_votes: bool = False,
+            drop_old_matches: bool = False,
+            budget_ms: int | None = None,
+    ) -> list[app.structures.base.Covote]:
+        ...
+
+    @abstractmethod
+    def submit_search(self, on_done: Callable[[Future], None] | None = None, ) -> Future:
+        ...
+
+    @abstractmethod
+    def make_search_job(self, ) -> list[app.structures.base.Covote]:
+        ...
+
+    @abstractmethod
+    def is_search_running(self, ) -> bool:
+        ...
+
     @abstractmethod
     def get_match(self, pop: bool = True) -> Match | None:
         ...
@@ -231,6 +482,22 @@ class Limit(IntEnum, ):  # Use me
         min: int = 1
         average: int = 10
 
+    class Mode(IntEnum, ):
+        TEMP_TABLES = 1  # Temporary tables + a separate DELETE statement for every filter
+        SINGLE_QUERY = 2  # One parameterized statement for the whole search, no temporary tables
+        VOTE_MATRIX = 3  # Covotes are counted in memory (engines.VoteMatrix), DB only applies the filters
+        TOP_MATCHES = 4  # Covotes are read from the incrementally updated table (top K per user)
+        COVOTE_INDEX = 5  # Temporary tables, but covotes are counted in memory (engines.CovoteIndex)
+        MINHASH = 6  # Approximate, as VOTE_MATRIX but only LSH candidates are counted (engines.MinHashLSH)
+
+    class Scoring(IntEnum, ):  # How to rank the matches of the single query modes (see scoring module)
+        COMMON_COUNT = 1  # Just covotes count, favours heavy voters
+        JACCARD = 2
+        COSINE = 3
+        OVERLAP = 4
+        IDF = 5  # Rarely voted common posts weight more
+        RECIPROCAL = 6  # Relative to the votes of the both users
+
     @dataclass
     class Filters:
         Goal = app.structures.base.Goal
@@ -247,6 +514,7 @@ class Checkbox(TypedDict, ):
             photo: bool
             country: bool
             city: bool
+            nearby: bool
 
         class Checkboxes(dict, ):
             def __init__(
@@ -254,9 +522,10 @@ def __init__(
                     age: bool = True,
                     photo: bool = False,
                     country: bool = False,
-                    city: bool = False
+                    city: bool = False,
+                    nearby: bool = False,
             ) -> None:
-                super().__init__(age=age, photo=photo, country=country, city=city)
+                super().__init__(age=age, photo=photo, country=country, city=city, nearby=nearby, )
 
         class MatchType(IntEnum, ):
             ALL_MATCHES = 1
@@ -267,6 +536,7 @@ class MatchType(IntEnum, ):
         age_range: tuple = (Age.MIN, Age.MAX,)
         match_type: MatchType = MatchType.ALL_MATCHES
         checkboxes: Checkboxes = field(default_factory=lambda: MatcherDC.Filters.Checkboxes())
+        radius: int = NEARBY_RADIUS_KM  # km, used if "nearby" checkbox is checked
 
     @dataclass
     class SearchResult:  # Use it
@@ -286,11 +556,17 @@ class MatchesRaw:
     class Matches:  # No dataclass cuz field(default_factory=Matcher.MatchesRaw()) not aware about MatchesRaw cls
         def __init__(self, ):
             self.raw: Matcher.MatchesRaw = Matcher.MatchesRaw()
-            self.new: list[Match] = []
-            self.all: list[Match] = []
-            self.current: list[Match] = []
+            # Arrays of the matches, Match objects are created on access (see results.MatchesArray)
+            self.new: list[Match] | results.MatchesArray[Match] = []
+            self.all: list[Match] | results.MatchesArray[Match] = []
+            self.current: list[Match] | results.MatchesArray[Match] = []
             self.count_all: int = 0
             self.count_new: int = 0
+            # Pages (temporary tables modes only)
+            self.keyset: tuple[int, int] | None = None  # (count_common_interests, tg_user_id) of the last fetched
+            self.count_fetched: int = 0
+            self.is_exhausted: bool = False
+            self.is_partial: bool = False  # The search is out of the time budget, see Matcher.make_search
 
 
 class Matcher(MatcherDC, MatcherInterface, ):
@@ -302,15 +578,68 @@ class Matcher(MatcherDC, MatcherInterface, ):
     """
 
     CRUD = app.db.crud.users.Matcher
+    mode = MatcherDC.Mode[MATCHER_MODE]
+    ENGINES = {
+        MatcherDC.Mode.VOTE_MATRIX: engines.VoteMatrix,
+        MatcherDC.Mode.COVOTE_INDEX: engines.CovoteIndex,
+        MatcherDC.Mode.MINHASH: engines.MinHashLSH,
+    }
+    # Modes with the whole search by the single statement (no temporary tables)
+    SINGLE_QUERY_MODES = (
+        MatcherDC.Mode.SINGLE_QUERY,
+        MatcherDC.Mode.VOTE_MATRIX,
+        MatcherDC.Mode.TOP_MATCHES,
+        MatcherDC.Mode.MINHASH,
+    )
+    scoring = MatcherDC.Scoring[MATCHER_SCORING]
+    SCORING_KERNELS = {
+        MatcherDC.Scoring.JACCARD: scoring_kernels.jaccard,
+        MatcherDC.Scoring.COSINE: scoring_kernels.cosine,
+        MatcherDC.Scoring.OVERLAP: scoring_kernels.overlap,
+        MatcherDC.Scoring.RECIPROCAL: scoring_kernels.reciprocal,
+    }
+    engine: engines.EngineInterface | None = None  # Shared by all the instances, see set_engine
+    SNAPSHOT_PATH = MATCHER_SNAPSHOT_PATH  # Votes snapshot for the engine warm start
+    SNAPSHOT_INTERVAL = MATCHER_SNAPSHOT_INTERVAL  # Minutes
+    PRECOMPUTE_TOP_K = 100  # Matches per user to keep in the precomputed matches table
+    # Shared by all the instances, filtered matches of the single query modes, see get_cache_key
+    search_cache = cache.SearchCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, )
+    # Shared, tg_user_id: version, a vote or a shown match invalidates the cached results of the user
+    versions = cache.Versions(maxsize=SEARCH_CACHE_SIZE, )
+    users_count: tuple[int, float] | None = None  # Shared, the count and the monotonic time of the read
+    USERS_COUNT_TTL = 600  # Seconds, the IDF weights barely depend on the new users
+    TOP_MATCHES_LIMIT = CRUD.db.sqls.Matches.Public.TOP_MATCHES_KEPT  # K, candidates to read from the top matches
+    TOP_MATCHES_TRIM_INTERVAL = MATCHER_TOP_MATCHES_TRIM_INTERVAL  # Minutes
+    PAGE_SIZE = 20  # Matches to fetch at once (temporary tables modes)
+    TOP_K: int | None = None  # Max matches to show for the search, None - no limit
+    SEARCH_BUDGET_MS = SEARCH_BUDGET_MS  # Milliseconds for the whole search, 0 - no limit
+    PARTIAL_BUDGET_SHARE = 0.3  # Part of the budget kept for the partial search, see make_search
+    PARTIAL_VOTES_LIMIT = 100  # The latest votes of the user to scan the covoters by (partial search)
+    SEARCH_JOBS = SEARCH_JOBS  # Search in the background, see submit_search
+    # Shared by all the instances, the background searches
+    search_executor = jobs.SearchExecutor(workers=SEARCH_JOBS_WORKERS, queue_size=SEARCH_JOBS_QUEUE_SIZE, )
+    # Shared by all the instances, the stages of the searches, see measure_search
+    timings_sink: stages.SinkInterface = stages.HistogramSink(window=SEARCH_TIMINGS_WINDOW, )
 
-    def __init__(self, user: app.models.base.users.User, filters: MatcherDC.Filters | None = None, ):
+    def __init__(
+            self,
+            user: app.models.base.users.User,
+            filters: MatcherDC.Filters | None = None,
+            mode: MatcherDC.Mode | None = None,
+    ):
         self.user = user
         self.filters = filters or self.Filters()
+        self.mode = mode or self.mode
         self.matches = self.Matches()
         self.user_votes_count = 0
         self.is_user_has_votes = False
         self.is_user_has_covotes = False
+        self.covotes: tuple[list[int], list[int]] | None = None  # tg_user_ids and counts, counted by engine
         self.search_results: list[Matcher.SearchResult] = []  # Not in use
+        self.search_job: Future | None = None  # The latest background search, see submit_search
+        self.is_search_cancelled = False  # The user left the search while it's made, see cancel_search
+        self.timings: stages.SearchTimings | None = None  # Of the current search, see measure_search
+        self.session: pg_ext_connection | None = None  # Own connection of the temporary tables, see open_session
         self._is_unfiltered_matches_already_set = False  # tmp solution
 
     def __repr__(self, ):
@@ -322,29 +651,213 @@ def __repr__(self, ):
         }
         return repr({k: v for k, v in d.items() if v is not None}) + '\n'
 
+    @classmethod
+    def check_config(cls, ) -> None:
+        """
+        Reject the config the mode can't serve (once, on the app start).
+        The temporary tables modes fetch the matches by pages in the covotes count order,
+        so only the single query modes are ranked by the scoring.
+        """
+        if cls.scoring != cls.Scoring.COMMON_COUNT and cls.mode not in cls.SINGLE_QUERY_MODES:
+            raise BadMatcherConfig(
+                f'{cls.scoring.name} scoring is not supported by {cls.mode.name} mode, '
+                f'use COMMON_COUNT or one of: {", ".join(mode.name for mode in cls.SINGLE_QUERY_MODES)}'
+            )
+
+    @classmethod
+    def set_engine(cls, connection: pg_ext_connection, ) -> None:
+        """
+        Create and load the in-memory engine if the mode requires it (once, on the app start).
+        The snapshot is used if present, all the votes are read from DB otherwise.
+        """
+        if cls.mode in cls.ENGINES:
+            engine = cls.ENGINES[cls.mode]()
+            try:
+                engine.load_snapshot(path=cls.SNAPSHOT_PATH, connection=connection, )
+            except FileNotFoundError:  # The first start
+                engine.load(connection=connection, )
+            except BadSnapshot as e:
+                logger.error(e)
+                engine.load(connection=connection, )
+            cls.engine = engine
+
+    @classmethod
+    def save_snapshot(cls, connection: pg_ext_connection | None = None, ) -> None:
+        """
+        Write all the votes to the snapshot file, the votes are streamed right into the arrays.
+        The stream holds the transaction of the connection open, so it runs on its own connection of the pool by default.
+        The mark is read before the votes, so the votes updated meanwhile are replayed twice (it's idempotent).
+        """
+        if connection is None:
+            with cls.CRUD.db.borrow(owner='votes snapshot', ) as connection:
+                return cls.save_snapshot(connection=connection, )
+        mark = cls.CRUD.read_votes_mark(connection=connection, )
+        votes = np.fromiter(cls.CRUD.stream_all_votes(connection=connection, ), dtype=snapshot.VOTE, )
+        snapshot.write(
+            path=cls.SNAPSHOT_PATH,
+            tg_user_ids=votes['tg_user_id'],
+            post_ids=votes['post_id'],
+            values=votes['value'],
+            mark=mark,
+        )
+
+    @classmethod
+    def create_snapshot_task(cls, ) -> None:
+        """Write the snapshot periodically if the mode requires the engine"""
+        if cls.mode in cls.ENGINES:
+            scheduler.add_job(func=cls.save_snapshot, trigger='interval', minutes=cls.SNAPSHOT_INTERVAL, )
+
+    @classmethod
+    def precompute_matches(
+            cls,
+            connection: pg_ext_connection,
+            processes: int | None = None,
+            refresh_snapshot: bool = True,
+            on_progress: Callable[[precompute.PrecomputeStats, int], None] | None = None,
+    ) -> precompute.PrecomputeStats:
+        """
+        Top matches of every voter to the precomputed matches table by a pool of processes, see precompute module.
+        Filters are not applied, the table is a base for the digests and the caches warming.
+        """
+        if refresh_snapshot:
+            cls.save_snapshot(connection=connection, )
+        return precompute.run(
+            path=cls.SNAPSHOT_PATH,
+            connection=connection,
+            processes=processes,
+            top_k=cls.PRECOMPUTE_TOP_K,
+            on_progress=on_progress,
+        )
+
+    @classmethod
+    def rebuild_top_matches(cls, connection: pg_ext_connection, ) -> None:
+        """Recount the top matches table (heavy, the repair command only, see app.repair)"""
+        cls.CRUD.rebuild_top_matches(connection=connection, )
+
+    @classmethod
+    def trim_top_matches(cls, connection: pg_ext_connection | None = None, ) -> None:
+        """
+        Trim the top matches table back to K rows per user.
+        The delete is heavy and runs on the scheduler thread, so it runs on its own connection of the pool by default.
+        """
+        if connection is None:
+            with cls.CRUD.db.borrow(owner='top matches trim', ) as connection:
+                return cls.trim_top_matches(connection=connection, )
+        cls.CRUD.trim_top_matches(connection=connection, )
+
+    @classmethod
+    def create_top_matches_trim_task(cls, ) -> None:
+        """Trim the top matches table periodically if the mode requires it, the votes add the new pairs to it"""
+        if cls.mode == cls.Mode.TOP_MATCHES:
+            scheduler.add_job(func=cls.trim_top_matches, trigger='interval', minutes=cls.TOP_MATCHES_TRIM_INTERVAL, )
+
+    @classmethod
+    def rebuild_votes_counts(cls, connection: pg_ext_connection, ) -> None:
+        """Recount the votes counters (see app.repair), e.g. after the votes were changed bypassing handle_vote"""
+        cls.CRUD.rebuild_votes_counts(connection=connection, )
+
+    @classmethod
+    def handle_vote(
+            cls,
+            tg_user_id: int,
+            post_id: int,
+            old_value: int,
+            new_value: int,
+            connection: pg_ext_connection,
+    ) -> None:
+        """
+        Keep the engine, the top matches, the votes counters and the cache in sync with DB, call after the save.
+        The in-memory state is updated after the commit (see apply_vote), so a rolled back vote never gets there.
+        """
+        if delta := bool(new_value) - bool(old_value):  # Zero value is not a vote
+            cls.CRUD.update_votes_count(tg_user_id=tg_user_id, delta=delta, connection=connection, )
+        if cls.mode == cls.Mode.TOP_MATCHES and old_value != new_value:
+            cls.CRUD.update_top_matches(
+                tg_user_id=tg_user_id,
+                post_id=post_id,
+                old_value=old_value,
+                new_value=new_value,
+                connection=connection,
+            )
+        cls.CRUD.db.after_commit(
+            callback=partial(cls.apply_vote, tg_user_id=tg_user_id, post_id=post_id, value=new_value, ),
+            connection=connection,
+        )
+
+    @classmethod
+    def handle_votes(cls, post_id: int, votes: list[tuple[int, int, int]], connection: pg_ext_connection, ) -> None:
+        """
+        handle_vote of the votes of the different users for the same post (the bots votes) by a statement per table,
+        a vote is (tg_user_id, old_value, new_value).
+        """
+        changed = [vote for vote in votes if vote[1] != vote[2]]  # Old and new values
+        if not changed:
+            return
+        cls.CRUD.update_votes_counts(
+            rows=[
+                (tg_user_id, delta,) for tg_user_id, old_value, new_value in changed
+                if (delta := bool(new_value) - bool(old_value))  # Zero value is not a vote
+            ],
+            connection=connection,
+        )
+        if cls.mode == cls.Mode.TOP_MATCHES:
+            cls.CRUD.update_top_matches_many(
+                rows=[(tg_user_id, post_id, int(old_value),) for tg_user_id, old_value, _ in changed],
+                connection=connection,
+            )
+        cls.CRUD.db.after_commit(
+            callback=partial(
+                cls.apply_votes,
+                post_id=post_id,
+                votes=[(tg_user_id, new_value,) for tg_user_id, _, new_value in changed],
+            ),
+            connection=connection,
+        )
+
+    @classmethod
+    def apply_vote(cls, tg_user_id: int, post_id: int, value: int, ) -> None:
+        """The committed vote to the engine and the cache"""
+        cls.versions.bump(key=tg_user_id, )
+        if cls.engine is not None:
+            cls.engine.set_vote(tg_user_id=tg_user_id, post_id=post_id, value=value, )
+
+    @classmethod
+    def apply_votes(cls, post_id: int, votes: list[tuple[int, int]], ) -> None:
+        """The committed votes (tg_user_id, value) for the same post to the engine and the cache"""
+        for tg_user_id, value in votes:
+            cls.apply_vote(tg_user_id=tg_user_id, post_id=post_id, value=value, )
+
     # Not in use, use me
     def is_user_has_enough_votes(self, limit: Matcher.Limit, ) -> bool:  # pragma: no cover
         return self.user_votes_count > limit.value
 
     def drop_votes_table(self, ) -> None:
         """Drop a table (user_votes) if you need completely new search (reselect user votes"""
-        return self.CRUD.drop_votes_table(connection=self.user.connection, )
+        return self.CRUD.drop_votes_table(connection=self.connection, )
 
     def drop_matches_table(self, ) -> None:
         """Drop a table (user_covotes) if you need make search with new filters"""
-        return self.CRUD.drop_matches_table(connection=self.user.connection, )
+        return self.CRUD.drop_matches_table(connection=self.connection, )
 
     def create_user_votes(self, ) -> None:
         """Caching, collect user votes in temporary table to increase performance"""
         # [#1] Raise if no votes?
-        self.CRUD.create_user_votes(tg_user_id=self.user.tg_user_id, connection=self.user.connection, )
+        self.CRUD.create_user_votes(tg_user_id=self.user.tg_user_id, connection=self.connection, )
 
     def create_user_covotes(self, ) -> None:
         """Caching, collect user covotes in temporary table to increase performance"""
         # [#2] Raise if no covotes?
         # Will be executed only if table not exists
         self.create_user_votes()  # Next query depend on this table
-        self.CRUD.create_user_covotes(tg_user_id=self.user.tg_user_id, connection=self.user.connection, )
+        covotes = None
+        if self.mode in self.ENGINES:
+            covotes_ids, covotes_counts = self.engine.count_covotes(tg_user_id=self.user.tg_user_id, )
+            covotes = covotes_ids.tolist(), covotes_counts.tolist()  # Python ints for DB driver
+        self.CRUD.create_user_covotes(
+            tg_user_id=self.user.tg_user_id,
+            covotes=covotes,
+            connection=self.connection,
+        )
 
     def get_user_votes(self, ) -> list[app.structures.base.UserPublicVote]:
         """
@@ -352,39 +865,76 @@ def get_user_votes(self, ) -> list[app.structures.base.UserPublicVote]:
         There an option to select only one vote for checking
         but most likely in next steps will need to select rest votes
         """
-        result = self.CRUD.read_user_votes(connection=self.user.connection, )  # ID inside the connection
+        result = self.CRUD.read_user_votes(connection=self.connection, )  # ID inside the connection
         return result
 
-    def get_user_matches(self, new: bool = False, ) -> list[app.structures.base.Covote]:
-        """Will create a temporary table with user covotes"""
-        return self.CRUD.read_user_covotes(
+    def get_user_matches(
+            self,
+            new: bool = False,
+            reuse: dict[int, app.structures.base.Covote] | None = None,
+    ) -> list[app.structures.base.Covote]:
+        """
+        All the covotes are streamed as the tuples, the Covote is created right from the row,
+        the ones of "reuse" (by id) are not created again.
+        """
+        covotes = self.CRUD.read_user_covotes(
             tg_user_id=self.user.tg_user_id,
-            connection=self.user.connection,
+            connection=self.connection,
             new=new,
         )
+        if new is True:
+            return covotes
+        reuse = reuse or {}
+        return [
+            reuse.get(id_) or app.structures.base.Covote(
+                id=id_,
+                tg_user_id=tg_user_id,
+                count_common_interests=count_common_interests,
+            )
+            for id_, tg_user_id, count_common_interests in covotes
+        ]
 
     def create_unfiltered_matches(self, drop_old_votes: bool = False, drop_old_matches: bool = False, ) -> None:
+        if self.mode in (self.Mode.SINGLE_QUERY, self.Mode.TOP_MATCHES,):  # Nothing to create, just check the votes
+            votes_stats = self.CRUD.read_user_votes_stats(
+                tg_user_id=self.user.tg_user_id,
+                connection=self.connection,
+            )
+            self.user_votes_count = votes_stats['votes_count']
+            self.is_user_has_votes = bool(self.user_votes_count)
+            self.is_user_has_covotes = votes_stats['has_covotes']
+            self._is_unfiltered_matches_already_set = True
+            return
+        if self.mode in (self.Mode.VOTE_MATRIX, self.Mode.MINHASH,):  # Engine counts, DB only filters
+            covotes_ids, covotes_counts = self.engine.count_covotes(tg_user_id=self.user.tg_user_id, )
+            self.covotes = covotes_ids.tolist(), covotes_counts.tolist()  # Python ints for DB driver
+            self.user_votes_count = self.engine.read_user_votes_count(tg_user_id=self.user.tg_user_id, )
+            self.is_user_has_votes = bool(self.user_votes_count)
+            self.is_user_has_covotes = bool(self.covotes[0])
+            self._is_unfiltered_matches_already_set = True
+            return
+        self.open_session()
         if drop_old_votes:  # Dropping old_votes also drops old_matches ?? (check it)
             self.drop_votes_table()
         if drop_old_matches:
             self.drop_matches_table()
         self.create_user_votes()  # Will be executed only if table not exists
-        self.user_votes_count = self.CRUD.read_user_votes_count(connection=self.user.connection, )
+        self.user_votes_count = self.CRUD.read_user_votes_count(connection=self.connection, )
         self.is_user_has_votes = bool(self.user_votes_count)
         if self.user_votes_count:
             self.create_user_covotes()  # Will be executed only if table not exists
-            self.is_user_has_covotes = bool(self.CRUD.read_user_covotes_count(connection=self.user.connection, ))
+            self.is_user_has_covotes = bool(self.CRUD.read_user_covotes_count(connection=self.connection, ))
         self._is_unfiltered_matches_already_set = True
 
     def apply_goal_filter(self, update: bool = False, ):
         if self.filters.goal != self.Filters.Goal.BOTH:
-            self.CRUD.apply_goal_filter(goal=self.filters.goal.value, connection=self.user.connection, )
+            self.CRUD.apply_goal_filter(goal=self.filters.goal.value, connection=self.connection, )
             if update is True:
                 self.matches.raw.current = self.get_user_matches()  # Update data
 
     def apply_gender_filter(self, update: bool = False, ):
         if self.filters.gender != self.Filters.Gender.BOTH:
-            self.CRUD.apply_gender_filter(gender=self.filters.gender.value, connection=self.user.connection, )
+            self.CRUD.apply_gender_filter(gender=self.filters.gender.value, connection=self.connection, )
             if update is True:
                 self.matches.raw.current = self.get_user_matches()  # Update data
 
@@ -393,52 +943,252 @@ def apply_age_filter(self, update: bool = False, ):
             self.CRUD.apply_age_filter(
                 min_age=self.filters.age_range[0],
                 max_age=self.filters.age_range[1],
-                connection=self.user.connection,
+                connection=self.connection,
             )
             if update is True:
                 self.matches.raw.current = self.get_user_matches()  # Update data
 
     def apply_checkboxes_country_filter(self, update: bool = False, ):
         if self.filters.checkboxes['country']:
-            self.CRUD.apply_checkboxes_country_filter(connection=self.user.connection, )
+            self.CRUD.apply_checkboxes_country_filter(connection=self.connection, )
             if update is True:
                 self.matches.raw.current = self.get_user_matches()  # Update data
 
     def apply_checkboxes_city_filter(self, update: bool = False, ):
         if self.filters.checkboxes['city']:
-            self.CRUD.apply_checkboxes_city_filter(connection=self.user.connection, )
+            self.CRUD.apply_checkboxes_city_filter(connection=self.connection, )
             if update is True:
                 self.matches.raw.current = self.get_user_matches()  # Update data
 
     def apply_checkboxes_photo_filter(self, update: bool = False, ):
         if self.filters.checkboxes['photo']:
-            self.CRUD.apply_checkboxes_photo_filter(connection=self.user.connection, )
+            self.CRUD.apply_checkboxes_photo_filter(connection=self.connection, )
+            if update is True:
+                self.matches.raw.current = self.get_user_matches()  # Update data
+
+    def apply_checkboxes_nearby_filter(self, update: bool = False, ):
+        if (nearby_ids := self.get_nearby_ids()) is not None:
+            self.CRUD.apply_nearby_filter(nearby_ids=nearby_ids, connection=self.connection, )
             if update is True:
                 self.matches.raw.current = self.get_user_matches()  # Update data
 
+    def get_nearby_ids(self, ) -> list[int] | None:
+        """
+        Users in the radius around the user, None if the filter is disabled.
+        Only the users of the grid cells around are read, the distance is calculated only near the radius edge.
+        Nobody is nearby for the user without a geolocation.
+        """
+        if not self.filters.checkboxes['nearby']:
+            return None
+        location = self.CRUD.read_user_location(tg_user_id=self.user.tg_user_id, connection=self.connection, )
+        if location is None:
+            return []
+        cells = geo.get_cells(
+            latitude=location['latitude'],
+            longitude=location['longitude'],
+            radius_km=self.filters.radius,
+        )
+        return geo.select_nearby(
+            latitude=location['latitude'],
+            longitude=location['longitude'],
+            radius_km=self.filters.radius,
+            locations=self.CRUD.read_users_locations(cells=cells.inner + cells.edge, connection=self.connection, ),
+            inner_cells=cells.inner,
+        )
+
     def filter_matches(self, update: bool = False) -> None:
+        """
+        The filters are independent deletes, so they are sent by a single pipeline (if supported by the DB backend)
+        and committed once. The stages of the pipelined filters measure only the sending, the wait is "filters".
+        The nearby filter reads the locations first, so it's out of the pipeline.
+        """
         # TODO Set restriction if filters are the same
-        self.apply_goal_filter()
-        self.apply_gender_filter()
-        self.apply_age_filter()
-        self.apply_checkboxes_country_filter()
-        self.apply_checkboxes_city_filter()
-        self.apply_checkboxes_photo_filter()
+        with (
+            self.measure_stage(name='filters', ),
+            self.CRUD.db.transaction(connection=self.connection, ),
+            self.CRUD.db.pipeline(connection=self.connection, ),
+        ):
+            with self.measure_stage(name='goal_filter', ):
+                self.apply_goal_filter()
+            with self.measure_stage(name='gender_filter', ):
+                self.apply_gender_filter()
+            with self.measure_stage(name='age_filter', ):
+                self.apply_age_filter()
+            with self.measure_stage(name='country_filter', ):
+                self.apply_checkboxes_country_filter()
+            with self.measure_stage(name='city_filter', ):
+                self.apply_checkboxes_city_filter()
+            with self.measure_stage(name='photo_filter', ):
+                self.apply_checkboxes_photo_filter()
+        with self.measure_stage(name='nearby_filter', ):
+            self.apply_checkboxes_nearby_filter()
         if update is True:
             self.matches.raw.current = self.get_user_matches()  # Update data
 
     def set_matches_raw(self, ) -> None:
         self.matches.raw.new = self.get_user_matches(new=True, )
-        self.matches.raw.all = self.get_user_matches(new=False, )
-        # Convert 'new' to a dictionary for faster lookup
-        new_dict = {covote['id']: covote for covote in self.matches.raw.new}
-        # Replace duplicates with a references to new items
-        self.matches.raw.all = [new_dict.get(item['id'], item) for item in self.matches.raw.all]
+        # Duplicates are the references to the new items, the rest of the stream is converted by a single pass
+        self.matches.raw.all = self.get_user_matches(
+            new=False,
+            reuse={covote['id']: covote for covote in self.matches.raw.new},
+        )
         self.matches.raw.count_new = len(self.matches.raw.new)
         self.matches.raw.count_all = len(self.matches.raw.all)
 
+    def get_filtered_matches(self, votes_limit: int | None = None, ) -> list[app.structures.base.FilteredCovote]:
+        """
+        Disabled filter is passed as None (or False for the checkboxes).
+        votes_limit - scan the covoters only by the latest votes of the user, the engine covotes are ignored.
+        """
+        return self.CRUD.read_filtered_matches(
+            tg_user_id=self.user.tg_user_id,
+            goal=None if self.filters.goal == self.Filters.Goal.BOTH else self.filters.goal.value,
+            gender=None if self.filters.gender == self.Filters.Gender.BOTH else self.filters.gender.value,
+            age_range=None if self.filters.age_range == tuple(self.Filters.Age) else self.filters.age_range,
+            photo=bool(self.filters.checkboxes['photo']),
+            country=bool(self.filters.checkboxes['country']),
+            city=bool(self.filters.checkboxes['city']),
+            covotes=None if votes_limit else self.covotes,
+            top_matches_limit=(
+                self.TOP_MATCHES_LIMIT if self.mode == self.Mode.TOP_MATCHES and not votes_limit else None
+            ),
+            votes_limit=votes_limit,
+            nearby_ids=self.get_nearby_ids(),
+            connection=self.connection,
+        )
+
+    @classmethod
+    def get_users_count(cls, connection: pg_ext_connection, ) -> int:
+        """Count of the users for the IDF weights, cached for USERS_COUNT_TTL seconds"""
+        if cls.users_count is None or monotonic() - cls.users_count[1] > cls.USERS_COUNT_TTL:
+            cls.users_count = (cls.CRUD.read_users_count(connection=connection, ), monotonic(),)
+        return cls.users_count[0]
+
+    def get_scores(self, raw_matches: list[app.structures.base.Covote], ) -> np.ndarray:
+        """Similarity of the user with every match, the order is the same as of raw_matches"""
+        tg_user_ids = [raw_match['tg_user_id'] for raw_match in raw_matches]
+        if self.scoring == self.Scoring.IDF:
+            covotes_posts = self.CRUD.read_covotes_posts(
+                tg_user_id=self.user.tg_user_id,
+                tg_user_ids=tg_user_ids,
+                connection=self.connection,
+            )
+            indexes = {tg_user_id: i for i, tg_user_id in enumerate(tg_user_ids)}
+            return scoring_kernels.idf_weighted(
+                candidates_indexes=np.array([indexes[row['tg_user_id']] for row in covotes_posts], dtype=np.int64, ),
+                voters_counts=np.array([row['voters_count'] for row in covotes_posts], dtype=np.float64, ),
+                users_count=self.get_users_count(connection=self.connection, ) if covotes_posts else 0,
+                candidates_count=len(tg_user_ids),
+            )
+        votes_counts = {
+            row['tg_user_id']: row['votes_count']
+            for row in self.CRUD.read_users_votes_counts(tg_user_ids=tg_user_ids, connection=self.connection, )
+        }
+        common = [raw_match['count_common_interests'] for raw_match in raw_matches]
+        return self.SCORING_KERNELS[self.scoring](
+            common=np.array(common, dtype=np.float64, ),
+            user_votes_count=self.user_votes_count,
+            # A counter may lag behind the votes (not recounted yet), common count is the lower bound of the votes
+            candidates_votes_counts=np.array(
+                [max(votes_counts.get(tg_user_id, 0), count, ) for tg_user_id, count in zip(tg_user_ids, common, )],
+                dtype=np.float64,
+            ),
+        )
+
+    def rank_matches(self, raw_matches: list[app.structures.base.Covote], ) -> list[app.structures.base.Covote]:
+        """
+        Sort by the score ascending (get_match pops from the end), cut to TOP_K best.
+        Raw matches are already sorted by the common count.
+        """
+        if self.scoring == self.Scoring.COMMON_COUNT or not raw_matches:
+            return raw_matches[-self.TOP_K:] if self.TOP_K else raw_matches
+        scores = self.get_scores(raw_matches=raw_matches, )
+        tg_user_ids = np.array([raw_match['tg_user_id'] for raw_match in raw_matches], )
+        order = np.lexsort((tg_user_ids, scores,), )  # By score, then by tg_user_id, as SQL does
+        if self.TOP_K:
+            order = order[-self.TOP_K:]
+        return [raw_matches[i] for i in order.tolist()]
+
+    def get_cache_key(self, ) -> tuple:
+        """
+        Match type is not a part of the key because all the matches are cached (new are marked).
+        Covotes and locations of other users are not a part of the key, they are stale at most ttl seconds.
+        """
+        return (
+            self.user.tg_user_id,
+            self.mode,
+            self.filters.goal,
+            self.filters.gender,
+            tuple(self.filters.age_range),
+            bool(self.filters.checkboxes['photo']),
+            bool(self.filters.checkboxes['country']),
+            bool(self.filters.checkboxes['city']),
+            self.filters.radius if self.filters.checkboxes['nearby'] else None,
+            self.versions.get(key=self.user.tg_user_id, ),  # Votes and shown users, "is_new" depends on them
+        )
+
+    def set_filtered_matches_raw(self, ) -> None:
+        """The same result as "filter_matches" + "set_matches_raw" but by single query"""
+        cache_key = self.get_cache_key()
+        if (filtered_matches := self.search_cache.get_result(key=cache_key, )) is None:
+            filtered_matches = self.rank_matches(raw_matches=self.get_filtered_matches(), )
+            self.search_cache.set_result(key=cache_key, value=filtered_matches, )
+        self.matches.raw.all = filtered_matches
+        self.matches.raw.new = [covote for covote in self.matches.raw.all if covote['is_new']]
+        self.matches.raw.count_new = len(self.matches.raw.new)
+        self.matches.raw.count_all = len(self.matches.raw.all)
+
+    def set_partial_matches_raw(self, ) -> None:
+        """
+        The best matches among the covoters of the latest votes only, by single query in any mode.
+        Not cached cuz the full result may be found by the next search.
+        """
+        self.matches.is_partial = True
+        self.matches.raw.all = self.rank_matches(
+            raw_matches=self.get_filtered_matches(votes_limit=self.PARTIAL_VOTES_LIMIT, ),
+        )
+        self.matches.raw.new = [covote for covote in self.matches.raw.all if covote['is_new']]
+        self.matches.raw.count_new = len(self.matches.raw.new)
+        self.matches.raw.count_all = len(self.matches.raw.all)
+
+    def set_matches_counts(self, ) -> None:
+        """Instead of reading all the matches, they will be fetched by pages (see get_next_page)"""
+        counts = self.CRUD.read_matches_counts(tg_user_id=self.user.tg_user_id, connection=self.connection, )
+        self.matches.raw.all, self.matches.raw.new = [], []
+        self.matches.raw.count_all = min(counts['count_all'], self.TOP_K or counts['count_all'], )
+        self.matches.raw.count_new = min(counts['count_new'], self.TOP_K or counts['count_new'], )
+        self.reset_pages()
+
+    def reset_pages(self, ) -> None:
+        self.matches.keyset = None
+        self.matches.count_fetched = 0
+        self.matches.is_exhausted = False
+
+    def get_next_page(self, ) -> list[app.structures.base.Covote]:
+        """The best match of the page is the last (get_match pops from the end)"""
+        limit = self.PAGE_SIZE
+        if self.TOP_K is not None:
+            limit = min(limit, self.TOP_K - self.matches.count_fetched, )
+        if self.matches.is_exhausted or limit <= 0:
+            return []
+        page = self.CRUD.read_matches_page(
+            tg_user_id=self.user.tg_user_id,
+            new=self.filters.match_type == self.Filters.MatchType.NEW_MATCHES,
+            keyset=self.matches.keyset,
+            limit=limit,
+            connection=self.connection,
+        )
+        self.matches.is_exhausted = len(page) < limit
+        self.matches.count_fetched += len(page)
+        if page:
+            self.matches.keyset = page[-1]['count_common_interests'], page[-1]['tg_user_id']
+        return page[::-1]
+
     def set_current_matches(self, ) -> None:
-        if self.filters.match_type == self.Filters.MatchType.ALL_MATCHES:
+        if self.mode not in self.SINGLE_QUERY_MODES and not self.matches.is_partial:  # Fetched by pages on demand
+            self.matches.current = []
+            self.reset_pages()
+        elif self.filters.match_type == self.Filters.MatchType.ALL_MATCHES:
             self.matches.current = self.matches.all
         elif self.filters.match_type == self.Filters.MatchType.NEW_MATCHES:
             self.matches.current = self.matches.new
@@ -446,18 +1196,156 @@ def set_current_matches(self, ) -> None:
     def get_common_interests_perc(self, common_posts_count: int, ) -> int:
         return get_perc(num_1=common_posts_count, num_2=self.user_votes_count, )
 
-    def make_search(
+    @property
+    def connection(self, ) -> pg_ext_connection:
+        """The search session if it's open, the connection of the user (current unit of work) otherwise"""
+        return self.session or self.user.connection
+
+    def open_session(self, ) -> None:
+        """
+        Temporary tables of the search are read by pages on the next updates (other units of work),
+        so the matcher holds its own connection till the end of the search (close_session).
+        """
+        if self.session is None:
+            self.session = self.CRUD.db.connection_pool.getconn(
+                pinned=True,  # Held across the updates by design, not a leak
+                owner=f'search session {self.user.tg_user_id}',
+            )
+
+    def close_session(self, ) -> None:
+        """
+        Return the session to the pool, the temporary tables are discarded, the next search creates them again.
+        The background search uses the session, so it's waited for (it's limited by the search budget).
+        """
+        if self.search_job is not None:
+            futures_wait((self.search_job,), )
+        if self.session is not None:
+            session, self.session = self.session, None
+            self._is_unfiltered_matches_already_set = False
+            self.CRUD.db.connection_pool.putconn(connection=session, )
+
+    def cancel_search(self, ) -> None:
+        """
+        The user left the search (cancel, timeout, re-entry), the result of the background search is not shown.
+        Not every mode opens the session, so the cancellation is marked explicitly.
+        """
+        self.is_search_cancelled = True
+        self.close_session()
+
+    @contextmanager
+    def measure_search(self, ) -> Iterator[None]:
+        """
+        Stages of the search (see measure_stage) and the whole search are reported to the sink at the end.
+        Nested call is a part of the outer search.
+        """
+        if self.timings is not None:
+            yield
+            return
+        if self.mode not in self.SINGLE_QUERY_MODES:  # The temporary tables are filled on the session, count them
+            self.open_session()
+        with self.CRUD.track_statements(connection=self.connection, ) as counter:
+            self.timings = stages.SearchTimings(counter=counter, )
+            try:
+                yield
+            finally:
+                self.timings_sink.record(stages=self.timings.finish(), )
+                self.timings = None
+
+    @contextmanager
+    def measure_stage(self, name: str, ) -> Iterator[None]:
+        """Wall time, rows and DB round trips of the block, only inside measure_search"""
+        if self.timings is None:
+            yield
+            return
+        with self.timings.stage(name=name, ):
+            yield
+
+    def search(
             self,
             drop_old_votes: bool = False,
             drop_old_matches: bool = False,
     ) -> list[app.structures.base.Covote]:
-        """Matches base may return only raw obj final obj contain user attr"""
+        """The full search, without the time budget"""
         if self._is_unfiltered_matches_already_set is False:  # A bit dirty tmp solution
-            self.create_unfiltered_matches(drop_old_votes=drop_old_votes, drop_old_matches=drop_old_matches, )
+            with self.measure_stage(name='covotes', ):
+                self.create_unfiltered_matches(drop_old_votes=drop_old_votes, drop_old_matches=drop_old_matches, )
+        if self.mode in self.SINGLE_QUERY_MODES:
+            with self.measure_stage(name='matches', ):  # Covotes are counted by the same statement (or engine)
+                self.set_filtered_matches_raw()
+            return self.matches.raw.all
         self.filter_matches()
-        self.set_matches_raw()
+        with self.measure_stage(name='matches', ):
+            self.set_matches_counts()  # Matches will be fetched by pages
         return self.matches.raw.all
 
+    def make_search(
+            self,
+            drop_old_votes: bool = False,
+            drop_old_matches: bool = False,
+            budget_ms: int | None = None,
+    ) -> list[app.structures.base.Covote]:
+        """
+        Matches base may return only raw obj final obj contain user attr.
+        budget_ms - milliseconds for the whole search (SEARCH_BUDGET_MS by default, 0 - no limit).
+        Every statement is limited by the time left (see db.deadline).
+        If the full search is out of its part of the budget - the rest is spent on the partial search,
+        if it's out of the time too - the result is empty. Both are marked by "matches.is_partial".
+        """
+        budget_ms = self.SEARCH_BUDGET_MS if budget_ms is None else budget_ms
+        self.matches.is_partial = False
+        if self.mode not in self.SINGLE_QUERY_MODES:  # The deadline is set on the connection of the statements
+            self.open_session()
+        with self.measure_search():
+            if not budget_ms:
+                return self.search(drop_old_votes=drop_old_votes, drop_old_matches=drop_old_matches, )
+            start = monotonic()
+            try:
+                with self.CRUD.db.deadline(
+                        connection=self.connection,
+                        deadline=start + budget_ms * (1 - self.PARTIAL_BUDGET_SHARE) / 1000,
+                ):
+                    return self.search(drop_old_votes=drop_old_votes, drop_old_matches=drop_old_matches, )
+            except DeadlineExceeded:
+                self.matches.raw = self.MatchesRaw()
+            try:
+                with (
+                    self.CRUD.db.deadline(connection=self.connection, deadline=start + budget_ms / 1000, ),
+                    self.measure_stage(name='partial', ),
+                ):
+                    self.set_partial_matches_raw()
+            except DeadlineExceeded:
+                self.matches.is_partial = True
+                self.matches.raw = self.MatchesRaw()
+            return self.matches.raw.all
+
+    def submit_search(self, on_done: Callable[[Future], None] | None = None, ) -> Future:
+        """
+        make_search in the background, the matches are set to this matcher when the job is done.
+        The search of the user already in progress is not repeated (on_done is not added to it).
+        Raises SearchQueueFull if the executor is busy.
+        """
+        self.is_search_cancelled = False
+        self.search_job = self.search_executor.submit(
+            key=self.user.tg_user_id,
+            func=self.make_search_job,
+            on_done=on_done,
+        )
+        return self.search_job
+
+    def make_search_job(self, ) -> list[app.structures.base.Covote]:
+        """
+        make_search in the worker thread, the job is a separate unit of work (own connection).
+        The search only reads (temporary tables are written by the session), so no commit is needed.
+        """
+        with (
+            self.CRUD.db.borrow(owner=f'search job {self.user.tg_user_id}', ) as connection,
+            self.CRUD.db.transaction(connection=connection, read_only=True, ),
+        ):
+            return self.make_search()
+
+    def is_search_running(self, ) -> bool:
+        return self.search_job is not None and not self.search_job.done()
+
     def get_match(self, pop: bool = True, ) -> Match | None:
         if self.matches.current:
             if pop:
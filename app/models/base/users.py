@@ -336,8 +336,8 @@ def is_registered(self, value: bool, ) -> None:
 
     @property
     def connection(self, ) -> pg_ext_connection:
-        self._connection: pg_ext_connection = self._connection or self.CRUD.db.get_user_connection()
-        return self._connection
+        """Connection of the current unit of work (see Postgres.borrow), the passed one is used only outside it"""
+        return self.CRUD.db.get_user_connection(default=self._connection, )
 
     @connection.setter
     def connection(self, value: pg_ext_connection, ) -> None:
@@ -18,9 +18,11 @@
 from typing import TYPE_CHECKING, Type
 
 from app.models import base
+from app.models.base._matches.results import MatchesArray
 import app.structures.base
 
 if TYPE_CHECKING:
+    from psycopg2.extensions import connection as pg_ext_connection
     from app.models import MatchMapper, MatcherMapper
     import app.models.users
 
@@ -41,11 +43,24 @@ def set_matches(self, ):
         ...
 
     @abstractmethod
-    def convert_matches(self, raw_matches: list[app.structures.base.Covote], ) -> list[Match]:
+    def create_match(self, id_: int, tg_user_id: int, count_common_interests: int, ) -> Match:
         ...
 
     @abstractmethod
-    def make_search(self, drop_old_votes: bool = False, drop_old_matches: bool = False, ) -> list[Match]:
+    def convert_matches(self, raw_matches: list[app.structures.base.Covote], ) -> MatchesArray[Match]:
+        ...
+
+    @abstractmethod
+    def load_matches(self, matches: list[Match], connection: pg_ext_connection | None = None, ) -> None:
+        ...
+
+    @abstractmethod
+    def make_search(
+            self,
+            drop_old_votes: bool = False,
+            drop_old_matches: bool = False,
+            budget_ms: int | None = None,
+    ) -> list[Match]:
         ...
 
 
@@ -60,30 +75,63 @@ class Matcher(base.matches.Matcher, MatcherInterface, ):
     Mapper: Type[MatcherMapper]
 
     def set_matches(self, ):
+        """Raw matches are empty if they are fetched by pages, so counts are taken from raw"""
         self.matches.all = self.convert_matches(raw_matches=self.matches.raw.all, )
         new_matches_ids = set(raw_match['id'] for raw_match in self.matches.raw.new)
-        self.matches.new = [match for match in self.matches.all if match.id in new_matches_ids]
-        self.matches.count_new = len(self.matches.new)
-        self.matches.count_all = len(self.matches.all)
-
-    def convert_matches(self, raw_matches: list[app.structures.base.Covote], ) -> list[Match]:
-        result = []
-        for raw_match in raw_matches:
-            perc = self.get_common_interests_perc(common_posts_count=raw_match['count_common_interests'], )
-            user = self.Mapper.User(tg_user_id=raw_match['tg_user_id'], )
-            result.append(
-                self.Mapper.Match(
-                    id=raw_match['id'],
-                    owner=self.user,
-                    user=user,
-                    common_posts_count=raw_match['count_common_interests'],
-                    common_posts_perc=perc,
-                )
-            )
-        return result
-
-    def make_search(self, drop_old_votes: bool = False, drop_old_matches: bool = False, ) -> list[Match]:
-        # Will be executed only if tables not exists
-        super().make_search(drop_old_votes=drop_old_votes, drop_old_matches=drop_old_matches, )
-        self.set_matches()
+        self.matches.new = self.matches.all.select(ids=new_matches_ids, )
+        self.matches.count_new = self.matches.raw.count_new
+        self.matches.count_all = self.matches.raw.count_all
+
+    def create_match(self, id_: int, tg_user_id: int, count_common_interests: int, ) -> Match:
+        return self.Mapper.Match(
+            id=id_,
+            owner=self.user,
+            user=self.Mapper.User(tg_user_id=tg_user_id, ),
+            common_posts_count=count_common_interests,
+            common_posts_perc=self.get_common_interests_perc(common_posts_count=count_common_interests, ),
+        )
+
+    def convert_matches(self, raw_matches: list[app.structures.base.Covote], ) -> MatchesArray[Match]:
+        """Thousands of matches are kept as arrays, the Match objects are created on access (see MatchesArray)"""
+        return MatchesArray.from_raw(raw_matches=raw_matches, create_match=self.create_match, )
+
+    def load_matches(self, matches: list[Match], connection: pg_ext_connection | None = None, ) -> None:
+        """
+        Load profiles (with photos) of the matches users by a single query instead of 2 queries per match.
+        connection - of the current unit of work (the user connection) by default.
+        """
+        matches = [match for match in matches if not match.is_loaded]
+        if not matches:
+            return
+        users_rows = self.Mapper.User.CRUD.read_many(
+            tg_user_ids=[match.user.tg_user_id for match in matches],
+            connection=connection or self.user.connection,
+        )
+        users_rows = {user_row['tg_user_id']: user_row for user_row in users_rows}
+        for match in matches:
+            if user_row := users_rows.get(match.user.tg_user_id):
+                for key, value in user_row.items():
+                    if value is not None:
+                        setattr(match.user, key, value)
+                match.user.is_registered = True
+                match.is_loaded = True  # Not found one is left to the load on demand
+
+    def make_search(
+            self,
+            drop_old_votes: bool = False,
+            drop_old_matches: bool = False,
+            budget_ms: int | None = None,
+    ) -> list[Match]:
+        with self.measure_search():  # Conversion is a part of the search
+            # Will be executed only if tables not exists
+            super().make_search(drop_old_votes=drop_old_votes, drop_old_matches=drop_old_matches, budget_ms=budget_ms, )
+            with self.measure_stage(name='conversion', ):
+                self.set_matches()
         return self.matches.all
+
+    def get_match(self, pop: bool = True, ) -> Match | None:
+        if not self.matches.current and self.mode not in self.SINGLE_QUERY_MODES and not self.matches.is_partial:
+            self.matches.current = self.convert_matches(raw_matches=self.get_next_page(), )
+        if self.matches.current and not self.matches.current[-1].is_loaded:  # Load the next matches (from the end)
+            self.load_matches(matches=self.matches.current[-self.PAGE_SIZE:], )
+        return super().get_match(pop=pop, )
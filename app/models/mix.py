@@ -258,6 +258,10 @@ class Photo:
     def create(cls, user: UserInterface, photo: str) -> None:
         return cls.CRUD.create(tg_user_id=user.tg_user_id, photo=photo, connection=user.connection, )
 
+    @classmethod
+    def create_many(cls, user: UserInterface, photos: list[str], ) -> None:
+        return cls.CRUD.create_many(tg_user_id=user.tg_user_id, photos=photos, connection=user.connection, )
+
     @classmethod
     def read(cls, user: UserInterface, ) -> list[str]:
         result = cls.CRUD.read(tg_user_id=user.tg_user_id, connection=user.connection, )
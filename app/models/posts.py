@@ -99,6 +99,10 @@ def accept_vote_value(
     def handle_vote(self, handled_vote: PublicVoteInterface.HandledVote, ) -> bool:
         ...
 
+    @abstractmethod
+    def handle_votes(self, handled_votes: list[PublicVoteInterface.HandledVote], ) -> bool:
+        ...
+
     @abstractmethod
     def get_voted_users(self, connection: pg_ext_connection, ) -> list[UserInterface]:
         ...
@@ -206,6 +210,19 @@ def handle_vote(self, handled_vote: PublicVoteInterface.HandledVote, ) -> bool:
             return True
         return False
 
+    def handle_votes(self, handled_votes: list[PublicVoteInterface.HandledVote], ) -> bool:
+        """Many votes at once (see PublicVote.handle_many), the counters are saved once"""
+        is_any_accepted = False
+        for handled_vote in handled_votes:
+            if handled_vote.is_accepted and self.accept_vote_value(
+                    old_value=handled_vote.old_value,
+                    incoming_value=handled_vote.incoming_value,
+            ):
+                is_any_accepted = True
+        if is_any_accepted:
+            self.update_votes_count()
+        return is_any_accepted
+
     def get_voted_users(self, connection: pg_ext_connection, ) -> list[UserInterface]:
         voted_users = []
         users_ids = self.CRUD.read_voted_users_ids(post_id=self.post_id, connection=connection, )
@@ -231,6 +248,11 @@ def read(cls, post_id: int, connection: pg_ext_connection, ) -> PersonalPost | N
     def handle_vote(handled_vote: PersonalVoteInterface.HandledVote, ) -> bool:
         ...
 
+    @staticmethod
+    @abstractmethod
+    def handle_votes(handled_votes: list[PersonalVoteInterface.HandledVote], ) -> bool:
+        ...
+
 
 class PersonalPost(base.posts.PersonalPost, PostBase, PersonalPostInterface, ):
     Mapper: PersonalPostMapper
@@ -277,6 +299,10 @@ def read(
     def handle_vote(handled_vote: PersonalVoteInterface.HandledVote, ) -> bool:
         return True  # no checking or saving for now
 
+    @staticmethod
+    def handle_votes(handled_votes: list[PersonalVoteInterface.HandledVote], ) -> bool:
+        return True  # no checking or saving for now
+
 
 class VotedPublicPostInterface:
     """Public post that has a vote"""
@@ -15,6 +15,7 @@
 
 from __future__ import annotations
 from typing import TYPE_CHECKING
+from functools import partial
 from abc import ABC, abstractmethod
 
 from psycopg2.extensions import connection as pg_ext_connection
@@ -182,13 +183,17 @@ def set_vote(
             vote: PublicVoteInterface | PersonalVoteInterface,
             post: PublicPostInterface | PersonalPostInterface = None,
     ) -> bool:
-        handled_vote = vote.handle()  # Validate + save (any vote type)
-        if handled_vote.is_accepted is True:
-            post = post or vote.Mapper.Post.get_post_by_vote(vote=vote, )
-            if isinstance(post, self.Mapper.PublicPost) and isinstance(vote, self.Mapper.PublicVote):
-                self.matcher.is_user_has_votes = True
-            return post.handle_vote(handled_vote=handled_vote, )  # Only public post need to be handled
-        return False
+        with self.CRUD.db.transaction(connection=self.connection, ):  # The vote, the counters and the post at once
+            handled_vote = vote.handle()  # Validate + save (any vote type)
+            if handled_vote.is_accepted is True:
+                post = post or vote.Mapper.Post.get_post_by_vote(vote=vote, )
+                if isinstance(post, self.Mapper.PublicPost) and isinstance(vote, self.Mapper.PublicVote):
+                    self.CRUD.db.after_commit(  # The flag follows only the committed vote
+                        callback=partial(setattr, self.matcher, 'is_user_has_votes', True, ),
+                        connection=self.connection,
+                    )
+                return post.handle_vote(handled_vote=handled_vote, )  # Only public post need to be handled
+            return False
 
     def get_personal_votes(self, ) -> list[PersonalVoteInterface]:
         return self.Mapper.PersonalVote.get_user_votes(user=self, )
@@ -22,6 +22,7 @@
 from app.db import crud
 
 if TYPE_CHECKING:
+    from psycopg2.extensions import connection as pg_ext_connection
     from app.models import PublicVoteMapper, PersonalVoteMapper
     from app.models.users import UserInterface
     from app.models.posts import PublicPostInterface, PersonalPostInterface
@@ -61,6 +62,11 @@ def get_user_vote(
     def get_user_votes(cls, user: UserInterface, ) -> list[PublicVote]:
         ...
 
+    @classmethod
+    @abstractmethod
+    def handle_many(cls, votes: list[PublicVote], connection: pg_ext_connection, ) -> list[PublicVote.HandledVote]:
+        ...
+
 
 class PersonalVoteInterface(base.votes.PersonalVoteInterface, ABC, ):
 
@@ -95,6 +101,11 @@ def get_user_votes(cls, user: UserInterface) -> list[PersonalVote]:
     def handle(self, ) -> PersonalVote.HandledVote:
         ...
 
+    @classmethod
+    @abstractmethod
+    def handle_many(cls, votes: list[PersonalVote], connection: pg_ext_connection, ) -> list[PersonalVote.HandledVote]:
+        ...
+
     @classmethod
     @abstractmethod
     def get_user_vote(
@@ -188,7 +199,15 @@ def handle(self, ) -> HandledVote:
         old_vote = self.read_vote(user=self.user, post_id=self.post_id, )  # Only for checking
         if old_vote.is_accept_vote(new_vote=self, ) is True:
             self.value: base.votes.VoteBase.Value = self.Value(self.value + old_vote.value)
-            self.upsert_value()
+            with self.CRUD.db.pipeline(connection=self.user.connection, ):  # Independent writes, single round trip
+                self.upsert_value()
+                self.Mapper.Matcher.handle_vote(  # The engine and the cache follow only the committed result
+                    tg_user_id=self.user.tg_user_id,
+                    post_id=self.post_id,
+                    old_value=old_vote.value,
+                    new_value=self.value,
+                    connection=self.user.connection,
+                )
             is_accepted = True
         return self.HandledVote(
             new_value=self.value,
@@ -197,6 +216,55 @@ def handle(self, ) -> HandledVote:
             is_accepted=is_accepted
         )
 
+    @classmethod
+    def handle_many(cls, votes: list[PublicVote], connection: pg_ext_connection, ) -> list[HandledVote]:
+        """
+        Handle the votes of the different users for the same post (the bots votes) as handle does,
+        but the old votes are read, the accepted ones are saved and their side effects are applied
+        by a single statement each (see Matcher.handle_votes).
+        """
+        if not votes:
+            return []
+        post_id = votes[0].post_id
+        vote_rows = cls.CRUD.read_users_votes(
+            post_id=post_id,
+            tg_user_ids=[vote.user.tg_user_id for vote in votes],
+            connection=connection,
+        )
+        old_values = {vote_row['tg_user_id']: cls.Value(vote_row['value']) for vote_row in vote_rows}
+        result, accepted = [], []
+        for vote in votes:
+            old_vote = cls(
+                user=vote.user,
+                post_id=post_id,
+                message_id=None,
+                value=old_values.get(vote.user.tg_user_id, cls.Value.NONE, ),
+            )
+            handled_vote = cls.HandledVote(
+                new_value=vote.value,
+                old_value=old_vote.value,
+                incoming_value=vote.value,
+                is_accepted=old_vote.is_accept_vote(new_vote=vote, ) is True,
+            )
+            if handled_vote.is_accepted:
+                vote.value = handled_vote.new_value = cls.Value(vote.value + old_vote.value)
+                accepted.append(vote)
+            result.append(handled_vote)
+        with cls.CRUD.db.pipeline(connection=connection, ):  # Independent writes, single round trip
+            cls.CRUD.upsert_values(
+                rows=[(vote.user.tg_user_id, post_id, vote.message_id, vote.value.value,) for vote in accepted],
+                connection=connection,
+            )
+            cls.Mapper.Matcher.handle_votes(
+                post_id=post_id,
+                votes=[
+                    (vote.user.tg_user_id, handled_vote.old_value, handled_vote.new_value,)
+                    for vote, handled_vote in zip(votes, result, ) if handled_vote.is_accepted
+                ],
+                connection=connection,
+            )
+        return result
+
     @classmethod
     def get_user_vote(
             cls,
@@ -267,6 +335,37 @@ def handle(self, ) -> PersonalVote.HandledVote:
             return self.HandledVote(new_vote=self, old_vote=old_vote, is_accepted=True, )
         return self.HandledVote(new_vote=self, old_vote=old_vote, is_accepted=False, )
 
+    @classmethod
+    def handle_many(cls, votes: list[PersonalVote], connection: pg_ext_connection, ) -> list[HandledVote]:
+        """Handle the votes of the different users for the same post as handle does, single statement each"""
+        if not votes:
+            return []
+        post_id = votes[0].post_id
+        vote_rows = cls.CRUD.read_users_votes(
+            post_id=post_id,
+            tg_user_ids=[vote.user.tg_user_id for vote in votes],
+            connection=connection,
+        )
+        old_values = {vote_row['tg_user_id']: cls.Value(vote_row['value']) for vote_row in vote_rows}
+        result = []
+        for vote in votes:
+            old_vote = cls(
+                user=vote.user,
+                post_id=post_id,
+                message_id=None,
+                value=old_values.get(vote.user.tg_user_id, cls.Value.ZERO, ),
+            )
+            is_accepted = old_vote.is_accept_vote(new_vote=vote, ) is True
+            result.append(cls.HandledVote(new_vote=vote, old_vote=old_vote, is_accepted=is_accepted, ))
+        cls.CRUD.upsert_many(
+            rows=[
+                (vote.user.tg_user_id, post_id, vote.message_id, vote.value.value,)
+                for vote, handled_vote in zip(votes, result, ) if handled_vote.is_accepted
+            ],
+            connection=connection,
+        )
+        return result
+
     @classmethod
     def get_user_vote(
             cls,
@@ -0,0 +1,55 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Precompute the top matches of every voter to precomputed_matches table (digests, caches warming).
+Usage:
+    python -m app.precompute --processes 4
+    Add "--no-refresh" to use the existing votes snapshot instead of writing a fresh one.
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from app.db import manager as db_manager
+import app.models.matches
+
+if TYPE_CHECKING:
+    from app.models.base._matches.precompute import PrecomputeStats
+
+
+def main():
+    parser = ArgumentParser(description=__doc__, )
+    parser.add_argument('--processes', type=int, default=None, help='Pool size, CPUs count by default', )
+    parser.add_argument('--no-refresh', action='store_true', help='Use the existing votes snapshot', )
+    args = parser.parse_args()
+    start = perf_counter()
+
+    def print_progress(stats: PrecomputeStats, total: int, ):
+        print(f'\r{stats["users"]}/{total} users, {stats["matches"]} matches, {perf_counter() - start:.1f}s', end='', )
+
+    stats = app.models.matches.Matcher.precompute_matches(
+        connection=db_manager.Postgres.connection,
+        processes=args.processes,
+        refresh_snapshot=not args.no_refresh,
+        on_progress=print_progress,
+    )
+    print(f'\nDone: {stats["users"]} users, {stats["matches"]} matches in {perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
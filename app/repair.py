@@ -0,0 +1,47 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Recount the materialized tables from the votes, heavy, run it after the votes were changed bypassing the app
+or after switching to the mode that requires the table. The tables are kept in sync by the votes otherwise.
+Usage:
+    python -m app.repair --top-matches --votes-counts
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from time import perf_counter
+
+from app.db import manager as db_manager
+import app.models.matches
+
+
+def main():
+    parser = ArgumentParser(description=__doc__, )
+    parser.add_argument('--top-matches', action='store_true', help='Recount the top matches table', )
+    parser.add_argument('--votes-counts', action='store_true', help='Recount the votes counters table', )
+    args = parser.parse_args()
+    if args.top_matches:
+        start = perf_counter()
+        app.models.matches.Matcher.rebuild_top_matches(connection=db_manager.Postgres.connection, )
+        print(f'Top matches are recounted in {perf_counter() - start:.1f}s')
+    if args.votes_counts:
+        start = perf_counter()
+        app.models.matches.Matcher.rebuild_votes_counts(connection=db_manager.Postgres.connection, )
+        print(f'Votes counters are recounted in {perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
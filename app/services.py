@@ -27,8 +27,10 @@
 import app.db.crud.mix
 import app.models.users
 import app.models.collections
+import app.forms.user
 
 if TYPE_CHECKING:
+    from typing import Iterator
     from psycopg2.extensions import connection as pg_ext_connection
     from app.models.posts import (
         PublicPostInterface as PublicPostModelInterface,
@@ -98,6 +100,7 @@ class Mapper(ABC):
     CRUD: app.db.crud.mix.System
     connection: pg_ext_connection
     user: app.models.users.User
+    USERS_IDS_PAGE_SIZE: int
 
     @classmethod
     @abstractmethod
@@ -125,19 +128,21 @@ def read_bots_ids(cls, ) -> list[int]:
 
     @classmethod
     @abstractmethod
-    def read_all_users_ids(cls, ) -> list[int]:
+    def read_all_users_ids(cls, ) -> Iterator[int]:
         ...
 
 
 class System(SystemInterface, ):
     class Mapper:
         User = app.models.users.User
+        NewUser = app.forms.user.NewUser
         PublicPost = PublicPostModel
 
     CRUD: Type[app.db.crud.mix.System] = app.db.crud.mix.System
     user = Mapper.User(tg_user_id=app.config.BOT_ID, is_registered=True, )
     connection = user.connection
     generator = generator
+    USERS_IDS_PAGE_SIZE = 1000  # See read_all_users_ids
     PublicPostService = PublicPost
 
     @classmethod
@@ -146,10 +151,16 @@ def set_bots_votes_to_post(
             post: PublicPostModelInterface | PersonalPostModelInterface,
             bots_ids: list[int] | None = None,
     ) -> None:
-        for user_id in bots_ids or cls.CRUD.read_bots_ids(connection=cls.connection, ):
+        """The votes are handled at once (see handle_many), the post counters are saved once"""
+        votes = []
+        # Read before the bots creation, the stream is closed by the statements of its connection
+        for user_id in bots_ids or list(cls.CRUD.read_bots_ids(connection=cls.connection, )):
             bot = cls.Mapper.User(tg_user_id=user_id, connection=cls.connection, )
-            vote = cls.generator.gen_vote(user=bot, post=post, )
-            bot.set_vote(vote=vote, post=post, )
+            votes.append(cls.generator.gen_vote(user=bot, post=post, ))
+        connection = cls.CRUD.db.get_user_connection(default=cls.connection, )  # The same as the bots use
+        with cls.CRUD.db.transaction(connection=connection, ):
+            handled_votes = post.Mapper.Vote.handle_many(votes=votes, connection=connection, )
+            post.handle_votes(handled_votes=handled_votes, )
 
     @classmethod
     def set_bots_votes_to_posts(
@@ -157,7 +168,7 @@ def set_bots_votes_to_posts(
             posts: list[PublicPostModelInterface | PersonalPostModelInterface],
             bots_ids: list[int] = None,
     ) -> None:
-        bots_ids = bots_ids or cls.CRUD.read_bots_ids(connection=cls.connection, )
+        bots_ids = bots_ids or list(cls.CRUD.read_bots_ids(connection=cls.connection, ))
         for post in posts:
             cls.set_bots_votes_to_post(post=post, bots_ids=bots_ids, )
 
@@ -168,22 +179,36 @@ def gen_bot(cls, bot_id: int, ) -> None:
 
     @classmethod
     def gen_bots(cls, bots_ids: list[int], gen_votes: bool = True, ) -> None:
+        """The bots are created at once (see NewUser.create_many)"""
+        new_users = [cls.generator.gen_new_user(tg_user_id=bot_id, ) for bot_id in bots_ids]
+        cls.Mapper.NewUser.create_many(
+            new_users=new_users,
+            connection=cls.CRUD.db.get_user_connection(default=cls.connection, ),
+        )
         if gen_votes:
             posts = cls.PublicPostService.get_public_posts(connection=cls.connection, )
             for post in posts:
                 cls.set_bots_votes_to_post(post=post, bots_ids=bots_ids, )
-        for bot_id in bots_ids:
-            cls.gen_bot(bot_id=bot_id, )
 
     @classmethod
     def read_bots_ids(cls, ) -> list[int]:
-        bots_ids = cls.CRUD.read_bots_ids(connection=cls.connection, )
+        bots_ids = list(cls.CRUD.read_bots_ids(connection=cls.connection, ))
         return bots_ids
 
     @classmethod
-    def read_all_users_ids(cls, ) -> list[int]:
-        all_users_ids = cls.CRUD.read_all_users_ids(connection=cls.connection, )
-        return all_users_ids
+    def read_all_users_ids(cls, ) -> Iterator[int]:
+        """
+        Read by the keyset pages, every page is a separate short read,
+        so no transaction is held while the caller iterates (the broadcast makes a telegram request per user).
+        """
+        after_tg_user_id = None
+        while users_ids := cls.CRUD.read_users_ids_page(
+                after_tg_user_id=after_tg_user_id,
+                limit=cls.USERS_IDS_PAGE_SIZE,
+                connection=cls.connection,
+        ):
+            yield from users_ids
+            after_tg_user_id = users_ids[-1]
 
 
 class CollectionInterface(ABC, ):
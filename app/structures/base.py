@@ -96,6 +96,12 @@ class PublicVoteDB(TypedDict):
     value: int | None
 
 
+class PublicVoteValue(TypedDict):  # Without message_id
+    tg_user_id: int
+    post_id: int
+    value: int
+
+
 class UserPublicVote(TypedDict):
     post_id: int
     value: int
@@ -145,6 +151,43 @@ class Covote(TypedDict):
     count_common_interests: int
 
 
+class FilteredCovote(Covote):
+    is_new: bool  # Not shown to the searcher yet
+
+
+class MatchesCounts(TypedDict):
+    count_all: int
+    count_new: int
+
+
+class StatementsCounter(TypedDict):
+    """DB statements of the connection, see db.track"""
+    round_trips: int
+    rows: int  # Affected or fetched
+
+
+class UserLocation(TypedDict):
+    tg_user_id: int
+    latitude: float
+    longitude: float
+    geo_cell: int
+
+
+class UserVotesCount(TypedDict):
+    tg_user_id: int
+    votes_count: int
+
+
+class CovotePost(TypedDict):
+    tg_user_id: int
+    voters_count: int  # Of the post
+
+
+class VotesStats(TypedDict):
+    votes_count: int
+    has_covotes: bool
+
+
 class ShownUserDB(TypedDict):
     tg_user_id: int
     shown_id: int
@@ -146,7 +146,7 @@ def from_user(cls, user: app.models.users.User, ) -> User:
         """init with "vars" can't be used because of properties (_connection, etc.) are unexpected args"""
         ptb_user = cls(
             tg_user_id=user.tg_user_id,
-            connection=user.connection,
+            connection=user._connection,
             photos=user.photos,
             fullname=user.fullname,
             goal=user.goal,
@@ -15,12 +15,19 @@
 
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import TYPE_CHECKING, Type
 
+from app.config import MATCHES_PREFETCH, MATCHES_PREFETCH_WORKERS
 from app.models import mix
 import app.models.matches  # Models layer is cuz tg matches not exists
+import app.tg.ptb.config
 
 if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from psycopg2.extensions import connection as pg_ext_connection
+    # noinspection PyPackageRequirements
+    from telegram import InputMediaPhoto as tg_InputMediaPhoto
     from app.tg import ptb
     from app.tg.ptb.classes.users import UserInterface
 
@@ -28,6 +35,10 @@
 class MatchInterface(app.models.matches.MatchInterface, ABC, ):
     Mapper: Type[ptb.classes.MatchMapper]
 
+    @abstractmethod
+    def prepare(self) -> None:
+        ...
+
     @abstractmethod
     def show(self) -> None:
         ...
@@ -35,24 +46,92 @@ def show(self) -> None:
 
 class Match(app.models.matches.Match, MatchInterface, ):
     Mapper: Type[ptb.classes.MatchMapper]
+    media: list[tg_InputMediaPhoto] | None = None  # Prepared in advance, see Matcher.prefetch_matches
+
+    def prepare(self, ) -> None:
+        self.media = self.user.profile.prepare_to_send()
 
     def show(self, ) -> None:
-        self.user.profile.send(self.owner.tg_user_id, )
+        self.user.profile.send(self.owner.tg_user_id, media=self.media, )
         self.create()  # Save shown match to db
 
 
 class MatcherInterface(app.models.matches.MatcherInterface, ABC, ):
     Mapper: Type[ptb.classes.MatcherMapper]
+    PREFETCH_COUNT: int
+    prefetch_executor: ThreadPoolExecutor
+    prefetch_job: Future | None
+
+    @abstractmethod
+    def prefetch_matches(self, matches: list[Match], ) -> None:
+        ...
+
+    @abstractmethod
+    def submit_prefetch(self, ) -> None:
+        ...
+
+    @abstractmethod
+    def wait_prefetch(self, ) -> None:
+        ...
 
 
 class Matcher(app.models.matches.Matcher, MatcherInterface, ):
-    Mapper: Type[ptb.classes.MatcherMapper]
+    """
+    The next matches are loaded and prepared to send in the background while the user looks at the current one,
+    so showing the next match requires only the telegram request.
+    The prefetch is a separate unit of work (own connection borrowed from the pool),
+    the next get_match waits for the prefetch to not read the matches while they are being loaded.
+    """
 
-    def convert_matches(self, raw_matches: list[app.structures.base.Covote], ) -> list[Match]:
-        matches = super().convert_matches(raw_matches=raw_matches, )
+    Mapper: Type[ptb.classes.MatcherMapper]
+    PREFETCH_COUNT = MATCHES_PREFETCH
+    # Shared by all the instances
+    prefetch_executor = ThreadPoolExecutor(max_workers=MATCHES_PREFETCH_WORKERS, thread_name_prefix='prefetch', )
+    prefetch_job: Future | None = None
+
+    def create_match(self, id_: int, tg_user_id: int, count_common_interests: int, ) -> Match:
+        match = super().create_match(id_=id_, tg_user_id=tg_user_id, count_common_interests=count_common_interests, )
+        match.user.profile.is_loaded = False  # Quickfix
+        return match
+
+    def load_matches(self, matches: list[Match], connection: pg_ext_connection | None = None, ) -> None:
+        """Profiles are loaded by batch, no need to load them on show"""
+        super().load_matches(matches=matches, connection=connection, )
         for match in matches:
-            match.user.profile.is_loaded = False  # Quickfix
-        return matches
+            if match.is_loaded:
+                match.user.profile.is_loaded = True
+
+    def prefetch_matches(self, matches: list[Match], ) -> None:
+        """
+        matches - from the end (get_match pops from the end), the whole batch is loaded as get_match does.
+        The prefetch thread is outside the unit of work of the update, so it borrows its own connection.
+        """
+        with self.CRUD.db.borrow(owner=f'prefetch {self.user.tg_user_id}', ) as connection:
+            self.load_matches(matches=matches, connection=connection, )
+            for match in matches[-self.PREFETCH_COUNT:]:
+                if match.media is None:
+                    match.prepare()  # Reads (if any) are on the borrowed connection too
+
+    def submit_prefetch(self, ) -> None:
+        if self.PREFETCH_COUNT and self.matches.current:
+            self.prefetch_job = self.prefetch_executor.submit(
+                self.prefetch_matches,
+                matches=self.matches.current[-self.PAGE_SIZE:],  # Copy, the current matches are changed by pop
+            )
+
+    def wait_prefetch(self, ) -> None:
+        """A failed prefetch is not critical, the matches will be loaded on demand"""
+        if self.prefetch_job is not None:
+            if (e := self.prefetch_job.exception()) is not None:
+                app.tg.ptb.config.Config.logger.error(e)
+            self.prefetch_job = None
+
+    def get_match(self, pop: bool = True, ) -> Match | None:
+        self.wait_prefetch()
+        match = super().get_match(pop=pop, )
+        if pop:
+            self.submit_prefetch()
+        return match
 
 
 class MatchStatsProtocol(mix.MatchStatsProtocol, ABC, ):
@@ -44,7 +44,11 @@ def prepare_photos_to_send(self, caption: str, ) -> list[tg_InputMediaPhoto]:
         ...
 
     @abstractmethod
-    def send(self, show_to_tg_user_id: int = None, ) -> MessageId:
+    def prepare_to_send(self, ) -> list[tg_InputMediaPhoto]:
+        ...
+
+    @abstractmethod
+    def send(self, show_to_tg_user_id: int = None, media: list[tg_InputMediaPhoto] | None = None, ) -> MessageId:
         ...
 
 
@@ -60,11 +64,15 @@ def prepare_photos_to_send(self, caption: str, ) -> list[tg_InputMediaPhoto]:
         photos_to_send[0].caption = caption  # Only first photo need a caption
         return photos_to_send
 
-    def send(self, show_to_tg_user_id: int = None, ) -> MessageId:
-        show_to_tg_user_id = show_to_tg_user_id or self.user.tg_user_id
+    def prepare_to_send(self, ) -> list[tg_InputMediaPhoto]:
         profile_data = self.get_data()  # Quickfix
-        photos_to_send = self.prepare_photos_to_send(caption=profile_data.text, )
-        return app.tg.ptb.config.Config.bot.send_media_group(chat_id=show_to_tg_user_id, media=photos_to_send, )
+        return self.prepare_photos_to_send(caption=profile_data.text, )
+
+    def send(self, show_to_tg_user_id: int = None, media: list[tg_InputMediaPhoto] | None = None, ) -> MessageId:
+        """media - already prepared (see prepare_to_send)"""
+        show_to_tg_user_id = show_to_tg_user_id or self.user.tg_user_id
+        media = media or self.prepare_to_send()
+        return app.tg.ptb.config.Config.bot.send_media_group(chat_id=show_to_tg_user_id, media=media, )
 
 
 class UserInterface(app.tg.classes.users.UserInterface, ABC, ):
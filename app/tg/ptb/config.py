@@ -82,6 +82,7 @@ class Config:
 GET_MY_PERSONAL_POSTS_COLLECTIONS_S = 'get_my_personal_posts_collections'
 GEN_BOTS_S = 'gen_bots'
 GEN_ME_S = 'gen_me'
+SEARCH_STAGES_S = 'search_stages'
 ALL_BOT_COMMANDS_S = 'all_commands'
 FAQ_S = 'faq'
 
@@ -125,6 +126,7 @@ class Config:
 GET_STATISTIC_WITH_COMMAND = f'/{GET_STATISTIC_WITH_S}'
 GEN_BOTS_COMMAND = f'/{GEN_BOTS_S}'
 GEN_ME_COMMAND = f'/{GEN_ME_S}'
+SEARCH_STAGES_COMMAND = f'/{SEARCH_STAGES_S}'
 GET_BOT_ALL_COMMANDS_COMMAND = f'/{GET_BOT_ALL_COMMANDS_S}'
 PERSONAL_SCENARIO_COMMAND = f'/{PERSONAL_SCENARIO_S}'
 GLOBAL_SCENARIO_COMMAND = f'/{GLOBAL_SCENARIO_S}'
@@ -130,6 +130,7 @@ def handle_location_geo(self, location: tg_Location) -> None:
             self.country = str_location[-1].strip()
         except IndexError:
             raise app.exceptions.BadLocation(location)
+        self.latitude, self.longitude = location.latitude, location.longitude
 
     def handle_photo_tg_object(self, photo: list[PhotoSize], media_group_id: str | None, ) -> str | None:
         """
@@ -222,4 +223,8 @@ def get_checkboxes_keyboard(self, ) -> tg_IKM:
             text=f"{checkboxes_emojis['photo']} {app.tg.ptb.constants.Search.Checkboxes.PHOTO_SPECIFIED}",
             callback_data=f"{app.tg.ptb.config.CHECKBOX_CBK_S} photo",
         )
-        return tg_IKM([[btn_2, btn_3], [btn_4, btn_5]])
+        btn_6 = tg_IKB(
+            text=f"{checkboxes_emojis['nearby']} {app.tg.ptb.constants.Search.Checkboxes.NEARBY}",
+            callback_data=f"{app.tg.ptb.config.CHECKBOX_CBK_S} nearby",
+        )
+        return tg_IKM([[btn_2, btn_3], [btn_4, btn_5], [btn_6]])
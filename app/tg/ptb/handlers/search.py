@@ -14,16 +14,21 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Callable
+from functools import partial, wraps as functools_wraps
 
 # noinspection PyPackageRequirements
 from telegram import Update
+# noinspection PyPackageRequirements
+from telegram.ext.utils.promise import Promise
 
 import app.constants
 import app.exceptions
 
 import app.tg.ptb.utils
 import app.tg.ptb.forms.user
+import app.tg.ptb.config
+import app.tg.ptb.handlers.mix
 
 if TYPE_CHECKING:
     from custom_ptb.callback_context import CustomCallbackContext as CallbackContext
@@ -31,20 +36,44 @@
 COMPLETE_KEYWORD = app.constants.Shared.Words.COMPLETE
 
 
+def closing_session_on_error(handler: Callable[..., int | None], ) -> Callable[..., int | None]:
+    """The search session (pooled connection) of the failed handler is returned, the error is reraised to be logged"""
+    @functools_wraps(handler)
+    def wrapper(*args, **kwargs, ) -> int | None:
+        try:
+            return handler(*args, **kwargs, )
+        except Exception:
+            context = kwargs['context'] if 'context' in kwargs else args[1]
+            context.user_data.current_user.matcher.close_session()
+            raise
+
+    return wrapper
+
+
 def entry_point(_, context):
+    context.user_data.current_user.matcher.cancel_search()  # Re-entry, the previous search is abandoned
     context.user_data.view.search.say_search_hello()
     return 0
 
 
+def cancel(update: Update, context: CallbackContext, ):
+    """Cancel and the conversation timeout"""
+    context.user_data.current_user.matcher.cancel_search()
+    return app.tg.ptb.handlers.mix.cancel(_=update, context=context, )
+
+
+@closing_session_on_error
 def entry_point_handler(update: Update, context: CallbackContext):
     try:
         context.user_data.forms.target = app.tg.ptb.forms.user.Target(user=context.user_data.current_user, )
         context.user_data.forms.target.handle_start_search(text=update.effective_message.text, )
     except app.exceptions.NoVotes:  # Use directly context.user_data.current_user.matcher.is_user_has_votes?
         context.user_data.view.search.no_votes()
+        context.user_data.current_user.matcher.close_session()
         return app.tg.ptb.utils.end_conversation()
     except app.exceptions.NoCovotes:  # Use directly context.user_data.current_user.matcher.is_user_has_covotes?
         context.user_data.view.search.no_covotes()
+        context.user_data.current_user.matcher.close_session()
         return app.tg.ptb.utils.end_conversation()
     context.user_data.view.search.ask_target_goal()
     return 1
@@ -81,16 +110,56 @@ def age_handler(update: Update, context: CallbackContext):
     return 4
 
 
-def checkboxes_handler(_: Update, context: CallbackContext):
-    context.user_data.current_user.matcher.make_search()
-    if context.user_data.current_user.matcher.matches.all:  # If user has matches
+def show_search_result(context: CallbackContext, ) -> int:
+    if context.user_data.current_user.matcher.matches.is_partial:  # The search is out of the time
+        context.user_data.view.search.partial_matches()
+    if context.user_data.current_user.matcher.matches.count_all:  # If user has matches
         context.user_data.view.search.ask_which_matches_show(matches=context.user_data.current_user.matcher.matches, )
     else:
         context.user_data.view.search.no_matches_with_filters()
+        context.user_data.current_user.matcher.close_session()
         return app.tg.ptb.utils.end_conversation()
     return 5
 
 
+def search_job_callback(context: CallbackContext, ) -> int:
+    """
+    Called by the search executor thread when the background search is done.
+    The result is the next state of the conversation (the promise returned by checkboxes_handler).
+    """
+    matcher = context.user_data.current_user.matcher
+    if matcher.is_search_cancelled:  # Cancelled during the search
+        return app.tg.ptb.utils.end_conversation()
+    try:
+        if (error := matcher.search_job.exception()) is not None:
+            raise error
+        return show_search_result(context=context, )
+    except Exception as e:  # No one to reraise to, the conversation can't stay in the waiting state
+        app.tg.ptb.config.Config.logger.error(e)
+        matcher.close_session()
+        return app.tg.ptb.utils.end_conversation()
+
+
+@closing_session_on_error
+def checkboxes_handler(_: Update, context: CallbackContext):
+    if context.user_data.current_user.matcher.SEARCH_JOBS:
+        context.user_data.view.search.searching()
+        try:
+            promise = Promise(pooled_function=search_job_callback, args=(), kwargs={'context': context, }, )
+            context.user_data.current_user.matcher.submit_search(on_done=lambda _: promise.run(), )
+            return promise  # The conversation waits for the search, the next state is the result of the callback
+        except app.exceptions.SearchQueueFull:
+            pass  # Search right here as without the jobs
+    context.user_data.current_user.matcher.make_search()
+    return show_search_result(context=context, )
+
+
+def searching_handler(_: Update, context: CallbackContext):
+    """The conversation is waiting for the background search"""
+    context.user_data.view.search.still_searching()
+
+
+@closing_session_on_error
 def match_type_handler(update: Update, context: CallbackContext):
     try:
         context.user_data.forms.target.handle_show_option(text=update.effective_message.text, )
@@ -102,10 +171,12 @@ def match_type_handler(update: Update, context: CallbackContext):
         match.show()
     else:
         context.user_data.view.search.no_more_matches()
+        context.user_data.current_user.matcher.close_session()
         return app.tg.ptb.utils.end_conversation()
     return 6
 
 
+@closing_session_on_error
 def show_match_handler(update: Update, context: CallbackContext):
     message_text = update.effective_message.text.lower().strip()
     if message_text == app.constants.Search.Buttons.SHOW_MORE.lower():
@@ -115,15 +186,22 @@ def show_match_handler(update: Update, context: CallbackContext):
             return
         else:
             context.user_data.view.search.no_more_matches()
+            context.user_data.current_user.matcher.close_session()
             return app.tg.ptb.utils.end_conversation()
     elif message_text == COMPLETE_KEYWORD.lower():
         context.user_data.view.search.say_search_goodbye()
+        context.user_data.current_user.matcher.close_session()
         return app.tg.ptb.utils.end_conversation()
     else:
         context.user_data.view.search.warn.incorrect_show_more_option()
         return
 
 
+def search_stages_handler_cmd(_: Update, context: CallbackContext, ):
+    """p50/p95/p99 of the every search stage of the recent searches (the process-wide sink)"""
+    context.user_data.view.search.search_stages(report=context.user_data.current_user.matcher.timings_sink.report(), )
+
+
 def checkbox_cbk_handler(update: Update, context: CallbackContext) -> None:
     _, button_name = update.callback_query.data.split()
     context.user_data.forms.target.filters.checkboxes[button_name] ^= 1  # Swap between 1 and 0
@@ -312,6 +312,14 @@ def create_checkboxes_handler():
         )
         return checkboxes_handler
 
+    @staticmethod
+    def create_searching_handler():
+        searching_handler = MessageHandler(
+            filters=Filters.text,
+            callback=ptb_handlers.search.searching_handler,
+        )
+        return searching_handler
+
     @staticmethod
     def create_confirm_handler():
         confirm_handler = MessageHandler(
@@ -328,6 +336,14 @@ def create_show_match_handler():
         )
         return show_match_handler
 
+    @staticmethod
+    def create_cancel():
+        cancel = MessageHandler(
+            filters=Filters.regex(constants.Regexp.CANCEL_R),
+            callback=ptb_handlers.search.cancel,  # Closes the search session
+        )
+        return cancel
+
     entry_point = create_entry_point()
     cancel = create_cancel()
     entry_point_handler = create_entry_point_handler()
@@ -336,6 +352,7 @@ def create_show_match_handler():
     age_handler = create_age_handler()
     checkbox_cbk_handler = create_checkbox_cbk_handler()
     checkboxes_handler = create_checkboxes_handler()
+    searching_handler = create_searching_handler()
     confirm_handler = create_confirm_handler()
     show_match_handler = create_show_match_handler()
     CH: ConversationHandler = None
@@ -353,6 +370,7 @@ def create_ch(cls, set_ch: bool = True, ) -> ConversationHandler:
                 4: [cls.checkbox_cbk_handler, cls.checkboxes_handler, ],
                 5: [cls.confirm_handler, ],
                 6: [cls.show_match_handler, ],
+                ConversationHandler.WAITING: [cls.cancel, cls.searching_handler, ],  # Prefallbacks are not checked
                 ConversationHandler.TIMEOUT: [TypeHandler(type=Update, callback=cls.cancel.callback, )]  # See 1
             },
             fallbacks=[],
@@ -755,6 +773,15 @@ def create_gen_me_handler_cmd() -> CommandHandler:
     return result
 
 
+def create_search_stages_handler_cmd() -> CommandHandler:
+    result = CommandHandler(
+        command=config.SEARCH_STAGES_S,
+        callback=ptb_handlers.search.search_stages_handler_cmd,
+        filters=Filters.user(ADMINS),
+    )
+    return result
+
+
 def create_get_my_collections_handler_cmd() -> CommandHandler:
     result = CommandHandler(
         command=config.GET_MY_COLLECTIONS_S,
@@ -886,6 +913,7 @@ def create_empty_cbk_handler() -> CallbackQueryHandler:
 global_scenario_cmd = create_global_scenario_cmd()
 get_public_post_handler_cmd = create_get_public_post_cmd()
 get_pending_public_posts_handler_cmd = create_get_pending_public_posts_handler_cmd()
+search_stages_handler_cmd = create_search_stages_handler_cmd()
 get_my_personal_posts_handler_cmd = create_get_my_personal_posts_cmd()
 public_post_mass_sending_handler_cmd = create_public_post_mass_sending_handler_cmd()
 public_post_in_channel_handler_cmd = create_public_post_in_channel_handler_cmd()
@@ -921,6 +949,7 @@ def get_regular_handlers() -> list[DispatcherAddHandlerKwargs]:
         {'handler': start_handler_cmd},
         {'handler': get_public_post_handler_cmd},
         {'handler': get_pending_public_posts_handler_cmd},
+        {'handler': search_stages_handler_cmd},
         {'handler': get_my_personal_posts_handler_cmd},
         {'handler': public_post_mass_sending_handler_cmd},
         {'handler': public_post_in_channel_handler_cmd},
@@ -14,12 +14,13 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
+from queue import Queue
 from typing import TYPE_CHECKING, Callable, Type
 
 # noinspection PyPackageRequirements
 from telegram.utils import request as tg_utils_request
 # noinspection PyPackageRequirements
-from telegram.ext import ExtBot, Updater, ContextTypes
+from telegram.ext import ExtBot, Updater, ContextTypes, JobQueue
 # noinspection PyPackageRequirements
 from telegram.error import BadRequest
 
@@ -27,6 +28,7 @@
 from app.db import manager as db_manager
 
 from custom_ptb.callback_context import CustomCallbackContext
+from custom_ptb.dispatcher import CustomDispatcher
 
 from app.tg.ptb.structures import CustomUserData
 from app.tg.classes.posts import PostsChannels
@@ -34,6 +36,7 @@
 import app.tg.ptb.config
 import app.tg.ptb.classes.posts
 import app.forms.post
+import app.models.matches
 import app.tg.ptb.handlers_definition
 
 if TYPE_CHECKING:
@@ -136,13 +139,17 @@ def create_ptb_app(
         handlers: list[dict[str, Handler]] | None = None,
         error_handlers: list[dict[str, Callable]] | None = None,
 ):
-    updater = Updater(
+    dispatcher = CustomDispatcher(
         bot=bot,
+        update_queue=Queue(),
+        job_queue=JobQueue(),
         context_types=ContextTypes(
             context=CustomCallbackContext,
             user_data=CustomUserData,
-        )
+        ),
     )
+    dispatcher.job_queue.set_dispatcher(dispatcher=dispatcher, )
+    updater = Updater(dispatcher=dispatcher, workers=None, )
     if handlers is None:
         handlers = app.tg.ptb.handlers_definition.get_regular_handlers() + app.tg.ptb.handlers_definition.get_chs()
     if error_handlers is None:
@@ -164,6 +171,12 @@ def configure_app(
     for key, value in vars(config).items():
         setattr(app.tg.ptb.config.Config, key, value)
     db_manager.Postgres.create_app_tables()
+    db_manager.Postgres.migrate()
+    db_manager.Postgres.create_pool_check_task()
+    app.models.matches.Matcher.check_config()
+    app.models.matches.Matcher.set_engine(connection=db_manager.Postgres.connection, )  # If required by mode
+    app.models.matches.Matcher.create_snapshot_task()  # The same, the snapshot borrows a connection of the pool
+    app.models.matches.Matcher.create_top_matches_trim_task()  # The same
     check_is_bot_has_access_to_posts_store(bot=config.bot, )
     if create_public_default_collections is True:
         create_default_collections_with_posts(
@@ -83,7 +83,7 @@ class _BotPublicPost:
     @classmethod
     def mass_send_job(cls, bot_post: app.tg.ptb.classes.posts.BotPublicPostInterface, ) -> None:
         """Send post to group of users (job because most likely usage is inside PTB job (another thread))"""
-        # Make separate cursor
+        # Read by pages, no transaction is held during the sending
         for tg_user_id in cls.System.read_all_users_ids():
             try:
                 sent_message = bot_post.send(recipient=tg_user_id, )
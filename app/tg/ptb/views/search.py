@@ -27,6 +27,7 @@
     from telegram.ext import ExtBot
     from app.tg.ptb.forms.user import Target  # Put model into target and use it
     from app.tg.ptb.classes.users import User
+    from app.models.base._matches.stages import StageStats
 
 
 class Search(Base, ):
@@ -126,6 +127,40 @@ def no_matches_with_filters(self, ) -> Message:
             text=constants.Search.Result.NO_MATCHES_WITH_FILTERS,
         )
 
+    @log
+    def searching(self, ) -> Message:
+        return self.bot.send_message(
+            chat_id=self.tg_user_id,
+            text=constants.Search.Result.SEARCHING,
+        )
+
+    @log
+    def still_searching(self, ) -> Message:
+        return self.bot.send_message(
+            chat_id=self.tg_user_id,
+            text=constants.Search.Result.STILL_SEARCHING,
+        )
+
+    @log
+    def partial_matches(self, ) -> Message:
+        return self.bot.send_message(
+            chat_id=self.tg_user_id,
+            text=constants.Search.Result.PARTIAL_MATCHES,
+        )
+
+    @log
+    def search_stages(self, report: dict[str, StageStats], ) -> Message:
+        """For the admins, the whole search ("total" stage) is the last"""
+        if not report:
+            return self.bot.send_message(chat_id=self.tg_user_id, text=constants.Search.Result.NO_SEARCHES, )
+        lines = [constants.Search.Result.SEARCH_STAGES.format(SEARCHES_COUNT=list(report.values())[-1]['count'], )]
+        for name, stats in report.items():
+            lines.append(
+                f"{name}: {stats['p50_ms']:.1f} / {stats['p95_ms']:.1f} / {stats['p99_ms']:.1f}, "
+                f"{stats['rows']:.0f}, {stats['round_trips']:.1f}"
+            )
+        return self.bot.send_message(chat_id=self.tg_user_id, text='\n'.join(lines), )
+
     @log
     def ask_which_matches_show(self, matches: ptb_matches.Matcher.Matches, ) -> Message:
         return self.bot.send_message(
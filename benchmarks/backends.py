@@ -0,0 +1,123 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compare the DB backends (see app.db.backends) on the app statements (real DB with data).
+Reads: the hot single user statements, psycopg3 prepares them after DB_PREPARE_THRESHOLD executions.
+Vote: the vote writes (the same values, so the data is not changed) one by one vs the pipeline.
+Usage:
+    python -m benchmarks.backends --users 100 --repeats 5
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+
+from app.config import DB_PREPARE_THRESHOLD
+from app.db import manager as db_manager, backends
+
+sqls = db_manager.Postgres.sqls
+READS = {
+    'read_user': sqls.Users.READ_USER,
+    'read_photos': sqls.Photos.READ_PHOTOS,
+    'is_registered': sqls.Users.IS_REGISTERED,
+    'read_votes_count': sqls.PublicVotes.READ_USER_PUBLIC_VOTES_COUNT,
+    'read_votes': sqls.PublicVotes.READ_USER_PUBLIC_VOTES,
+}
+
+
+def measure(func, ) -> float:
+    start = perf_counter()
+    func()
+    return perf_counter() - start
+
+
+def vote(connection, vote_row: dict, ) -> None:
+    """The same as the vote handling writes (see PublicVote.handle)"""
+    with db_manager.Postgres.pipeline(connection=connection, ):
+        db_manager.Postgres.update(
+            statement=sqls.PublicVotes.UPSERT_PUBLIC_VOTE_VALUE,
+            values=(
+                vote_row['tg_user_id'],
+                vote_row['post_id'],
+                vote_row['message_id'],
+                vote_row['value'],
+                vote_row['value'],
+            ),
+            connection=connection,
+        )
+        db_manager.Postgres.create(
+            statement=sqls.Matches.Public.UPDATE_USER_VOTES_COUNT,
+            values={'tg_user_id': vote_row['tg_user_id'], 'delta': 0, },
+            connection=connection,
+        )
+
+
+def run(backend: backends.Backend, users: int, repeats: int, seed: int = 0, ):
+    connection = backends.get_connect(
+        backend=backend,
+        config=db_manager.Postgres.CONFIG,
+        prepare_threshold=DB_PREPARE_THRESHOLD,
+    )()
+    tg_user_ids = db_manager.Postgres.read(
+        statement=sqls.System.READ_ALL_USERS_IDS,
+        connection=connection,
+        fetch='fetchall',
+    )
+    if not tg_user_ids:
+        print('No users in DB')
+        return
+    random = np.random.default_rng(seed, )
+    tg_user_ids = random.choice(tg_user_ids, size=min(users, len(tg_user_ids), ), replace=False, ).tolist()
+    timings: dict[str, list[float]] = {name: [] for name in (*READS, 'vote',)}
+    for _ in range(repeats):
+        for tg_user_id in tg_user_ids:
+            for name, statement in READS.items():
+                timings[name].append(measure(lambda: db_manager.Postgres.read(
+                    statement=statement,
+                    values=(tg_user_id,),
+                    connection=connection,
+                    fetch='fetchall',
+                )))
+            votes_rows = db_manager.Postgres.read(
+                statement=sqls.PublicVotes.READ_USER_PUBLIC_VOTES,
+                values=(tg_user_id,),
+                connection=connection,
+                fetch='fetchall',
+            )
+            for vote_row in votes_rows[:1]:
+                timings['vote'].append(measure(lambda: vote(connection=connection, vote_row=vote_row, )))
+    connection.close()
+    for name, seconds in timings.items():
+        if seconds:
+            print(
+                f'{backend.value} {name}: mean {np.mean(seconds) * 1000:.3f}ms, '
+                f'p95 {np.percentile(seconds, 95) * 1000:.3f}ms'
+            )
+
+
+def main():
+    parser = ArgumentParser(description=__doc__, )
+    parser.add_argument('--users', type=int, default=100, )
+    parser.add_argument('--repeats', type=int, default=5, )
+    args = parser.parse_args()
+    for backend in backends.Backend:
+        run(backend=backend, users=args.users, repeats=args.repeats, )
+
+
+if __name__ == '__main__':
+    main()
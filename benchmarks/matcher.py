@@ -0,0 +1,119 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compare the exact covotes counting with the approximate one (MinHash/LSH) to choose the matcher mode per deployment.
+DB is used only for reading.
+Usage:
+    python -m benchmarks.matcher --searches 50  # Real votes from DB, exact SQL path is measured too
+    python -m benchmarks.matcher --synthetic 100000 2000 3000000  # users, posts, votes; engines only
+    Add "--bands 48 --rows 3" to check another recall.
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from time import perf_counter
+from typing import TYPE_CHECKING, Callable
+
+import numpy as np
+
+from app.config import MINHASH_BANDS, MINHASH_ROWS
+from app.db import manager as db_manager
+from app.models.base._matches import engines
+import app.db.crud.users
+
+if TYPE_CHECKING:
+    import app.structures.base
+
+TOP_K = 10  # Recall is a share of the exact top K covoters found by the approximate engine
+
+
+def gen_votes(users: int, posts: int, votes: int, seed: int = 0, ) -> list[app.structures.base.PublicVoteValue]:
+    """Popular posts get more votes (zipf), duplicated (user, post) pairs are dropped"""
+    random = np.random.default_rng(seed, )
+    tg_user_ids = random.integers(1, users + 1, size=votes, )
+    post_ids = np.minimum(random.zipf(1.3, size=votes, ), posts, )
+    values = random.choice((-1, 1,), size=votes, )
+    pairs = {}
+    for tg_user_id, post_id, value in zip(tg_user_ids.tolist(), post_ids.tolist(), values.tolist(), ):
+        pairs[(tg_user_id, post_id,)] = value
+    return [
+        {'tg_user_id': tg_user_id, 'post_id': post_id, 'value': value, }
+        for (tg_user_id, post_id), value in pairs.items()
+    ]
+
+
+def measure(func: Callable, ) -> tuple[float, object]:
+    start = perf_counter()
+    result = func()
+    return perf_counter() - start, result
+
+
+def get_top(covotes: tuple[np.ndarray, np.ndarray], ) -> set[int]:
+    tg_user_ids, counts = covotes
+    return set(tg_user_ids[np.argsort(-counts, kind='stable', )[:TOP_K]].tolist())
+
+
+def run(votes: list[app.structures.base.PublicVoteValue], searches: int, bands: int, rows: int, connection=None, ):
+    exact = engines.CovoteIndex()
+    approximate = engines.MinHashLSH(bands=bands, rows=rows, )
+    for engine in (engines.VoteMatrix(), exact, approximate,):
+        seconds, _ = measure(func=lambda: engine.load_votes(votes=votes, ), )
+        print(f'{type(engine).__name__} load: {seconds:.2f}s')
+    searchers = np.random.default_rng(0).choice(sorted({vote['tg_user_id'] for vote in votes}), size=searches, )
+    timings: dict[str, list[float]] = {'SQL': [], 'CovoteIndex': [], 'MinHashLSH': [], }
+    recalls, candidates = [], []
+    for tg_user_id in searchers.tolist():
+        if connection is not None:
+            seconds, _ = measure(func=lambda: app.db.crud.users.Matcher.read_filtered_matches(
+                tg_user_id=tg_user_id,
+                connection=connection,
+            ), )
+            timings['SQL'].append(seconds)
+        seconds, exact_covotes = measure(func=lambda: exact.count_covotes(tg_user_id=tg_user_id, ), )
+        timings['CovoteIndex'].append(seconds)
+        seconds, approximate_covotes = measure(func=lambda: approximate.count_covotes(tg_user_id=tg_user_id, ), )
+        timings['MinHashLSH'].append(seconds)
+        if len(exact_covotes[0]):
+            top = get_top(covotes=exact_covotes, )
+            recalls.append(len(top & set(approximate_covotes[0].tolist())) / len(top))
+            candidates.append(len(approximate_covotes[0]) / len(exact_covotes[0]))
+    for name, seconds in timings.items():
+        if seconds:
+            print(f'{name} search: mean {np.mean(seconds) * 1000:.2f}ms, p95 {np.percentile(seconds, 95) * 1000:.2f}ms')
+    print(f'MinHashLSH (bands={bands}, rows={rows}): recall@{TOP_K} {np.mean(recalls):.3f}, '
+          f'candidates {np.mean(candidates):.3f} of exact covoters')
+
+
+def main():
+    parser = ArgumentParser(description=__doc__, )
+    parser.add_argument('--searches', type=int, default=50, )
+    parser.add_argument('--synthetic', type=int, nargs=3, metavar=('USERS', 'POSTS', 'VOTES'), )
+    parser.add_argument('--bands', type=int, default=MINHASH_BANDS, )
+    parser.add_argument('--rows', type=int, default=MINHASH_ROWS, )
+    args = parser.parse_args()
+    if args.synthetic:
+        votes, connection = gen_votes(*args.synthetic, ), None
+    else:
+        connection = db_manager.Postgres.get_connection()
+        votes = app.db.crud.users.Matcher.read_all_votes(connection=connection, )
+    print(f'Votes: {len(votes)}')
+    if not votes:
+        return
+    run(votes=votes, searches=args.searches, bands=args.bands, rows=args.rows, connection=connection, )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Measure the scoring kernels on synthetic candidates to choose the matcher scoring per deployment.
+Usage:
+    python -m benchmarks.scoring --candidates 100000 --repeats 20
+    python -m benchmarks.scoring --candidates 1000 --db  # + candidates votes counts: counters vs aggregation (real DB)
+"""
+
+from __future__ import annotations
+from argparse import ArgumentParser
+from time import perf_counter
+
+import numpy as np
+
+from app.db import manager as db_manager
+from app.models.base._matches import scoring
+import app.db.crud.users
+
+COVOTES_PER_CANDIDATE = 10  # For the IDF kernel
+
+
+def run(candidates: int, repeats: int, seed: int = 0, ):
+    random = np.random.default_rng(seed, )
+    candidates_votes_counts = random.integers(1, 1000, size=candidates, ).astype(np.float64, )
+    common = np.minimum(random.integers(1, 100, size=candidates, ), candidates_votes_counts, )
+    user_votes_count = 500
+    kernels = {
+        name: lambda kernel=kernel: kernel(
+            common=common,
+            user_votes_count=user_votes_count,
+            candidates_votes_counts=candidates_votes_counts,
+        )
+        for name, kernel in (
+            ('jaccard', scoring.jaccard,),
+            ('cosine', scoring.cosine,),
+            ('overlap', scoring.overlap,),
+            ('reciprocal', scoring.reciprocal,),
+        )
+    }
+    covotes = candidates * COVOTES_PER_CANDIDATE
+    candidates_indexes = random.integers(0, candidates, size=covotes, )
+    voters_counts = random.integers(1, candidates, size=covotes, ).astype(np.float64, )
+    kernels['idf_weighted'] = lambda: scoring.idf_weighted(
+        candidates_indexes=candidates_indexes,
+        voters_counts=voters_counts,
+        users_count=candidates,
+        candidates_count=candidates,
+    )
+    for name, kernel in kernels.items():
+        timings = []
+        for _ in range(repeats):
+            start = perf_counter()
+            kernel()
+            timings.append(perf_counter() - start)
+        print(f'{name}: mean {np.mean(timings) * 1000:.3f}ms, p95 {np.percentile(timings, 95) * 1000:.3f}ms')
+    # The ranking itself, the same as Matcher.rank_matches does
+    scores = kernels['jaccard']()
+    tg_user_ids = np.arange(candidates, )
+    start = perf_counter()
+    np.lexsort((tg_user_ids, scores,), )
+    print(f'rank: {(perf_counter() - start) * 1000:.3f}ms')
+
+
+def run_db(candidates: int, repeats: int, seed: int = 0, ):
+    """Votes counts of the candidates as the scoring reads them (counters table) and by the votes aggregation"""
+    connection = db_manager.Postgres.get_connection()
+    voters = sorted({vote['tg_user_id'] for vote in app.db.crud.users.Matcher.read_all_votes(connection=connection, )})
+    if not voters:
+        print('No votes in DB')
+        return
+    random = np.random.default_rng(seed, )
+    statements = {
+        'counters': db_manager.Postgres.sqls.Matches.Public.READ_USERS_VOTES_COUNTS,
+        'aggregation': db_manager.Postgres.sqls.Matches.Public.COUNT_USERS_VOTES,
+    }
+    timings: dict[str, list[float]] = {name: [] for name in statements}
+    for _ in range(repeats):
+        tg_user_ids = random.choice(voters, size=min(candidates, len(voters), ), replace=False, ).tolist()
+        for name, statement in statements.items():
+            start = perf_counter()
+            db_manager.Postgres.read(
+                statement=statement,
+                values={'tg_user_ids': tg_user_ids, },
+                connection=connection,
+                fetch='fetchall',
+            )
+            timings[name].append(perf_counter() - start)
+    for name, seconds in timings.items():
+        print(
+            f'votes counts by {name}: mean {np.mean(seconds) * 1000:.3f}ms, '
+            f'p95 {np.percentile(seconds, 95) * 1000:.3f}ms'
+        )
+
+
+def main():
+    parser = ArgumentParser(description=__doc__, )
+    parser.add_argument('--candidates', type=int, default=100_000, )
+    parser.add_argument('--repeats', type=int, default=20, )
+    parser.add_argument('--db', action='store_true', )
+    args = parser.parse_args()
+    print(f'Candidates: {args.candidates}')
+    run(candidates=args.candidates, repeats=args.repeats, )
+    if args.db:
+        run_db(candidates=args.candidates, repeats=args.repeats, )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+# noinspection PyPackageRequirements
+from telegram.ext import Dispatcher
+
+from app.db.manager import Postgres
+
+
+class CustomDispatcher(Dispatcher):
+    """
+    Every update is a unit of work: all the handlers of the update share a single DB connection of the pool.
+    Note: run_async callbacks are executed in another thread, so they are out of the unit.
+    """
+
+    def process_update(self, update: object) -> None:
+        with Postgres.borrow():
+            super().process_update(update)
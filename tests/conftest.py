@@ -399,7 +399,16 @@ def matcher_s(user_s: app.models.users.User, ) -> app.models.matches.Matcher:
 def mock_matcher(matcher_s: app.models.matches.Matcher) -> MagicMock:
     result = create_autospec(spec=matcher_s, spec_set=True, )
     result.Filters.Age = app.models.matches.Matcher.Filters.Age
+    result.Mode = app.models.matches.Matcher.Mode
+    result.ENGINES = app.models.matches.Matcher.ENGINES
+    result.SINGLE_QUERY_MODES = app.models.matches.Matcher.SINGLE_QUERY_MODES
+    result.mode = app.models.matches.Matcher.Mode.TEMP_TABLES  # Default
+    result.Scoring = app.models.matches.Matcher.Scoring
+    result.SCORING_KERNELS = app.models.matches.Matcher.SCORING_KERNELS
+    result.scoring = app.models.matches.Matcher.Scoring.COMMON_COUNT  # Default
+    result.TOP_K = None  # Default
     result._is_unfiltered_matches_already_set = False  # Set explicitly
+    result.matches.is_partial = False  # Default
     yield result
 
 
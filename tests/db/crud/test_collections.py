@@ -60,6 +60,14 @@ def test_create_2m2_collection_post(self, patched_db: MagicMock, collection: app
             connection=collection.author.connection,
         )
 
+    def test_create_m2m_collection_posts(self, patched_db: MagicMock, ):
+        self.cls_to_test.create_m2m_collection_posts(collection_id=1, posts_ids=[2, 3, ], connection=typing_Any, )
+        patched_db.execute_values.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Collections.CREATE_M2M_COLLECTIONS_POSTS_MANY,
+            rows=[(1, 2,), (1, 3,), ],
+            connection=typing_Any,
+        )
+
     def test_read_id_by_name(self, patched_db: MagicMock, collection: app.models.collections.Collection):
         result = self.cls_to_test.read_id_by_name(
             author=collection.author.tg_user_id,
@@ -77,7 +85,7 @@ def test_read_collections_by_ids(self, patched_db: MagicMock, ):
         result = self.cls_to_test.read_by_ids(ids=[1, ], connection=typing_Any)
         patched_db.read.assert_called_once_with(
             statement=self.cls_to_test.db.sqls.Collections.READ_COLLECTIONS_BY_IDS,
-            values=((1,),),  # list of ids will be converted to tuple
+            values=([1, ],),
             connection=typing_Any,
             fetch='fetchall'
         )
@@ -73,6 +73,14 @@ def test_create_user_covotes(self, patched_db: MagicMock, ):
             ),
         ]
 
+    def test_create_user_covotes_engine(self, patched_db: MagicMock, ):
+        self.cls_to_test.create_user_covotes(tg_user_id=1, covotes=([2, 3, ], [1, 4, ], ), connection=typing_Any, )
+        assert patched_db.create.call_args_list[1] == call(
+            statement=self.cls_to_test.db.sqls.Matches.Public.FILL_TEMP_TABLE_USER_COVOTES_FROM_ENGINE,
+            values=([2, 3, ], [1, 4, ], ),
+            connection=typing_Any,
+        )
+
     def test_read_user_votes(self, patched_db: MagicMock, ):
         result = self.cls_to_test.read_user_votes(connection=typing_Any, )
         # Checks
@@ -104,12 +112,11 @@ def test_read_user_covotes_count(self, patched_db: MagicMock, ):
     def test_read_user_covotes_all(self, patched_db: MagicMock, ):
         result = self.cls_to_test.read_user_covotes(tg_user_id=1, connection=typing_Any, new=False, )
         # Checks
-        patched_db.read.assert_called_once_with(
+        patched_db.stream.assert_called_once_with(
             statement=self.cls_to_test.db.sqls.Matches.Public.READ_ALL_MATCHES,
             connection=typing_Any,
-            fetch='fetchall',
         )
-        assert result == patched_db.read.return_value
+        assert result == patched_db.stream.return_value  # Not read till consumed
 
     def test_read_user_covotes_new(self, patched_db: MagicMock, ):
         result = self.cls_to_test.read_user_covotes(tg_user_id=1, connection=typing_Any, new=True, )
@@ -122,6 +129,134 @@ def test_read_user_covotes_new(self, patched_db: MagicMock, ):
         )
         assert result == patched_db.read.return_value
 
+    def test_read_matches_counts(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_matches_counts(tg_user_id=1, connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_MATCHES_COUNTS,
+            values={'tg_user_id': 1, },
+            connection=typing_Any,
+        )
+        assert result == patched_db.read.return_value
+
+    def test_read_matches_page(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_matches_page(
+            tg_user_id=1,
+            limit=10,
+            new=True,
+            keyset=(5, 2,),
+            connection=typing_Any,
+        )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_MATCHES_PAGE,
+            values={'tg_user_id': 1, 'new': True, 'last_count': 5, 'last_tg_user_id': 2, 'limit': 10, },
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+        assert result == patched_db.read.return_value
+
+    def test_read_matches_page_first(self, patched_db: MagicMock, ):
+        self.cls_to_test.read_matches_page(tg_user_id=1, limit=10, connection=typing_Any, )
+        values = patched_db.read.call_args.kwargs['values']
+        assert values['last_count'] is values['last_tg_user_id'] is None
+        assert values['new'] is False
+
+    def test_upsert_precomputed_matches(self, patched_db: MagicMock, ):
+        self.cls_to_test.upsert_precomputed_matches(
+            tg_user_ids=[1, ],
+            match_ids=[2, ],
+            counts=[3, ],
+            computed_at=typing_Any,
+            connection=typing_Any,
+        )
+        patched_db.upsert.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.UPSERT_PRECOMPUTED_MATCHES,
+            values={'tg_user_ids': [1, ], 'match_ids': [2, ], 'counts': [3, ], 'computed_at': typing_Any, },
+            connection=typing_Any,
+        )
+
+    def test_delete_stale_precomputed_matches(self, patched_db: MagicMock, ):
+        self.cls_to_test.delete_stale_precomputed_matches(computed_at=typing_Any, connection=typing_Any, )
+        patched_db.delete.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.DELETE_STALE_PRECOMPUTED_MATCHES,
+            values={'computed_at': typing_Any, },
+            connection=typing_Any,
+        )
+
+    def test_read_votes_mark(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_votes_mark(connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_VOTES_MARK,
+            connection=typing_Any,
+        )
+        assert result == patched_db.read.return_value
+
+    def test_read_votes_since(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_votes_since(mark=None, connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_VOTES_SINCE,
+            values={'mark': None, },
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+        assert result == patched_db.read.return_value
+
+    def test_read_users_votes_counts(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_users_votes_counts(tg_user_ids=[1, 2, ], connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_USERS_VOTES_COUNTS,
+            values={'tg_user_ids': [1, 2, ], },
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+        assert result == patched_db.read.return_value
+
+    def test_update_votes_count(self, patched_db: MagicMock, ):
+        self.cls_to_test.update_votes_count(tg_user_id=1, delta=-1, connection=typing_Any, )
+        patched_db.create.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.UPDATE_USER_VOTES_COUNT,
+            values={'tg_user_id': 1, 'delta': -1, },
+            connection=typing_Any,
+        )
+
+    def test_update_votes_counts(self, patched_db: MagicMock, ):
+        self.cls_to_test.update_votes_counts(rows=[(1, -1,), ], connection=typing_Any, )
+        patched_db.execute_values.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.UPDATE_USERS_VOTES_COUNTS,
+            rows=[(1, -1,), ],
+            template=self.cls_to_test.db.sqls.Matches.Public.UPDATE_USERS_VOTES_COUNTS_TEMPLATE,
+            connection=typing_Any,
+        )
+
+    def test_rebuild_votes_counts(self, patched_db: MagicMock, ):
+        self.cls_to_test.rebuild_votes_counts(connection=typing_Any, )
+        patched_db.transaction.assert_called_once_with(connection=typing_Any, )
+        patched_db.execute.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.TRUNCATE_USERS_VOTES_COUNTS,
+            connection=typing_Any,
+        )
+        patched_db.create.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.FILL_USERS_VOTES_COUNTS,
+            connection=typing_Any,
+        )
+
+    def test_read_users_count(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_users_count(connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_USERS_COUNT,
+            connection=typing_Any,
+        )
+        assert result == patched_db.read.return_value
+
+    def test_read_covotes_posts(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_covotes_posts(tg_user_id=1, tg_user_ids=[2, ], connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_COVOTES_POSTS,
+            values={'tg_user_id': 1, 'tg_user_ids': [2, ], },
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+        assert result == patched_db.read.return_value
+
     def test_apply_goal_filter(self, patched_db: MagicMock, ):
         self.cls_to_test.apply_goal_filter(goal=1, connection=typing_Any, )
         patched_db.execute.assert_called_once_with(
@@ -167,6 +302,183 @@ def test_apply_checkboxes_photo_filter(self, patched_db: MagicMock, ):
             connection=typing_Any,
         )
 
+    def test_apply_nearby_filter(self, patched_db: MagicMock, ):
+        self.cls_to_test.apply_nearby_filter(nearby_ids=[1, 2, ], connection=typing_Any, )
+        patched_db.execute.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.USE_NEARBY_FILTER,
+            values=([1, 2, ],),
+            connection=typing_Any,
+        )
+
+    def test_read_user_location(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_user_location(tg_user_id=1, connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_USER_LOCATION,
+            values=(1,),
+            connection=typing_Any,
+        )
+        assert result == patched_db.read.return_value
+
+    def test_read_users_locations(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_users_locations(cells=[1, 2, ], connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_USERS_LOCATIONS,
+            values=([1, 2, ],),
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+        assert result == patched_db.read.return_value
+
+    def test_track_statements(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.track_statements(connection=typing_Any, )
+        patched_db.track.assert_called_once_with(connection=typing_Any, )
+        assert result == patched_db.track.return_value
+
+    def test_read_user_votes_stats(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_user_votes_stats(tg_user_id=1, connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_USER_VOTES_STATS,
+            values={'tg_user_id': 1, },
+            connection=typing_Any,
+        )
+        assert result == patched_db.read.return_value
+
+    def test_read_filtered_matches(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_filtered_matches(
+            tg_user_id=1,
+            goal=2,
+            age_range=(20, 50),
+            photo=True,
+            connection=typing_Any,
+        )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_FILTERED_MATCHES,
+            values={
+                'tg_user_id': 1,
+                'goal': 2,
+                'gender': None,
+                'min_age': 20,
+                'max_age': 50,
+                'photo': True,
+                'country': False,
+                'city': False,
+                'nearby_ids': None,
+            },
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+        assert result == patched_db.read.return_value
+
+    def test_read_filtered_matches_engine(self, patched_db: MagicMock, ):
+        self.cls_to_test.read_filtered_matches(tg_user_id=1, covotes=([2, 3, ], [1, 4, ], ), connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_FILTERED_ENGINE_MATCHES,
+            values={
+                'tg_user_id': 1,
+                'goal': None,
+                'gender': None,
+                'min_age': None,
+                'max_age': None,
+                'photo': False,
+                'country': False,
+                'city': False,
+                'nearby_ids': None,
+                'covotes_ids': [2, 3, ],
+                'covotes_counts': [1, 4, ],
+            },
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+
+    def test_read_filtered_matches_top_matches(self, patched_db: MagicMock, ):
+        self.cls_to_test.read_filtered_matches(tg_user_id=1, top_matches_limit=10, connection=typing_Any, )
+        assert patched_db.read.call_args.kwargs['statement'] == (
+            self.cls_to_test.db.sqls.Matches.Public.READ_FILTERED_TOP_MATCHES
+        )
+        assert patched_db.read.call_args.kwargs['values']['limit'] == 10
+
+    def test_read_filtered_matches_recent(self, patched_db: MagicMock, ):
+        self.cls_to_test.read_filtered_matches(tg_user_id=1, votes_limit=10, connection=typing_Any, )
+        assert patched_db.read.call_args.kwargs['statement'] == (
+            self.cls_to_test.db.sqls.Matches.Public.READ_FILTERED_RECENT_MATCHES
+        )
+        assert patched_db.read.call_args.kwargs['values']['votes_limit'] == 10
+
+    def test_update_top_matches(self, patched_db: MagicMock, ):
+        self.cls_to_test.update_top_matches(
+            tg_user_id=1,
+            post_id=2,
+            old_value=1,
+            new_value=-1,
+            connection=typing_Any,
+        )
+        assert patched_db.create.call_args_list == [
+            call(
+                statement=self.cls_to_test.db.sqls.Matches.Public.DECREASE_TOP_MATCHES,
+                values={'tg_user_id': 1, 'post_id': 2, 'value': 1, },
+                connection=typing_Any,
+            ),
+            call(
+                statement=self.cls_to_test.db.sqls.Matches.Public.UPDATE_TOP_MATCHES,
+                values={'tg_user_id': 1, 'post_id': 2, 'value': -1, 'delta': 1, },
+                connection=typing_Any,
+            ),
+        ]
+
+    def test_update_top_matches_zero(self, patched_db: MagicMock, ):
+        """New vote, nothing to decrease"""
+        self.cls_to_test.update_top_matches(tg_user_id=1, post_id=2, old_value=0, new_value=1, connection=typing_Any, )
+        assert patched_db.create.call_count == 1
+
+    def test_update_top_matches_many(self, patched_db: MagicMock, ):
+        """A single page, the pairs of the batch voters are counted together"""
+        rows = [(1, 2, 1,), (3, 2, 0,), ]
+        self.cls_to_test.update_top_matches_many(rows=rows, connection=typing_Any, )
+        patched_db.execute_values.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.UPDATE_TOP_MATCHES_MANY,
+            rows=rows,
+            template=self.cls_to_test.db.sqls.Matches.Public.UPDATE_TOP_MATCHES_MANY_TEMPLATE,
+            page_size=2,
+            connection=typing_Any,
+        )
+
+    def test_rebuild_top_matches(self, patched_db: MagicMock, ):
+        self.cls_to_test.rebuild_top_matches(connection=typing_Any, )
+        patched_db.transaction.assert_called_once_with(connection=typing_Any, )
+        patched_db.execute.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.TRUNCATE_TOP_MATCHES,
+            connection=typing_Any,
+        )
+        patched_db.create.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.FILL_TOP_MATCHES,
+            connection=typing_Any,
+        )
+
+    def test_trim_top_matches(self, patched_db: MagicMock, ):
+        self.cls_to_test.trim_top_matches(connection=typing_Any, )
+        patched_db.create.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.TRIM_TOP_MATCHES,
+            connection=typing_Any,
+        )
+
+    def test_read_all_votes(self, patched_db: MagicMock, ):
+        result = self.cls_to_test.read_all_votes(connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_ALL_VOTES,
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+        assert result == patched_db.read.return_value
+
+    def test_stream_all_votes(self, patched_db: MagicMock, ):
+        patched_db.stream.return_value = iter([(1, 2, -1,), ], )
+        result = list(self.cls_to_test.stream_all_votes(connection=typing_Any, ), )
+        patched_db.stream.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Matches.Public.READ_ALL_VOTES,
+            connection=typing_Any,
+        )
+        assert result == [(1, 2, -1,), ]
+
 
 class TestMatch:
     cls_to_test = app.db.crud.users.Match
@@ -104,21 +104,32 @@ def patched_db() -> MagicMock:
 
     @staticmethod
     def test_read_bots_ids(patched_db: MagicMock, ):
+        patched_db.stream.return_value = iter([(1,), (2,), ])
         result = app.db.crud.mix.System.read_bots_ids(connection=typing_Any, )
-        patched_db.read.assert_called_once_with(
+        assert list(result) == [1, 2, ]
+        patched_db.stream.assert_called_once_with(
             statement=app.db.crud.mix.System.db.sqls.System.READ_BOTS_IDS,
             values=(app.constants.I_AM_BOT,),
             connection=typing_Any,
-            fetch='fetchall',
         )
-        assert result == patched_db.read.return_value
 
     @staticmethod
     def test_read_all_users_ids(patched_db: MagicMock, ):
+        patched_db.stream.return_value = iter([(1,), (2,), ])
         result = app.db.crud.mix.System.read_all_users_ids(connection=typing_Any, )
-        patched_db.read.assert_called_once_with(
+        assert list(result) == [1, 2, ]
+        patched_db.stream.assert_called_once_with(
             statement=app.db.crud.mix.System.db.sqls.System.READ_ALL_USERS_IDS,
             connection=typing_Any,
+        )
+
+    @staticmethod
+    def test_read_users_ids_page(patched_db: MagicMock, ):
+        result = app.db.crud.mix.System.read_users_ids_page(after_tg_user_id=1, limit=2, connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=app.db.crud.mix.System.db.sqls.System.READ_USERS_IDS_PAGE,
+            values={'after_tg_user_id': 1, 'limit': 2, },
+            connection=typing_Any,
             fetch='fetchall',
         )
         assert result == patched_db.read.return_value
@@ -141,6 +152,26 @@ def test_create(patched_db: MagicMock):
         )
         assert len(patched_db.mock_calls) == 1
 
+    @staticmethod
+    def test_create_many(patched_db: MagicMock):
+        app.db.crud.mix.Photo.create_many(tg_user_id=1, photos=['foo', 'bar', ], connection=typing_Any, )
+        patched_db.execute_values.assert_called_once_with(
+            statement=app.db.crud.mix.Photo.db.sqls.Photos.CREATE_PHOTOS,
+            rows=[(1, 'foo',), (1, 'bar',), ],
+            connection=typing_Any,
+        )
+        assert len(patched_db.mock_calls) == 1
+
+    @staticmethod
+    def test_copy(patched_db: MagicMock):
+        app.db.crud.mix.Photo.copy(rows=[(1, 'foo',), ], connection=typing_Any, )
+        patched_db.copy.assert_called_once_with(
+            statement=app.db.crud.mix.Photo.db.sqls.Photos.COPY_PHOTOS,
+            rows=[(1, 'foo',), ],
+            connection=typing_Any,
+        )
+        assert len(patched_db.mock_calls) == 1
+
     @staticmethod
     def test_read(patched_db: MagicMock):
         result = app.db.crud.mix.Photo.read(tg_user_id=1, connection=typing_Any, )
@@ -162,3 +193,13 @@ def test_delete_user_photos(patched_db: MagicMock):
             connection=typing_Any,
         )
         assert len(patched_db.mock_calls) == 1
+
+    @staticmethod
+    def test_delete_users_photos(patched_db: MagicMock):
+        app.db.crud.mix.Photo.delete_users_photos(tg_user_ids=[1, 2, ], connection=typing_Any, )
+        patched_db.delete.assert_called_once_with(
+            statement=app.db.crud.mix.Photo.db.sqls.Photos.DELETE_USERS_PHOTOS,
+            values=([1, 2, ],),
+            connection=typing_Any,
+        )
+        assert len(patched_db.mock_calls) == 1
@@ -14,7 +14,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any as typing_Any
 from unittest.mock import patch
 
 import app.db.crud.users
@@ -67,6 +67,17 @@ def test_read(self, user_s: app.models.users.User, ):
         assert len(mock_read.mock_calls) == 1
         assert result == mock_read.return_value
 
+    def test_read_many(self, user_s: app.models.users.User, ):
+        with patch.object(self.cls_to_test.db, 'read', spec_set=self.cls_to_test.db, ) as mock_read:
+            result = self.cls_to_test.read_many(tg_user_ids=[1, 2, ], connection=user_s.connection, )
+        mock_read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Users.READ_USERS_WITH_PHOTOS,
+            values=([1, 2, ],),
+            connection=user_s.connection,
+            fetch='fetchall',
+        )
+        assert result == mock_read.return_value
+
     def test_upsert(self, user_s: app.models.users.User, ):
         with patch.object(self.cls_to_test.db, 'create', spec_set=self.cls_to_test.db, ) as mock_upsert:
             self.cls_to_test.upsert(
@@ -95,6 +106,33 @@ def test_upsert(self, user_s: app.models.users.User, ):
             ) * 2, )
         assert len(mock_upsert.mock_calls) == 1
 
+    def test_upsert_many(self, ):
+        with patch.object(
+                self.cls_to_test.db, 'execute_values', spec_set=self.cls_to_test.db,
+        ) as mock_execute_values:
+            self.cls_to_test.upsert_many(rows=[(1,), ], connection=typing_Any, )
+        mock_execute_values.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Users.UPSERT_USERS,
+            rows=[(1,), ],
+            template=self.cls_to_test.db.sqls.Users.UPSERT_USERS_TEMPLATE,
+            connection=typing_Any,
+        )
+
+    def test_update_location(self, user_s: app.models.users.User, ):
+        with patch.object(self.cls_to_test.db, 'update', spec_set=self.cls_to_test.db, ) as mock_update:
+            self.cls_to_test.update_location(
+                tg_user_id=user_s.tg_user_id,
+                latitude=1.5,
+                longitude=2.5,
+                geo_cell=3,
+                connection=user_s.connection,
+            )
+        mock_update.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.Users.UPDATE_USER_LOCATION,
+            values=(1.5, 2.5, 3, user_s.tg_user_id,),
+            connection=user_s.connection,
+        )
+
     def test_delete(self, user_s: app.models.users.User, ):
         with patch.object(self.cls_to_test.db, 'delete', spec_set=self.cls_to_test.db, ) as mock_delete:
             app.db.crud.users.User.delete(tg_user_id=user_s.tg_user_id, connection=user_s.connection, )
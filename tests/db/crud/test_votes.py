@@ -125,6 +125,25 @@ def test_upsert_value(self, patched_db: MagicMock, ):
             connection=typing_Any,
         )
 
+    def test_read_users_votes(self, patched_db: MagicMock, public_vote_db_s: app.structures.base.PublicVoteDB, ):
+        patched_db.read.return_value = [public_vote_db_s | {}, ]  # Copy, the session fixture is not changed
+        result = self.cls_to_test.read_users_votes(post_id=1, tg_user_ids=[2, 3, ], connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.PublicVotes.READ_USERS_PUBLIC_VOTES_FOR_POST,
+            values=(1, [2, 3, ],),
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+        assert result == [public_vote_db_s | {'value': 0, }, ]  # None is converted to 0
+
+    def test_upsert_values(self, patched_db: MagicMock, ):
+        self.cls_to_test.upsert_values(rows=[(1, 2, 3, 4,), ], connection=typing_Any, )
+        patched_db.execute_values.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.PublicVotes.UPSERT_PUBLIC_VOTES_VALUES,
+            rows=[(1, 2, 3, 4,), ],
+            connection=typing_Any,
+        )
+
     def test_read_user_votes_count(self, patched_db: MagicMock, user_s: app.models.users.User, ):
         assert self.cls_to_test.read_user_votes_count(
             tg_user_id=user_s.tg_user_id,
@@ -161,6 +180,25 @@ def test_upsert(self, patched_db: MagicMock, personal_vote_db_s: app.structures.
         )
         assert len(patched_db.mock_calls) == 1
 
+    def test_upsert_many(self, patched_db: MagicMock, ):
+        self.cls_to_test.upsert_many(rows=[(1, 2, 3, 4,), ], connection=typing_Any, )
+        patched_db.execute_values.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.PersonalVotes.UPSERT_PERSONAL_VOTES,
+            rows=[(1, 2, 3, 4,), ],
+            connection=typing_Any,
+        )
+
+    def test_read_users_votes(self, patched_db: MagicMock, personal_vote_db_s: app.structures.base.PersonalVoteDB, ):
+        patched_db.read.return_value = [personal_vote_db_s | {}, ]  # Copy, the session fixture is not changed
+        result = self.cls_to_test.read_users_votes(post_id=1, tg_user_ids=[2, 3, ], connection=typing_Any, )
+        patched_db.read.assert_called_once_with(
+            statement=self.cls_to_test.db.sqls.PersonalVotes.READ_USERS_PERSONAL_VOTES_FOR_POST,
+            values=(1, [2, 3, ],),
+            connection=typing_Any,
+            fetch='fetchall',
+        )
+        assert result == [personal_vote_db_s | {'value': 0, }, ]  # None is converted to 0
+
     def test_upsert_message_id(self, patched_db: MagicMock, ):
         self.cls_to_test.upsert_message_id(
             tg_user_id=1,
@@ -15,8 +15,6 @@
 
 from __future__ import annotations
 from typing import TYPE_CHECKING
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
 
 from pytest import fixture
 from psycopg.rows import dict_row
@@ -83,7 +81,7 @@ def create_user(cursor: Cursor, user_id: int = 1, comment: str = 'Hello, world!'
         'fullname': 'Test User',
         'goal': 1,
         'gender': 1,
-        'birthdate': (datetime.now() - relativedelta(years=5)).date(),
+        'age': 5,
         'country': None,
         'city': None,
         'comment': comment,
@@ -17,9 +17,9 @@
 from typing import TYPE_CHECKING
 
 from pytest import mark as pytest_mark, raises as pytest_raises
-from psycopg.errors import UndefinedTable
+from psycopg.errors import UndefinedTable, QueryCanceled
 
-from app.db import postgres_sqls
+from app.db import postgres_sqls, backends
 from app.models.base.matches import Matcher
 from app.generation import generator
 
@@ -208,6 +208,23 @@ def test_create_temp_table_user_covotes(self, cursor, psycopg2_cursor):
         result = self.read_all_matches(cursor=cursor, )
         assert sort_matches(matches=result, ) == sort_matches(matches=self.covotes[0], )
 
+    def test_fill_temp_table_user_covotes_from_engine(self, cursor, ):
+        self.create_matches_table(cursor=cursor, )
+        expected = self.read_all_matches(cursor=cursor, )
+        cursor.execute(self.test_cls.DROP_TEMP_TABLE_USER_COVOTES, )
+        cursor.execute(self.test_cls.CREATE_TEMP_TABLE_USER_COVOTES, )
+        cursor.execute(
+            self.test_cls.FILL_TEMP_TABLE_USER_COVOTES_FROM_ENGINE,
+            (
+                [covote['tg_user_id'] for covote in self.covotes[0]],
+                [covote['count_common_interests'] for covote in self.covotes[0]],
+            ),
+        )
+        result = self.read_all_matches(cursor=cursor, )
+        assert sort_matches(matches=[{k: v for k, v in row.items() if k != 'id'} for row in result]) == (
+            sort_matches(matches=[{k: v for k, v in row.items() if k != 'id'} for row in expected])
+        )
+
     def test_read_all_matches(self, cursor, ):
         """
         Almost the same test with test_create_temp_table_user_covotes cuz most of the actions the same:
@@ -236,6 +253,43 @@ def test_read_new_matches(self, cursor, ):
         expected = sort_matches(matches=self.covotes[0][:-1], )
         assert sort_matches(matches=result, ) == expected
 
+    def test_read_matches_counts(self, cursor, ):
+        self.create_matches_table(cursor=cursor, )
+        create_shown_user(cursor=cursor, shown_id=self.best_covote['tg_user_id'], )
+        cursor.execute(self.test_cls.READ_MATCHES_COUNTS, {'tg_user_id': 1, }, )
+        assert cursor.fetchone() == {'count_all': len(self.covotes[0]), 'count_new': len(self.covotes[0]) - 1, }
+
+    def read_matches_page(self, cursor, limit: int, new: bool = False, keyset: tuple | None = None, ):
+        last_count, last_tg_user_id = keyset or (None, None)
+        cursor.execute(
+            self.test_cls.READ_MATCHES_PAGE,
+            {
+                'tg_user_id': 1,
+                'new': new,
+                'last_count': last_count,
+                'last_tg_user_id': last_tg_user_id,
+                'limit': limit,
+            },
+        )
+        return cursor.fetchall()
+
+    def test_read_matches_page(self, cursor, ):
+        """Pages are read one by one, the result should be the same as all the matches sorted by the best"""
+        self.create_matches_table(cursor=cursor, )
+        result, keyset = [], None
+        while page := self.read_matches_page(cursor=cursor, limit=2, keyset=keyset, ):
+            assert len(page) <= 2
+            result.extend(page)
+            keyset = page[-1]['count_common_interests'], page[-1]['tg_user_id']
+        assert result == sort_matches(matches=self.read_all_matches(cursor=cursor, ), )[::-1]
+
+    def test_read_matches_page_new(self, cursor, ):
+        self.create_matches_table(cursor=cursor, )
+        create_shown_user(cursor=cursor, shown_id=self.best_covote['tg_user_id'], )
+        result = self.read_matches_page(cursor=cursor, limit=len(self.covotes[0]), new=True, )
+        assert self.best_covote['tg_user_id'] not in [match['tg_user_id'] for match in result]
+        assert len(result) == len(self.covotes[0]) - 1
+
     def test_drop_temp_table_user_votes(self, cursor):
         self.create_user_votes_table(cursor=cursor, )  # Ensure the table exists
         cursor.execute(self.test_cls.DROP_TEMP_TABLE_USER_VOTES, )
@@ -338,6 +392,24 @@ def test_use_age_filter(self, cursor, min_age: int, max_age: int, ):
             results = cursor.fetchall()
             assert all(min_age <= result['age'] <= max_age for result in results)
 
+        @pytest_mark.parametrize(argnames='days', argvalues=(-1, 0, 1,), )  # Around the birthday
+        def test_use_age_filter_boundaries(self, cursor, days: int, ):
+            """The birthdate range should be the same as the age computed by Postgres"""
+            self.create_matches_table(cursor, )
+            cursor.execute(
+                "UPDATE users SET birthdate = CURRENT_DATE - INTERVAL '30 YEAR' + make_interval(days => %s::int)",
+                (days,),
+            )
+            cursor.execute(
+                "SELECT tg_user_id FROM users WHERE date_part('year', age(birthdate)) BETWEEN 30 AND 30 AND "
+                f"tg_user_id IN (SELECT tg_user_id FROM {self.test_cls.TMP_COVOTES_TABLE_NAME}) ORDER BY tg_user_id"
+            )
+            expected = cursor.fetchall()
+            cursor.execute(self.test_cls.USE_AGE_FILTER, (30, 30,))
+            cursor.execute(f'SELECT tg_user_id FROM {self.test_cls.TMP_COVOTES_TABLE_NAME} ORDER BY tg_user_id', )
+            assert cursor.fetchall() == expected
+            assert bool(expected) is (days <= 0)  # Not 30 yet if the birthday is tomorrow
+
         def test_use_photo_filter(self, cursor):
             self.create_matches_table(cursor, )
             # Before
@@ -371,6 +443,13 @@ def test_use_city_filter(self, cursor):
             result = self.read_all_matches(cursor=cursor, )
             assert result == [self.best_covote, ]  # Only users with photos are left
 
+        def test_use_nearby_filter(self, cursor):
+            self.create_matches_table(cursor, )
+            cursor.execute(self.test_cls.USE_NEARBY_FILTER, ([self.best_covote['tg_user_id'], ],), )
+            assert self.read_all_matches(cursor=cursor, ) == [self.best_covote, ]
+            cursor.execute(self.test_cls.USE_NEARBY_FILTER, ([],), )  # Nobody is nearby
+            assert self.read_all_matches(cursor=cursor, ) == []
+
     def test_is_user_has_covotes(self, cursor):
         self.create_matches_table(cursor, )
         cursor.execute(self.test_cls.IS_USER_HAS_COVOTES)
@@ -383,6 +462,355 @@ def test_is_user_has_covotes(self, cursor):
         assert results is None  # Covotes are not present
 
 
+class TestPublicSingleQuery(Public, ):
+    """Single statement search should return the same as temporary tables + filters"""
+
+    no_filters = {
+        'tg_user_id': 1,
+        'goal': None,
+        'gender': None,
+        'min_age': None,
+        'max_age': None,
+        'photo': False,
+        'country': False,
+        'city': False,
+        'nearby_ids': None,
+    }
+
+    def read_filtered_matches(self, cursor, **filters, ):
+        cursor.execute(self.test_cls.READ_FILTERED_MATCHES, self.no_filters | filters, )
+        return cursor.fetchall()
+
+    def test_read_user_votes_stats(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute(self.test_cls.READ_USER_VOTES_STATS, {'tg_user_id': 1, }, )
+        assert cursor.fetchone() == {'votes_count': 11, 'has_covotes': True, }
+
+    def test_read_user_votes_stats_no_votes(self, cursor, ):
+        cursor.execute(self.test_cls.READ_USER_VOTES_STATS, {'tg_user_id': 1, }, )
+        assert cursor.fetchone() == {'votes_count': 0, 'has_covotes': False, }
+
+    def test_read_filtered_matches(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        result = self.read_filtered_matches(cursor=cursor, )
+        assert [row['id'] for row in result] == list(range(1, len(self.covotes[0]) + 1))  # Ordered
+        assert all(row['is_new'] for row in result)
+        expected = [{k: v for k, v in covote.items() if k != 'id'} for covote in self.covotes[0]]
+        assert [{k: v for k, v in row.items() if k in ('tg_user_id', 'count_common_interests', )} for row in result] == (
+            sort_matches(matches=expected, )
+        )
+
+    def test_read_filtered_matches_new(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        create_shown_user(cursor=cursor, shown_id=self.best_covote['tg_user_id'], )
+        result = self.read_filtered_matches(cursor=cursor, )
+        assert [row['tg_user_id'] for row in result if not row['is_new']] == [self.best_covote['tg_user_id'], ]
+
+    @pytest_mark.parametrize(argnames='checkbox', argvalues=('country', 'city', ), )
+    def test_read_filtered_matches_checkboxes(self, cursor, checkbox: str, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute(f"UPDATE users SET {checkbox} = 'Foo' WHERE id = %s", (self.best_covote['tg_user_id'],), )
+        result = self.read_filtered_matches(cursor=cursor, **{checkbox: True}, )
+        assert [row['tg_user_id'] for row in result] == [self.best_covote['tg_user_id'], ]
+
+    def test_read_filtered_matches_photo(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        create_photo(cursor=cursor, user_id=self.best_covote['tg_user_id'], )
+        result = self.read_filtered_matches(cursor=cursor, photo=True, )
+        assert [row['tg_user_id'] for row in result] == [self.best_covote['tg_user_id'], ]
+
+    def test_read_filtered_matches_nearby(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        result = self.read_filtered_matches(cursor=cursor, nearby_ids=[self.best_covote['tg_user_id'], ], )
+        assert [row['tg_user_id'] for row in result] == [self.best_covote['tg_user_id'], ]
+        assert self.read_filtered_matches(cursor=cursor, nearby_ids=[], ) == []
+
+    def test_read_users_locations(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute(
+            'UPDATE users SET latitude = 1.5, longitude = 2.5, geo_cell = tg_user_id WHERE tg_user_id IN (2, 3)',
+        )
+        cursor.execute(self.test_cls.READ_USERS_LOCATIONS, ([2, 4, ],), )
+        assert cursor.fetchall() == [{'tg_user_id': 2, 'latitude': 1.5, 'longitude': 2.5, 'geo_cell': 2, }, ]
+        cursor.execute(self.test_cls.READ_USER_LOCATION, (3,), )
+        assert cursor.fetchone() == {'tg_user_id': 3, 'latitude': 1.5, 'longitude': 2.5, 'geo_cell': 3, }
+        cursor.execute(self.test_cls.READ_USER_LOCATION, (4,), )  # Not located
+        assert cursor.fetchone() is None
+
+    def test_read_filtered_matches_goal_gender_age(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        # All the users are created with goal 1, gender 1, age 5
+        assert len(self.read_filtered_matches(cursor=cursor, goal=1, gender=1, min_age=5, max_age=5, )) == 28
+        assert self.read_filtered_matches(cursor=cursor, goal=2, ) == []
+        assert self.read_filtered_matches(cursor=cursor, gender=2, ) == []
+        assert self.read_filtered_matches(cursor=cursor, min_age=18, max_age=25, ) == []
+
+    def test_read_all_votes(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute(self.test_cls.READ_ALL_VOTES, )
+        result = cursor.fetchall()
+        assert len(result) == sum(bool(value) for votes_values in self.fixed_votes for value in votes_values)
+        assert all(row['value'] for row in result)
+
+    def test_upsert_precomputed_matches(self, cursor, ):
+        """The second run replaces the counts, the pairs not found by it are deleted as stale"""
+        for computed_at, match_ids, counts in (('2023-01-01', [2, 3, ], [5, 6, ],), ('2023-01-02', [3, ], [7, ],),):
+            cursor.execute(
+                self.test_cls.UPSERT_PRECOMPUTED_MATCHES,
+                {'tg_user_ids': [1] * len(match_ids), 'match_ids': match_ids, 'counts': counts, 'computed_at': computed_at, },
+            )
+        cursor.execute(self.test_cls.DELETE_STALE_PRECOMPUTED_MATCHES, {'computed_at': '2023-01-02', }, )
+        cursor.execute('SELECT tg_user_id, match_id, count_common_interests FROM precomputed_matches', )
+        assert cursor.fetchall() == [{'tg_user_id': 1, 'match_id': 3, 'count_common_interests': 7, }, ]
+
+    def test_read_votes_since(self, cursor, ):
+        """The mark is inclusive, canceled votes are included as zero"""
+        create_user(cursor=cursor, user_id=1, )
+        for post_id, value in enumerate((1, 0, -1,), start=1, ):
+            create_public_vote(cursor=cursor, user_id=1, post_id=post_id, value=value, )
+        cursor.execute("UPDATE public_votes SET updated_at = '2023-01-01' WHERE post_id = 3", )
+        cursor.execute(self.test_cls.READ_VOTES_MARK, )
+        mark = cursor.fetchone()['mark']
+        cursor.execute(self.test_cls.READ_VOTES_SINCE, {'mark': mark, }, )
+        assert sorted(row['post_id'] for row in cursor.fetchall()) == [1, 2, ]
+        cursor.execute(self.test_cls.READ_VOTES_SINCE, {'mark': None, }, )
+        assert sorted(row['value'] for row in cursor.fetchall()) == [-1, 0, 1, ]
+
+    def test_read_votes_mark(self, cursor, ):
+        """Not later than the start of this transaction, a vote updated by it is committed later"""
+        cursor.execute(self.test_cls.READ_VOTES_MARK, )
+        mark = cursor.fetchone()['mark']
+        cursor.execute('SELECT CURRENT_TIMESTAMP::timestamp AS now', )
+        assert mark <= cursor.fetchone()['now']
+
+    def test_read_users_votes_counts(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute(self.test_cls.TRUNCATE_USERS_VOTES_COUNTS, )
+        cursor.execute(self.test_cls.FILL_USERS_VOTES_COUNTS, )
+        expected = [
+            {'tg_user_id': i, 'votes_count': sum(bool(value) for value in self.fixed_votes[i - 1])} for i in (1, 2,)
+        ]
+        for statement in (self.test_cls.READ_USERS_VOTES_COUNTS, self.test_cls.COUNT_USERS_VOTES,):
+            cursor.execute(statement, {'tg_user_ids': [1, 2, -1, ], }, )
+            assert sorted(cursor.fetchall(), key=lambda row: row['tg_user_id'], ) == expected
+
+    def test_fill_users_votes_counts_stale(self, cursor, ):
+        """The recount overwrites the stale counters without the truncate"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute(self.test_cls.TRUNCATE_USERS_VOTES_COUNTS, )
+        cursor.execute(
+            'INSERT INTO users_votes_counts (tg_user_id, votes_count) VALUES (1, 100), (2, 100)',
+        )
+        cursor.execute(self.test_cls.FILL_USERS_VOTES_COUNTS, )
+        cursor.execute(self.test_cls.READ_USERS_VOTES_COUNTS, {'tg_user_ids': [1, 2, ], }, )
+        recounted = sorted(cursor.fetchall(), key=lambda row: row['tg_user_id'], )
+        cursor.execute(self.test_cls.COUNT_USERS_VOTES, {'tg_user_ids': [1, 2, ], }, )
+        assert recounted == sorted(cursor.fetchall(), key=lambda row: row['tg_user_id'], )
+
+    def test_update_user_votes_count(self, cursor, ):
+        """Incrementally updated counter should be equal to the full recount"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute(self.test_cls.TRUNCATE_USERS_VOTES_COUNTS, )
+        cursor.execute(self.test_cls.FILL_USERS_VOTES_COUNTS, )
+        new_user_id = self.count_users + 1
+        create_user(cursor=cursor, user_id=new_user_id, )
+        create_public_vote(cursor=cursor, user_id=1, post_id=len(self.fixed_votes[0]) + 1, value=1, )
+        create_public_vote(cursor=cursor, user_id=new_user_id, post_id=1, value=-1, )  # The first vote of the user
+        for tg_user_id in (1, new_user_id,):
+            cursor.execute(self.test_cls.UPDATE_USER_VOTES_COUNT, {'tg_user_id': tg_user_id, 'delta': 1, }, )
+        cursor.execute(self.test_cls.READ_USERS_VOTES_COUNTS, {'tg_user_ids': [1, new_user_id, ], }, )
+        incremental = sorted(cursor.fetchall(), key=lambda row: row['tg_user_id'], )
+        cursor.execute(self.test_cls.COUNT_USERS_VOTES, {'tg_user_ids': [1, new_user_id, ], }, )
+        assert incremental == sorted(cursor.fetchall(), key=lambda row: row['tg_user_id'], )
+
+    def test_read_users_count(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute(self.test_cls.READ_USERS_COUNT, )
+        assert cursor.fetchone() == {'count': self.count_users, }
+
+    def test_read_covotes_posts(self, cursor, ):
+        """Covotes per candidate should be the same as count_common_interests"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        candidates = [covote['tg_user_id'] for covote in self.covotes[0]]
+        cursor.execute(self.test_cls.READ_COVOTES_POSTS, {'tg_user_id': 1, 'tg_user_ids': candidates, }, )
+        result = cursor.fetchall()
+        assert {row['voters_count'] for row in result} <= set(range(1, self.count_users + 1))
+        counts = {}
+        for row in result:
+            counts[row['tg_user_id']] = counts.get(row['tg_user_id'], 0) + 1
+        assert counts == {covote['tg_user_id']: covote['count_common_interests'] for covote in self.covotes[0]}
+
+    def test_read_filtered_engine_matches(self, cursor, ):
+        """Covotes from the engine should give the same result as covotes counted by DB"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        create_shown_user(cursor=cursor, shown_id=self.best_covote['tg_user_id'], )
+        expected = self.read_filtered_matches(cursor=cursor, )
+        cursor.execute(
+            self.test_cls.READ_FILTERED_ENGINE_MATCHES,
+            self.no_filters | {
+                'covotes_ids': [covote['tg_user_id'] for covote in self.covotes[0]],
+                'covotes_counts': [covote['count_common_interests'] for covote in self.covotes[0]],
+            },
+        )
+        assert cursor.fetchall() == expected
+
+
+    def test_read_filtered_recent_matches(self, cursor, ):
+        """All the votes are recent - the same as the full search, otherwise only the covoters of the latest votes"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute(self.test_cls.READ_FILTERED_RECENT_MATCHES, self.no_filters | {'votes_limit': 1_000, }, )
+        assert cursor.fetchall() == self.read_filtered_matches(cursor=cursor, )
+        cursor.execute("UPDATE public_votes SET updated_at = '2023-01-01' WHERE tg_user_id = 1 AND post_id != 1", )
+        cursor.execute(self.test_cls.READ_FILTERED_RECENT_MATCHES, self.no_filters | {'votes_limit': 1, }, )
+        result = cursor.fetchall()
+        cursor.execute(
+            'SELECT tg_user_id FROM public_votes WHERE tg_user_id != 1 AND post_id = 1 AND value = '
+            '(SELECT value FROM public_votes WHERE tg_user_id = 1 AND post_id = 1)',
+        )
+        assert sorted(row['tg_user_id'] for row in result) == sorted(row['tg_user_id'] for row in cursor.fetchall())
+        assert {row['count_common_interests'] for row in result} == {1, }
+
+    def test_set_statement_timeout(self, cursor, ):
+        cursor.execute(postgres_sqls.System.SET_STATEMENT_TIMEOUT, ('10',), )
+        with pytest_raises(expected_exception=QueryCanceled, ):
+            cursor.execute('SELECT pg_sleep(1)', )
+
+
+class TestPublicTopMatches(Public, ):
+    """Incrementally updated table should be equal to the full recount"""
+
+    no_filters = TestPublicSingleQuery.no_filters | {'limit': 1_000, }
+
+    @staticmethod
+    def read_top_matches(cursor, ) -> list[dict]:
+        cursor.execute('SELECT * FROM user_top_matches WHERE count_common_interests > 0 ORDER BY 1, 2', )
+        return cursor.fetchall()
+
+    def update_top_matches(self, cursor, old_value: int, new_value: int, user_id: int = 1, post_id: int = 1, ):
+        cursor.execute(
+            'UPDATE public_votes SET value = %s WHERE tg_user_id = %s AND post_id = %s',
+            (new_value, user_id, post_id,),
+        )
+        if old_value:
+            cursor.execute(
+                self.test_cls.DECREASE_TOP_MATCHES,
+                {'tg_user_id': user_id, 'post_id': post_id, 'value': old_value, },
+            )
+        if new_value:
+            cursor.execute(
+                self.test_cls.UPDATE_TOP_MATCHES,
+                {'tg_user_id': user_id, 'post_id': post_id, 'value': new_value, 'delta': 1, },
+            )
+
+    def rebuild_top_matches(self, cursor, ):
+        cursor.execute(self.test_cls.TRUNCATE_TOP_MATCHES, )
+        cursor.execute(self.test_cls.FILL_TOP_MATCHES, )
+
+    def test_fill_top_matches(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        self.rebuild_top_matches(cursor=cursor, )
+        cursor.execute(self.test_cls.READ_FILTERED_TOP_MATCHES, self.no_filters, )
+        result = cursor.fetchall()
+        expected = [{k: v for k, v in covote.items() if k != 'id'} for covote in self.covotes[0]]
+        assert [{k: v for k, v in row.items() if k in ('tg_user_id', 'count_common_interests', )} for row in result] == (
+            sort_matches(matches=expected, )
+        )
+
+    @pytest_mark.parametrize(argnames='old_value, new_value', argvalues=((1, 0,), (1, -1,), (-1, 1,),), )
+    def test_update_top_matches(self, cursor, old_value: int, new_value: int, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute('UPDATE public_votes SET value = %s WHERE tg_user_id = 1 AND post_id = 1', (old_value,), )
+        self.rebuild_top_matches(cursor=cursor, )
+        self.update_top_matches(cursor=cursor, old_value=old_value, new_value=new_value, )
+        incremental = self.read_top_matches(cursor=cursor, )
+        self.rebuild_top_matches(cursor=cursor, )
+        assert incremental == self.read_top_matches(cursor=cursor, )
+
+    def test_update_top_matches_many(self, cursor, ):
+        """The votes of a few users for the same post at once, the pairs of the batch voters are counted once"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        self.rebuild_top_matches(cursor=cursor, )
+        cursor.execute('SELECT tg_user_id, value FROM public_votes WHERE post_id = 1 ORDER BY 1 LIMIT 3', )
+        old_values = {row['tg_user_id']: row['value'] for row in cursor.fetchall()}
+        new_values = dict(zip(old_values, (1, 1, 0,), ))  # The first two are equal now
+        for tg_user_id, new_value in new_values.items():
+            cursor.execute(
+                'UPDATE public_votes SET value = %s WHERE tg_user_id = %s AND post_id = 1', (new_value, tg_user_id,),
+            )
+        backends.execute_values(
+            cursor=cursor,
+            statement=self.test_cls.UPDATE_TOP_MATCHES_MANY,
+            rows=[(tg_user_id, 1, old_value,) for tg_user_id, old_value in old_values.items()],
+            template=self.test_cls.UPDATE_TOP_MATCHES_MANY_TEMPLATE,
+            page_size=len(old_values),
+            fetch=False,
+        )
+        incremental = self.read_top_matches(cursor=cursor, )
+        self.rebuild_top_matches(cursor=cursor, )
+        assert incremental == self.read_top_matches(cursor=cursor, )
+
+    def test_decrease_top_matches_trimmed(self, cursor, ):
+        """A pair out of the table (trimmed) is not inserted back by the decrease"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        self.rebuild_top_matches(cursor=cursor, )
+        cursor.execute('DELETE FROM user_top_matches WHERE tg_user_id = 1 OR match_id = 1', )
+        cursor.execute('SELECT value FROM public_votes WHERE tg_user_id = 1 AND post_id = 1', )
+        value = cursor.fetchone()['value']
+        cursor.execute(self.test_cls.DECREASE_TOP_MATCHES, {'tg_user_id': 1, 'post_id': 1, 'value': value, }, )
+        cursor.execute('SELECT * FROM user_top_matches WHERE tg_user_id = 1 OR match_id = 1', )
+        assert cursor.fetchall() == []
+
+    def test_update_top_matches_trimmed(self, cursor, ):
+        """A trimmed pair that comes back is inserted with its full count, not with the delta"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute('UPDATE public_votes SET value = -1 WHERE tg_user_id = 1 AND post_id = 1', )
+        self.rebuild_top_matches(cursor=cursor, )
+        cursor.execute('DELETE FROM user_top_matches WHERE tg_user_id = 1 OR match_id = 1', )
+        self.update_top_matches(cursor=cursor, old_value=-1, new_value=1, )
+        incremental = self.read_top_matches(cursor=cursor, )
+        self.rebuild_top_matches(cursor=cursor, )
+        full = self.read_top_matches(cursor=cursor, )
+        assert [row for row in incremental if row['tg_user_id'] == 1]
+        assert all(row in full for row in incremental)
+
+    def test_update_top_matches_touched(self, cursor, ):
+        """Only the users that got the new rows are marked to trim"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        cursor.execute('UPDATE public_votes SET value = -1 WHERE tg_user_id = 1 AND post_id = 1', )
+        self.rebuild_top_matches(cursor=cursor, )
+        cursor.execute('SELECT tg_user_id FROM user_top_matches_touched', )
+        assert cursor.fetchall() == []
+        cursor.execute('DELETE FROM user_top_matches WHERE tg_user_id = 1', )
+        self.update_top_matches(cursor=cursor, old_value=-1, new_value=1, )
+        cursor.execute('SELECT tg_user_id FROM user_top_matches_touched', )
+        assert cursor.fetchall() == [{'tg_user_id': 1, }, ]
+
+    def test_trim_top_matches(self, cursor, ):
+        """Not positive pairs of the touched users are removed, the rest are kept (less than K per user)"""
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        self.rebuild_top_matches(cursor=cursor, )
+        expected = self.read_top_matches(cursor=cursor, )
+        cursor.execute(
+            'INSERT INTO user_top_matches (tg_user_id, match_id, count_common_interests) '
+            'VALUES (1, -1, 0), (-1, 1, -1), (2, -1, 0)',
+        )
+        cursor.execute('INSERT INTO user_top_matches_touched (tg_user_id) VALUES (1), (-1)', )
+        cursor.execute(self.test_cls.TRIM_TOP_MATCHES, )
+        cursor.execute('SELECT * FROM user_top_matches ORDER BY 1, 2', )
+        assert cursor.fetchall() == sorted(
+            expected + [{'tg_user_id': 2, 'match_id': -1, 'count_common_interests': 0, }, ],
+            key=lambda row: (row['tg_user_id'], row['match_id'],),
+        )
+        cursor.execute('SELECT tg_user_id FROM user_top_matches_touched', )
+        assert cursor.fetchall() == []
+
+    def test_read_filtered_top_matches_limit(self, cursor, ):
+        create_fixed_votes(cursor=cursor, func=create_public_vote, )
+        self.rebuild_top_matches(cursor=cursor, )
+        cursor.execute(self.test_cls.READ_FILTERED_TOP_MATCHES, self.no_filters | {'limit': 1, }, )
+        assert [row['tg_user_id'] for row in cursor.fetchall()] == [self.best_covote['tg_user_id'], ]
+
+
 class TestPersonal:
     test_cls = postgres_sqls.Matches.Personal
 
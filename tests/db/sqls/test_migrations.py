@@ -0,0 +1,55 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+from app.db import postgres_sqls
+from app.db import manager as db_manager
+
+if TYPE_CHECKING:
+    from psycopg import Connection, Cursor
+
+
+class TestMigrations:
+
+    test_cls = postgres_sqls.Migrations
+
+    def test_read_schema_version(self, cursor: Cursor, ):
+        cursor.execute(self.test_cls.READ_SCHEMA_VERSION, )
+        assert cursor.fetchone() == {'coalesce': 0, }
+        cursor.execute(self.test_cls.CREATE_SCHEMA_VERSION, (1,))
+        cursor.execute(self.test_cls.READ_SCHEMA_VERSION, )
+        assert cursor.fetchone() == {'coalesce': 1, }
+
+    def test_migrate(self, connection: Connection, cursor: Cursor, ):
+        """Indexes are created concurrently, the second run does nothing"""
+        connection.commit()  # Concurrent index creation waits for the open transactions
+        last_version = max(db_manager.Postgres.migrations)
+        assert db_manager.Postgres.migrate(connection=connection, ) == last_version
+        assert db_manager.Postgres.migrate(connection=connection, ) == last_version
+        cursor.execute('SELECT indexname FROM pg_indexes', )
+        indexes = {row['indexname'] for row in cursor.fetchall()}
+        assert {
+            'public_votes_covotes_idx',
+            'collections_name_pattern_idx',
+            'public_votes_updated_at_idx',
+            'users_geo_cell_idx',
+            'users_filters_idx',
+            'users_has_country_idx',
+            'users_has_city_idx',
+        } <= indexes
+        cursor.execute('SELECT version FROM schema_version', )
+        assert cursor.fetchall() == [{'version': version, } for version in sorted(db_manager.Postgres.migrations)]
@@ -16,7 +16,7 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
-from pytest import fixture, mark
+from pytest import fixture
 
 from app.db import postgres_sqls
 
@@ -202,13 +202,8 @@ def test_read_user_collection_id_by_name(self, cursor: Cursor, create_collection
         result = cursor.fetchone()
         assert result == {'collection_id': 1}
 
-    @mark.skip(
-        reason='Query for psycopg v2 and v3 are differ. '
-               'V3 requires brackets but able to handle a flat tuple.'
-               'V2 not requires brackets but unable to handle a flat tuple.'
-    )
     def test_read_collections_by_ids(self, cursor: Cursor, create_collection: dict):
-        cursor.execute(self.test_cls.READ_COLLECTIONS_BY_IDS, (1,))
+        cursor.execute(self.test_cls.READ_COLLECTIONS_BY_IDS, ([1, -1, ],), )
         result = cursor.fetchall()
         assert result == [self.default_expected, ]
 
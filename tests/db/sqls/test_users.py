@@ -18,7 +18,7 @@
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
-from app.db import postgres_sqls
+from app.db import postgres_sqls, backends
 
 from .conftest import create_user, read_user, create_photo, create_shown_user, read_shown_user
 
@@ -27,12 +27,7 @@
 
 
 class TestUsers:
-    """
-    Probably bug with psycopg3. Instead of setting birthdate to current year - value,
-    it's setting birthdate to current year - index of value (5 in that case)
-    See: https://github.com/psycopg/psycopg/issues/594#issue-1792154366
-    """
-    # See docstring about -5 year
+    """The birthdate is calculated from the passed age (5 years)"""
     default_expected = {
         'tg_user_id': 1,
         'fullname': 'Test User',
@@ -43,23 +38,49 @@ class TestUsers:
         'city': None,
         'comment': 'Hello, world!',
     }
+    default_params = default_expected | {'birthdate': 5}  # Age instead of the birthdate
 
     test_cls = postgres_sqls.Users
 
     def test_create_user(self, cursor: Cursor, ):
         assert read_user(user_id=1, cursor=cursor, ) is None
-        cursor.execute(self.test_cls.CREATE_USER, tuple(self.default_expected.values()))
+        cursor.execute(self.test_cls.CREATE_USER, tuple(self.default_params.values()))
         result = read_user(user_id=1, cursor=cursor, )
         assert result == self.default_expected
 
     def test_upsert_user(self, cursor: Cursor, ):
         create_user(cursor=cursor, )
-        new_params = expected = self.default_expected | {'fullname': 'New Test User'}
+        expected = self.default_expected | {'fullname': 'New Test User'}
+        new_params = self.default_params | {'fullname': 'New Test User'}
         cursor.execute(self.test_cls.UPSERT_USER, tuple(new_params.values()) * 2)
         result = read_user(user_id=1, cursor=cursor, )
-        result['birthdate'] = expected['birthdate']  # Just quickfix, some troubles with date in beta psycopg3
         assert result == expected
 
+    def test_upsert_users(self, cursor: Cursor, ):
+        create_user(cursor=cursor, )
+        location = {'latitude': 1.5, 'longitude': 2.5, 'geo_cell': 3, }
+        new_params = self.default_params | {'fullname': 'New Test User'} | location
+        backends.execute_values(
+            cursor=cursor,
+            statement=self.test_cls.UPSERT_USERS,
+            rows=[tuple(new_params.values()), tuple((new_params | {'tg_user_id': 2, }).values()), ],
+            template=self.test_cls.UPSERT_USERS_TEMPLATE,
+            page_size=1,
+            fetch=False,
+        )
+        expected = self.default_expected | {'fullname': 'New Test User'} | location
+        cursor.execute(
+            'SELECT tg_user_id, fullname, goal, gender, birthdate, country, city, comment, latitude, longitude, geo_cell '
+            'FROM users ORDER BY tg_user_id',
+        )
+        assert cursor.fetchall() == [expected, expected | {'tg_user_id': 2, }, ]
+
+    def test_update_user_location(self, cursor: Cursor, ):
+        create_user(cursor=cursor, )
+        cursor.execute(self.test_cls.UPDATE_USER_LOCATION, (1.5, 2.5, 3, 1,), )
+        cursor.execute('SELECT latitude, longitude, geo_cell FROM users WHERE tg_user_id = 1', )
+        assert cursor.fetchone() == {'latitude': 1.5, 'longitude': 2.5, 'geo_cell': 3, }
+
     def test_is_registered(self, cursor: Cursor, ):
         create_user(cursor=cursor, )
         cursor.execute(self.test_cls.IS_REGISTERED, (1,))
@@ -75,6 +96,20 @@ def test_read_user(self, cursor: Cursor, ):
         result = cursor.fetchone()
         assert result == expected
 
+    def test_read_users_with_photos(self, cursor: Cursor, ):
+        create_photo(cursor=cursor, user_id=1, photo_file_id='foo', )
+        create_photo(cursor=cursor, user_id=1, photo_file_id='bar', )
+        create_user(cursor=cursor, user_id=2, )  # Without photos
+        create_user(cursor=cursor, user_id=3, )  # Not requested
+        expected = self.default_expected | {'age': 5}  # See cls docstring
+        del expected['birthdate']
+        cursor.execute(self.test_cls.READ_USERS_WITH_PHOTOS, ([1, 2, 4, ],))  # 4 not exists
+        result = sorted(cursor.fetchall(), key=lambda row: row['tg_user_id'], )
+        assert result == [
+            expected | {'photos': ['foo', 'bar', ]},
+            expected | {'tg_user_id': 2, 'photos': []},
+        ]
+
     def test_delete_user(self, cursor: Cursor, ):
         create_user(cursor=cursor, )
         cursor.execute(self.test_cls.DELETE_USER, (1,))
@@ -116,6 +151,43 @@ def test_delete_user_photos(self, cursor, ):
         assert result == [self.default_expected, ]
 
 
+    def test_create_photos(self, cursor, ):
+        create_photo(cursor=cursor, photo_file_id='foo', )  # Conflict is skipped
+        backends.execute_values(
+            cursor=cursor,
+            statement=self.test_cls.CREATE_PHOTOS,
+            rows=[(1, 'foo',), (1, 'bar',), ],
+            template=None,
+            page_size=100,
+            fetch=False,
+        )
+        cursor.execute(self.test_cls.READ_PHOTOS, (1,))
+        assert sorted(cursor.fetchall(), key=lambda row: row['tg_photo_file_id'], ) == [
+            {'tg_photo_file_id': 'bar', },
+            {'tg_photo_file_id': 'foo', },
+        ]
+
+    def test_copy_photos(self, cursor, psycopg2_cursor, ):
+        """Both the drivers, psycopg2 sends the rows as the escaped text"""
+        create_user(cursor=psycopg2_cursor, user_id=1, )
+        backends.copy(cursor=psycopg2_cursor, statement=self.test_cls.COPY_PHOTOS, rows=[(1, 'foo\tbar\\',), ], )
+        psycopg2_cursor.execute(self.test_cls.READ_PHOTOS, (1,))
+        assert psycopg2_cursor.fetchall() == [('foo\tbar\\',), ]
+        create_user(cursor=cursor, user_id=2, )
+        backends.copy(cursor=cursor, statement=self.test_cls.COPY_PHOTOS, rows=[(2, 'foo\tbar\\',), ], )
+        cursor.execute(self.test_cls.READ_PHOTOS, (2,))
+        assert cursor.fetchall() == [{'tg_photo_file_id': 'foo\tbar\\', }, ]
+        psycopg2_cursor.connection.rollback()
+
+    def test_delete_users_photos(self, cursor, ):
+        create_photo(cursor=cursor, user_id=1, )
+        create_photo(cursor=cursor, user_id=2, )
+        create_photo(cursor=cursor, user_id=3, )  # Should not be deleted
+        cursor.execute(self.test_cls.DELETE_USERS_PHOTOS, ([1, 2, ],))
+        cursor.execute('SELECT tg_user_id FROM photos', )
+        assert cursor.fetchall() == [{'tg_user_id': 3, }, ]
+
+
 class TestShownUsers:
 
     test_cls = postgres_sqls.ShownUsers
@@ -158,3 +230,28 @@ def test_read_all_users_ids(self, cursor, ):
         cursor.execute(self.test_cls.READ_ALL_USERS_IDS)
         result = cursor.fetchall()
         assert result == [{'tg_user_id': 1}, {'tg_user_id': 2}, ]
+
+    def test_read_users_ids_page(self, cursor, ):
+        for user_id in (3, 1, 2,):
+            create_user(cursor, user_id=user_id, )
+        cursor.execute(self.test_cls.READ_USERS_IDS_PAGE, {'after_tg_user_id': None, 'limit': 2, }, )
+        assert cursor.fetchall() == [{'tg_user_id': 1}, {'tg_user_id': 2}, ]
+        cursor.execute(self.test_cls.READ_USERS_IDS_PAGE, {'after_tg_user_id': 2, 'limit': 2, }, )
+        assert cursor.fetchall() == [{'tg_user_id': 3}, ]
+
+    def test_stream_all_users_ids(self, connection, psycopg2_connection, ):
+        """
+        Both the drivers, the tuples are fetched by the server-side cursor by itersize rows.
+        Every driver has its own users, the same ones would wait for the not committed transaction of the other.
+        """
+        for connection_, users_ids in ((connection, [1, 2, 3, ],), (psycopg2_connection, [4, 5, 6, ],),):
+            with connection_.cursor() as cursor:
+                for user_id in users_ids:
+                    create_user(cursor=cursor, user_id=user_id, )
+            result = backends.stream(
+                connection=connection_,
+                statement=f'{self.test_cls.READ_ALL_USERS_IDS} WHERE tg_user_id = ANY(%s) ORDER BY tg_user_id',
+                values=(users_ids,),
+                itersize=2,
+            )
+            assert list(result) == [(user_id,) for user_id in users_ids]
@@ -16,7 +16,9 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
-from app.db import postgres_sqls
+from pytest import mark as pytest_mark
+
+from app.db import postgres_sqls, backends
 
 from .conftest import create_user, create_public_post, create_personal_post, create_public_vote, create_personal_vote
 
@@ -55,6 +57,27 @@ def test_read_users_ids_voted_for_public_post(self, cursor: Cursor, ):
         result = cursor.fetchall()
         assert result == [{'tg_user_id': self.default_expected['tg_user_id']}, ]
 
+    def test_read_users_public_votes_for_post(self, cursor: Cursor, ):
+        create_public_vote(cursor=cursor, user_id=1, )
+        create_public_vote(cursor=cursor, user_id=2, )  # Not requested
+        cursor.execute(self.test_cls.READ_USERS_PUBLIC_VOTES_FOR_POST, (1, [1, 3, ],))  # 3 not voted
+        assert cursor.fetchall() == [self.default_expected, ]
+
+    def test_upsert_public_votes_values(self, cursor: Cursor, ):
+        create_public_vote(cursor=cursor, user_id=1, )
+        rows = [(1, 1, 2, -1,), (2, 1, 2, 1,), ]
+        backends.execute_values(
+            cursor=cursor,
+            statement=self.test_cls.UPSERT_PUBLIC_VOTES_VALUES,
+            rows=rows,
+            template=None,
+            page_size=100,
+            fetch=False,
+        )
+        cursor.execute(self.test_cls.READ_USERS_PUBLIC_VOTES_FOR_POST, (1, [1, 2, ],))
+        result = sorted(cursor.fetchall(), key=lambda row: row['tg_user_id'], )
+        assert result == [self.default_expected | {'value': -1}, self.default_expected | {'tg_user_id': 2, }, ]
+
     def test_read_user_public_votes_count(self, cursor: Cursor, ):
         create_public_vote(cursor=cursor, )
         create_user(cursor=cursor, )
@@ -90,6 +113,18 @@ def test_update_public_vote_value(self, cursor: Cursor, ):
         result = cursor.fetchone()
         assert result == expected
 
+    @pytest_mark.parametrize(argnames='statement', argvalues=('UPDATE_PUBLIC_VOTE_VALUE', 'UPSERT_PUBLIC_VOTE_VALUE', ), )
+    def test_vote_value_updated_at(self, cursor: Cursor, statement: str, ):
+        """The votes snapshot replays the votes by updated_at"""
+        create_public_vote(cursor=cursor, )
+        cursor.execute("UPDATE public_votes SET updated_at = '2023-01-01'", )
+        if statement == 'UPDATE_PUBLIC_VOTE_VALUE':
+            cursor.execute(self.test_cls.UPDATE_PUBLIC_VOTE_VALUE, (-1, 1, 1), )
+        else:
+            cursor.execute(self.test_cls.UPSERT_PUBLIC_VOTE_VALUE, (1, 1, 2, -1, -1), )
+        cursor.execute('SELECT updated_at = CURRENT_TIMESTAMP AS is_updated FROM public_votes', )
+        assert cursor.fetchone() == {'is_updated': True, }
+
     class TestUpsertPublicVoteMessageId(SharedAttrs):
         def test_create(self, cursor: Cursor, ):
             create_public_post(cursor=cursor, )
@@ -167,3 +202,22 @@ def test_upsert(self, cursor: Cursor, ):
             cursor.execute(self.test_cls.READ_PERSONAL_VOTE, (1, 1))
             result = cursor.fetchone()
             assert result == params
+
+    def test_read_users_personal_votes_for_post(self, cursor: Cursor, ):
+        create_personal_vote(cursor=cursor, user_id=1, )
+        create_personal_vote(cursor=cursor, user_id=2, )  # Not requested
+        cursor.execute(self.test_cls.READ_USERS_PERSONAL_VOTES_FOR_POST, (1, [1, 3, ],))  # 3 not voted
+        assert cursor.fetchall() == [self.default_expected, ]
+
+    def test_upsert_personal_votes(self, cursor: Cursor, ):
+        create_personal_vote(cursor=cursor, user_id=1, )
+        backends.execute_values(
+            cursor=cursor,
+            statement=self.test_cls.UPSERT_PERSONAL_VOTES,
+            rows=[(1, 1, 3, -1,), (2, 1, 2, 1,), ],
+            template=None,
+            page_size=100,
+            fetch=False,
+        )
+        assert self.read(cursor=cursor, ) == self.default_expected | {'message_id': 3, 'value': -1, }
+        assert self.read(cursor=cursor, user_id=2, ) == self.default_expected | {'tg_user_id': 2, }
@@ -0,0 +1,140 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+from unittest.mock import patch, create_autospec, call, ANY
+
+import psycopg
+import pytest
+from psycopg.rows import dict_row, tuple_row
+from psycopg2 import extras as pg_extras
+from psycopg2.extensions import connection as pg_ext_connection, cursor as pg_ext_cursor
+
+from app.db import backends
+from app.db.manager import Postgres
+
+
+def test_connect_psycopg2():
+    with patch.object(backends.psycopg2, 'connect', autospec=True, ) as mock_connect:
+        result = backends.get_connect(backend=backends.Backend.PSYCOPG2, config=Postgres.CONFIG, prepare_threshold=5, )()
+    mock_connect.assert_called_once_with(cursor_factory=pg_extras.RealDictCursor, **vars(Postgres.CONFIG), )
+    assert result == mock_connect.return_value
+
+
+def test_connect_psycopg3():
+    with patch.object(backends.psycopg, 'connect', autospec=True, ) as mock_connect:
+        result = backends.get_connect(backend=backends.Backend.PSYCOPG3, config=Postgres.CONFIG, prepare_threshold=5, )()
+    mock_connect.assert_called_once_with(row_factory=dict_row, prepare_threshold=5, **vars(Postgres.CONFIG), )
+    assert result == mock_connect.return_value
+
+
+def test_is_pipeline_supported():
+    assert backends.is_pipeline_supported(connection=create_autospec(spec=psycopg.Connection, instance=True, ), )
+    assert not backends.is_pipeline_supported(connection=create_autospec(spec=pg_ext_connection, instance=True, ), )
+
+
+class TestExecuteValues:
+    @staticmethod
+    def test_psycopg2():
+        mock_cursor = create_autospec(spec=pg_ext_cursor, instance=True, )
+        with patch.object(backends.pg_extras, 'execute_values', autospec=True, ) as mock_execute_values:
+            result = backends.execute_values(
+                cursor=mock_cursor, statement='foo VALUES %s', rows=[(1,), ], template=None, page_size=2, fetch=True,
+            )
+        mock_execute_values.assert_called_once_with(
+            mock_cursor, 'foo VALUES %s', [(1,), ], template=None, page_size=2, fetch=True,
+        )
+        assert result == mock_execute_values.return_value
+
+    @staticmethod
+    def test_psycopg3():
+        """A statement per page, the placeholder is replaced by the rows placeholders"""
+        mock_cursor = create_autospec(spec=psycopg.Cursor, instance=True, )
+        mock_cursor.fetchall.side_effect = [[{'id': 1}, {'id': 2}, ], [{'id': 3}, ], ]
+        result = backends.execute_values(
+            cursor=mock_cursor,
+            statement='INSERT INTO foo (a, b) VALUES %s RETURNING id',
+            rows=[(1, 2,), (3, 4,), (5, 6,), ],
+            template=None,
+            page_size=2,
+            fetch=True,
+        )
+        assert mock_cursor.execute.call_args_list == [
+            call('INSERT INTO foo (a, b) VALUES (%s, %s), (%s, %s) RETURNING id', [1, 2, 3, 4, ], ),
+            call('INSERT INTO foo (a, b) VALUES (%s, %s) RETURNING id', [5, 6, ], ),
+        ]
+        assert result == [{'id': 1}, {'id': 2}, {'id': 3}, ]
+
+    @staticmethod
+    def test_psycopg3_other_placeholders():
+        """Only the rows placeholder is replaced"""
+        mock_cursor = create_autospec(spec=psycopg.Cursor, instance=True, )
+        backends.execute_values(
+            cursor=mock_cursor,
+            statement="INSERT INTO foo (a, b) SELECT rows.a, '%s' FROM (VALUES %s) AS rows (a) WHERE rows.a != %s",
+            rows=[(1,), ],
+            template=None,
+            page_size=2,
+            fetch=False,
+        )
+        mock_cursor.execute.assert_called_once_with(
+            "INSERT INTO foo (a, b) SELECT rows.a, '%s' FROM (VALUES (%s)) AS rows (a) WHERE rows.a != %s", [1, ],
+        )
+
+    @staticmethod
+    @pytest.mark.parametrize(
+        argnames='statement',
+        argvalues=('INSERT INTO foo (a) SELECT %s', 'INSERT INTO foo (a) VALUES %s UNION ALL VALUES %s',),
+    )
+    def test_no_single_placeholder(statement: str, ):
+        mock_cursor = create_autospec(spec=psycopg.Cursor, instance=True, )
+        with pytest.raises(ValueError, ):
+            backends.execute_values(
+                cursor=mock_cursor, statement=statement, rows=[(1,), ], template=None, page_size=2, fetch=False,
+            )
+        mock_cursor.execute.assert_not_called()
+
+
+def test_copy_psycopg2():
+    """Text format, NULL and the special chars are escaped"""
+    mock_cursor = create_autospec(spec=pg_ext_cursor, instance=True, )
+    backends.copy(cursor=mock_cursor, statement='foo', rows=[(1, 'a\tb',), (2, None,), ], )
+    mock_cursor.copy_expert.assert_called_once_with('foo', ANY, )
+    assert mock_cursor.copy_expert.call_args.args[1].getvalue() == '1\ta\\tb\n2\t\\N\n'
+
+
+class TestStream:
+    @staticmethod
+    def test_psycopg2():
+        """Plain tuples instead of the dicts of the connection"""
+        mock_connection = create_autospec(spec=pg_ext_connection, instance=True, )
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.__iter__.return_value = iter([(1,), ])
+        result = list(backends.stream(connection=mock_connection, statement='foo', values=(1,), itersize=2, ))
+        mock_connection.cursor.assert_called_once_with(name=ANY, cursor_factory=pg_ext_cursor, )
+        assert mock_cursor.itersize == 2
+        mock_cursor.execute.assert_called_once_with('foo', (1,), )
+        assert result == [(1,), ]
+
+    @staticmethod
+    def test_psycopg3():
+        mock_connection = create_autospec(spec=psycopg.Connection, instance=True, )
+        mock_cursor = mock_connection.cursor.return_value
+        mock_cursor.__iter__.return_value = iter([(1,), ])
+        result = list(backends.stream(connection=mock_connection, statement='foo', values=None, itersize=2, ))
+        mock_connection.cursor.assert_called_once_with(name=ANY, row_factory=tuple_row, )
+        assert mock_cursor.itersize == 2
+        mock_cursor.execute.assert_called_once_with('foo', None, )
+        assert result == [(1,), ]
@@ -15,31 +15,242 @@
 
 from __future__ import annotations
 
-from unittest.mock import patch, ANY
-from typing import TYPE_CHECKING, Any as typing_Any, Iterable
+from unittest.mock import patch, ANY, call, MagicMock, create_autospec
+from time import monotonic
+from typing import Any as typing_Any, Iterable
 
 import pytest
+import psycopg
+from psycopg2 import errors as pg_errors
 
 import app.db.manager
+import app.db.transactions
 import app.postconfig
-
-
-if TYPE_CHECKING:
-    from unittest.mock import MagicMock
+import app.exceptions
 
 
 def test_get_connection():
     with patch.object(app.db.manager.Postgres, 'connection_pool', autospec=True, ) as mock_connection_pool:
         result = app.db.manager.Postgres.get_connection()
-    mock_connection_pool.getconn.assert_called_once_with()
+    mock_connection_pool.getconn.assert_called_once_with(pinned=True, )
     assert result == mock_connection_pool.getconn.return_value
 
 
-def test_get_user_connection():
-    with patch.object(app.db.manager.Postgres, 'get_connection', autospec=True, ) as mock_get_connection:
+class TestGetUserConnection:
+    @staticmethod
+    def test_unit_connection(mock_connection_f: MagicMock, ):
+        with patch.object(app.db.manager.Postgres, 'units', ) as mock_units:
+            result = app.db.manager.Postgres.get_user_connection(default=ANY, )
+        assert result == mock_units.connection
+
+    @staticmethod
+    def test_default(mock_connection_f: MagicMock, ):
+        result = app.db.manager.Postgres.get_user_connection(default=mock_connection_f, )
+        assert result == mock_connection_f
+
+    @staticmethod
+    def test_system_connection():
         result = app.db.manager.Postgres.get_user_connection()
-    mock_get_connection.assert_called_once_with()
-    assert result == mock_get_connection.return_value
+        assert result == app.db.manager.Postgres.connection
+
+
+def test_borrow():
+    with patch.object(app.db.manager.Postgres, 'connection_pool', autospec=True, ) as mock_connection_pool:
+        with app.db.manager.Postgres.borrow(owner='foo', ) as connection:
+            with app.db.manager.Postgres.borrow() as nested_connection:  # Reuse of the outer connection
+                assert app.db.manager.Postgres.get_user_connection() == nested_connection == connection
+        assert app.db.manager.Postgres.get_user_connection() == app.db.manager.Postgres.connection
+    mock_connection_pool.borrow.assert_called_once_with(owner='foo', )
+    assert connection == mock_connection_pool.borrow.return_value.__enter__.return_value
+
+
+class TestTransaction:
+    @staticmethod
+    def test_commit_once(mock_connection_f: MagicMock, ):
+        with app.db.manager.Postgres.transaction(connection=mock_connection_f, ) as connection:
+            app.db.manager.Postgres.execute(statement='foo', connection=connection, )
+            with app.db.manager.Postgres.transaction(connection=mock_connection_f, ):  # Part of the outer one
+                app.db.manager.Postgres.execute(statement='foo', connection=connection, )
+            mock_connection_f.commit.assert_not_called()
+        mock_connection_f.commit.assert_called_once_with()
+        mock_connection_f.rollback.assert_not_called()
+        assert mock_connection_f not in app.db.manager.Postgres.transactions
+
+    @staticmethod
+    def test_read_only(mock_connection_f: MagicMock, ):
+        with app.db.manager.Postgres.transaction(connection=mock_connection_f, read_only=True, ):
+            app.db.manager.Postgres.execute(statement='foo', connection=mock_connection_f, )
+            with pytest.raises(expected_exception=app.exceptions.UnexpectedException, ):
+                with app.db.manager.Postgres.transaction(connection=mock_connection_f, ):
+                    pass
+        mock_connection_f.commit.assert_not_called()
+        mock_connection_f.rollback.assert_called_once_with()
+
+    @staticmethod
+    def test_error(mock_connection_f: MagicMock, ):
+        with pytest.raises(expected_exception=ValueError, ):
+            with app.db.manager.Postgres.transaction(connection=mock_connection_f, ):
+                raise ValueError
+        mock_connection_f.commit.assert_not_called()
+        mock_connection_f.rollback.assert_called_once_with()
+        assert mock_connection_f not in app.db.manager.Postgres.transactions
+
+    @staticmethod
+    def test_unit_connection(mock_connection_f: MagicMock, ):
+        with patch.object(app.db.manager.Postgres, 'units', ) as mock_units:
+            mock_units.connection = mock_connection_f
+            with app.db.manager.Postgres.transaction() as connection:
+                assert connection == mock_connection_f
+
+    @staticmethod
+    def test_meter(mock_connection_f: MagicMock, ):
+        with patch.object(app.db.manager.Postgres, 'transactions_meter', autospec=True, ) as mock_meter:
+            with app.db.manager.Postgres.transaction(connection=mock_connection_f, ):
+                pass
+            with app.db.manager.Postgres.transaction(connection=mock_connection_f, read_only=True, ):
+                pass
+        assert [call_.kwargs['outcome'] for call_ in mock_meter.record.call_args_list] == [
+            app.db.transactions.Outcome.COMMIT,
+            app.db.transactions.Outcome.READ_ONLY,
+        ]
+
+
+class TestAfterCommit:
+    @staticmethod
+    def test_no_transaction(mock_connection_f: MagicMock, ):
+        """Already committed by execute"""
+        mock_callback = MagicMock()
+        app.db.manager.Postgres.after_commit(callback=mock_callback, connection=mock_connection_f, )
+        mock_callback.assert_called_once_with()
+
+    @staticmethod
+    def test_commit(mock_connection_f: MagicMock, ):
+        mock_callback = MagicMock()
+        mock_callback.side_effect = lambda: mock_connection_f.commit.assert_called_once_with()
+        with app.db.manager.Postgres.transaction(connection=mock_connection_f, ):
+            with app.db.manager.Postgres.transaction(connection=mock_connection_f, ):  # Part of the outer one
+                app.db.manager.Postgres.after_commit(callback=mock_callback, connection=mock_connection_f, )
+            mock_callback.assert_not_called()
+        mock_callback.assert_called_once_with()
+        assert mock_connection_f not in app.db.manager.Postgres.commit_callbacks
+
+    @staticmethod
+    def test_rollback(mock_connection_f: MagicMock, ):
+        mock_callback = MagicMock()
+        with pytest.raises(expected_exception=ValueError, ):
+            with app.db.manager.Postgres.transaction(connection=mock_connection_f, ):
+                app.db.manager.Postgres.after_commit(callback=mock_callback, connection=mock_connection_f, )
+                raise ValueError
+        mock_callback.assert_not_called()
+        assert mock_connection_f not in app.db.manager.Postgres.commit_callbacks
+
+
+class TestPipeline:
+    @staticmethod
+    @pytest.fixture
+    def mock_connection() -> MagicMock:
+        """psycopg3 connection"""
+        yield create_autospec(spec=psycopg.Connection, spec_set=True, instance=True, )
+
+    @staticmethod
+    def test_not_supported(mock_connection_f: MagicMock, ):
+        """psycopg2, the statements are executed as usual"""
+        with app.db.manager.Postgres.pipeline(connection=mock_connection_f, ):
+            assert mock_connection_f not in app.db.manager.Postgres.pipelines
+            app.db.manager.Postgres.execute(statement='foo', connection=mock_connection_f, )
+        mock_connection_f.commit.assert_called_once_with()
+
+    @staticmethod
+    def test_pipeline(mock_connection: MagicMock, ):
+        with app.db.manager.Postgres.track(connection=mock_connection, ) as counter:
+            with app.db.manager.Postgres.pipeline(connection=mock_connection, ):
+                with app.db.manager.Postgres.pipeline(connection=mock_connection, ):  # Part of the outer one
+                    assert app.db.manager.Postgres.execute(statement='foo', connection=mock_connection, ) is None
+                assert app.db.manager.Postgres.execute(statement='foo', connection=mock_connection, ) is None
+                mock_connection.commit.assert_not_called()
+        mock_connection.pipeline.assert_called_once_with()
+        mock_connection.commit.assert_called_once_with()
+        assert counter['round_trips'] == 1
+        assert mock_connection not in app.db.manager.Postgres.pipelines
+
+    @staticmethod
+    def test_transaction(mock_connection: MagicMock, ):
+        """Committed by the transaction scope"""
+        with app.db.manager.Postgres.transaction(connection=mock_connection, ):
+            with app.db.manager.Postgres.pipeline(connection=mock_connection, ):
+                app.db.manager.Postgres.execute(statement='foo', connection=mock_connection, )
+            mock_connection.commit.assert_not_called()
+        mock_connection.commit.assert_called_once_with()
+
+    @staticmethod
+    def test_deadline(mock_connection: MagicMock, ):
+        """Statement error is raised on the pipeline exit"""
+        mock_connection.pipeline.return_value.__exit__.side_effect = psycopg.errors.QueryCanceled
+        with pytest.raises(expected_exception=app.exceptions.DeadlineExceeded, ):
+            with (
+                app.db.manager.Postgres.deadline(connection=mock_connection, deadline=monotonic() + 60, ),
+                app.db.manager.Postgres.pipeline(connection=mock_connection, ),
+            ):
+                app.db.manager.Postgres.execute(statement='foo', connection=mock_connection, )
+        mock_connection.rollback.assert_called_once_with()
+        mock_connection.commit.assert_not_called()
+
+    @staticmethod
+    def test_after_commit(mock_connection: MagicMock, ):
+        """The callback waits for the pipeline result"""
+        mock_callback = MagicMock()
+        mock_callback.side_effect = lambda: mock_connection.commit.assert_called_once_with()
+        with app.db.manager.Postgres.pipeline(connection=mock_connection, ):
+            app.db.manager.Postgres.after_commit(callback=mock_callback, connection=mock_connection, )
+            mock_callback.assert_not_called()
+        mock_callback.assert_called_once_with()
+
+    @staticmethod
+    def test_after_commit_error(mock_connection: MagicMock, ):
+        """A statement error is raised on the exit, the callback is dropped"""
+        mock_connection.pipeline.return_value.__exit__.side_effect = psycopg.errors.UniqueViolation
+        mock_callback = MagicMock()
+        with (
+            patch.object(app.postconfig, 'logger', autospec=True, ),
+            pytest.raises(expected_exception=psycopg.errors.UniqueViolation, ),
+        ):
+            with app.db.manager.Postgres.pipeline(connection=mock_connection, ):
+                app.db.manager.Postgres.after_commit(callback=mock_callback, connection=mock_connection, )
+        mock_callback.assert_not_called()
+        assert mock_connection not in app.db.manager.Postgres.commit_callbacks
+
+    @staticmethod
+    def test_after_commit_transaction(mock_connection: MagicMock, ):
+        """Run by the transaction scope"""
+        mock_callback = MagicMock()
+        with app.db.manager.Postgres.transaction(connection=mock_connection, ):
+            with app.db.manager.Postgres.pipeline(connection=mock_connection, ):
+                app.db.manager.Postgres.after_commit(callback=mock_callback, connection=mock_connection, )
+            mock_callback.assert_not_called()
+        mock_callback.assert_called_once_with()
+
+
+def test_transactions_meter():
+    timer = MagicMock(side_effect=[0, 1, 2, 3, ], )
+    meter = app.db.transactions.TransactionsMeter(timer=timer, )
+    assert meter.stats()['commits_per_second'] == 0
+    for outcome in ('commit', 'read_only', 'commit', 'rollback',):
+        meter.record(seconds=0.01, outcome=app.db.transactions.Outcome(outcome), )
+    assert meter.stats() == {
+        'commits': 2, 'read_only': 1, 'rollbacks': 1, 'commits_per_second': 0.5,
+        'p50_ms': 10, 'p95_ms': 10, 'max_ms': 10,
+    }
+
+
+def test_check_pool():
+    checkout = {'owner': 'foo', 'since': monotonic(), 'pinned': False, 'is_leak_reported': True, }
+    with (
+        patch.object(app.db.manager.Postgres, 'connection_pool', autospec=True, ) as mock_connection_pool,
+        patch.object(app.postconfig, 'logger', autospec=True, ) as mock_logger,
+    ):
+        mock_connection_pool.find_leaks.return_value = [checkout, checkout, ]
+        app.db.manager.Postgres.check_pool()
+    assert mock_logger.warning.call_count == 2
 
 
 class TestExecute:
@@ -73,6 +284,53 @@ def test_success(mock_connection_f: MagicMock, ):
         mock_cursor.execute.assert_called_once_with('foo', ('foo',), )
         assert result == mock_extract_result.return_value
 
+    @staticmethod
+    def test_deadline(mock_connection_f: MagicMock, ):
+        mock_cursor = mock_connection_f.cursor.return_value.__enter__.return_value
+        with app.db.manager.Postgres.deadline(connection=mock_connection_f, deadline=monotonic() + 60, ):
+            app.db.manager.Postgres.execute(statement='foo', connection=mock_connection_f, )
+        assert mock_connection_f not in app.db.manager.Postgres.deadlines
+        assert mock_cursor.execute.call_args_list == [
+            call(app.db.manager.Postgres.sqls.System.SET_STATEMENT_TIMEOUT, (ANY,), ),
+            call('foo', None, ),
+        ]
+        assert 0 < mock_cursor.execute.call_args_list[0].args[1][0] <= 60_000
+
+    @staticmethod
+    def test_track(mock_connection_f: MagicMock, ):
+        mock_cursor = mock_connection_f.cursor.return_value.__enter__.return_value
+        with app.db.manager.Postgres.track(connection=mock_connection_f, ) as counter:
+            mock_cursor.rowcount = 5
+            app.db.manager.Postgres.execute(statement='foo', connection=mock_connection_f, )
+            mock_cursor.rowcount = -1  # Not applicable
+            with app.db.manager.Postgres.deadline(connection=mock_connection_f, deadline=monotonic() + 60, ):
+                app.db.manager.Postgres.execute(statement='foo', connection=mock_connection_f, )
+        assert counter == {'round_trips': 3, 'rows': 5, }  # Statement timeout is the extra round trip
+        assert mock_connection_f not in app.db.manager.Postgres.trackers
+        app.db.manager.Postgres.execute(statement='foo', connection=mock_connection_f, )  # Not tracked anymore
+        assert counter == {'round_trips': 3, 'rows': 5, }
+
+    @staticmethod
+    def test_deadline_is_over(mock_connection_f: MagicMock, ):
+        mock_cursor = mock_connection_f.cursor.return_value.__enter__.return_value
+        with app.db.manager.Postgres.deadline(connection=mock_connection_f, deadline=monotonic() - 1, ):
+            with pytest.raises(expected_exception=app.exceptions.DeadlineExceeded, ):
+                app.db.manager.Postgres.execute(statement='foo', connection=mock_connection_f, )
+        mock_cursor.execute.assert_not_called()
+        mock_connection_f.rollback.assert_called_once_with()
+
+    @staticmethod
+    def test_query_canceled(mock_connection_f: MagicMock, monkeypatch, ):
+        """Canceled by the deadline is not an error"""
+        mock_cursor = mock_connection_f.cursor.return_value.__enter__.return_value
+        monkeypatch.setattr(mock_cursor.execute, 'side_effect', [None, pg_errors.QueryCanceled, ], )
+        with patch.object(app.postconfig, 'logger', autospec=True, ) as mock_logger:
+            with app.db.manager.Postgres.deadline(connection=mock_connection_f, deadline=monotonic() + 60, ):
+                with pytest.raises(expected_exception=app.exceptions.DeadlineExceeded, ):
+                    app.db.manager.Postgres.execute(statement='foo', connection=mock_connection_f, )
+        mock_connection_f.rollback.assert_called_once_with()
+        mock_logger.error.assert_not_called()
+
     @staticmethod
     @pytest.mark.parametrize(
         argnames="item, expected",
@@ -109,9 +367,157 @@ def test_extract_result(result: Iterable, expected: Iterable | int | str, ):
         assert app.db.manager.Postgres.extract_result(result) == expected
 
 
+class TestExecuteValues:
+    @staticmethod
+    def test_success(mock_connection_f: MagicMock, ):
+        mock_cursor = mock_connection_f.cursor.return_value.__enter__.return_value
+        with (
+            patch.object(app.db.manager.backends, 'execute_values', autospec=True, ) as mock_execute_values,
+            app.db.manager.Postgres.track(connection=mock_connection_f, ) as counter,
+        ):
+            mock_execute_values.return_value = [{'id': 1}, {'id': 2}, ]
+            result = app.db.manager.Postgres.execute_values(
+                statement='foo',
+                rows=[(1,), (2,), (3,), ],
+                connection=mock_connection_f,
+                page_size=2,
+                fetch=True,
+            )
+        mock_execute_values.assert_called_once_with(
+            cursor=mock_cursor,
+            statement='foo',
+            rows=[(1,), (2,), (3,), ],
+            template=None,
+            page_size=2,
+            fetch=True,
+        )
+        mock_connection_f.commit.assert_called_once_with()
+        assert result == [1, 2, ]
+        assert counter == {'round_trips': 2, 'rows': 3, }  # Round trip per page
+
+    @staticmethod
+    def test_no_rows(mock_connection_f: MagicMock, ):
+        assert app.db.manager.Postgres.execute_values(statement='foo', rows=[], connection=mock_connection_f, ) is None
+        mock_connection_f.cursor.assert_not_called()
+
+    @staticmethod
+    def test_transaction(mock_connection_f: MagicMock, ):
+        with (
+            patch.object(app.db.manager.backends, 'execute_values', autospec=True, ),
+            app.db.manager.Postgres.transaction(connection=mock_connection_f, ),
+        ):
+            app.db.manager.Postgres.execute_values(statement='foo', rows=[(1,), ], connection=mock_connection_f, )
+            mock_connection_f.commit.assert_not_called()
+        mock_connection_f.commit.assert_called_once_with()
+
+    @staticmethod
+    def test_error(mock_connection_f: MagicMock, ):
+        with (
+            patch.object(app.db.manager.backends, 'execute_values', autospec=True, side_effect=ValueError, ),
+            patch.object(app.postconfig, 'logger', autospec=True, ) as mock_logger,
+            pytest.raises(expected_exception=ValueError),
+        ):
+            app.db.manager.Postgres.execute_values(statement='foo', rows=[(1,), ], connection=mock_connection_f, )
+        mock_connection_f.rollback.assert_called_once_with()
+        mock_connection_f.commit.assert_not_called()
+        mock_logger.error.assert_called_once_with(ANY)
+
+
+class TestCopy:
+    @staticmethod
+    def test_success(mock_connection_f: MagicMock, ):
+        mock_cursor = mock_connection_f.cursor.return_value.__enter__.return_value
+        with (
+            patch.object(app.db.manager.backends, 'copy', autospec=True, ) as mock_copy,
+            app.db.manager.Postgres.track(connection=mock_connection_f, ) as counter,
+        ):
+            app.db.manager.Postgres.copy(statement='foo', rows=iter([(1,), (2,), ]), connection=mock_connection_f, )
+        mock_copy.assert_called_once_with(cursor=mock_cursor, statement='foo', rows=[(1,), (2,), ], )
+        mock_connection_f.commit.assert_called_once_with()
+        assert counter == {'round_trips': 1, 'rows': 2, }
+
+    @staticmethod
+    def test_error(mock_connection_f: MagicMock, ):
+        with (
+            patch.object(app.db.manager.backends, 'copy', autospec=True, side_effect=ValueError, ),
+            patch.object(app.postconfig, 'logger', autospec=True, ),
+            pytest.raises(expected_exception=ValueError),
+        ):
+            app.db.manager.Postgres.copy(statement='foo', rows=[(1,), ], connection=mock_connection_f, )
+        mock_connection_f.rollback.assert_called_once_with()
+
+
+class TestStream:
+    @staticmethod
+    def gen_rows(**_, ):
+        yield from [(1,), (2,), (3,), ]
+
+    def test_success(self, mock_connection_f: MagicMock, ):
+        with (
+            patch.object(app.db.manager.backends, 'stream', autospec=True, side_effect=self.gen_rows, ) as mock_stream,
+            app.db.manager.Postgres.track(connection=mock_connection_f, ) as counter,
+        ):
+            result = list(app.db.manager.Postgres.stream(
+                statement='foo',
+                values=(1,),
+                connection=mock_connection_f,
+                itersize=2,
+            ))
+        assert result == [(1,), (2,), (3,), ]
+        mock_stream.assert_called_once_with(connection=mock_connection_f, statement='foo', values=(1,), itersize=2, )
+        mock_connection_f.commit.assert_called_once_with()
+        assert counter == {'round_trips': 3, 'rows': 3, }  # Declaration and 2 fetches
+
+    def test_not_finished(self, mock_connection_f: MagicMock, ):
+        with patch.object(app.db.manager.backends, 'stream', autospec=True, side_effect=self.gen_rows, ):
+            stream = app.db.manager.Postgres.stream(statement='foo', connection=mock_connection_f, )
+            assert next(stream) == (1,)
+            stream.close()
+        mock_connection_f.rollback.assert_called_once_with()
+        mock_connection_f.commit.assert_not_called()
+
+    def test_transaction(self, mock_connection_f: MagicMock, ):
+        with (
+            patch.object(app.db.manager.backends, 'stream', autospec=True, side_effect=self.gen_rows, ),
+            patch.dict(app.db.manager.Postgres.transactions, {mock_connection_f: True, }, ),
+        ):
+            list(app.db.manager.Postgres.stream(statement='foo', connection=mock_connection_f, ))
+        mock_connection_f.commit.assert_not_called()
+        mock_connection_f.rollback.assert_not_called()
+
+    @staticmethod
+    def test_error(mock_connection_f: MagicMock, ):
+        with (
+            patch.object(app.db.manager.backends, 'stream', autospec=True, side_effect=ValueError, ),
+            patch.object(app.postconfig, 'logger', autospec=True, ),
+            pytest.raises(expected_exception=ValueError),
+        ):
+            list(app.db.manager.Postgres.stream(statement='foo', connection=mock_connection_f, ))
+        mock_connection_f.rollback.assert_called_once_with()
+
+
 def test_create_app_tables(monkeypatch, ):
     monkeypatch.setattr(app.db.manager.Postgres, 'tables', ['foo'])
     for connection in [typing_Any, app.db.manager.Postgres.connection, ]:
         with patch.object(app.db.manager.Postgres, 'execute', autospec=True, ) as mock_execute:
             app.db.manager.Postgres.create_app_tables(connection=connection, )
         mock_execute.assert_called_once_with(statement='foo', connection=connection, )
+
+
+def test_migrate(monkeypatch, mock_connection_f: MagicMock, ):
+    monkeypatch.setattr(app.db.manager.Postgres, 'migrations', {3: ('baz',), 1: ('foo',), 2: ('bar', 'qux',), })
+    mock_connection_f.autocommit = False
+    with patch.object(app.db.manager.Postgres, 'execute', autospec=True, return_value=1, ) as mock_execute:
+        result = app.db.manager.Postgres.migrate(connection=mock_connection_f, )
+    sqls = app.db.manager.Postgres.sqls.Migrations
+    assert mock_execute.call_args_list == [
+        call(statement=sqls.READ_SCHEMA_VERSION, connection=mock_connection_f, ),
+        # 1 is already applied
+        call(statement='bar', connection=mock_connection_f, ),
+        call(statement='qux', connection=mock_connection_f, ),
+        call(statement=sqls.CREATE_SCHEMA_VERSION, values=(2,), connection=mock_connection_f, ),
+        call(statement='baz', connection=mock_connection_f, ),
+        call(statement=sqls.CREATE_SCHEMA_VERSION, values=(3,), connection=mock_connection_f, ),
+    ]
+    assert mock_connection_f.autocommit is False  # Restored
+    assert result == 3
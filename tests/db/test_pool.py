@@ -0,0 +1,110 @@
+# Copyright (C) 2023 David Shiko
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+from threading import Thread
+from unittest.mock import MagicMock
+
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS, TRANSACTION_STATUS_UNKNOWN
+
+from app.db.pool import ConnectionPool
+import app.exceptions
+
+
+def create_connection() -> MagicMock:
+    connection = MagicMock(closed=0, )
+    connection.info.transaction_status = TRANSACTION_STATUS_IDLE
+    return connection
+
+
+@pytest.fixture
+def pool() -> ConnectionPool:
+    return ConnectionPool(
+        connect=MagicMock(side_effect=lambda: create_connection(), ),
+        maxconn=2,
+        timeout=0.05,
+        leak_seconds=10,
+        reset_statement='foo',
+        timer=MagicMock(return_value=0, ),
+    )
+
+
+def test_reuse(pool: ConnectionPool, ):
+    with pool.borrow() as connection:
+        pass
+    with pool.borrow() as connection_2:
+        pass
+    assert connection == connection_2
+    pool.connect.assert_called_once_with()
+    connection.cursor.return_value.__enter__.return_value.execute.assert_called_with('foo', )
+    assert pool.stats() == {
+        'opened': 1, 'idle': 1, 'in_use': 0, 'pinned': 0, 'checkouts': 2,
+        'waits': 0, 'wait_seconds': 0, 'max_wait_seconds': 0, 'timeouts': 0, 'leaks': 0,
+    }
+
+
+def test_exhausted(pool: ConnectionPool, ):
+    pool.getconn()
+    pool.getconn()
+    pool.timer.side_effect = [0, 1, ]  # Start, remaining
+    with pytest.raises(expected_exception=app.exceptions.PoolExhausted, ):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_wait(pool: ConnectionPool, ):
+    pool.timeout = 5
+    pool.maxconn = 1
+    connection = pool.getconn()
+    thread = Thread(target=lambda: pool.putconn(connection=connection, ), )
+    thread.start()
+    assert pool.getconn() == connection
+    thread.join()
+    assert pool.stats()['checkouts'] == 2
+
+
+def test_rollback(pool: ConnectionPool, ):
+    connection = pool.getconn()
+    connection.info.transaction_status = TRANSACTION_STATUS_INTRANS
+    pool.putconn(connection=connection, )
+    connection.rollback.assert_called_once_with()
+    assert pool.idle == [connection]
+
+
+def test_broken(pool: ConnectionPool, ):
+    connection = pool.getconn()
+    connection.info.transaction_status = TRANSACTION_STATUS_UNKNOWN
+    pool.putconn(connection=connection, )
+    connection.close.assert_called_once_with()
+    assert pool.stats()['opened'] == 0
+    assert pool.getconn() != connection
+
+
+def test_connect_error(pool: ConnectionPool, ):
+    pool.connect.side_effect = ConnectionError
+    with pytest.raises(expected_exception=ConnectionError, ):
+        pool.getconn()
+    assert pool.stats()['opened'] == 0
+
+
+def test_find_leaks(pool: ConnectionPool, ):
+    pool.getconn(owner='foo', )
+    pool.getconn(pinned=True, )
+    pool.timer.return_value = 11
+    assert [checkout['owner'] for checkout in pool.find_leaks()] == ['foo']
+    assert [checkout['owner'] for checkout in pool.find_leaks()] == ['foo']
+    assert pool.stats()['leaks'] == 1  # Counted once
+    assert pool.stats()['pinned'] == 1
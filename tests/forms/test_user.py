@@ -15,6 +15,7 @@
 
 from __future__ import annotations
 from typing import TYPE_CHECKING
+from unittest.mock import patch
 
 import pytest
 
@@ -89,9 +90,11 @@ def test_handle_location_text(new_user_f: NewUser, monkeypatch, ):
             (None, None, app.constants.Shared.Words.SKIP,),
             (app.constants.Shared.Words.BACK, None, app.constants.Shared.Words.BACK,),
         ]:
+            new_user_f.latitude, new_user_f.longitude = 45.0, 42.0
             new_user_f.handle_location_text(text=location_text)
             assert new_user_f.country == expected_country
             assert new_user_f.city == expected_city
+            assert new_user_f.latitude is new_user_f.longitude is None
 
     @staticmethod
     def test_add_photo(new_user_f: NewUser, ):
@@ -127,7 +130,9 @@ def test_handle_comment(new_user_f: NewUser, faker: Faker, ) -> None:
     @staticmethod
     def test_create_user(mock_new_user_f: MagicMock, ):
         mock_new_user_f.photos = ['foo', ]
+        mock_new_user_f.latitude = mock_new_user_f.longitude = None
         app.forms.user.NewUser.create(self=mock_new_user_f, )
+        mock_new_user_f.user.CRUD.db.transaction.assert_called_once_with(connection=mock_new_user_f.user.connection, )
         mock_new_user_f.user.CRUD.upsert.assert_called_once_with(
             tg_user_id=mock_new_user_f.user.tg_user_id,
             fullname=mock_new_user_f.fullname,
@@ -139,9 +144,72 @@ def test_create_user(mock_new_user_f: MagicMock, ):
             comment=mock_new_user_f.comment,
             connection=mock_new_user_f.user.connection,
         )
-        mock_new_user_f.Mapper.Photo.create.assert_called_once_with(user=mock_new_user_f.user, photo='foo', )
+        mock_new_user_f.user.CRUD.update_location.assert_called_once_with(
+            tg_user_id=mock_new_user_f.user.tg_user_id,
+            latitude=None,
+            longitude=None,
+            geo_cell=None,
+            connection=mock_new_user_f.user.connection,
+        )
+        mock_new_user_f.Mapper.Photo.create_many.assert_called_once_with(user=mock_new_user_f.user, photos=['foo', ], )
+        after_commit_kwargs = mock_new_user_f.user.CRUD.db.after_commit.call_args.kwargs
+        assert after_commit_kwargs['connection'] == mock_new_user_f.user.connection
+        after_commit_kwargs['callback']()  # Registered only once committed
         assert mock_new_user_f.user.is_registered is True
 
+    @staticmethod
+    def test_create_user_geolocation(mock_new_user_f: MagicMock, ):
+        mock_new_user_f.photos = []
+        mock_new_user_f.latitude, mock_new_user_f.longitude = 45.0, 42.0
+        app.forms.user.NewUser.create(self=mock_new_user_f, )
+        mock_new_user_f.user.CRUD.update_location.assert_called_once_with(
+            tg_user_id=mock_new_user_f.user.tg_user_id,
+            latitude=45.0,
+            longitude=42.0,
+            geo_cell=app.forms.user.geo.get_cell(latitude=45.0, longitude=42.0, ),
+            connection=mock_new_user_f.user.connection,
+        )
+
+
+    @staticmethod
+    def test_create_many(new_user_f: NewUser, mock_connection_f: MagicMock, ):
+        new_user_f.photos = ['foo', 'bar', 'foo', ]
+        new_user_f.latitude, new_user_f.longitude = 45.0, 42.0
+        with (
+            patch.object(NewUser.Mapper.User, 'CRUD', autospec=True, ) as mock_user_crud,
+            patch.object(NewUser.Mapper.Photo, 'CRUD', autospec=True, ) as mock_photo_crud,
+        ):
+            NewUser.create_many(new_users=[new_user_f, ], connection=mock_connection_f, )
+            after_commit_kwargs = mock_user_crud.db.after_commit.call_args.kwargs
+            assert after_commit_kwargs['connection'] == mock_connection_f
+            after_commit_kwargs['callback']()  # Registered only once committed
+        mock_user_crud.db.transaction.assert_called_once_with(connection=mock_connection_f, )
+        mock_user_crud.upsert_many.assert_called_once_with(
+            rows=[(
+                new_user_f.user.tg_user_id,
+                new_user_f.fullname,
+                new_user_f.goal,
+                new_user_f.gender,
+                new_user_f.age,
+                new_user_f.country,
+                new_user_f.city,
+                new_user_f.comment,
+                45.0,
+                42.0,
+                app.forms.user.geo.get_cell(latitude=45.0, longitude=42.0, ),
+            ), ],
+            connection=mock_connection_f,
+        )
+        mock_photo_crud.delete_users_photos.assert_called_once_with(
+            tg_user_ids=[new_user_f.user.tg_user_id, ],
+            connection=mock_connection_f,
+        )
+        mock_photo_crud.copy.assert_called_once_with(  # Without the duplicates
+            rows=[(new_user_f.user.tg_user_id, 'foo',), (new_user_f.user.tg_user_id, 'bar',), ],
+            connection=mock_connection_f,
+        )
+        assert new_user_f.user.is_registered is True
+
 
 class TestTarget:
 
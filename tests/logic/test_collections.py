@@ -76,9 +76,9 @@ def test_create(patched_crud: MagicMock, collection: app.models.collections.Coll
             name=collection.name,
             connection=collection.author.connection,
         )
-        patched_crud.create_2m2_collection_post.assert_called_once_with(
+        patched_crud.create_m2m_collection_posts.assert_called_once_with(
             collection_id=patched_crud.read_id_by_name.return_value,
-            post_id=typing_Any,
+            posts_ids=[typing_Any],
             connection=collection.author.connection,
         )
         assert len(patched_crud.mock_calls) == 3
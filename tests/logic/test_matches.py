@@ -15,17 +15,25 @@
 
 from __future__ import annotations
 
-from unittest.mock import patch, call, ANY
-from typing import TYPE_CHECKING
+from unittest.mock import patch, call, ANY, create_autospec, MagicMock
+from functools import partial
+from concurrent.futures import Future
+from sys import getsizeof
+from threading import Event
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any as typing_Any, Type
 
 import pytest
+import numpy as np
 
 import app.models.base.matches
+from app.exceptions import BadMatcherConfig, DeadlineExceeded, SearchQueueFull
 from app.models.matches import Match, Matcher
 import app.tg.ptb.config
+from tests.db.sqls.test_matches import fixed_votes, covotes
 
 if TYPE_CHECKING:
-    from unittest.mock import MagicMock
     from app.structures.base import Covote
 
 
@@ -37,12 +45,12 @@ def test_repr(matcher: Matcher, ):
     @staticmethod
     def test_drop_votes_table(mock_matcher: app.models.matches.Matcher, ):
         app.models.matches.Matcher.drop_votes_table(self=mock_matcher, )
-        mock_matcher.CRUD.drop_votes_table.assert_called_once_with(connection=mock_matcher.user.connection, )
+        mock_matcher.CRUD.drop_votes_table.assert_called_once_with(connection=mock_matcher.connection, )
 
     @staticmethod
     def test_drop_matches_table(mock_matcher: app.models.matches.Matcher, ):
         app.models.matches.Matcher.drop_matches_table(self=mock_matcher, )
-        mock_matcher.CRUD.drop_matches_table.assert_called_once_with(connection=mock_matcher.user.connection, )
+        mock_matcher.CRUD.drop_matches_table.assert_called_once_with(connection=mock_matcher.connection, )
 
     @staticmethod
     def test_create_user_votes(mock_matcher: MagicMock, ):
@@ -51,22 +59,53 @@ def test_create_user_votes(mock_matcher: MagicMock, ):
     @staticmethod
     def test_create_user_covotes(mock_matcher: MagicMock, ):
         Matcher.create_user_covotes(self=mock_matcher, )
+        mock_matcher.CRUD.create_user_covotes.assert_called_once_with(
+            tg_user_id=mock_matcher.user.tg_user_id,
+            covotes=None,
+            connection=mock_matcher.connection,
+        )
+
+    @staticmethod
+    def test_create_user_covotes_engine(mock_matcher: MagicMock, ):
+        mock_matcher.mode = Matcher.Mode.COVOTE_INDEX
+        mock_matcher.engine.count_covotes.return_value = np.array([2, 3, ]), np.array([1, 4, ])
+        Matcher.create_user_covotes(self=mock_matcher, )
+        mock_matcher.create_user_votes.assert_called_once_with()
+        mock_matcher.engine.count_covotes.assert_called_once_with(tg_user_id=mock_matcher.user.tg_user_id, )
+        mock_matcher.CRUD.create_user_covotes.assert_called_once_with(
+            tg_user_id=mock_matcher.user.tg_user_id,
+            covotes=([2, 3, ], [1, 4, ], ),
+            connection=mock_matcher.connection,
+        )
 
     @staticmethod
     def test_get_user_votes(mock_matcher: MagicMock, ):
         result = app.models.matches.Matcher.get_user_votes(self=mock_matcher, )
         # Checks
-        mock_matcher.CRUD.read_user_votes.assert_called_once_with(connection=mock_matcher.user.connection, )
+        mock_matcher.CRUD.read_user_votes.assert_called_once_with(connection=mock_matcher.connection, )
         assert result == mock_matcher.CRUD.read_user_votes.return_value
 
     @staticmethod
     def test_get_user_covotes_all(mock_matcher: MagicMock, ):
-        result = app.models.matches.Matcher.get_user_matches(self=mock_matcher, )
+        reused = {'id': 1, 'tg_user_id': 2, 'count_common_interests': 3, }
+        mock_matcher.CRUD.read_user_covotes.return_value = iter([(1, 2, 3,), (4, 5, 6,), ])
+        result = app.models.matches.Matcher.get_user_matches(self=mock_matcher, reuse={1: reused, }, )
         # Checks
         mock_matcher.CRUD.read_user_covotes.assert_called_once_with(
             tg_user_id=mock_matcher.user.tg_user_id,
-            connection=mock_matcher.user.connection,
-            new=ANY,
+            connection=mock_matcher.connection,
+            new=False,
+        )
+        assert result == [reused, {'id': 4, 'tg_user_id': 5, 'count_common_interests': 6, }, ]
+        assert result[0] is reused
+
+    @staticmethod
+    def test_get_user_covotes_new(mock_matcher: MagicMock, ):
+        result = app.models.matches.Matcher.get_user_matches(self=mock_matcher, new=True, )
+        mock_matcher.CRUD.read_user_covotes.assert_called_once_with(
+            tg_user_id=mock_matcher.user.tg_user_id,
+            connection=mock_matcher.connection,
+            new=True,
         )
         assert result == mock_matcher.CRUD.read_user_covotes.return_value
 
@@ -82,11 +121,307 @@ def test_set_unfiltered_matches(
         mock_matcher.drop_votes_table.assert_called_once_with()
         mock_matcher.drop_matches_table.assert_called_once_with()
         mock_matcher.create_user_votes.assert_called_once_with()
-        mock_matcher.CRUD.read_user_votes_count.assert_called_once_with(connection=mock_matcher.user.connection, )
+        mock_matcher.CRUD.read_user_votes_count.assert_called_once_with(connection=mock_matcher.connection, )
         mock_matcher.create_user_covotes.assert_called_once_with()
-        mock_matcher.CRUD.read_user_covotes_count.assert_called_once_with(connection=mock_matcher.user.connection, )
+        mock_matcher.CRUD.read_user_covotes_count.assert_called_once_with(connection=mock_matcher.connection, )
+        assert mock_matcher.is_user_has_covotes is True
+
+    @staticmethod
+    @pytest.mark.parametrize(argnames='mode', argvalues=(Matcher.Mode.SINGLE_QUERY, Matcher.Mode.TOP_MATCHES, ), )
+    def test_set_unfiltered_matches_single_query(mock_matcher: MagicMock, mode: Matcher.Mode, ):
+        mock_matcher.mode = mode
+        mock_matcher.CRUD.read_user_votes_stats.return_value = {'votes_count': 5, 'has_covotes': True, }
+        app.models.matches.Matcher.create_unfiltered_matches(self=mock_matcher, drop_old_votes=True, )
+        mock_matcher.CRUD.read_user_votes_stats.assert_called_once_with(
+            tg_user_id=mock_matcher.user.tg_user_id,
+            connection=mock_matcher.connection,
+        )
+        mock_matcher.drop_votes_table.assert_not_called()
+        mock_matcher.create_user_votes.assert_not_called()
+        assert mock_matcher.user_votes_count == 5
+        assert mock_matcher.is_user_has_votes is True
+        assert mock_matcher.is_user_has_covotes is True
+
+    @staticmethod
+    @pytest.mark.parametrize(argnames='mode', argvalues=(Matcher.Mode.VOTE_MATRIX, Matcher.Mode.MINHASH, ), )
+    def test_set_unfiltered_matches_engine(mock_matcher: MagicMock, mode: Matcher.Mode, ):
+        mock_matcher.mode = mode
+        mock_matcher.engine.count_covotes.return_value = np.array([2, 3, ]), np.array([1, 4, ])
+        mock_matcher.engine.read_user_votes_count.return_value = 5
+        app.models.matches.Matcher.create_unfiltered_matches(self=mock_matcher, )
+        mock_matcher.engine.count_covotes.assert_called_once_with(tg_user_id=mock_matcher.user.tg_user_id, )
+        mock_matcher.create_user_votes.assert_not_called()
+        assert mock_matcher.covotes == ([2, 3, ], [1, 4, ], )
+        assert mock_matcher.user_votes_count == 5
+        assert mock_matcher.is_user_has_votes is True
         assert mock_matcher.is_user_has_covotes is True
 
+    @staticmethod
+    def test_set_engine(monkeypatch, ):
+        mock_engine_cls = create_autospec(spec=app.models.base.matches.engines.VoteMatrix, )
+        monkeypatch.setattr(Matcher, 'mode', Matcher.Mode.VOTE_MATRIX, )
+        monkeypatch.setattr(Matcher, 'ENGINES', {Matcher.Mode.VOTE_MATRIX: mock_engine_cls, }, )
+        monkeypatch.setattr(Matcher, 'engine', None, )
+        Matcher.set_engine(connection=typing_Any, )
+        mock_engine_cls.return_value.load_snapshot.assert_called_once_with(
+            path=Matcher.SNAPSHOT_PATH,
+            connection=typing_Any,
+        )
+        mock_engine_cls.return_value.load.assert_not_called()
+        assert Matcher.engine == mock_engine_cls.return_value
+
+    @staticmethod
+    @pytest.mark.parametrize(
+        argnames='exception',
+        argvalues=(FileNotFoundError, app.models.base.matches.BadSnapshot, ),
+    )
+    def test_set_engine_no_snapshot(monkeypatch, exception: Type[Exception], ):
+        mock_engine_cls = create_autospec(spec=app.models.base.matches.engines.VoteMatrix, )
+        mock_engine_cls.return_value.load_snapshot.side_effect = exception
+        monkeypatch.setattr(Matcher, 'mode', Matcher.Mode.VOTE_MATRIX, )
+        monkeypatch.setattr(Matcher, 'ENGINES', {Matcher.Mode.VOTE_MATRIX: mock_engine_cls, }, )
+        monkeypatch.setattr(Matcher, 'engine', None, )
+        Matcher.set_engine(connection=typing_Any, )
+        mock_engine_cls.return_value.load.assert_called_once_with(connection=typing_Any, )
+        assert Matcher.engine == mock_engine_cls.return_value
+
+    @staticmethod
+    def test_save_snapshot(monkeypatch, tmp_path: Path, ):
+        monkeypatch.setattr(Matcher, 'SNAPSHOT_PATH', tmp_path / 'votes.snapshot', )
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            mock_crud.read_votes_mark.return_value = datetime(2023, 1, 1, )
+            mock_crud.stream_all_votes.return_value = iter([(2, 1, -1,), (1, 5, 1,), ], )
+            Matcher.save_snapshot(connection=typing_Any, )
+        mock_crud.db.borrow.assert_not_called()
+        mock_crud.stream_all_votes.assert_called_once_with(connection=typing_Any, )
+        result = app.models.base.matches.snapshot.read(path=tmp_path / 'votes.snapshot', )
+        assert result.mark == datetime(2023, 1, 1, )
+        assert [array.tolist() for array in result.get_votes()] == [[1, 2, ], [5, 1, ], [1, -1, ], ]
+
+    @staticmethod
+    def test_save_snapshot_borrow(monkeypatch, tmp_path: Path, ):
+        """The stream holds a transaction open, so the shared connection is not used"""
+        monkeypatch.setattr(Matcher, 'SNAPSHOT_PATH', tmp_path / 'votes.snapshot', )
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            mock_crud.read_votes_mark.return_value = None
+            mock_crud.stream_all_votes.return_value = iter([], )
+            Matcher.save_snapshot()
+        mock_crud.db.borrow.assert_called_once_with(owner='votes snapshot', )
+        connection = mock_crud.db.borrow.return_value.__enter__.return_value
+        mock_crud.read_votes_mark.assert_called_once_with(connection=connection, )
+        mock_crud.stream_all_votes.assert_called_once_with(connection=connection, )
+        assert app.models.base.matches.snapshot.read(path=tmp_path / 'votes.snapshot', ).mark is None
+
+    @staticmethod
+    @pytest.mark.parametrize(argnames='refresh_snapshot', argvalues=(True, False, ), )
+    def test_precompute_matches(refresh_snapshot: bool, ):
+        with (
+            patch.object(Matcher, 'save_snapshot', autospec=True, ) as mock_save_snapshot,
+            patch.object(app.models.base.matches.precompute, 'run', autospec=True, ) as mock_run,
+        ):
+            result = Matcher.precompute_matches(
+                connection=typing_Any,
+                processes=2,
+                refresh_snapshot=refresh_snapshot,
+                on_progress=typing_Any,
+            )
+        assert mock_save_snapshot.call_count == refresh_snapshot
+        mock_run.assert_called_once_with(
+            path=Matcher.SNAPSHOT_PATH,
+            connection=typing_Any,
+            processes=2,
+            top_k=Matcher.PRECOMPUTE_TOP_K,
+            on_progress=typing_Any,
+        )
+        assert result == mock_run.return_value
+
+    @staticmethod
+    @pytest.mark.parametrize(argnames='mode', argvalues=(Matcher.Mode.VOTE_MATRIX, Matcher.Mode.TEMP_TABLES, ), )
+    def test_create_snapshot_task(monkeypatch, mode: Matcher.Mode, ):
+        monkeypatch.setattr(Matcher, 'mode', mode, )
+        with patch.object(app.models.base.matches, 'scheduler', autospec=True, ) as mock_scheduler:
+            Matcher.create_snapshot_task()
+        if mode == Matcher.Mode.VOTE_MATRIX:
+            mock_scheduler.add_job.assert_called_once_with(
+                func=Matcher.save_snapshot,
+                trigger='interval',
+                minutes=Matcher.SNAPSHOT_INTERVAL,
+            )
+        else:
+            mock_scheduler.add_job.assert_not_called()
+
+    @staticmethod
+    @pytest.mark.parametrize(argnames='mode', argvalues=tuple(Matcher.Mode), )
+    def test_check_config(monkeypatch, mode: Matcher.Mode, ):
+        """Only the single query modes are ranked by the scoring"""
+        monkeypatch.setattr(Matcher, 'mode', mode, )
+        monkeypatch.setattr(Matcher, 'scoring', Matcher.Scoring.COMMON_COUNT, )
+        Matcher.check_config()
+        monkeypatch.setattr(Matcher, 'scoring', Matcher.Scoring.JACCARD, )
+        if mode in Matcher.SINGLE_QUERY_MODES:
+            Matcher.check_config()
+        else:
+            with pytest.raises(BadMatcherConfig, ):
+                Matcher.check_config()
+
+    @staticmethod
+    def test_set_engine_no_engine_mode(monkeypatch, ):
+        monkeypatch.setattr(Matcher, 'mode', Matcher.Mode.TEMP_TABLES, )
+        monkeypatch.setattr(Matcher, 'engine', None, )
+        Matcher.set_engine(connection=typing_Any, )
+        assert Matcher.engine is None
+
+    @staticmethod
+    def test_rebuild_top_matches():
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            Matcher.rebuild_top_matches(connection=typing_Any, )
+        mock_crud.rebuild_top_matches.assert_called_once_with(connection=typing_Any, )
+
+    @staticmethod
+    def test_trim_top_matches():
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            Matcher.trim_top_matches(connection=typing_Any, )
+        mock_crud.db.borrow.assert_not_called()
+        mock_crud.trim_top_matches.assert_called_once_with(connection=typing_Any, )
+
+    @staticmethod
+    def test_trim_top_matches_borrow():
+        """The scheduler thread doesn't use the shared connection"""
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            Matcher.trim_top_matches()
+        mock_crud.db.borrow.assert_called_once_with(owner='top matches trim', )
+        mock_crud.trim_top_matches.assert_called_once_with(
+            connection=mock_crud.db.borrow.return_value.__enter__.return_value,
+        )
+
+    @staticmethod
+    @pytest.mark.parametrize(argnames='mode', argvalues=(Matcher.Mode.TOP_MATCHES, Matcher.Mode.TEMP_TABLES, ), )
+    def test_create_top_matches_trim_task(monkeypatch, mode: Matcher.Mode, ):
+        monkeypatch.setattr(Matcher, 'mode', mode, )
+        with patch.object(app.models.base.matches, 'scheduler', autospec=True, ) as mock_scheduler:
+            Matcher.create_top_matches_trim_task()
+        if mode == Matcher.Mode.TOP_MATCHES:
+            mock_scheduler.add_job.assert_called_once_with(
+                func=Matcher.trim_top_matches,
+                trigger='interval',
+                minutes=Matcher.TOP_MATCHES_TRIM_INTERVAL,
+            )
+        else:
+            mock_scheduler.add_job.assert_not_called()
+
+    @staticmethod
+    def test_handle_vote_engine(monkeypatch, ):
+        mock_engine = create_autospec(spec=app.models.base.matches.engines.VoteMatrix, instance=True, )
+        monkeypatch.setattr(Matcher, 'engine', mock_engine, )
+        monkeypatch.setattr(Matcher, 'mode', Matcher.Mode.VOTE_MATRIX, )
+        monkeypatch.setattr(Matcher, 'versions', app.models.base.matches.cache.Versions(maxsize=10, ), )
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            Matcher.handle_vote(tg_user_id=1, post_id=2, old_value=0, new_value=-1, connection=typing_Any, )
+        mock_crud.update_top_matches.assert_not_called()
+        mock_engine.set_vote.assert_not_called()  # Not committed yet
+        callback = mock_crud.db.after_commit.call_args.kwargs['callback']
+        assert mock_crud.db.after_commit.call_args.kwargs['connection'] == typing_Any
+        callback()
+        mock_engine.set_vote.assert_called_once_with(tg_user_id=1, post_id=2, value=-1, )
+
+    @staticmethod
+    def test_handle_vote_top_matches(monkeypatch, ):
+        monkeypatch.setattr(Matcher, 'engine', None, )
+        monkeypatch.setattr(Matcher, 'mode', Matcher.Mode.TOP_MATCHES, )
+        monkeypatch.setattr(Matcher, 'versions', app.models.base.matches.cache.Versions(maxsize=10, ), )
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            Matcher.handle_vote(tg_user_id=1, post_id=2, old_value=1, new_value=0, connection=typing_Any, )
+            Matcher.handle_vote(tg_user_id=1, post_id=2, old_value=1, new_value=1, connection=typing_Any, )  # Same
+        mock_crud.update_top_matches.assert_called_once_with(
+            tg_user_id=1,
+            post_id=2,
+            old_value=1,
+            new_value=0,
+            connection=typing_Any,
+        )
+
+    @staticmethod
+    def test_handle_votes(monkeypatch, ):
+        """A statement per table for all the votes, a single callback after the commit"""
+        mock_engine = create_autospec(spec=app.models.base.matches.engines.VoteMatrix, instance=True, )
+        monkeypatch.setattr(Matcher, 'engine', mock_engine, )
+        monkeypatch.setattr(Matcher, 'mode', Matcher.Mode.TOP_MATCHES, )
+        monkeypatch.setattr(Matcher, 'versions', app.models.base.matches.cache.Versions(maxsize=10, ), )
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            Matcher.handle_votes(
+                post_id=2,
+                votes=[(1, 0, 1,), (3, 1, -1,), (4, -1, 0,), (5, 1, 1,), ],  # The last is not changed
+                connection=typing_Any,
+            )
+        mock_crud.update_votes_counts.assert_called_once_with(rows=[(1, 1,), (4, -1,), ], connection=typing_Any, )
+        mock_crud.update_top_matches_many.assert_called_once_with(
+            rows=[(1, 2, 0,), (3, 2, 1,), (4, 2, -1,), ],
+            connection=typing_Any,
+        )
+        mock_engine.set_vote.assert_not_called()  # Not committed yet
+        mock_crud.db.after_commit.assert_called_once()
+        mock_crud.db.after_commit.call_args.kwargs['callback']()
+        assert mock_engine.set_vote.call_args_list == [
+            call(tg_user_id=1, post_id=2, value=1, ),
+            call(tg_user_id=3, post_id=2, value=-1, ),
+            call(tg_user_id=4, post_id=2, value=0, ),
+        ]
+
+    @staticmethod
+    def test_handle_votes_not_changed(monkeypatch, ):
+        monkeypatch.setattr(Matcher, 'mode', Matcher.Mode.TOP_MATCHES, )
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            Matcher.handle_votes(post_id=2, votes=[(5, 1, 1,), ], connection=typing_Any, )
+        assert mock_crud.mock_calls == []
+
+    @staticmethod
+    def test_rebuild_votes_counts():
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            Matcher.rebuild_votes_counts(connection=typing_Any, )
+        mock_crud.rebuild_votes_counts.assert_called_once_with(connection=typing_Any, )
+
+    @staticmethod
+    def test_handle_vote_votes_count(monkeypatch, ):
+        monkeypatch.setattr(Matcher, 'engine', None, )
+        monkeypatch.setattr(Matcher, 'mode', Matcher.Mode.TEMP_TABLES, )
+        monkeypatch.setattr(Matcher, 'versions', app.models.base.matches.cache.Versions(maxsize=10, ), )
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            for old_value, new_value in ((0, 1,), (1, -1,), (-1, 0,), (0, 0,),):
+                Matcher.handle_vote(
+                    tg_user_id=1, post_id=2, old_value=old_value, new_value=new_value, connection=typing_Any,
+                )
+        assert mock_crud.update_votes_count.call_args_list == [  # A changed value is not a new vote
+            call(tg_user_id=1, delta=1, connection=typing_Any, ),
+            call(tg_user_id=1, delta=-1, connection=typing_Any, ),
+        ]
+
+    @staticmethod
+    def test_handle_vote_invalidates_cache(monkeypatch, matcher: Matcher, ):
+        monkeypatch.setattr(Matcher, 'engine', None, )
+        monkeypatch.setattr(Matcher, 'mode', Matcher.Mode.TEMP_TABLES, )
+        monkeypatch.setattr(Matcher, 'versions', app.models.base.matches.cache.Versions(maxsize=10, ), )
+        cache_key = matcher.get_cache_key()
+        with patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud:
+            Matcher.handle_vote(
+                tg_user_id=matcher.user.tg_user_id, post_id=2, old_value=0, new_value=1, connection=typing_Any,
+            )
+        assert matcher.get_cache_key() == cache_key  # Not committed yet
+        mock_crud.db.after_commit.call_args.kwargs['callback']()
+        assert matcher.get_cache_key() != cache_key
+
+    @staticmethod
+    def test_get_cache_key(matcher: Matcher, ):
+        cache_key = matcher.get_cache_key()
+        matcher.filters.match_type = matcher.Filters.MatchType.NEW_MATCHES  # Not a part of the key
+        assert matcher.get_cache_key() == cache_key
+        matcher.filters.checkboxes['photo'] = True
+        assert matcher.get_cache_key() != cache_key
+        cache_key = matcher.get_cache_key()
+        matcher.filters.radius += 1  # Not a part of the key while "nearby" is not checked
+        assert matcher.get_cache_key() == cache_key
+        matcher.filters.checkboxes['nearby'] = True
+        assert matcher.get_cache_key() != cache_key
+
     @staticmethod
     @pytest.mark.parametrize(
         argnames='goal',
@@ -97,7 +432,7 @@ def test_apply_goal_filter(mock_matcher: MagicMock, goal: Matcher.Filters.Goal,
         Matcher.apply_goal_filter(self=mock_matcher, update=True, )
         mock_matcher.CRUD.apply_goal_filter.assert_called_once_with(
             goal=mock_matcher.filters.goal.value,
-            connection=mock_matcher.user.connection,
+            connection=mock_matcher.connection,
         )
         mock_matcher.get_user_matches.assert_called_once_with()
         assert mock_matcher.matches.raw.current == mock_matcher.get_user_matches.return_value
@@ -120,7 +455,7 @@ def test_apply_gender_filter(mock_matcher: MagicMock, monkeypatch, gender: Match
         Matcher.apply_gender_filter(self=mock_matcher, update=True, )
         mock_matcher.CRUD.apply_gender_filter.assert_called_once_with(
             gender=mock_matcher.filters.gender.value,
-            connection=mock_matcher.user.connection,
+            connection=mock_matcher.connection,
         )
         mock_matcher.get_user_matches.assert_called_once_with()
         assert mock_matcher.matches.raw.current == mock_matcher.get_user_matches.return_value
@@ -140,7 +475,7 @@ def test_apply_age_filter(mock_matcher: MagicMock, monkeypatch, ):
         mock_matcher.CRUD.apply_age_filter.assert_called_once_with(
             min_age=mock_matcher.filters.age_range[0],
             max_age=mock_matcher.filters.age_range[1],
-            connection=mock_matcher.user.connection,
+            connection=mock_matcher.connection,
         )
         assert mock_matcher.matches.raw.current == mock_matcher.get_user_matches.return_value
 
@@ -156,7 +491,7 @@ def test_apply_checkboxes_country_filter_true(mock_matcher: MagicMock, monkeypat
         monkeypatch.setitem(mock_matcher.filters.checkboxes, 'country', True)
         Matcher.apply_checkboxes_country_filter(self=mock_matcher, update=True, )
         mock_matcher.CRUD.apply_checkboxes_country_filter.assert_called_once_with(
-            connection=mock_matcher.user.connection,
+            connection=mock_matcher.connection,
         )
         assert mock_matcher.matches.raw.current == mock_matcher.get_user_matches.return_value
 
@@ -165,7 +500,7 @@ def test_apply_checkboxes_city_filter_true(mock_matcher: MagicMock, monkeypatch,
         monkeypatch.setitem(mock_matcher.filters.checkboxes, 'city', True)
         Matcher.apply_checkboxes_city_filter(self=mock_matcher, update=True, )
         mock_matcher.CRUD.apply_checkboxes_city_filter.assert_called_once_with(
-            connection=mock_matcher.user.connection,
+            connection=mock_matcher.connection,
         )
         assert mock_matcher.matches.raw.current == mock_matcher.get_user_matches.return_value
 
@@ -174,10 +509,58 @@ def test_apply_checkboxes_photo_filter_true(mock_matcher: MagicMock, monkeypatch
         monkeypatch.setitem(mock_matcher.filters.checkboxes, 'photo', True)
         Matcher.apply_checkboxes_photo_filter(self=mock_matcher, update=True, )
         mock_matcher.CRUD.apply_checkboxes_photo_filter.assert_called_once_with(
-            connection=mock_matcher.user.connection,
+            connection=mock_matcher.connection,
+        )
+        assert mock_matcher.matches.raw.current == mock_matcher.get_user_matches.return_value
+
+    @staticmethod
+    def test_apply_checkboxes_nearby_filter(mock_matcher: MagicMock, ):
+        Matcher.apply_checkboxes_nearby_filter(self=mock_matcher, update=True, )
+        mock_matcher.CRUD.apply_nearby_filter.assert_called_once_with(
+            nearby_ids=mock_matcher.get_nearby_ids.return_value,
+            connection=mock_matcher.connection,
         )
         assert mock_matcher.matches.raw.current == mock_matcher.get_user_matches.return_value
 
+    @staticmethod
+    def test_apply_checkboxes_nearby_filter_disabled(mock_matcher: MagicMock, ):
+        mock_matcher.get_nearby_ids.return_value = None
+        Matcher.apply_checkboxes_nearby_filter(self=mock_matcher, update=True, )
+        mock_matcher.CRUD.apply_nearby_filter.assert_not_called()
+        mock_matcher.get_user_matches.assert_not_called()
+
+    @staticmethod
+    def test_get_nearby_ids(mock_matcher: MagicMock, ):
+        geo = app.models.base.matches.geo
+        mock_matcher.filters = Matcher.Filters(checkboxes=Matcher.Filters.Checkboxes(nearby=True, ), radius=10, )
+        mock_matcher.CRUD.read_user_location.return_value = {
+            'tg_user_id': 1, 'latitude': 55.75, 'longitude': 37.62, 'geo_cell': geo.get_cell(55.75, 37.62, ),
+        }
+        mock_matcher.CRUD.read_users_locations.return_value = [
+            {'tg_user_id': 2, 'latitude': 55.76, 'longitude': 37.61, 'geo_cell': geo.get_cell(55.76, 37.61, ), },
+            {'tg_user_id': 3, 'latitude': 55.80, 'longitude': 37.85, 'geo_cell': geo.get_cell(55.80, 37.85, ), },
+        ]
+        result = Matcher.get_nearby_ids(self=mock_matcher, )
+        cells = geo.get_cells(latitude=55.75, longitude=37.62, radius_km=10, )
+        mock_matcher.CRUD.read_users_locations.assert_called_once_with(
+            cells=cells.inner + cells.edge,
+            connection=mock_matcher.connection,
+        )
+        assert result == [2, ]  # The second is about 15 km away
+
+    @staticmethod
+    def test_get_nearby_ids_no_location(mock_matcher: MagicMock, ):
+        mock_matcher.filters = Matcher.Filters(checkboxes=Matcher.Filters.Checkboxes(nearby=True, ), )
+        mock_matcher.CRUD.read_user_location.return_value = None
+        assert Matcher.get_nearby_ids(self=mock_matcher, ) == []
+        mock_matcher.CRUD.read_users_locations.assert_not_called()
+
+    @staticmethod
+    def test_get_nearby_ids_disabled(mock_matcher: MagicMock, ):
+        mock_matcher.filters = Matcher.Filters()
+        assert Matcher.get_nearby_ids(self=mock_matcher, ) is None
+        mock_matcher.CRUD.read_user_location.assert_not_called()
+
     @staticmethod
     def test_apply_checkboxes_filter_false(matcher: Matcher, monkeypatch, ):
         for checkbox_name in matcher.filters.checkboxes:
@@ -190,30 +573,199 @@ def test_apply_checkboxes_filter_false(matcher: Matcher, monkeypatch, ):
     @staticmethod
     def test_filter_matches(mock_matcher: MagicMock, ):
         app.models.matches.Matcher.filter_matches(self=mock_matcher, update=True)
+        mock_matcher.CRUD.db.transaction.assert_called_once_with(connection=mock_matcher.connection, )
+        mock_matcher.CRUD.db.pipeline.assert_called_once_with(connection=mock_matcher.connection, )
         mock_matcher.apply_goal_filter.assert_called_once_with()
         mock_matcher.apply_gender_filter.assert_called_once_with()
         mock_matcher.apply_age_filter.assert_called_once_with()
         mock_matcher.apply_checkboxes_country_filter.assert_called_once_with()
         mock_matcher.apply_checkboxes_city_filter.assert_called_once_with()
         mock_matcher.apply_checkboxes_photo_filter.assert_called_once_with()
+        mock_matcher.apply_checkboxes_nearby_filter.assert_called_once_with()
         assert mock_matcher.matches.raw.current == mock_matcher.get_user_matches()
 
     @staticmethod
     def test_set_matches_raw(mock_matcher: MagicMock, ):
         mock_matcher.get_user_matches.return_value = []
         app.models.matches.Matcher.set_matches_raw(self=mock_matcher, )
-        mock_matcher.get_user_matches.assert_has_calls([call(new=True), call(new=False), ])
+        mock_matcher.get_user_matches.assert_has_calls([call(new=True, ), call(new=False, reuse={}, ), ])
         assert mock_matcher.matches.raw.new == mock_matcher.get_user_matches(new=True)
         assert mock_matcher.matches.raw.all == mock_matcher.get_user_matches(new=False)
         assert mock_matcher.matches.raw.count_new == len(mock_matcher.matches.raw.new)
         assert mock_matcher.matches.raw.count_all == len(mock_matcher.matches.raw.all)
 
+    @staticmethod
+    def test_get_filtered_matches(mock_matcher: MagicMock, ):
+        mock_matcher.Filters = Matcher.Filters
+        mock_matcher.filters = Matcher.Filters(age_range=(20, 30), checkboxes=Matcher.Filters.Checkboxes(photo=True, ), )
+        mock_matcher.filters.goal = Matcher.Filters.Goal.DATE
+        result = app.models.matches.Matcher.get_filtered_matches(self=mock_matcher, )
+        mock_matcher.CRUD.read_filtered_matches.assert_called_once_with(
+            tg_user_id=mock_matcher.user.tg_user_id,
+            goal=Matcher.Filters.Goal.DATE.value,
+            gender=None,  # BOTH
+            age_range=(20, 30),
+            photo=True,
+            country=False,
+            city=False,
+            covotes=mock_matcher.covotes,
+            top_matches_limit=None,
+            votes_limit=None,
+            nearby_ids=mock_matcher.get_nearby_ids.return_value,
+            connection=mock_matcher.connection,
+        )
+        assert result == mock_matcher.CRUD.read_filtered_matches.return_value
+
+    @staticmethod
+    def test_get_filtered_matches_votes_limit(mock_matcher: MagicMock, ):
+        """The engine covotes and the top matches are ignored by the partial search"""
+        mock_matcher.mode = Matcher.Mode.TOP_MATCHES
+        mock_matcher.Filters = Matcher.Filters
+        mock_matcher.filters = Matcher.Filters()
+        app.models.matches.Matcher.get_filtered_matches(self=mock_matcher, votes_limit=10, )
+        kwargs = mock_matcher.CRUD.read_filtered_matches.call_args.kwargs
+        assert (kwargs['covotes'], kwargs['top_matches_limit'], kwargs['votes_limit'],) == (None, None, 10,)
+
+    @staticmethod
+    def test_get_filtered_matches_top_matches(mock_matcher: MagicMock, ):
+        mock_matcher.mode = Matcher.Mode.TOP_MATCHES
+        mock_matcher.Filters = Matcher.Filters
+        mock_matcher.filters = Matcher.Filters()
+        app.models.matches.Matcher.get_filtered_matches(self=mock_matcher, )
+        assert mock_matcher.CRUD.read_filtered_matches.call_args.kwargs['top_matches_limit'] == (
+            mock_matcher.TOP_MATCHES_LIMIT
+        )
+
+    @staticmethod
+    def test_set_filtered_matches_raw(mock_matcher: MagicMock, ):
+        old = {'id': 1, 'tg_user_id': 2, 'count_common_interests': 1, 'is_new': False, }
+        new = {'id': 2, 'tg_user_id': 3, 'count_common_interests': 2, 'is_new': True, }
+        mock_matcher.rank_matches.return_value = [old, new, ]
+        mock_matcher.search_cache.get_result.return_value = None
+        app.models.matches.Matcher.set_filtered_matches_raw(self=mock_matcher, )
+        mock_matcher.rank_matches.assert_called_once_with(raw_matches=mock_matcher.get_filtered_matches.return_value, )
+        mock_matcher.search_cache.set_result.assert_called_once_with(
+            key=mock_matcher.get_cache_key.return_value,
+            value=[old, new, ],
+        )
+        assert mock_matcher.matches.raw.all == [old, new, ]
+        assert mock_matcher.matches.raw.new == [new, ]
+        assert mock_matcher.matches.raw.count_all == 2
+        assert mock_matcher.matches.raw.count_new == 1
+
+    @staticmethod
+    def test_set_filtered_matches_raw_cached(mock_matcher: MagicMock, ):
+        new = {'id': 2, 'tg_user_id': 3, 'count_common_interests': 2, 'is_new': True, }
+        mock_matcher.search_cache.get_result.return_value = [new, ]
+        app.models.matches.Matcher.set_filtered_matches_raw(self=mock_matcher, )
+        mock_matcher.search_cache.get_result.assert_called_once_with(key=mock_matcher.get_cache_key.return_value, )
+        mock_matcher.get_filtered_matches.assert_not_called()
+        mock_matcher.search_cache.set_result.assert_not_called()
+        assert mock_matcher.matches.raw.all == [new, ]
+        assert mock_matcher.matches.raw.count_new == 1
+
+    @staticmethod
+    def test_set_partial_matches_raw(mock_matcher: MagicMock, ):
+        old = {'id': 1, 'tg_user_id': 2, 'count_common_interests': 1, 'is_new': False, }
+        new = {'id': 2, 'tg_user_id': 3, 'count_common_interests': 2, 'is_new': True, }
+        mock_matcher.rank_matches.return_value = [old, new, ]
+        app.models.matches.Matcher.set_partial_matches_raw(self=mock_matcher, )
+        mock_matcher.get_filtered_matches.assert_called_once_with(votes_limit=mock_matcher.PARTIAL_VOTES_LIMIT, )
+        mock_matcher.rank_matches.assert_called_once_with(raw_matches=mock_matcher.get_filtered_matches.return_value, )
+        mock_matcher.search_cache.set_result.assert_not_called()
+        assert mock_matcher.matches.is_partial is True
+        assert mock_matcher.matches.raw.all == [old, new, ]
+        assert mock_matcher.matches.raw.new == [new, ]
+        assert (mock_matcher.matches.raw.count_all, mock_matcher.matches.raw.count_new,) == (2, 1,)
+
+    class TestRankMatches:
+        raw_matches = [  # As read from DB, ascending by count_common_interests
+            {'id': 1, 'tg_user_id': 3, 'count_common_interests': 1, },
+            {'id': 2, 'tg_user_id': 2, 'count_common_interests': 2, },
+            {'id': 3, 'tg_user_id': 1, 'count_common_interests': 3, },
+        ]
+
+        def test_common_count(self, mock_matcher: MagicMock, ):
+            assert app.models.matches.Matcher.rank_matches(self=mock_matcher, raw_matches=self.raw_matches, ) == (
+                self.raw_matches
+            )
+            mock_matcher.TOP_K = 2
+            assert app.models.matches.Matcher.rank_matches(self=mock_matcher, raw_matches=self.raw_matches, ) == (
+                self.raw_matches[1:]
+            )
+            mock_matcher.get_scores.assert_not_called()
+
+        def test_rank(self, mock_matcher: MagicMock, ):
+            mock_matcher.scoring = Matcher.Scoring.JACCARD
+            mock_matcher.TOP_K = 2
+            mock_matcher.get_scores.return_value = np.array([0.5, 0.1, 0.5, ], )  # Equal scores - by tg_user_id
+            result = app.models.matches.Matcher.rank_matches(self=mock_matcher, raw_matches=self.raw_matches, )
+            mock_matcher.get_scores.assert_called_once_with(raw_matches=self.raw_matches, )
+            assert result == [self.raw_matches[2], self.raw_matches[0], ]  # The best is the last
+
+        def test_get_scores(self, mock_matcher: MagicMock, ):
+            mock_matcher.scoring = Matcher.Scoring.JACCARD
+            mock_matcher.user_votes_count = 4
+            mock_matcher.CRUD.read_users_votes_counts.return_value = [
+                {'tg_user_id': 1, 'votes_count': 3, },
+                {'tg_user_id': 3, 'votes_count': 10, },
+                {'tg_user_id': 2, 'votes_count': 2, },
+            ]
+            result = app.models.matches.Matcher.get_scores(self=mock_matcher, raw_matches=self.raw_matches, )
+            mock_matcher.CRUD.read_users_votes_counts.assert_called_once_with(
+                tg_user_ids=[3, 2, 1, ],
+                connection=mock_matcher.connection,
+            )
+            assert result.tolist() == [1 / 13, 2 / 4, 3 / 4, ]
+
+        def test_get_scores_lagging_counter(self, mock_matcher: MagicMock, ):
+            """Candidate has no counter yet or the counter is behind the covotes"""
+            mock_matcher.scoring = Matcher.Scoring.RECIPROCAL
+            mock_matcher.SCORING_KERNELS = Matcher.SCORING_KERNELS
+            mock_matcher.user_votes_count = 4
+            mock_matcher.CRUD.read_users_votes_counts.return_value = [{'tg_user_id': 2, 'votes_count': 1, }, ]
+            result = app.models.matches.Matcher.get_scores(self=mock_matcher, raw_matches=self.raw_matches, )
+            assert result.tolist() == pytest.approx([2 / 5, 4 / 6, 6 / 7, ], )
+
+        def test_get_scores_idf(self, mock_matcher: MagicMock, ):
+            mock_matcher.scoring = Matcher.Scoring.IDF
+            mock_matcher.CRUD.read_covotes_posts.return_value = [
+                {'tg_user_id': 1, 'voters_count': 2, },
+                {'tg_user_id': 1, 'voters_count': 8, },
+                {'tg_user_id': 3, 'voters_count': 8, },
+            ]
+            mock_matcher.get_users_count.return_value = 8
+            result = app.models.matches.Matcher.get_scores(self=mock_matcher, raw_matches=self.raw_matches, )
+            mock_matcher.get_users_count.assert_called_once_with(connection=mock_matcher.connection, )
+            mock_matcher.CRUD.read_covotes_posts.assert_called_once_with(
+                tg_user_id=mock_matcher.user.tg_user_id,
+                tg_user_ids=[3, 2, 1, ],
+                connection=mock_matcher.connection,
+            )
+            assert result.tolist() == pytest.approx([np.log(2), 0, np.log(5) + np.log(2), ])
+
+    @staticmethod
+    def test_get_users_count(monkeypatch, ):
+        """Read once, then from the cache until the TTL is expired"""
+        monkeypatch.setattr(Matcher, 'users_count', None, )
+        with (
+            patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud,
+            patch.object(app.models.base.matches, 'monotonic', autospec=True, ) as mock_monotonic,
+        ):
+            mock_crud.read_users_count.side_effect = (5, 7,)
+            mock_monotonic.side_effect = (0, Matcher.USERS_COUNT_TTL, Matcher.USERS_COUNT_TTL + 1, Matcher.USERS_COUNT_TTL + 1, )
+            assert Matcher.get_users_count(connection=typing_Any, ) == 5
+            assert Matcher.get_users_count(connection=typing_Any, ) == 5
+            assert Matcher.get_users_count(connection=typing_Any, ) == 7
+        assert mock_crud.read_users_count.call_args_list == [call(connection=typing_Any, )] * 2
+
     @staticmethod
     def test_set_matches(mock_matcher: MagicMock, ):
         app.models.matches.Matcher.set_matches(self=mock_matcher, )
         mock_matcher.convert_matches.assert_called_once_with(raw_matches=mock_matcher.matches.raw.all, )
-        assert mock_matcher.matches.count_new == len(mock_matcher.matches.new)
-        assert mock_matcher.matches.count_all == len(mock_matcher.matches.all)
+        assert mock_matcher.matches.new == mock_matcher.convert_matches.return_value.select.return_value
+        assert mock_matcher.matches.count_new == mock_matcher.matches.raw.count_new
+        assert mock_matcher.matches.count_all == mock_matcher.matches.raw.count_all
 
     @staticmethod
     def test_set_current_matches(matcher: Matcher, ):
@@ -222,31 +774,284 @@ def test_set_current_matches(matcher: Matcher, ):
         matcher.filters.match_type = matcher.Filters.MatchType.NEW_MATCHES
         matcher.set_current_matches()
 
+    @staticmethod
+    def test_set_current_matches_pages(mock_matcher: MagicMock, ):
+        mock_matcher.matches.current = ['foo', ]
+        app.models.matches.Matcher.set_current_matches(self=mock_matcher, )
+        assert mock_matcher.matches.current == []
+        mock_matcher.reset_pages.assert_called_once_with()
+
+    @staticmethod
+    def test_set_current_matches_single_query(mock_matcher: MagicMock, ):
+        mock_matcher.mode = Matcher.Mode.SINGLE_QUERY
+        mock_matcher.Filters = Matcher.Filters
+        mock_matcher.filters.match_type = Matcher.Filters.MatchType.NEW_MATCHES
+        app.models.matches.Matcher.set_current_matches(self=mock_matcher, )
+        assert mock_matcher.matches.current == mock_matcher.matches.new
+        mock_matcher.reset_pages.assert_not_called()
+
+    @staticmethod
+    def test_set_current_matches_partial(mock_matcher: MagicMock, ):
+        """The partial result is not paginated in any mode"""
+        mock_matcher.matches.is_partial = True
+        mock_matcher.Filters = Matcher.Filters
+        mock_matcher.filters.match_type = Matcher.Filters.MatchType.ALL_MATCHES
+        app.models.matches.Matcher.set_current_matches(self=mock_matcher, )
+        assert mock_matcher.matches.current == mock_matcher.matches.all
+        mock_matcher.reset_pages.assert_not_called()
+
+    @staticmethod
+    def test_set_matches_counts(mock_matcher: MagicMock, ):
+        mock_matcher.TOP_K = None
+        mock_matcher.CRUD.read_matches_counts.return_value = {'count_all': 5, 'count_new': 3, }
+        app.models.matches.Matcher.set_matches_counts(self=mock_matcher, )
+        mock_matcher.CRUD.read_matches_counts.assert_called_once_with(
+            tg_user_id=mock_matcher.user.tg_user_id,
+            connection=mock_matcher.connection,
+        )
+        assert mock_matcher.matches.raw.all == mock_matcher.matches.raw.new == []
+        assert mock_matcher.matches.raw.count_all == 5
+        assert mock_matcher.matches.raw.count_new == 3
+        mock_matcher.reset_pages.assert_called_once_with()
+
+    @staticmethod
+    def test_set_matches_counts_top_k(mock_matcher: MagicMock, ):
+        mock_matcher.TOP_K = 4
+        mock_matcher.CRUD.read_matches_counts.return_value = {'count_all': 5, 'count_new': 3, }
+        app.models.matches.Matcher.set_matches_counts(self=mock_matcher, )
+        assert mock_matcher.matches.raw.count_all == 4
+        assert mock_matcher.matches.raw.count_new == 3
+
+    class TestGetNextPage:
+        @staticmethod
+        @pytest.fixture
+        def mock_matcher(mock_matcher: MagicMock, ) -> MagicMock:
+            mock_matcher.PAGE_SIZE = 2
+            mock_matcher.TOP_K = None
+            mock_matcher.Filters = Matcher.Filters
+            mock_matcher.filters.match_type = Matcher.Filters.MatchType.NEW_MATCHES
+            mock_matcher.matches.keyset = None
+            mock_matcher.matches.count_fetched = 0
+            mock_matcher.matches.is_exhausted = False
+            return mock_matcher
+
+        @staticmethod
+        def test_full_page(mock_matcher: MagicMock, ):
+            page = [
+                {'id': 1, 'tg_user_id': 3, 'count_common_interests': 5, },
+                {'id': 2, 'tg_user_id': 2, 'count_common_interests': 4, },
+            ]
+            mock_matcher.CRUD.read_matches_page.return_value = page
+            result = app.models.matches.Matcher.get_next_page(self=mock_matcher, )
+            mock_matcher.CRUD.read_matches_page.assert_called_once_with(
+                tg_user_id=mock_matcher.user.tg_user_id,
+                new=True,
+                keyset=None,
+                limit=2,
+                connection=mock_matcher.connection,
+            )
+            assert result == page[::-1]  # The best is the last
+            assert mock_matcher.matches.keyset == (4, 2,)
+            assert mock_matcher.matches.count_fetched == 2
+            assert mock_matcher.matches.is_exhausted is False
+
+        @staticmethod
+        def test_last_page(mock_matcher: MagicMock, ):
+            mock_matcher.filters.match_type = Matcher.Filters.MatchType.ALL_MATCHES
+            mock_matcher.matches.keyset = (4, 2,)
+            mock_matcher.CRUD.read_matches_page.return_value = []
+            assert app.models.matches.Matcher.get_next_page(self=mock_matcher, ) == []
+            assert mock_matcher.CRUD.read_matches_page.call_args.kwargs['new'] is False
+            assert mock_matcher.CRUD.read_matches_page.call_args.kwargs['keyset'] == (4, 2,)
+            assert mock_matcher.matches.keyset == (4, 2,)
+            assert mock_matcher.matches.is_exhausted is True
+
+        @staticmethod
+        def test_exhausted(mock_matcher: MagicMock, ):
+            mock_matcher.matches.is_exhausted = True
+            assert app.models.matches.Matcher.get_next_page(self=mock_matcher, ) == []
+            mock_matcher.CRUD.read_matches_page.assert_not_called()
+
+        @staticmethod
+        def test_top_k(mock_matcher: MagicMock, ):
+            mock_matcher.TOP_K = 3
+            mock_matcher.matches.count_fetched = 2
+            mock_matcher.CRUD.read_matches_page.return_value = [
+                {'id': 1, 'tg_user_id': 1, 'count_common_interests': 1, },
+            ]
+            app.models.matches.Matcher.get_next_page(self=mock_matcher, )
+            assert mock_matcher.CRUD.read_matches_page.call_args.kwargs['limit'] == 1
+            assert mock_matcher.matches.is_exhausted is False
+            # TOP_K is reached
+            mock_matcher.CRUD.read_matches_page.reset_mock()
+            assert app.models.matches.Matcher.get_next_page(self=mock_matcher, ) == []
+            mock_matcher.CRUD.read_matches_page.assert_not_called()
+
     @staticmethod
     def test_convert_matches(mock_matcher: MagicMock, covote: Covote, ):
-        mock_matcher.matches.raw.current = [covote]
-        result = app.models.matches.Matcher.convert_matches(
+        """Matches are created only on access"""
+        result = app.models.matches.Matcher.convert_matches(self=mock_matcher, raw_matches=[covote], )
+        mock_matcher.create_match.assert_not_called()
+        assert result[0] == mock_matcher.create_match.return_value
+        mock_matcher.create_match.assert_called_once_with(
+            covote['id'],
+            covote['tg_user_id'],
+            covote['count_common_interests'],
+        )
+
+    @staticmethod
+    def test_create_match(mock_matcher: MagicMock, ):
+        result = app.models.matches.Matcher.create_match(
             self=mock_matcher,
-            raw_matches=mock_matcher.matches.raw.current,
+            id_=1,
+            tg_user_id=2,
+            count_common_interests=3,
+        )
+        mock_matcher.Mapper.User.assert_called_once_with(tg_user_id=2, )
+        mock_matcher.get_common_interests_perc.assert_called_once_with(common_posts_count=3, )
+        mock_matcher.Mapper.Match.assert_called_once_with(
+            id=1,
+            owner=mock_matcher.user,
+            user=mock_matcher.Mapper.User.return_value,
+            common_posts_count=3,
+            common_posts_perc=mock_matcher.get_common_interests_perc.return_value,
         )
-        assert len(mock_matcher.Mapper.Match.mock_calls) == 1
-        assert result == [mock_matcher.Mapper.Match.return_value, ]
+        assert result == mock_matcher.Mapper.Match.return_value
+
+    class TestLoadMatches:
+        @staticmethod
+        @pytest.fixture
+        def matches(matcher: Matcher, ) -> list[Match]:
+            return matcher.convert_matches(raw_matches=[
+                {'id': 1, 'tg_user_id': 2, 'count_common_interests': 1, },
+                {'id': 2, 'tg_user_id': 3, 'count_common_interests': 1, },
+            ], )
+
+        @staticmethod
+        def test_load_matches(matcher: Matcher, matches: list[Match], ):
+            users_rows = [{'tg_user_id': 2, 'fullname': 'foo', 'country': None, 'photos': ['bar', ], }, ]
+            with patch.object(matcher.Mapper.User.CRUD, 'read_many', return_value=users_rows, ) as mock_read_many:
+                matcher.load_matches(matches=matches, )
+            mock_read_many.assert_called_once_with(tg_user_ids=[2, 3, ], connection=matcher.user.connection, )
+            assert matches[0].user.fullname == 'foo'
+            assert matches[0].user.photos == ['bar', ]
+            assert matches[0].user.is_registered is True
+            assert matches[1].user.fullname is None  # Not exists in DB
+            assert [match.is_loaded for match in matches] == [True, False, ]  # Not found one is not loaded
+            with patch.object(matcher.Mapper.User.CRUD, 'read_many', return_value=[], ) as mock_read_many:
+                matcher.load_matches(matches=matches, connection=typing_Any, )
+            mock_read_many.assert_called_once_with(tg_user_ids=[3, ], connection=typing_Any, )  # Passed one
+            assert matches[1].is_loaded is False
+
+        @staticmethod
+        def test_already_loaded(matcher: Matcher, matches: list[Match], ):
+            for match in matches:
+                match.is_loaded = True
+            with patch.object(matcher.Mapper.User.CRUD, 'read_many', ) as mock_read_many:
+                matcher.load_matches(matches=matches, )
+            mock_read_many.assert_not_called()
 
     class TestMakeSearch:
         """test_make_search"""
 
         @staticmethod
-        def test_make_search_base(mock_matcher: MagicMock, ):
-            result = app.models.base.matches.Matcher.make_search(self=mock_matcher, )
+        def test_search(mock_matcher: MagicMock, ):
+            result = app.models.base.matches.Matcher.search(self=mock_matcher, )
             # Checks
             mock_matcher.create_unfiltered_matches.assert_called_once_with(
                 drop_old_votes=False, drop_old_matches=False,
             )
             mock_matcher.filter_matches.assert_called_once_with()
-            mock_matcher.set_matches_raw.assert_called_once_with()
-            assert len(mock_matcher.mock_calls) == 3
+            mock_matcher.set_matches_counts.assert_called_once_with()
+            assert mock_matcher.measure_stage.call_args_list == [call(name='covotes', ), call(name='matches', ), ]
+            assert len([c for c in mock_matcher.mock_calls if not c[0].startswith('measure_stage')]) == 3
             assert result == mock_matcher.matches.raw.all
 
+        @staticmethod
+        def test_search_single_query(mock_matcher: MagicMock, ):
+            mock_matcher.mode = Matcher.Mode.SINGLE_QUERY
+            result = app.models.base.matches.Matcher.search(self=mock_matcher, )
+            # Checks
+            mock_matcher.create_unfiltered_matches.assert_called_once_with(
+                drop_old_votes=False, drop_old_matches=False,
+            )
+            mock_matcher.set_filtered_matches_raw.assert_called_once_with()
+            mock_matcher.filter_matches.assert_not_called()
+            mock_matcher.set_matches_raw.assert_not_called()
+            assert result == mock_matcher.matches.raw.all
+
+        @staticmethod
+        def test_search_engine(mock_matcher: MagicMock, ):
+            mock_matcher.mode = Matcher.Mode.VOTE_MATRIX
+            result = app.models.base.matches.Matcher.search(self=mock_matcher, )
+            mock_matcher.set_filtered_matches_raw.assert_called_once_with()
+            mock_matcher.filter_matches.assert_not_called()
+            assert result == mock_matcher.matches.raw.all
+
+        @staticmethod
+        def test_make_search_base_no_budget(mock_matcher: MagicMock, ):
+            result = app.models.base.matches.Matcher.make_search(self=mock_matcher, budget_ms=0, )
+            mock_matcher.search.assert_called_once_with(drop_old_votes=False, drop_old_matches=False, )
+            mock_matcher.CRUD.db.deadline.assert_not_called()
+            assert mock_matcher.matches.is_partial is False
+            assert result == mock_matcher.search.return_value
+
+        @staticmethod
+        def test_make_search_base_budget(mock_matcher: MagicMock, ):
+            mock_matcher.PARTIAL_BUDGET_SHARE = 0.5
+            with patch.object(app.models.base.matches, 'monotonic', autospec=True, return_value=10, ):
+                result = app.models.base.matches.Matcher.make_search(self=mock_matcher, budget_ms=1000, )
+            mock_matcher.CRUD.db.deadline.assert_called_once_with(
+                connection=mock_matcher.connection,
+                deadline=10.5,
+            )
+            mock_matcher.search.assert_called_once_with(drop_old_votes=False, drop_old_matches=False, )
+            mock_matcher.set_partial_matches_raw.assert_not_called()
+            assert mock_matcher.matches.is_partial is False
+            assert result == mock_matcher.search.return_value
+
+        @staticmethod
+        def test_make_search_base_partial(mock_matcher: MagicMock, ):
+            mock_matcher.MatchesRaw = Matcher.MatchesRaw
+            mock_matcher.PARTIAL_BUDGET_SHARE = 0.5
+            mock_matcher.search.side_effect = DeadlineExceeded
+            with patch.object(app.models.base.matches, 'monotonic', autospec=True, return_value=10, ):
+                result = app.models.base.matches.Matcher.make_search(self=mock_matcher, budget_ms=1000, )
+            assert mock_matcher.CRUD.db.deadline.call_args_list == [
+                call(connection=mock_matcher.connection, deadline=10.5, ),
+                call(connection=mock_matcher.connection, deadline=11, ),
+            ]
+            mock_matcher.set_partial_matches_raw.assert_called_once_with()
+            assert result == mock_matcher.matches.raw.all
+
+        @staticmethod
+        def test_make_search_base_partial_exceeded(mock_matcher: MagicMock, ):
+            """Both the full and the partial searches are out of the time"""
+            mock_matcher.MatchesRaw = Matcher.MatchesRaw
+            mock_matcher.PARTIAL_BUDGET_SHARE = 0.5
+            mock_matcher.search.side_effect = DeadlineExceeded
+            mock_matcher.set_partial_matches_raw.side_effect = DeadlineExceeded
+            result = app.models.base.matches.Matcher.make_search(self=mock_matcher, budget_ms=1000, )
+            assert mock_matcher.matches.is_partial is True
+            assert mock_matcher.matches.raw == Matcher.MatchesRaw()
+            assert result == []
+
+        @staticmethod
+        def test_make_search_base_session(matcher: Matcher, monkeypatch, ):
+            """The first temporary tables search is limited and measured on the session, not on the user connection"""
+            monkeypatch.setattr(matcher, 'mode', Matcher.Mode.TEMP_TABLES, )
+            with (
+                patch.object(Matcher, 'CRUD', autospec=True, ) as mock_crud,
+                patch.object(Matcher, 'timings_sink', autospec=True, ),
+                patch.object(matcher, 'search', autospec=True, return_value=[], ),
+            ):
+                mock_crud.track_statements.return_value.__enter__.return_value = {'round_trips': 0, 'rows': 0, }
+                matcher.make_search(budget_ms=1000, )
+            session = mock_crud.db.connection_pool.getconn.return_value
+            assert matcher.session == session
+            assert mock_crud.db.deadline.call_args.kwargs['connection'] == session
+            mock_crud.track_statements.assert_called_once_with(connection=session, )
+
         @staticmethod
         def test_make_search(mock_matcher: MagicMock, ):
             # Checks
@@ -256,24 +1061,66 @@ def test_make_search(mock_matcher: MagicMock, ):
                     mock_matcher,
                     drop_old_votes=False,
                     drop_old_matches=False,
+                    budget_ms=None,
                 )
                 mock_matcher.set_matches.assert_called_once_with()
+                mock_matcher.measure_search.assert_called_once_with()
+                mock_matcher.measure_stage.assert_called_once_with(name='conversion', )
                 assert result == mock_matcher.matches.all
 
     class TestGetMatch:
         @staticmethod
         def test_pop(mock_matcher: MagicMock, ):
-            mock_matcher.matches.current = ['foo', ]
+            foo = MagicMock(is_loaded=True, )
+            mock_matcher.matches.current = [foo, ]
             result = app.models.matches.Matcher.get_match(self=mock_matcher, pop=True, )
-            assert result == 'foo'
+            assert result == foo
             assert mock_matcher.matches.current == []
 
         @staticmethod
         def test_index(mock_matcher: MagicMock, ):
-            mock_matcher.matches.current = ['foo', ]
+            foo = MagicMock(is_loaded=True, )
+            mock_matcher.matches.current = [foo, ]
             result = app.models.matches.Matcher.get_match(self=mock_matcher, pop=False, )
-            assert result == 'foo'
-            assert mock_matcher.matches.current == ['foo', ]
+            assert result == foo
+            assert mock_matcher.matches.current == [foo, ]
+
+        @staticmethod
+        def test_load(mock_matcher: MagicMock, ):
+            mock_matcher.PAGE_SIZE = 2
+            loaded, not_loaded = MagicMock(is_loaded=True, ), MagicMock(is_loaded=False, )
+            mock_matcher.matches.current = [loaded, not_loaded, not_loaded, ]
+            app.models.matches.Matcher.get_match(self=mock_matcher, )
+            mock_matcher.load_matches.assert_called_once_with(matches=[not_loaded, not_loaded, ], )
+            # The match to show is already loaded
+            mock_matcher.load_matches.reset_mock()
+            mock_matcher.matches.current = [not_loaded, loaded, ]
+            app.models.matches.Matcher.get_match(self=mock_matcher, )
+            mock_matcher.load_matches.assert_not_called()
+
+        @staticmethod
+        def test_next_page(mock_matcher: MagicMock, ):
+            foo, bar = MagicMock(is_loaded=True, ), MagicMock(is_loaded=True, )
+            mock_matcher.matches.current = []
+            mock_matcher.convert_matches.return_value = [bar, foo, ]
+            result = app.models.matches.Matcher.get_match(self=mock_matcher, )
+            mock_matcher.convert_matches.assert_called_once_with(raw_matches=mock_matcher.get_next_page.return_value, )
+            assert result == foo
+            assert mock_matcher.matches.current == [bar, ]
+
+        @staticmethod
+        def test_single_query(mock_matcher: MagicMock, ):
+            mock_matcher.mode = Matcher.Mode.SINGLE_QUERY
+            mock_matcher.matches.current = []
+            assert app.models.matches.Matcher.get_match(self=mock_matcher, ) is None
+            mock_matcher.get_next_page.assert_not_called()
+
+        @staticmethod
+        def test_partial(mock_matcher: MagicMock, ):
+            mock_matcher.matches.is_partial = True
+            mock_matcher.matches.current = []
+            assert app.models.matches.Matcher.get_match(self=mock_matcher, ) is None
+            mock_matcher.get_next_page.assert_not_called()
 
     @staticmethod
     def test_get_common_interests_perc(matcher_s: Matcher, monkeypatch, ):
@@ -287,6 +1134,734 @@ def test_get_common_interests_perc(matcher_s: Matcher, monkeypatch, ):
         assert matcher_s.get_common_interests_perc(common_posts_count=14) == 88
 
 
+class TestSession:
+    @staticmethod
+    def test_connection(mock_matcher: MagicMock, ):
+        mock_matcher.session = None
+        assert app.models.base.matches.Matcher.connection.fget(mock_matcher, ) == mock_matcher.user.connection
+        mock_matcher.session = MagicMock()
+        assert app.models.base.matches.Matcher.connection.fget(mock_matcher, ) == mock_matcher.session
+
+    @staticmethod
+    def test_open_session(mock_matcher: MagicMock, ):
+        mock_matcher.session = None
+        app.models.base.matches.Matcher.open_session(self=mock_matcher, )
+        app.models.base.matches.Matcher.open_session(self=mock_matcher, )  # Already open
+        mock_matcher.CRUD.db.connection_pool.getconn.assert_called_once_with(
+            pinned=True,
+            owner=f'search session {mock_matcher.user.tg_user_id}',
+        )
+        assert mock_matcher.session == mock_matcher.CRUD.db.connection_pool.getconn.return_value
+
+    @staticmethod
+    def test_close_session(mock_matcher: MagicMock, ):
+        session = mock_matcher.session = MagicMock()
+        mock_matcher.search_job = None
+        app.models.base.matches.Matcher.close_session(self=mock_matcher, )
+        app.models.base.matches.Matcher.close_session(self=mock_matcher, )  # Already closed
+        mock_matcher.CRUD.db.connection_pool.putconn.assert_called_once_with(connection=session, )
+        assert mock_matcher.session is None
+        assert mock_matcher._is_unfiltered_matches_already_set is False
+
+    @staticmethod
+    def test_close_session_search_job(mock_matcher: MagicMock, ):
+        """The background search is waited for, it searches on the session"""
+        session = mock_matcher.session = MagicMock()
+        mock_matcher.search_job = Future()
+        with patch.object(app.models.base.matches, 'futures_wait', autospec=True, ) as mock_futures_wait:
+            app.models.base.matches.Matcher.close_session(self=mock_matcher, )
+        mock_futures_wait.assert_called_once_with((mock_matcher.search_job,), )
+        mock_matcher.CRUD.db.connection_pool.putconn.assert_called_once_with(connection=session, )
+
+    @staticmethod
+    def test_cancel_search(mock_matcher: MagicMock, ):
+        mock_matcher.is_search_cancelled = False
+        app.models.base.matches.Matcher.cancel_search(self=mock_matcher, )
+        assert mock_matcher.is_search_cancelled is True
+        mock_matcher.close_session.assert_called_once_with()
+
+
+class TestVersions:
+
+    @staticmethod
+    def test_bump():
+        versions = app.models.base.matches.cache.Versions(maxsize=2, )
+        version = versions.get(key=1, )
+        assert versions.get(key=1, ) == version
+        versions.bump(key=1, )
+        assert versions.get(key=1, ) != version
+
+    @staticmethod
+    def test_evicted():
+        """Bounded, an evicted user gets a new version, not the initial one again"""
+        versions = app.models.base.matches.cache.Versions(maxsize=2, )
+        version = versions.get(key=1, )
+        versions.get(key=2, )
+        versions.get(key=3, )
+        assert len(versions.versions) == 2
+        assert versions.get(key=1, ) not in (version, versions.get(key=2, ), versions.get(key=3, ),)
+
+
+class TestSearchCache:
+    @staticmethod
+    def test_get_set():
+        search_cache = app.models.base.matches.cache.SearchCache(maxsize=2, ttl=60, )
+        assert search_cache.get_result(key=1, ) is None
+        search_cache.set_result(key=1, value=['foo', ], )
+        assert search_cache.get_result(key=1, ) == ['foo', ]
+        stats = search_cache.stats()
+        assert (stats['size'], stats['maxsize'], stats['hits'], stats['misses'],) == (1, 2, 1, 1,)
+        assert stats['hit_rate'] == 0.5
+
+    @staticmethod
+    def test_evictions():
+        search_cache = app.models.base.matches.cache.SearchCache(maxsize=2, ttl=60, )
+        for key in range(3):
+            search_cache.set_result(key=key, value=[], )
+        assert search_cache.get_result(key=0, ) is None  # The least recently used
+        assert search_cache.stats()['evictions'] == 1
+        assert search_cache.stats()['size'] == 2
+
+    @staticmethod
+    def test_expirations():
+        now = [0]
+        search_cache = app.models.base.matches.cache.SearchCache(maxsize=2, ttl=60, timer=lambda: now[0], )
+        search_cache.set_result(key=1, value=[], )
+        now[0] = 61
+        assert search_cache.get_result(key=1, ) is None
+        stats = search_cache.stats()
+        assert (stats['size'], stats['expirations'], stats['evictions'],) == (0, 1, 0,)
+
+
+class TestMatchesArray:
+    raw_matches = [
+        {'id': 1, 'tg_user_id': 10, 'count_common_interests': 1, },
+        {'id': 2, 'tg_user_id': 20, 'count_common_interests': 2, },
+        {'id': 3, 'tg_user_id': 30, 'count_common_interests': 3, },
+    ]
+
+    def create(self, ) -> app.models.base.matches.results.MatchesArray:
+        return app.models.base.matches.results.MatchesArray.from_raw(
+            raw_matches=self.raw_matches,
+            create_match=lambda *args: MagicMock(args=args, ),
+        )
+
+    def test_get(self, ):
+        matches = self.create()
+        assert len(matches) == 3 and not matches.created
+        assert matches[-1].args == (3, 30, 3,)
+        assert matches[-1] is matches[2]  # Created once
+        assert [match.args[0] for match in matches[-2:]] == [2, 3, ]
+        with pytest.raises(expected_exception=IndexError, ):
+            matches[3]
+
+    def test_pop(self, ):
+        """The best first, the popped match is not kept"""
+        matches = self.create()
+        assert [matches.pop().args[0] for _ in range(3)] == [3, 2, 1, ]
+        assert not matches and not matches.created
+        with pytest.raises(expected_exception=IndexError, ):
+            matches.pop()
+
+    def test_select(self, ):
+        matches = self.create()
+        matches.pop()
+        selected = matches.select(ids={1, 3, }, )
+        assert [match.args for match in selected] == [(1, 10, 1,), ]
+
+    def test_nbytes(self, ):
+        """Much less than the objects"""
+        matches = self.create()
+        assert matches.nbytes == 3 * (4 + 8 + 4) + getsizeof({}, )
+
+
+class TestSearchJobs:
+    @staticmethod
+    def test_submit():
+        executor = app.models.base.matches.jobs.SearchExecutor(workers=1, queue_size=0, )
+        on_done = MagicMock()
+        future = executor.submit(key=1, func=lambda: 'foo', on_done=on_done, )
+        assert future.result(timeout=5, ) == 'foo'
+        executor.executor.shutdown(wait=True, )  # on_done is called after the result is set
+        on_done.assert_called_once_with(future, )
+        assert executor.is_running(key=1, ) is False
+        assert executor.stats() == {
+            'queued': 0, 'running': 0, 'completed': 1, 'merged': 0, 'rejected': 0,
+            'mean_latency': ANY, 'max_latency': ANY,
+        }
+
+    @staticmethod
+    def test_merge_and_reject():
+        """The same key is merged while in progress, a new key is rejected if the queue is full"""
+        executor = app.models.base.matches.jobs.SearchExecutor(workers=1, queue_size=1, )
+        release = Event()
+        first = executor.submit(key=1, func=partial(release.wait, 5, ), )
+        second = executor.submit(key=2, func=lambda: 'bar', )
+        assert executor.submit(key=1, func=lambda: 'baz', ) is first
+        with pytest.raises(expected_exception=SearchQueueFull, ):
+            executor.submit(key=3, func=lambda: 'baz', )
+        assert executor.is_running(key=2, ) is True
+        release.set()
+        assert (first.result(timeout=5, ), second.result(timeout=5, ),) == (True, 'bar',)
+        executor.executor.shutdown(wait=True, )
+        stats = executor.stats()
+        assert (stats['completed'], stats['merged'], stats['rejected'], stats['queued'],) == (2, 1, 1, 0,)
+        assert 0 < stats['mean_latency'] <= stats['max_latency']
+
+    @staticmethod
+    def test_error():
+        """The job is done even if the search failed"""
+        executor = app.models.base.matches.jobs.SearchExecutor(workers=1, queue_size=0, )
+        future = executor.submit(key=1, func=partial(int, 'foo', ), )
+        assert isinstance(future.exception(timeout=5, ), ValueError)
+        executor.executor.shutdown(wait=True, )
+        assert executor.is_running(key=1, ) is False
+        assert executor.stats()['completed'] == 1
+
+    @staticmethod
+    def test_submit_search(mock_matcher: MagicMock, ):
+        on_done = MagicMock()
+        mock_matcher.is_search_cancelled = True  # Of the previous search
+        result = app.models.base.matches.Matcher.submit_search(self=mock_matcher, on_done=on_done, )
+        mock_matcher.search_executor.submit.assert_called_once_with(
+            key=mock_matcher.user.tg_user_id,
+            func=mock_matcher.make_search_job,
+            on_done=on_done,
+        )
+        assert result == mock_matcher.search_job == mock_matcher.search_executor.submit.return_value
+        assert mock_matcher.is_search_cancelled is False
+
+    @staticmethod
+    def test_make_search_job(mock_matcher: MagicMock, ):
+        result = app.models.base.matches.Matcher.make_search_job(self=mock_matcher, )
+        mock_matcher.CRUD.db.borrow.assert_called_once_with(owner=f'search job {mock_matcher.user.tg_user_id}', )
+        mock_matcher.CRUD.db.transaction.assert_called_once_with(
+            connection=mock_matcher.CRUD.db.borrow.return_value.__enter__.return_value,
+            read_only=True,
+        )
+        mock_matcher.make_search.assert_called_once_with()
+        assert result == mock_matcher.make_search.return_value
+
+    @staticmethod
+    def test_is_search_running(mock_matcher: MagicMock, ):
+        mock_matcher.search_job = None
+        assert app.models.base.matches.Matcher.is_search_running(self=mock_matcher, ) is False
+        mock_matcher.search_job = Future()
+        assert app.models.base.matches.Matcher.is_search_running(self=mock_matcher, ) is True
+        mock_matcher.search_job.set_result(None, )
+        assert app.models.base.matches.Matcher.is_search_running(self=mock_matcher, ) is False
+
+
+class TestScoring:
+    common = np.array([1, 2, 3, ], dtype=np.float64, )
+    candidates_votes_counts = np.array([1, 4, 12, ], dtype=np.float64, )
+
+    def test_jaccard(self, ):
+        result = app.models.base.matches.scoring_kernels.jaccard(
+            common=self.common,
+            user_votes_count=3,
+            candidates_votes_counts=self.candidates_votes_counts,
+        )
+        assert result.tolist() == pytest.approx([1 / 3, 2 / 5, 3 / 12, ])
+
+    def test_cosine(self, ):
+        result = app.models.base.matches.scoring_kernels.cosine(
+            common=self.common,
+            user_votes_count=3,
+            candidates_votes_counts=self.candidates_votes_counts,
+        )
+        assert result.tolist() == pytest.approx([1 / 3 ** 0.5, 2 / 12 ** 0.5, 3 / 36 ** 0.5, ])
+
+    def test_overlap(self, ):
+        result = app.models.base.matches.scoring_kernels.overlap(
+            common=self.common,
+            user_votes_count=3,
+            candidates_votes_counts=self.candidates_votes_counts,
+        )
+        assert result.tolist() == pytest.approx([1, 2 / 3, 1, ])
+
+    def test_reciprocal(self, ):
+        result = app.models.base.matches.scoring_kernels.reciprocal(
+            common=self.common,
+            user_votes_count=3,
+            candidates_votes_counts=self.candidates_votes_counts,
+        )
+        assert result.tolist() == pytest.approx([2 / 4, 4 / 7, 6 / 15, ])
+
+    def test_reciprocal_heavy_voter(self, ):
+        """The same common count, the heavy voter candidate is the worse"""
+        result = app.models.base.matches.scoring_kernels.reciprocal(
+            common=np.array([10, 10, ], dtype=np.float64, ),
+            user_votes_count=20,
+            candidates_votes_counts=np.array([10_000, 20, ], dtype=np.float64, ),
+        )
+        assert result[0] < result[1]
+
+    @staticmethod
+    def test_idf_weighted():
+        result = app.models.base.matches.scoring_kernels.idf_weighted(
+            candidates_indexes=np.array([0, 0, 2, ], ),
+            voters_counts=np.array([1, 3, 3, ], dtype=np.float64, ),
+            users_count=3,
+            candidates_count=4,
+        )
+        assert result.tolist() == pytest.approx([np.log(4) + np.log(2), 0, np.log(2), 0, ])
+
+
+class TestGeo:
+    geo = app.models.base.matches.geo
+
+    def test_haversine(self, ):
+        result = self.geo.haversine(0, 0, np.array([0, 1, 0, ], ), np.array([0, 0, 180, ], ), )
+        assert result.tolist() == pytest.approx([0, 111.195, np.pi * self.geo.EARTH_RADIUS_KM, ], rel=1e-4, )
+
+    @pytest.mark.parametrize(argnames='latitude, longitude', argvalues=((-90, -180,), (90, 180,), (0, 179.99,), ), )
+    def test_get_cell(self, latitude: float, longitude: float, ):
+        assert 0 <= self.geo.get_cell(latitude=latitude, longitude=longitude, ) < self.geo.ROWS * self.geo.COLUMNS
+
+    def test_get_cell_antimeridian(self, ):
+        assert self.geo.get_cell(latitude=0, longitude=180, ) == self.geo.get_cell(latitude=0, longitude=-180, )
+
+    @pytest.mark.parametrize(
+        argnames='latitude, longitude, radius_km',
+        argvalues=((55.75, 37.62, 30,), (0, 179.99, 20,), (89.95, 0, 30,), (-33.9, 18.4, 1,), ),
+    )
+    def test_select_nearby(self, latitude: float, longitude: float, radius_km: float, ):
+        """The same users as by the distance to every user, cells lookup misses nobody"""
+        random = np.random.default_rng(0, )
+        latitudes = np.clip(latitude + random.uniform(-1, 1, size=2_000, ), -90, 90, )
+        longitudes = (longitude + random.uniform(-1, 1, size=2_000, ) + 180) % 360 - 180
+        locations = [
+            {'tg_user_id': i, 'latitude': lat, 'longitude': lon, 'geo_cell': self.geo.get_cell(lat, lon, ), }
+            for i, (lat, lon) in enumerate(zip(latitudes.tolist(), longitudes.tolist(), ))
+        ]
+        cells = self.geo.get_cells(latitude=latitude, longitude=longitude, radius_km=radius_km, )
+        lookup = set(cells.inner + cells.edge)
+        result = self.geo.select_nearby(
+            latitude=latitude,
+            longitude=longitude,
+            radius_km=radius_km,
+            locations=[location for location in locations if location['geo_cell'] in lookup],
+            inner_cells=cells.inner,
+        )
+        expected = np.flatnonzero(self.geo.haversine(latitude, longitude, latitudes, longitudes, ) <= radius_km, )
+        assert sorted(result) == expected.tolist()
+
+    def test_get_cells_inner(self, ):
+        """Cell inside the circle needs no distance calculation"""
+        cells = self.geo.get_cells(latitude=55.75, longitude=37.62, radius_km=30, )
+        assert self.geo.get_cell(latitude=55.75, longitude=37.62, ) in cells.inner
+        assert not set(cells.inner) & set(cells.edge)
+
+
+class TestStages:
+    stages = app.models.base.matches.stages
+
+    @staticmethod
+    def get_stage(name: str, seconds: float, rows: int = 0, round_trips: int = 1, ) -> dict:
+        return {'name': name, 'seconds': seconds, 'rows': rows, 'round_trips': round_trips, }
+
+    def test_search_timings(self, ):
+        counter = {'round_trips': 0, 'rows': 0, }
+        timer = iter(range(10), ).__next__  # Every call is the next second
+        timings = self.stages.SearchTimings(counter=counter, timer=timer, )  # Start is 0
+        with timings.stage(name='covotes', ):  # 1
+            counter['round_trips'] += 2
+            counter['rows'] += 10
+        with timings.stage(name='matches', ):  # 3
+            counter['round_trips'] += 1
+        assert timings.finish() == [  # 5
+            self.get_stage(name='covotes', seconds=1, rows=10, round_trips=2, ),
+            self.get_stage(name='matches', seconds=1, rows=0, round_trips=1, ),
+            self.get_stage(name=self.stages.TOTAL, seconds=5, rows=10, round_trips=3, ),
+        ]
+
+    def test_search_timings_error(self, ):
+        """Failed stage is measured too"""
+        timings = self.stages.SearchTimings(counter={'round_trips': 0, 'rows': 0, }, )
+        with pytest.raises(DeadlineExceeded, ), timings.stage(name='covotes', ):
+            raise DeadlineExceeded
+        assert [stage['name'] for stage in timings.stages] == ['covotes', ]
+
+    def test_histogram_sink(self, ):
+        sink = self.stages.HistogramSink(window=100, )
+        for i in range(1, 101, ):
+            sink.record(stages=[
+                self.get_stage(name='covotes', seconds=i / 1000, rows=i, ),
+                self.get_stage(name=self.stages.TOTAL, seconds=i / 1000, ),
+            ], )
+        result = sink.report()
+        assert list(result) == ['covotes', self.stages.TOTAL, ]
+        assert result['covotes']['count'] == 100
+        assert result['covotes']['p50_ms'] == pytest.approx(50.5, )
+        assert result['covotes']['p95_ms'] == pytest.approx(95.05, )
+        assert result['covotes']['p99_ms'] == pytest.approx(99.01, )
+        assert result['covotes']['rows'] == pytest.approx(50.5, )
+        assert result['covotes']['round_trips'] == 1
+        # Buckets: <=1, <=5, <=10, <=50, <=100, ...
+        assert result['covotes']['histogram'] == [1, 4, 5, 40, 50, 0, 0, 0, 0, ]
+
+    def test_histogram_sink_window(self, ):
+        sink = self.stages.HistogramSink(window=2, )
+        for seconds in (1, 2, 3,):
+            sink.record(stages=[self.get_stage(name=self.stages.TOTAL, seconds=seconds, ), ], )
+        result = sink.report()[self.stages.TOTAL]
+        assert result['count'] == 2
+        assert result['p50_ms'] == 2500
+        assert sum(result['histogram']) == 3  # Histogram is since the start
+
+    def test_histogram_sink_summing(self, ):
+        """The partial search after the time out is the second stage with the same name"""
+        sink = self.stages.HistogramSink(window=10, )
+        sink.record(stages=[
+            self.get_stage(name='covotes', seconds=0.1, rows=1, ),
+            self.get_stage(name='covotes', seconds=0.2, rows=2, ),
+        ], )
+        result = sink.report()['covotes']
+        assert result['count'] == 1
+        assert result['p50_ms'] == pytest.approx(300, )
+        assert result['rows'] == 3
+        assert result['round_trips'] == 2
+
+    def test_sink_interface(self, ):
+        class Sink(self.stages.SinkInterface, ):
+            def record(self, stages: list, ) -> None:
+                pass
+
+        assert Sink().report() == {}
+
+    @staticmethod
+    def test_measure_search(mock_matcher: MagicMock, ):
+        mock_matcher.timings = None
+        mock_matcher.CRUD.track_statements.return_value.__enter__.return_value = {'round_trips': 0, 'rows': 0, }
+        with app.models.base.matches.Matcher.measure_search(self=mock_matcher, ):
+            assert isinstance(mock_matcher.timings, app.models.base.matches.stages.SearchTimings, )
+        mock_matcher.CRUD.track_statements.assert_called_once_with(connection=mock_matcher.connection, )
+        stages = mock_matcher.timings_sink.record.call_args.kwargs['stages']
+        assert [stage['name'] for stage in stages] == [app.models.base.matches.stages.TOTAL, ]
+        assert mock_matcher.timings is None
+
+    @staticmethod
+    def test_measure_search_error(mock_matcher: MagicMock, ):
+        """Failed search is reported too"""
+        mock_matcher.timings = None
+        mock_matcher.CRUD.track_statements.return_value.__enter__.return_value = {'round_trips': 0, 'rows': 0, }
+        with pytest.raises(DeadlineExceeded, ), app.models.base.matches.Matcher.measure_search(self=mock_matcher, ):
+            raise DeadlineExceeded
+        mock_matcher.timings_sink.record.assert_called_once()
+        assert mock_matcher.timings is None
+
+    @staticmethod
+    def test_measure_search_nested(mock_matcher: MagicMock, ):
+        """Nested search is a part of the outer one"""
+        with app.models.base.matches.Matcher.measure_search(self=mock_matcher, ):
+            pass
+        mock_matcher.CRUD.track_statements.assert_not_called()
+        mock_matcher.timings_sink.record.assert_not_called()
+
+    @staticmethod
+    def test_measure_stage(mock_matcher: MagicMock, ):
+        with app.models.base.matches.Matcher.measure_stage(self=mock_matcher, name='covotes', ):
+            pass
+        mock_matcher.timings.stage.assert_called_once_with(name='covotes', )
+
+    @staticmethod
+    def test_measure_stage_no_search(mock_matcher: MagicMock, ):
+        mock_matcher.timings = None
+        with app.models.base.matches.Matcher.measure_stage(self=mock_matcher, name='covotes', ):
+            pass  # Just no error
+
+    @staticmethod
+    def test_search_stages(matcher: Matcher, ):
+        """All the stages of the real search are reported"""
+        with (
+                patch.object(matcher, 'timings_sink', autospec=True, ) as mock_sink,
+                patch.object(matcher, 'create_unfiltered_matches', autospec=True, ),
+                patch.object(matcher, 'filter_matches', autospec=True, ),
+                patch.object(matcher, 'set_matches_counts', autospec=True, ),
+                patch.object(matcher.CRUD, 'track_statements', autospec=True, ) as mock_track_statements,
+        ):
+            mock_track_statements.return_value.__enter__.return_value = {'round_trips': 0, 'rows': 0, }
+            app.models.base.matches.Matcher.make_search(self=matcher, )
+        stages = mock_sink.record.call_args.kwargs['stages']
+        assert [stage['name'] for stage in stages] == ['covotes', 'matches', app.models.base.matches.stages.TOTAL, ]
+
+
+class TestSnapshot:
+    snapshot = app.models.base.matches.snapshot
+
+    @pytest.fixture
+    def path(self, tmp_path: Path, ) -> Path:
+        result = tmp_path / 'votes.snapshot'
+        self.snapshot.write(
+            path=result,
+            tg_user_ids=np.array([3, 1, 3, 1, ], ),
+            post_ids=np.array([10, 20, 20, 10, ], ),
+            values=np.array([1, -1, -1, 1, ], ),
+            mark=datetime(2023, 1, 1, 12, ),
+        )
+        return result
+
+    def test_read(self, path: Path, ):
+        result = self.snapshot.read(path=path, )
+        assert result.mark == datetime(2023, 1, 1, 12, )
+        assert result.tg_user_ids.tolist() == [1, 3, ]
+        assert result.post_ids.tolist() == [10, 20, ]
+        assert result.indptr.tolist() == [0, 2, 4, ]
+        assert result.indices.tolist() == [0, 1, 0, 1, ]
+        assert [array.tolist() for array in result.get_votes()] == [[1, 1, 3, 3, ], [10, 20, 10, 20, ], [1, -1, 1, -1, ], ]
+        assert not result.values.flags.writeable  # Mapped, not copied
+        assert not path.with_name(f'{path.name}.tmp', ).exists()
+
+    def test_read_empty(self, tmp_path: Path, ):
+        self.snapshot.write(
+            path=tmp_path / 'votes.snapshot',
+            tg_user_ids=np.empty(0, dtype=np.int64, ),
+            post_ids=np.empty(0, dtype=np.int64, ),
+            values=np.empty(0, dtype=np.int8, ),
+            mark=None,
+        )
+        result = self.snapshot.read(path=tmp_path / 'votes.snapshot', )
+        assert result.mark is None
+        assert [array.tolist() for array in result.get_votes()] == [[], [], [], ]
+
+    def test_read_corrupted(self, path: Path, ):
+        data = bytearray(path.read_bytes(), )
+        data[-1] ^= 1
+        path.write_bytes(data, )
+        with pytest.raises(app.models.base.matches.BadSnapshot, match='checksum', ):
+            self.snapshot.read(path=path, )
+
+    def test_read_version(self, path: Path, monkeypatch, ):
+        monkeypatch.setattr(self.snapshot, 'VERSION', self.snapshot.VERSION + 1, )
+        with pytest.raises(app.models.base.matches.BadSnapshot, match='version', ):
+            self.snapshot.read(path=path, )
+
+    def test_read_truncated(self, path: Path, ):
+        path.write_bytes(b'foo', )
+        with pytest.raises(app.models.base.matches.BadSnapshot, match='truncated', ):
+            self.snapshot.read(path=path, )
+
+    def test_read_not_found(self, tmp_path: Path, ):
+        with pytest.raises(FileNotFoundError, ):
+            self.snapshot.read(path=tmp_path / 'votes.snapshot', )
+
+
+class TestPrecompute:
+    precompute = app.models.base.matches.precompute
+    expected = {covote['tg_user_id']: covote['count_common_interests'] for covote in covotes[0]}  # Of user 1
+
+    @pytest.fixture
+    def path(self, tmp_path: Path, ) -> Path:
+        tg_user_ids, post_ids, values = zip(*(
+            (i + 1, post_id + 1, value,)
+            for i, votes_values in enumerate(fixed_votes) for post_id, value in enumerate(votes_values) if value
+        ))
+        result = tmp_path / 'votes.snapshot'
+        app.models.base.matches.snapshot.write(
+            path=result,
+            tg_user_ids=np.array(tg_user_ids, ),
+            post_ids=np.array(post_ids, ),
+            values=np.array(values, ),
+            mark=None,
+        )
+        return result
+
+    def test_get_top(self, path: Path, ):
+        counter = self.precompute.CovoteCounter(votes_snapshot=app.models.base.matches.snapshot.read(path=path, ), )
+        assert dict(zip(*(array.tolist() for array in counter.get_top(row=0, )))) == self.expected
+        result = dict(zip(*(array.tolist() for array in counter.get_top(row=0, top_k=3, ))))
+        assert sorted(result.values(), ) == sorted(self.expected.values(), )[-3:]
+        assert result.items() <= self.expected.items()
+
+    def test_run(self, path: Path, ):
+        """In the current process"""
+        mock_on_progress = MagicMock()
+        with patch.object(self.precompute.app.db.crud.users, 'Matcher', autospec=True, ) as mock_crud:
+            result = self.precompute.run(
+                path=path,
+                connection=typing_Any,
+                processes=1,
+                chunk_size=7,
+                on_progress=mock_on_progress,
+            )
+        users_count = len(fixed_votes)
+        assert mock_on_progress.call_count == mock_crud.upsert_precomputed_matches.call_count == 5  # 30 users by 7
+        assert mock_on_progress.call_args.args == (result, users_count, )
+        assert result['users'] == users_count
+        first_chunk = mock_crud.upsert_precomputed_matches.call_args_list[0].kwargs
+        assert first_chunk['connection'] == typing_Any
+        user_matches = {
+            match_id: count for tg_user_id, match_id, count in zip(
+                first_chunk['tg_user_ids'], first_chunk['match_ids'], first_chunk['counts'],
+            ) if tg_user_id == 1
+        }
+        assert user_matches == self.expected
+        assert result['matches'] == sum(
+            len(call.kwargs['match_ids']) for call in mock_crud.upsert_precomputed_matches.call_args_list
+        )
+        mock_crud.delete_stale_precomputed_matches.assert_called_once_with(
+            computed_at=first_chunk['computed_at'],
+            connection=typing_Any,
+        )
+        assert self.precompute.counter is None
+
+    def test_init_worker(self, path: Path, ):
+        """The worker connection is closed when the worker exits"""
+        with (
+            patch.object(self.precompute.db_manager.Postgres, 'get_connection', autospec=True, ) as mock_get_connection,
+            patch.object(self.precompute, 'Finalize', autospec=True, ) as mock_finalize,
+        ):
+            self.precompute.init_worker(path=path, )
+        try:
+            assert self.precompute.worker_connection == mock_get_connection.return_value
+            mock_finalize.assert_called_once_with(None, mock_get_connection.return_value.close, exitpriority=0, )
+        finally:
+            self.precompute.counter = self.precompute.worker_connection = None
+
+    def test_run_pool(self, path: Path, ):
+        """The forked workers give the same result"""
+        with (
+            patch.object(self.precompute.app.db.crud.users, 'Matcher', autospec=True, ),
+            patch.object(self.precompute.db_manager.Postgres, 'get_connection', autospec=True, ),
+        ):
+            expected = self.precompute.run(path=path, connection=typing_Any, processes=1, chunk_size=7, )
+            result = self.precompute.run(path=path, connection=typing_Any, processes=2, chunk_size=7, )
+        assert result == expected
+
+
+class TestEngines:
+    """Real engines on the same votes as SQL tests use"""
+
+    @staticmethod
+    @pytest.fixture(
+        scope='function',
+        params=(
+                app.models.base.matches.engines.VoteMatrix,
+                app.models.base.matches.engines.CovoteIndex,
+                # Single row bands - almost every pair with common votes will be a candidate
+                partial(app.models.base.matches.engines.MinHashLSH, bands=128, rows=1, ),
+        ),
+    )
+    def engine(request, ) -> app.models.base.matches.engines.EngineInterface:
+        votes = [
+            {'tg_user_id': i + 1, 'post_id': post_id + 1, 'value': value, }
+            for i, votes_values in enumerate(fixed_votes) for post_id, value in enumerate(votes_values) if value
+        ]
+        result = request.param()
+        result.load_votes(votes=votes, )
+        return result
+
+    @staticmethod
+    def get_covotes(engine: app.models.base.matches.engines.EngineInterface, tg_user_id: int, ) -> dict[int, int]:
+        return dict(zip(*(array.tolist() for array in engine.count_covotes(tg_user_id=tg_user_id, ))))
+
+    def test_count_covotes(self, engine: app.models.base.matches.engines.EngineInterface, ):
+        expected = {covote['tg_user_id']: covote['count_common_interests'] for covote in covotes[0]}
+        assert self.get_covotes(engine=engine, tg_user_id=1, ) == expected
+        assert engine.read_user_votes_count(tg_user_id=1, ) == 11
+
+    @staticmethod
+    def test_load():
+        engine = app.models.base.matches.engines.CovoteIndex()
+        with (
+            patch.object(engine, 'CRUD', autospec=True, ) as mock_crud,
+            patch.object(engine, 'load_votes', autospec=True, ) as mock_load_votes,
+        ):
+            engine.load(connection=typing_Any, )
+        mock_crud.read_all_votes.assert_called_once_with(connection=typing_Any, )
+        mock_load_votes.assert_called_once_with(votes=mock_crud.read_all_votes.return_value, )
+
+    def test_load_snapshot(self, engine: app.models.base.matches.engines.EngineInterface, tmp_path: Path, ):
+        """The same state as the full load, the votes since the mark are replayed"""
+        tg_user_ids, post_ids, values = zip(*(
+            (i + 1, post_id + 1, value,)
+            for i, votes_values in enumerate(fixed_votes) for post_id, value in enumerate(votes_values) if value
+        ))
+        app.models.base.matches.snapshot.write(
+            path=tmp_path / 'votes.snapshot',
+            tg_user_ids=np.array(tg_user_ids, ),
+            post_ids=np.array(post_ids, ),
+            values=np.array(values, ),
+            mark=datetime(2023, 1, 1, ),
+        )
+        expected = self.get_covotes(engine=engine, tg_user_id=1, )
+        engine.load_votes(votes=[], )
+        with patch.object(engine, 'CRUD', autospec=True, ) as mock_crud:
+            mock_crud.read_votes_since.return_value = [{'tg_user_id': 100, 'post_id': 1, 'value': 1, }, ]
+            engine.load_snapshot(path=tmp_path / 'votes.snapshot', connection=typing_Any, )
+        mock_crud.read_votes_since.assert_called_once_with(mark=datetime(2023, 1, 1, ), connection=typing_Any, )
+        assert self.get_covotes(engine=engine, tg_user_id=1, ) == expected | {100: 1, }  # User 1 liked post 1 too
+        assert engine.read_user_votes_count(tg_user_id=100, ) == 1
+
+    def test_unknown_user(self, engine: app.models.base.matches.engines.EngineInterface, ):
+        assert self.get_covotes(engine=engine, tg_user_id=100, ) == {}
+        assert engine.read_user_votes_count(tg_user_id=100, ) == 0
+
+    @pytest.mark.parametrize(argnames='compact_threshold', argvalues=(10_000, 0, ), )
+    def test_set_vote(
+            self,
+            engine: app.models.base.matches.engines.EngineInterface,
+            monkeypatch,
+            compact_threshold: int,
+    ):
+        monkeypatch.setattr(engine, 'COMPACT_THRESHOLD', compact_threshold, raising=False, )  # Not MinHashLSH
+        # User 1 voted +1 for post 1, user 2 too (1 is a covote of 2); user 100 and post 100 are new
+        engine.set_vote(tg_user_id=100, post_id=1, value=1, )
+        engine.set_vote(tg_user_id=100, post_id=100, value=-1, )
+        engine.set_vote(tg_user_id=1, post_id=100, value=-1, )
+        assert self.get_covotes(engine=engine, tg_user_id=100, )[1] == 2
+        engine.set_vote(tg_user_id=100, post_id=100, value=0, )  # Cancel
+        assert self.get_covotes(engine=engine, tg_user_id=100, )[1] == 1
+        assert engine.read_user_votes_count(tg_user_id=100, ) == 1
+        expected = self.get_covotes(engine=engine, tg_user_id=2, )[1] - 1
+        engine.set_vote(tg_user_id=1, post_id=1, value=-1, )  # Change
+        assert self.get_covotes(engine=engine, tg_user_id=2, ).get(1, 0, ) == expected
+        assert 1 not in self.get_covotes(engine=engine, tg_user_id=100, )
+
+    @staticmethod
+    def test_covote_index_compact():
+        """The changes are merged into the same state as the full load of the final votes"""
+        votes = {
+            (i + 1, post_id + 1,): value
+            for i, votes_values in enumerate(fixed_votes) for post_id, value in enumerate(votes_values) if value
+        }
+        engine = app.models.base.matches.engines.CovoteIndex()
+        engine.load_votes(votes=[
+            {'tg_user_id': tg_user_id, 'post_id': post_id, 'value': value, }
+            for (tg_user_id, post_id,), value in votes.items()
+        ], )
+        for tg_user_id, post_id, value in ((1, 1, -1,), (1, 7, 1,), (100, 1, 1,), (2, 1, 0,), (100, 1, 0,), ):
+            engine.set_vote(tg_user_id=tg_user_id, post_id=post_id, value=value, )
+            votes[(tg_user_id, post_id,)] = value
+        engine.compact()
+        expected = app.models.base.matches.engines.CovoteIndex()
+        expected.load_votes(votes=[
+            {'tg_user_id': tg_user_id, 'post_id': post_id, 'value': value, }
+            for (tg_user_id, post_id,), value in votes.items() if value
+        ], )
+        assert engine.postings.keys() == expected.postings.keys()
+        for key, posting in expected.postings.items():
+            assert engine.postings[key].tolist() == posting.tolist()
+        for attr in ('users', 'indptr', 'items', ):
+            assert getattr(engine, attr, ).tolist() == getattr(expected, attr, ).tolist()
+        assert (engine.added, engine.removed, engine.changed, engine.changed_count,) == ({}, {}, {}, 0,)
+
+
+def test_minhash_lsh_low_recall():
+    """Fewer candidates with strict LSH, but the count is exact for every of them"""
+    votes = [
+        {'tg_user_id': i + 1, 'post_id': post_id + 1, 'value': value, }
+        for i, votes_values in enumerate(fixed_votes) for post_id, value in enumerate(votes_values) if value
+    ]
+    engine = app.models.base.matches.engines.MinHashLSH(bands=2, rows=8, )
+    engine.load_votes(votes=votes, )
+    expected = {covote['tg_user_id']: covote['count_common_interests'] for covote in covotes[0]}
+    result = dict(zip(*(array.tolist() for array in engine.count_covotes(tg_user_id=1, ))))
+    assert len(result) < len(expected)
+    assert result.items() <= expected.items()
+
+
 class TestMatch:
 
     @staticmethod
@@ -295,9 +1870,14 @@ def test_repr(match_s: Match):
 
     @staticmethod
     def test_create(mock_match_f: MagicMock):
-        app.models.matches.Match.create(self=mock_match_f, )
-        mock_match_f.CRUD.create.assert_called_once_with(
-            tg_user_id=mock_match_f.owner.tg_user_id,
-            matched_tg_user_id=mock_match_f.user.tg_user_id,
-            connection=mock_match_f.owner.connection,
-        )
+        with patch.object(app.models.base.matches.Matcher, 'versions', autospec=True, ) as mock_versions:
+            app.models.matches.Match.create(self=mock_match_f, )
+            mock_match_f.CRUD.create.assert_called_once_with(
+                tg_user_id=mock_match_f.owner.tg_user_id,
+                matched_tg_user_id=mock_match_f.user.tg_user_id,
+                connection=mock_match_f.owner.connection,
+            )
+            after_commit_kwargs = mock_match_f.CRUD.db.after_commit.call_args.kwargs
+            assert after_commit_kwargs['connection'] == mock_match_f.owner.connection
+            after_commit_kwargs['callback']()
+        mock_versions.bump.assert_called_once_with(key=mock_match_f.owner.tg_user_id, )  # Not new anymore
@@ -151,6 +151,16 @@ def test_create(user_s: User, ):
             connection=user_s.connection,
         )
 
+    @staticmethod
+    def test_create_many(user_s: User, ):
+        with patch.object(Photo, 'CRUD', autospec=True, ) as mock_crud:
+            Photo.create_many(user=user_s, photos=['foo', ], )
+        mock_crud.create_many.assert_called_once_with(
+            tg_user_id=user_s.tg_user_id,
+            photos=['foo', ],
+            connection=user_s.connection,
+        )
+
     @staticmethod
     def test_read(user_s: User, ):
         with patch.object(Photo, 'CRUD', autospec=True, ) as mock_crud:
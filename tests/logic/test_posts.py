@@ -254,6 +254,39 @@ def test_accepted(mock_public_post_f: MagicMock, mock_public_handled_vote: Magic
             mock_self.update_votes_count.assert_called_once_with()
             assert result is True
 
+    class TestHandleVotes:
+        """handle_votes"""
+
+        @staticmethod
+        def test_accepted(mock_public_post_f: MagicMock, ):
+            """The counters are saved once, not accepted votes are skipped"""
+            mock_self = mock_public_post_f
+            value = app.models.votes.PublicVote.Value
+            handled_votes = [
+                app.models.votes.PublicVote.HandledVote(
+                    new_value=value.POSITIVE,
+                    old_value=value.ZERO,
+                    incoming_value=value.POSITIVE,
+                    is_accepted=is_accepted,
+                ) for is_accepted in (True, False, True,)
+            ]
+            result = app.models.posts.PublicPost.handle_votes(self=mock_self, handled_votes=handled_votes, )
+            assert mock_self.accept_vote_value.call_args_list == [
+                call(old_value=value.ZERO, incoming_value=value.POSITIVE, ),
+            ] * 2
+            mock_self.update_votes_count.assert_called_once_with()
+            assert result is True
+
+        @staticmethod
+        def test_declined(mock_public_post_f: MagicMock, mock_public_handled_vote: MagicMock, ):
+            """Accepted by the vote but not by the post"""
+            mock_self = mock_public_post_f
+            mock_self.accept_vote_value.return_value = False
+            mock_public_handled_vote.is_accepted = True
+            result = app.models.posts.PublicPost.handle_votes(self=mock_self, handled_votes=[mock_public_handled_vote], )
+            mock_self.update_votes_count.assert_not_called()
+            assert result is False
+
     @staticmethod
     def test_get_voted_users(mock_public_post_f: MagicMock, ):
         mock_public_post_f.CRUD.read_voted_users_ids.return_value = [1]
@@ -362,6 +395,10 @@ def test_handle_vote():
         """Nothing to handle for now"""
         assert app.models.posts.PersonalPost.handle_vote(handled_vote=typing_Any, ) is True
 
+    @staticmethod
+    def test_handle_votes():
+        assert app.models.posts.PersonalPost.handle_votes(handled_votes=[typing_Any, ], ) is True
+
 
 class TestVotedPublicPost:
     @staticmethod
@@ -14,7 +14,7 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from __future__ import annotations
-from unittest.mock import patch
+from unittest.mock import patch, call
 from typing import TYPE_CHECKING, Any as typing_Any
 
 import pytest
@@ -142,26 +142,42 @@ def test_set_bot_votes(
             user=mock_Mapper.User.return_value,
             post=mock_public_post_f,
         )
-        mock_Mapper.User.return_value.set_vote.assert_called_once_with(
-            vote=mock_gen_vote.return_value,
-            post=mock_public_post_f,
+        connection = patched_crud.db.get_user_connection.return_value
+        patched_crud.db.get_user_connection.assert_called_once_with(default=System.connection, )
+        patched_crud.db.transaction.assert_called_once_with(connection=connection, )
+        mock_public_post_f.Mapper.Vote.handle_many.assert_called_once_with(
+            votes=[mock_gen_vote.return_value, ],
+            connection=connection,
+        )
+        mock_public_post_f.handle_votes.assert_called_once_with(
+            handled_votes=mock_public_post_f.Mapper.Vote.handle_many.return_value,
         )
 
     @staticmethod
     def test_read_bots_ids(patched_crud: MagicMock, ):
+        patched_crud.read_bots_ids.return_value = iter([1, 2, ])
         result = System.read_bots_ids()
         patched_crud.read_bots_ids.assert_called_once_with(connection=System.connection, )
-        assert result == patched_crud.read_bots_ids.return_value
+        assert result == [1, 2, ]
 
     @staticmethod
-    def test_read_all_users_ids(patched_crud: MagicMock, ):
+    def test_read_all_users_ids(patched_crud: MagicMock, monkeypatch, ):
+        """Page after page till the empty one"""
+        monkeypatch.setattr(System, 'USERS_IDS_PAGE_SIZE', 2, )
+        patched_crud.read_users_ids_page.side_effect = [[1, 2, ], [3, ], [], ]
         result = System.read_all_users_ids()
-        patched_crud.read_all_users_ids.assert_called_once_with(connection=System.connection, )
-        assert result == patched_crud.read_all_users_ids.return_value
+        assert list(result) == [1, 2, 3, ]
+        assert patched_crud.read_users_ids_page.call_args_list == [
+            call(after_tg_user_id=None, limit=2, connection=System.connection, ),
+            call(after_tg_user_id=2, limit=2, connection=System.connection, ),
+            call(after_tg_user_id=3, limit=2, connection=System.connection, ),
+        ]
 
     @staticmethod
     def test_gen_bots(mock_public_post_f: MagicMock, ):
         with (
+            patch.object(System.generator, 'gen_new_user', autospec=True, ) as mock_gen_new_user,
+            patch.object(System.Mapper, 'NewUser', autospec=True, ) as mock_NewUser,
             patch.object(
                 System.PublicPostService,
                 'get_public_posts',
@@ -173,16 +189,15 @@ def test_gen_bots(mock_public_post_f: MagicMock, ):
                 'set_bots_votes_to_post',
                 autospec=True,
             ) as mock_set_bots_votes_to_post,
-            patch.object(
-                System,
-                'gen_bot',
-                autospec=True,
-            ) as mock_gen_bot,
         ):
             System.gen_bots(bots_ids=[1, ], gen_votes=True, )
+            mock_gen_new_user.assert_called_once_with(tg_user_id=1, )
+            mock_NewUser.create_many.assert_called_once_with(
+                new_users=[mock_gen_new_user.return_value, ],
+                connection=System.connection,
+            )
             mock_get_public_posts.assert_called_once_with(connection=System.connection, )
             mock_set_bots_votes_to_post.assert_called_once_with(post=mock_public_post_f, bots_ids=[1, ], )
-            mock_gen_bot.assert_called_once_with(bot_id=1, )
 
     @staticmethod
     def test_gen_bot(mock_public_post_f: MagicMock, ):
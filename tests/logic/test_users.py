@@ -43,6 +43,15 @@ def test_connection_setter(user_f: User):
         assert user_f.connection == typing_Any
         assert user_f._connection == typing_Any
 
+    @staticmethod
+    def test_connection_unit_of_work(user_f: User):
+        """Connection of the current unit of work is preferred to the passed one"""
+        user_f.connection = typing_Any
+        with patch.object(user_f.CRUD.db, 'connection_pool', autospec=True, ) as mock_connection_pool:
+            with user_f.CRUD.db.borrow() as connection:
+                assert user_f.connection == connection == mock_connection_pool.borrow.return_value.__enter__.return_value
+        assert user_f.connection == typing_Any
+
     @staticmethod
     @pytest.mark.parametrize(argnames='flag', argvalues=(True, False), )
     def test_is_registered(user_f: User, monkeypatch, flag: bool, ):
@@ -142,6 +151,12 @@ def test_get_vote(
     class TestSetPublicVote:
         """set_public_vote"""
 
+        @staticmethod
+        @pytest.fixture(autouse=True, )
+        def mock_transaction() -> MagicMock:
+            with patch.object(app.models.users.User.CRUD.db, 'transaction', autospec=True, ) as mock_transaction:
+                yield mock_transaction
+
         @staticmethod
         def test_not_accepted(
                 user_f: app.models.users.User,
@@ -159,14 +174,21 @@ def test_public(
                 user_f: app.models.users.User,
                 mock_public_vote: MagicMock,
                 mock_public_post_f: MagicMock,
+                mock_transaction: MagicMock,
         ):
             mock_public_vote.Mapper.Post.get_post_by_vote.return_value = mock_public_post_f
             mock_public_vote.handle.return_value.is_accepted = True
-            result = app.models.users.User.set_vote(self=user_f, vote=mock_public_vote, )
+            user_f.matcher.is_user_has_votes = False
+            with patch.object(app.models.users.User.CRUD.db, 'after_commit', autospec=True, ) as mock_after_commit:
+                result = app.models.users.User.set_vote(self=user_f, vote=mock_public_vote, )
             # Checks
+            mock_transaction.assert_called_once_with(connection=user_f.connection, )
             mock_public_vote.handle.assert_called_once_with()
             mock_public_vote.Mapper.Post.get_post_by_vote.assert_called_once_with(vote=mock_public_vote, )
             mock_public_post_f.handle_vote.assert_called_once_with(handled_vote=mock_public_vote.handle.return_value, )
+            assert mock_after_commit.call_args.kwargs['connection'] == user_f.connection
+            assert user_f.matcher.is_user_has_votes is False  # Not before the commit
+            mock_after_commit.call_args.kwargs['callback']()
             assert user_f.matcher.is_user_has_votes is True
             assert result == mock_public_post_f.handle_vote.return_value
 
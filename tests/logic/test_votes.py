@@ -174,9 +174,55 @@ def test_handle(mock_public_vote: MagicMock, ):
         # CHECKS
         mock_self.read_vote.assert_called_once_with(user=mock_self.user, post_id=mock_self.post_id, )
         mock_self.read_vote.return_value.is_accept_vote.assert_called_once_with(new_vote=mock_self, )
+        mock_self.CRUD.db.pipeline.assert_called_once_with(connection=mock_self.user.connection, )
         mock_self.upsert_value.assert_called_once_with()
+        mock_self.Mapper.Matcher.handle_vote.assert_called_once_with(
+            tg_user_id=mock_self.user.tg_user_id,
+            post_id=mock_self.post_id,
+            old_value=mock_self.read_vote.return_value.value,
+            new_value=mock_self.value,
+            connection=mock_self.user.connection,
+        )
         assert result == mock_self.HandledVote.return_value
 
+    @staticmethod
+    def test_handle_many(patched_crud: MagicMock, mock_connection_f: MagicMock, ):
+        user_1, user_2 = (app.models.users.User(tg_user_id=i, connection=mock_connection_f, ) for i in (1, 2,))
+        patched_crud.read_users_votes.return_value = [{'tg_user_id': 1, 'post_id': 3, 'message_id': 4, 'value': 1, }]
+        votes = [
+            PublicVote(user=user_1, post_id=3, message_id=4, value=PublicVote.Value.POSITIVE, ),  # Already liked
+            PublicVote(user=user_2, post_id=3, message_id=4, value=PublicVote.Value.NEGATIVE, ),
+        ]
+        with patch.object(PublicVote.Mapper, 'Matcher', autospec=True, ) as mock_matcher:
+            result = PublicVote.handle_many(votes=votes, connection=mock_connection_f, )
+        # CHECKS
+        patched_crud.read_users_votes.assert_called_once_with(
+            post_id=3,
+            tg_user_ids=[1, 2, ],
+            connection=mock_connection_f,
+        )
+        patched_crud.db.pipeline.assert_called_once_with(connection=mock_connection_f, )
+        patched_crud.upsert_values.assert_called_once_with(rows=[(2, 3, 4, -1,), ], connection=mock_connection_f, )
+        mock_matcher.handle_votes.assert_called_once_with(
+            post_id=3,
+            votes=[(2, PublicVote.Value.NONE, PublicVote.Value.NEGATIVE,), ],
+            connection=mock_connection_f,
+        )
+        assert result == [
+            PublicVote.HandledVote(
+                new_value=PublicVote.Value.POSITIVE,
+                old_value=PublicVote.Value.POSITIVE,
+                incoming_value=PublicVote.Value.POSITIVE,
+                is_accepted=False,
+            ),
+            PublicVote.HandledVote(
+                new_value=PublicVote.Value.NEGATIVE,
+                old_value=PublicVote.Value.NONE,
+                incoming_value=PublicVote.Value.NEGATIVE,
+                is_accepted=True,
+            ),
+        ]
+
     @staticmethod
     def test_upsert_value(mock_public_vote: MagicMock, ):
         app.models.votes.PublicVote.upsert_value(self=mock_public_vote, )
@@ -316,3 +362,18 @@ def test_declined(self, mock_personal_vote: MagicMock, ):
             mock_personal_vote.is_accept_vote.return_value = False
             result = self.body(mock_self=mock_personal_vote, )
             assert result == mock_personal_vote.HandledVote.return_value
+
+    @staticmethod
+    def test_handle_many(mock_connection_f: MagicMock, ):
+        user_1, user_2 = (app.models.users.User(tg_user_id=i, connection=mock_connection_f, ) for i in (1, 2,))
+        votes = [
+            PersonalVote(user=user_1, post_id=3, message_id=4, value=PersonalVote.Value.POSITIVE, ),  # Already liked
+            PersonalVote(user=user_2, post_id=3, message_id=4, value=PersonalVote.Value.NEGATIVE, ),
+        ]
+        with patch.object(PersonalVote, 'CRUD', autospec=True, ) as mock_crud:
+            mock_crud.read_users_votes.return_value = [{'tg_user_id': 1, 'post_id': 3, 'message_id': 4, 'value': 1, }]
+            result = PersonalVote.handle_many(votes=votes, connection=mock_connection_f, )
+        mock_crud.upsert_many.assert_called_once_with(rows=[(2, 3, 4, -1,), ], connection=mock_connection_f, )
+        assert [handled_vote.is_accepted for handled_vote in result] == [False, True, ]
+        assert [handled_vote.new_vote for handled_vote in result] == votes
+        assert result[1].old_vote.value == PersonalVote.Value.ZERO
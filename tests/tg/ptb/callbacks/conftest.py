@@ -46,6 +46,9 @@ def mock_context(
     mock_context: MagicMock = create_autospec(CustomCallbackContext, spec_set=True, )
     mock_context.bot = mock_ptb_bot_s
     mock_context.user_data.current_user = mock_ptb_user_s
+    mock_context.user_data.current_user.matcher.SEARCH_JOBS = False  # Default
+    mock_context.user_data.current_user.matcher.is_search_running.return_value = False
+    mock_context.user_data.current_user.matcher.is_search_cancelled = False  # Default
     mock_context.user_data.view = mock_tg_view_s
     mock_context.user_data.tmp_data = app.tg.ptb.structures.CustomUserData.TmpData()
     mock_context.user_data.forms = app.tg.ptb.structures.CustomUserData.Forms()
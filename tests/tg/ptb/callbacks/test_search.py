@@ -15,16 +15,21 @@
 
 from __future__ import annotations
 from typing import TYPE_CHECKING
-from unittest.mock import patch
+from unittest.mock import patch, call
+from concurrent.futures import Future
 
 import pytest
 # noinspection PyPackageRequirements
 from telegram import Update as tg_Update
+# noinspection PyPackageRequirements
+from telegram.ext.utils.promise import Promise
 
-from app.exceptions import NoVotes, NoCovotes, IncorrectProfileValue
+from app.exceptions import NoVotes, NoCovotes, IncorrectProfileValue, SearchQueueFull
 from app.tg.ptb.classes.matches import Matcher
 import app.tg.ptb.config
 import app.tg.ptb.handlers.search
+import app.tg.ptb.utils
+import app.tg.ptb.handlers.mix
 
 from tests.tg.ptb.functional.utils import get_text_cases
 
@@ -56,11 +61,36 @@ def patched_target_cls(mock_ptb_target: MagicMock, ):
 
 def test_entry_point(mock_context: MagicMock, tg_update_f: tg_Update, monkeypatch, ):
     result = app.tg.ptb.handlers.search.entry_point(_=tg_update_f, context=mock_context, )
+    mock_context.user_data.current_user.matcher.cancel_search.assert_called_once_with()  # Re-entry
     mock_context.user_data.view.search.say_search_hello.assert_called_once_with()
     assert len(mock_context.user_data.view.mock_calls) == 1
     assert result == 0
 
 
+def test_cancel(mock_context: MagicMock, tg_update_f: tg_Update, ):
+    with patch.object(app.tg.ptb.handlers.mix, 'cancel', autospec=True, ) as mock_cancel:
+        result = app.tg.ptb.handlers.search.cancel(update=tg_update_f, context=mock_context, )
+    mock_context.user_data.current_user.matcher.cancel_search.assert_called_once_with()
+    mock_cancel.assert_called_once_with(_=tg_update_f, context=mock_context, )
+    assert result == mock_cancel.return_value
+
+
+@pytest.mark.parametrize(
+    argnames='handler',
+    argvalues=(
+            app.tg.ptb.handlers.search.entry_point_handler,
+            app.tg.ptb.handlers.search.checkboxes_handler,
+            app.tg.ptb.handlers.search.match_type_handler,
+            app.tg.ptb.handlers.search.show_match_handler,
+    ),
+)
+def test_closing_session_on_error(mock_context: MagicMock, tg_update_f: tg_Update, handler, monkeypatch, ):
+    monkeypatch.setattr(mock_context.user_data, 'view', None, )  # Any access fails
+    with pytest.raises(expected_exception=AttributeError, ):
+        handler(tg_update_f, mock_context, )
+    mock_context.user_data.current_user.matcher.close_session.assert_called_once_with()
+
+
 def test_entry_point_handler_no_votes(
         mock_context: MagicMock,
         tg_update_f: tg_Update,
@@ -76,6 +106,7 @@ def test_entry_point_handler_no_votes(
         text=tg_update_f.effective_message.text
     )
     mock_context.user_data.view.search.no_votes.assert_called_once_with()
+    mock_context.user_data.current_user.matcher.close_session.assert_called_once_with()  # Not kept till re-entry
     assert len(mock_context.user_data.view.mock_calls) == 1
     assert result == -1
 
@@ -96,6 +127,7 @@ def test_entry_point_handler_no_covotes(
         text=tg_update_f.effective_message.text,
     )
     mock_context.user_data.view.search.no_covotes.assert_called_once_with()
+    mock_context.user_data.current_user.matcher.close_session.assert_called_once_with()  # Not kept till re-entry
     assert len(mock_context.user_data.view.mock_calls) == 1
     assert result == -1
 
@@ -207,27 +239,145 @@ def test_age_handler(mock_context: MagicMock, tg_update_f: tg_Update, text: str,
 
 def test_checkboxes_handler_no_matches_with_filters(mock_context: MagicMock, tg_update_f: tg_Update, monkeypatch, ):
     monkeypatch.setattr(tg_update_f.effective_message, 'text', 'foo')
-    with patch.object(mock_context.user_data.current_user.matcher.matches, 'all', [], ):
+    matches = mock_context.user_data.current_user.matcher.matches
+    with patch.object(matches, 'count_all', 0, ), patch.object(matches, 'is_partial', False, ):
         result = app.tg.ptb.handlers.search.checkboxes_handler(_=tg_update_f, context=mock_context, )
     mock_context.user_data.current_user.matcher.make_search.assert_called_once_with()
     mock_context.user_data.view.search.no_matches_with_filters.assert_called_once_with()
+    mock_context.user_data.current_user.matcher.close_session.assert_called_once_with()  # Not kept till re-entry
     assert len(mock_context.user_data.view.mock_calls) == 1
     assert result == -1
 
 
 def test_checkboxes_handler(mock_context: MagicMock, tg_update_f: tg_Update, monkeypatch, ):
     monkeypatch.setattr(tg_update_f.effective_message, 'text', 'foo', )
+    matches = mock_context.user_data.current_user.matcher.matches
     # Execution
-    with patch.object(mock_context.user_data.current_user.matcher.matches, 'all', ['foo', ], ):
+    with patch.object(matches, 'count_all', 1, ), patch.object(matches, 'is_partial', False, ):
         result = app.tg.ptb.handlers.search.checkboxes_handler(_=tg_update_f, context=mock_context, )
     # Checks
     mock_context.user_data.current_user.matcher.make_search.assert_called_once_with()
-    matches = mock_context.user_data.current_user.matcher.matches
     mock_context.user_data.view.search.ask_which_matches_show.assert_called_once_with(matches=matches, )
     assert len(mock_context.user_data.view.mock_calls) == 1
     assert result == 5
 
 
+def test_checkboxes_handler_partial(mock_context: MagicMock, tg_update_f: tg_Update, monkeypatch, ):
+    monkeypatch.setattr(tg_update_f.effective_message, 'text', 'foo', )
+    matches = mock_context.user_data.current_user.matcher.matches
+    # Execution
+    with patch.object(matches, 'count_all', 1, ), patch.object(matches, 'is_partial', True, ):
+        result = app.tg.ptb.handlers.search.checkboxes_handler(_=tg_update_f, context=mock_context, )
+    # Checks
+    assert mock_context.user_data.view.search.mock_calls == [
+        call.partial_matches(),
+        call.ask_which_matches_show(matches=matches, ),
+    ]
+    assert result == 5
+
+
+def test_checkboxes_handler_job(mock_context: MagicMock, tg_update_f: tg_Update, monkeypatch, ):
+    """The next state is the promise of the callback, it's resolved by the search thread"""
+    matcher = mock_context.user_data.current_user.matcher
+    monkeypatch.setattr(matcher, 'SEARCH_JOBS', True, )
+    # Execution
+    with patch.object(app.tg.ptb.handlers.search, 'search_job_callback', autospec=True, ) as mock_search_job_callback:
+        result = app.tg.ptb.handlers.search.checkboxes_handler(_=tg_update_f, context=mock_context, )
+    # Checks
+    assert isinstance(result, Promise, )
+    assert result.kwargs == {'context': mock_context, }
+    matcher.make_search.assert_not_called()
+    mock_context.user_data.view.search.searching.assert_called_once_with()
+    assert len(mock_context.user_data.view.mock_calls) == 1
+    assert not result.done.is_set()
+    matcher.submit_search.call_args.kwargs['on_done'](Future(), )  # The job is done
+    mock_search_job_callback.assert_called_once_with(context=mock_context, )
+    assert result.result(timeout=0, ) == mock_search_job_callback.return_value
+
+
+def test_checkboxes_handler_job_queue_full(mock_context: MagicMock, tg_update_f: tg_Update, monkeypatch, ):
+    """The search is made right in the handler"""
+    matcher = mock_context.user_data.current_user.matcher
+    monkeypatch.setattr(matcher, 'SEARCH_JOBS', True, )
+    monkeypatch.setattr(matcher.submit_search, 'side_effect', SearchQueueFull, )
+    with patch.object(app.tg.ptb.handlers.search, 'show_search_result', autospec=True, ) as mock_show_search_result:
+        result = app.tg.ptb.handlers.search.checkboxes_handler(_=tg_update_f, context=mock_context, )
+    matcher.make_search.assert_called_once_with()
+    mock_show_search_result.assert_called_once_with(context=mock_context, )
+    assert result == mock_show_search_result.return_value
+
+
+class TestSearchJobCallback:
+    @staticmethod
+    def test_done(mock_context: MagicMock, monkeypatch, ):
+        job = Future()
+        job.set_result([], )
+        monkeypatch.setattr(mock_context.user_data.current_user.matcher, 'search_job', job, )
+        with patch.object(app.tg.ptb.handlers.search, 'show_search_result', autospec=True, ) as mock_show_search_result:
+            result = app.tg.ptb.handlers.search.search_job_callback(context=mock_context, )
+        mock_show_search_result.assert_called_once_with(context=mock_context, )
+        assert result == mock_show_search_result.return_value
+
+    @staticmethod
+    def test_error(mock_context: MagicMock, patched_logger: MagicMock, monkeypatch, ):
+        job, error = Future(), ValueError()
+        job.set_exception(error, )
+        monkeypatch.setattr(mock_context.user_data.current_user.matcher, 'search_job', job, )
+        with patch.object(app.tg.ptb.handlers.search, 'show_search_result', autospec=True, ) as mock_show_search_result:
+            result = app.tg.ptb.handlers.search.search_job_callback(context=mock_context, )
+        patched_logger.error.assert_called_once_with(error, )
+        mock_context.user_data.current_user.matcher.close_session.assert_called_once_with()
+        mock_show_search_result.assert_not_called()
+        assert result == app.tg.ptb.utils.end_conversation()
+
+    @staticmethod
+    def test_show_error(mock_context: MagicMock, patched_logger: MagicMock, monkeypatch, ):
+        """The conversation is not left in the waiting state"""
+        job, error = Future(), ValueError()
+        job.set_result([], )
+        monkeypatch.setattr(mock_context.user_data.current_user.matcher, 'search_job', job, )
+        with patch.object(app.tg.ptb.handlers.search, 'show_search_result', autospec=True, side_effect=error, ):
+            result = app.tg.ptb.handlers.search.search_job_callback(context=mock_context, )
+        patched_logger.error.assert_called_once_with(error, )
+        mock_context.user_data.current_user.matcher.close_session.assert_called_once_with()
+        assert result == app.tg.ptb.utils.end_conversation()
+
+    @staticmethod
+    def test_no_session(mock_context: MagicMock, monkeypatch, ):
+        """The single query modes search without the session, the result is shown"""
+        matcher = mock_context.user_data.current_user.matcher
+        job = Future()
+        job.set_result([], )
+        monkeypatch.setattr(matcher, 'mode', Matcher.Mode.SINGLE_QUERY, )
+        monkeypatch.setattr(matcher, 'session', None, )
+        monkeypatch.setattr(matcher, 'search_job', job, )
+        with patch.object(app.tg.ptb.handlers.search, 'show_search_result', autospec=True, ) as mock_show_search_result:
+            result = app.tg.ptb.handlers.search.search_job_callback(context=mock_context, )
+        mock_show_search_result.assert_called_once_with(context=mock_context, )
+        assert result == mock_show_search_result.return_value
+
+    @staticmethod
+    def test_cancelled(mock_context: MagicMock, monkeypatch, ):
+        monkeypatch.setattr(mock_context.user_data.current_user.matcher, 'is_search_cancelled', True, )
+        with patch.object(app.tg.ptb.handlers.search, 'show_search_result', autospec=True, ) as mock_show_search_result:
+            result = app.tg.ptb.handlers.search.search_job_callback(context=mock_context, )
+        mock_show_search_result.assert_not_called()
+        assert result == app.tg.ptb.utils.end_conversation()
+
+
+def test_search_stages_handler_cmd(mock_context: MagicMock, tg_update_f: tg_Update, ):
+    app.tg.ptb.handlers.search.search_stages_handler_cmd(tg_update_f, context=mock_context, )
+    mock_context.user_data.view.search.search_stages.assert_called_once_with(
+        report=mock_context.user_data.current_user.matcher.timings_sink.report.return_value,
+    )
+
+
+def test_searching_handler(mock_context: MagicMock, tg_update_f: tg_Update, ):
+    result = app.tg.ptb.handlers.search.searching_handler(tg_update_f, context=mock_context, )
+    mock_context.user_data.view.search.still_searching.assert_called_once_with()
+    assert result is None
+
+
 def test_match_type_handler_incorrect(mock_context: MagicMock, tg_update_f: tg_Update, monkeypatch, ):
     monkeypatch.setattr(tg_update_f.effective_message, 'text', 'foo')
     mock_handle_show_option = mock_context.user_data.forms.target.handle_show_option
@@ -251,6 +401,7 @@ def test_match_type_handler_no_more_matches(mock_context: MagicMock, tg_update_f
     # Checks
     mock_context.user_data.current_user.matcher.get_match.assert_called_once_with()
     mock_context.user_data.view.search.no_more_matches.assert_called_once_with()
+    mock_context.user_data.current_user.matcher.close_session.assert_called_once_with()
     assert len(mock_context.user_data.view.mock_calls) == 1
     assert result == -1
 
@@ -291,6 +442,7 @@ def test_show_match_handler_no_more_matches(
     result = app.tg.ptb.handlers.search.show_match_handler(update=tg_update_f, context=mock_context, )
     # Checks
     mock_context.user_data.view.search.no_more_matches.assert_called_once_with()
+    mock_context.user_data.current_user.matcher.close_session.assert_called_once_with()
     assert len(mock_context.user_data.view.mock_calls) == 1
     assert result == -1
 
@@ -302,6 +454,7 @@ def test_show_match_handler_complete(mock_context: MagicMock, tg_update_f: tg_Up
     result = app.tg.ptb.handlers.search.show_match_handler(update=tg_update_f, context=mock_context, )
     # Checks
     mock_context.user_data.view.search.say_search_goodbye.assert_called_once_with()
+    mock_context.user_data.current_user.matcher.close_session.assert_called_once_with()
     assert len(mock_context.user_data.view.mock_calls) == 1
     assert result == -1
 
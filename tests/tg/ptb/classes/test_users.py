@@ -16,7 +16,8 @@
 from __future__ import annotations
 
 import typing
-from unittest.mock import patch
+from unittest.mock import patch, call, MagicMock
+from concurrent.futures import Future
 from typing import TYPE_CHECKING, Any as typing_Any
 
 import pytest
@@ -39,13 +40,11 @@
 from tests.conftest import raise_side_effect
 
 if TYPE_CHECKING:
-    from unittest.mock import MagicMock
     # noinspection PyPackageRequirements
     from telegram import User as tg_ptb_User, PhotoSize as tg_PhotoSize
     import app.tg.ptb.classes.users
     import app.tg.classes.users
     import app.models.users
-    from app.structures.base import Covote
 
 
 class TestPTBProfile:
@@ -58,42 +57,151 @@ def test_prepare_photos(mock_ptb_profile: MagicMock, ):
         assert result == [tg_InputMediaPhoto(media='photo_file_tg_id', parse_mode=tg_ParseMode.HTML), ]
 
     @staticmethod
-    def test_send(patched_ptb_bot: MagicMock, mock_ptb_profile: MagicMock, ):
-        app.tg.ptb.classes.users.Profile.send(self=mock_ptb_profile)
+    def test_prepare_to_send(mock_ptb_profile: MagicMock, ):
+        result = app.tg.ptb.classes.users.Profile.prepare_to_send(self=mock_ptb_profile)
         mock_ptb_profile.get_data.assert_called_once_with()
         mock_ptb_profile.prepare_photos_to_send.assert_called_once_with(
             caption=mock_ptb_profile.get_data.return_value.text,
         )
+        assert result == mock_ptb_profile.prepare_photos_to_send.return_value
+
+    @staticmethod
+    def test_send(patched_ptb_bot: MagicMock, mock_ptb_profile: MagicMock, ):
+        app.tg.ptb.classes.users.Profile.send(self=mock_ptb_profile)
+        mock_ptb_profile.prepare_to_send.assert_called_once_with()
         patched_ptb_bot.send_media_group.assert_called_once_with(
             chat_id=mock_ptb_profile.user.tg_user_id,
-            media=mock_ptb_profile.prepare_photos_to_send.return_value,
+            media=mock_ptb_profile.prepare_to_send.return_value,
         )
 
+    @staticmethod
+    def test_send_prepared(patched_ptb_bot: MagicMock, mock_ptb_profile: MagicMock, ):
+        app.tg.ptb.classes.users.Profile.send(self=mock_ptb_profile, show_to_tg_user_id=1, media=['foo', ], )
+        mock_ptb_profile.prepare_to_send.assert_not_called()
+        patched_ptb_bot.send_media_group.assert_called_once_with(chat_id=1, media=['foo', ], )
+
 
 class TestMatch:
+    @staticmethod
+    def test_prepare(mock_tg_ptb_match: MagicMock, ):
+        app.tg.ptb.classes.matches.Match.prepare(self=mock_tg_ptb_match, )
+        assert mock_tg_ptb_match.media == mock_tg_ptb_match.user.profile.prepare_to_send.return_value
+
     @staticmethod
     def test_show(mock_tg_ptb_match: MagicMock, ):
         app.tg.ptb.classes.matches.Match.show(self=mock_tg_ptb_match, )
+        mock_tg_ptb_match.user.profile.send.assert_called_once_with(
+            mock_tg_ptb_match.owner.tg_user_id,
+            media=mock_tg_ptb_match.media,
+        )
         mock_tg_ptb_match.create.assert_called_once_with()
 
 
 class TestMatcher:
     @staticmethod
-    def test_convert_matches(
-            mock_ptb_matcher: MagicMock,
-            covote: Covote,
-            mock_tg_ptb_match: MagicMock,
-    ):
+    def test_create_match(mock_ptb_matcher: MagicMock, mock_tg_ptb_match: MagicMock, ):
         with patch.object(
                 app.models.matches.Matcher,
-                'convert_matches',
+                'create_match',
                 autospec=True,
-                return_value=[mock_tg_ptb_match],
-        ) as mock_super_convert_matches:
-            result = app.tg.ptb.classes.matches.Matcher.convert_matches(self=mock_ptb_matcher, raw_matches=[covote], )
-        mock_super_convert_matches.assert_called_once_with(self=mock_ptb_matcher, raw_matches=[covote], )
-        assert all(match.user.profile.is_loaded is False for match in mock_super_convert_matches.return_value)
-        assert result == mock_super_convert_matches.return_value
+                return_value=mock_tg_ptb_match,
+        ) as mock_super_create_match:
+            result = app.tg.ptb.classes.matches.Matcher.create_match(
+                self=mock_ptb_matcher,
+                id_=1,
+                tg_user_id=2,
+                count_common_interests=3,
+            )
+        mock_super_create_match.assert_called_once_with(
+            self=mock_ptb_matcher,
+            id_=1,
+            tg_user_id=2,
+            count_common_interests=3,
+        )
+        assert result.user.profile.is_loaded is False
+        assert result == mock_tg_ptb_match
+
+    @staticmethod
+    @pytest.mark.parametrize(argnames='is_loaded', argvalues=(True, False, ), )
+    def test_load_matches(mock_ptb_matcher: MagicMock, mock_tg_ptb_match: MagicMock, is_loaded: bool, ):
+        """The profile of the not found user is not marked as loaded"""
+        mock_tg_ptb_match.user.profile.is_loaded = False
+        with patch.object(app.models.matches.Matcher, 'load_matches', autospec=True, ) as mock_super_load_matches:
+            mock_tg_ptb_match.is_loaded = is_loaded  # As set by the super
+            app.tg.ptb.classes.matches.Matcher.load_matches(self=mock_ptb_matcher, matches=[mock_tg_ptb_match], )
+        mock_super_load_matches.assert_called_once_with(
+            self=mock_ptb_matcher,
+            matches=[mock_tg_ptb_match],
+            connection=None,
+        )
+        assert mock_tg_ptb_match.user.profile.is_loaded is is_loaded
+
+    class TestPrefetch:
+        @staticmethod
+        def test_prefetch_matches(mock_ptb_matcher: MagicMock, ):
+            mock_ptb_matcher.PREFETCH_COUNT = 2
+            far, prepared, *nearest = [MagicMock(media=None, ) for _ in range(4)]
+            prepared.media = ['foo', ]
+            matches = [far, nearest[0], prepared, nearest[1], ]
+            app.tg.ptb.classes.matches.Matcher.prefetch_matches(self=mock_ptb_matcher, matches=matches, )
+            mock_ptb_matcher.CRUD.db.borrow.assert_called_once_with(owner=f'prefetch {mock_ptb_matcher.user.tg_user_id}', )
+            mock_ptb_matcher.load_matches.assert_called_once_with(
+                matches=matches,
+                connection=mock_ptb_matcher.CRUD.db.borrow.return_value.__enter__.return_value,
+            )
+            far.prepare.assert_not_called()
+            prepared.prepare.assert_not_called()
+            nearest[1].prepare.assert_called_once_with()
+
+        @staticmethod
+        def test_submit_prefetch(mock_ptb_matcher: MagicMock, ):
+            mock_ptb_matcher.PREFETCH_COUNT, mock_ptb_matcher.PAGE_SIZE = 2, 2
+            mock_ptb_matcher.matches.current = ['foo', 'bar', 'baz', ]
+            app.tg.ptb.classes.matches.Matcher.submit_prefetch(self=mock_ptb_matcher, )
+            mock_ptb_matcher.prefetch_executor.submit.assert_called_once_with(
+                mock_ptb_matcher.prefetch_matches,
+                matches=['bar', 'baz', ],
+            )
+            assert mock_ptb_matcher.prefetch_job == mock_ptb_matcher.prefetch_executor.submit.return_value
+
+        @staticmethod
+        def test_submit_prefetch_disabled(mock_ptb_matcher: MagicMock, ):
+            for count, current in ((0, ['foo', ],), (2, [],),):
+                mock_ptb_matcher.PREFETCH_COUNT, mock_ptb_matcher.matches.current = count, current
+                app.tg.ptb.classes.matches.Matcher.submit_prefetch(self=mock_ptb_matcher, )
+            mock_ptb_matcher.prefetch_executor.submit.assert_not_called()
+
+        @staticmethod
+        def test_wait_prefetch(mock_ptb_matcher: MagicMock, patched_logger: MagicMock, ):
+            job, error = Future(), ValueError()
+            job.set_exception(error, )
+            mock_ptb_matcher.prefetch_job = job
+            app.tg.ptb.classes.matches.Matcher.wait_prefetch(self=mock_ptb_matcher, )
+            patched_logger.error.assert_called_once_with(error, )
+            assert mock_ptb_matcher.prefetch_job is None
+
+        @staticmethod
+        def test_get_match(mock_ptb_matcher: MagicMock, ):
+            with patch.object(app.models.matches.Matcher, 'get_match', autospec=True, ) as mock_super_get_match:
+                result = app.tg.ptb.classes.matches.Matcher.get_match(self=mock_ptb_matcher, )
+            mock_super_get_match.assert_called_once_with(self=mock_ptb_matcher, pop=True, )
+            assert mock_ptb_matcher.mock_calls == [call.wait_prefetch(), call.submit_prefetch(), ]
+            assert result == mock_super_get_match.return_value
+
+        @staticmethod
+        def test_prefetched(ptb_user_s: app.tg.ptb.classes.users.User, mock_tg_ptb_match: MagicMock, ):
+            """The real executor, the next match is prepared before the next get_match"""
+            matcher = app.tg.ptb.classes.matches.Matcher(user=ptb_user_s, )
+            mock_tg_ptb_match.media = None
+            matcher.matches.current = [mock_tg_ptb_match, ]
+            with (
+                patch.object(matcher, 'load_matches', autospec=True, ),
+                patch.object(matcher.CRUD.db, 'borrow', autospec=True, ) as mock_borrow,
+            ):
+                matcher.submit_prefetch()
+                matcher.wait_prefetch()
+            mock_borrow.assert_called_once_with(owner=f'prefetch {ptb_user_s.tg_user_id}', )
+            mock_tg_ptb_match.prepare.assert_called_once_with()
 
 
 class TestUser:
@@ -213,6 +321,7 @@ def test_handle_location_geo(mock_ptb_new_user_f: MagicMock, tg_location: tg_Loc
         )
         assert mock_ptb_new_user_f.country == 'Россия'
         assert mock_ptb_new_user_f.city == 'Ставропольский край'
+        assert (mock_ptb_new_user_f.latitude, mock_ptb_new_user_f.longitude,) == (45, 45,)
 
     class TestHandlePhotoText:
         @staticmethod
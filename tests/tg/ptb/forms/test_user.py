@@ -39,6 +39,7 @@ def test_convert_checkboxes_emojis(ptb_target_s: Target, monkeypatch, ):
             'photo': Target.UNCHECKED_EMOJI_CHECKBOX,
             'country': Target.UNCHECKED_EMOJI_CHECKBOX,
             'city': Target.UNCHECKED_EMOJI_CHECKBOX,
+            'nearby': Target.UNCHECKED_EMOJI_CHECKBOX,
         }
 
         assert actual == expected
@@ -48,8 +49,8 @@ def test_convert_checkboxes_emojis(ptb_target_s: Target, monkeypatch, ):
         argnames='checkboxes',
         argvalues=(
                 # Not all cases but ok
-                Target.Mapper.Matcher.Filters.Checkbox(age=True, photo=True, country=True, city=True, ),
-                Target.Mapper.Matcher.Filters.Checkbox(age=False, photo=False, country=False, city=False, )
+                Target.Mapper.Matcher.Filters.Checkbox(age=True, photo=True, country=True, city=True, nearby=True, ),
+                Target.Mapper.Matcher.Filters.Checkbox(age=False, photo=False, country=False, city=False, nearby=False, )
         ), )
     def test_get_checkboxes_keyboard(mock_ptb_target: MagicMock, checkboxes: Target.Mapper.Matcher.Filters.Checkbox, ):
         mock_ptb_target.filters.checkboxes = checkboxes
@@ -80,6 +81,13 @@ def test_get_checkboxes_keyboard(mock_ptb_target: MagicMock, checkboxes: Target.
                         callback_data=f"{CHECKBOX_CBK_S} photo",
                     ),
                 ],
+                [
+                    InlineKeyboardButton(
+                        text=f"{mock_ptb_target.convert_checkboxes_emojis.return_value['nearby']} "
+                             f"{constants.Search.Checkboxes.NEARBY}",
+                        callback_data=f"{CHECKBOX_CBK_S} nearby",
+                    ),
+                ],
             ]
         )
 
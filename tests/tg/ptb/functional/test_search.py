@@ -21,10 +21,14 @@
 from telegram import Update as tg_Update
 # noinspection PyPackageRequirements
 from telegram.ext import Dispatcher as tg_Dispatcher
+# noinspection PyPackageRequirements
+from telegram.ext.utils.promise import Promise
 
 from app.tg.ptb.classes.matches import Matcher
 import app.tg.ptb.config
 import app.tg.ptb.handlers_definition
+import app.tg.ptb.handlers.search
+import app.tg.ptb.utils
 
 from tests.tg.ptb.functional.utils import set_command_to_tg_message, get_text_cases, cancel_body
 
@@ -127,6 +131,29 @@ def test_target_checkboxes_handler(
     CLS_TO_TEST.checkboxes_handler.callback.assert_called_once()
 
 
+def test_searching_handler(tg_update_f: tg_Update, tg_dispatcher: tg_Dispatcher, monkeypatch, ):
+    """The background search is not done yet"""
+    CLS_TO_TEST.searching_handler.callback.reset_mock()
+    key = (tg_update_f.effective_chat.id, tg_update_f.effective_user.id)
+    CLS_TO_TEST.CH.conversations[key] = (4, Promise(pooled_function=lambda: 5, args=(), kwargs={}, ), )
+    monkeypatch.setattr(tg_update_f.effective_message, 'text', 'foo', )
+    tg_dispatcher.process_update(update=tg_update_f, )
+    CLS_TO_TEST.searching_handler.callback.assert_called_once()
+
+
+def test_search_done_without_matches(tg_update_f: tg_Update, tg_dispatcher: tg_Dispatcher, monkeypatch, ):
+    """The background search has ended the conversation, the next message is not a part of it"""
+    CLS_TO_TEST.confirm_handler.callback.reset_mock()
+    key = (tg_update_f.effective_chat.id, tg_update_f.effective_user.id)
+    promise = Promise(pooled_function=app.tg.ptb.utils.end_conversation, args=(), kwargs={}, )
+    promise.run()
+    CLS_TO_TEST.CH.conversations[key] = (4, promise, )
+    monkeypatch.setattr(tg_update_f.effective_message, 'text', app.constants.Search.TARGET_SHOW_CHOICE[0], )
+    tg_dispatcher.process_update(update=tg_update_f, )
+    CLS_TO_TEST.confirm_handler.callback.assert_not_called()
+    assert key not in CLS_TO_TEST.CH.conversations
+
+
 @pytest.mark.parametrize(argnames='text', argvalues=get_text_cases(texts=app.constants.Search.TARGET_SHOW_CHOICE))
 def test_target_confirm_handler(
         tg_update_f: tg_Update,
@@ -181,3 +208,11 @@ def test_cancel(
         callback=CLS_TO_TEST.cancel.callback,
         monkeypatch=monkeypatch,
     )
+
+
+def test_timeout_closes_session():
+    """Cancel and the timeout of the search return the pooled connection of the abandoned search"""
+    assert CLS_TO_TEST.create_cancel().callback is app.tg.ptb.handlers.search.cancel
+    ch = CLS_TO_TEST.create_ch(set_ch=False, )
+    timeout_handler, = ch.states[app.tg.ptb.handlers_definition.ConversationHandler.TIMEOUT]
+    assert timeout_handler.callback is CLS_TO_TEST.cancel.callback
@@ -101,6 +101,9 @@ def test_handlers_passed(mock_ptb_bot: MagicMock, mock_handler: MagicMock, ):
         error_handlers = [{'error_handler': create_autospec(spec=error_handler, spec_set=True, )}]
         with (
             patch.object(ptb_app, 'Updater', autospec=True, ) as mock_Updater,
+            patch.object(ptb_app, 'CustomDispatcher', autospec=True, ) as mock_CustomDispatcher,
+            patch.object(ptb_app, 'Queue', autospec=True, ) as mock_Queue,
+            patch.object(ptb_app, 'JobQueue', autospec=True, ) as mock_JobQueue,
             patch.object(ptb_app, 'ContextTypes', autospec=True, ) as mock_ContextTypes,
             patch.object(handlers_definition, 'get_regular_handlers', autospec=True, ) as mock_get_regular_handlers,
             patch.object(handlers_definition, 'get_chs', autospec=True, ) as mock_get_chs,
@@ -116,7 +119,16 @@ def test_handlers_passed(mock_ptb_bot: MagicMock, mock_handler: MagicMock, ):
             context=ptb_app.CustomCallbackContext,
             user_data=ptb_app.CustomUserData,
         )
-        mock_Updater.assert_called_once_with(bot=mock_ptb_bot, context_types=mock_ContextTypes.return_value, )
+        mock_CustomDispatcher.assert_called_once_with(
+            bot=mock_ptb_bot,
+            update_queue=mock_Queue.return_value,
+            job_queue=mock_JobQueue.return_value,
+            context_types=mock_ContextTypes.return_value,
+        )
+        mock_CustomDispatcher.return_value.job_queue.set_dispatcher.assert_called_once_with(
+            dispatcher=mock_CustomDispatcher.return_value,
+        )
+        mock_Updater.assert_called_once_with(dispatcher=mock_CustomDispatcher.return_value, workers=None, )
         mock_get_regular_handlers.assert_not_called()
         mock_get_chs.assert_not_called()
         mock_get_error_handlers.assert_not_called()
@@ -131,6 +143,9 @@ def test_handlers_passed(mock_ptb_bot: MagicMock, mock_handler: MagicMock, ):
     def test_handlers_not_passed(mock_ptb_bot: MagicMock, ):
         with (
             patch.object(ptb_app, 'Updater', autospec=True, ) as mock_Updater,
+            patch.object(ptb_app, 'CustomDispatcher', autospec=True, ) as mock_CustomDispatcher,
+            patch.object(ptb_app, 'Queue', autospec=True, ) as mock_Queue,
+            patch.object(ptb_app, 'JobQueue', autospec=True, ) as mock_JobQueue,
             patch.object(ptb_app, 'ContextTypes', autospec=True, ) as mock_ContextTypes,
             patch.object(handlers_definition, 'get_regular_handlers', autospec=True, ) as mock_get_regular_handlers,
             patch.object(handlers_definition, 'get_chs', autospec=True, ) as mock_get_chs,
@@ -142,7 +157,16 @@ def test_handlers_not_passed(mock_ptb_bot: MagicMock, ):
                 context=ptb_app.CustomCallbackContext,
                 user_data=ptb_app.CustomUserData,
             )
-        mock_Updater.assert_called_once_with(bot=mock_ptb_bot, context_types=mock_ContextTypes.return_value, )
+        mock_CustomDispatcher.assert_called_once_with(
+            bot=mock_ptb_bot,
+            update_queue=mock_Queue.return_value,
+            job_queue=mock_JobQueue.return_value,
+            context_types=mock_ContextTypes.return_value,
+        )
+        mock_CustomDispatcher.return_value.job_queue.set_dispatcher.assert_called_once_with(
+            dispatcher=mock_CustomDispatcher.return_value,
+        )
+        mock_Updater.assert_called_once_with(dispatcher=mock_CustomDispatcher.return_value, workers=None, )
         mock_get_regular_handlers.assert_called_once_with()
         mock_get_chs.assert_called_once_with()
         mock_get_error_handlers.assert_called_once_with()
@@ -169,6 +193,12 @@ def test_configure_app(
 ):
     with (
         patch.object(ptb_app.db_manager.Postgres, 'create_app_tables', autospec=True) as mock_create_app_tables,
+        patch.object(ptb_app.db_manager.Postgres, 'migrate', autospec=True) as mock_migrate,
+        patch.object(
+            ptb_app.db_manager.Postgres,
+            'create_pool_check_task',
+            autospec=True,
+        ) as mock_create_pool_check_task,
         patch.object(post, post_cls.__name__, autospec=True, ) as mock_post_cls,  # Patch class
         patch.object(
             ptb_app,
@@ -183,6 +213,8 @@ def test_configure_app(
             create_personal_default_collections=create_personal,
         )
     mock_create_app_tables.assert_called_once_with()
+    mock_migrate.assert_called_once_with()
+    mock_create_pool_check_task.assert_called_once_with()
     mock_create_default_collections_with_posts.assert_called_once_with(
         bot=ptb_app_config.bot,
         collections=collections,
@@ -101,6 +101,58 @@ def test_no_matches_with_filters(mock_tg_view_f: MagicMock, ):
     assert result == mock_tg_view_f.bot.send_message.return_value
 
 
+def test_searching(mock_tg_view_f: MagicMock, ):
+    result = View.Search.searching(self=mock_tg_view_f, )
+    mock_tg_view_f.bot.send_message.assert_called_once_with(
+        chat_id=mock_tg_view_f.tg_user_id,
+        text=constants.Search.Result.SEARCHING,
+    )
+    assert result == mock_tg_view_f.bot.send_message.return_value
+
+
+def test_still_searching(mock_tg_view_f: MagicMock, ):
+    result = View.Search.still_searching(self=mock_tg_view_f, )
+    mock_tg_view_f.bot.send_message.assert_called_once_with(
+        chat_id=mock_tg_view_f.tg_user_id,
+        text=constants.Search.Result.STILL_SEARCHING,
+    )
+    assert result == mock_tg_view_f.bot.send_message.return_value
+
+
+def test_partial_matches(mock_tg_view_f: MagicMock, ):
+    result = View.Search.partial_matches(self=mock_tg_view_f, )
+    mock_tg_view_f.bot.send_message.assert_called_once_with(
+        chat_id=mock_tg_view_f.tg_user_id,
+        text=constants.Search.Result.PARTIAL_MATCHES,
+    )
+    assert result == mock_tg_view_f.bot.send_message.return_value
+
+
+class TestSearchStages:
+    @staticmethod
+    def test_no_searches(mock_tg_view_f: MagicMock, ):
+        result = View.Search.search_stages(self=mock_tg_view_f, report={}, )
+        mock_tg_view_f.bot.send_message.assert_called_once_with(
+            chat_id=mock_tg_view_f.tg_user_id,
+            text=constants.Search.Result.NO_SEARCHES,
+        )
+        assert result == mock_tg_view_f.bot.send_message.return_value
+
+    @staticmethod
+    def test_report(mock_tg_view_f: MagicMock, ):
+        stats = {'count': 2, 'p50_ms': 1, 'p95_ms': 2.25, 'p99_ms': 3, 'rows': 4, 'round_trips': 1.5, 'histogram': [], }
+        result = View.Search.search_stages(self=mock_tg_view_f, report={'covotes': stats, 'total': stats, }, )
+        mock_tg_view_f.bot.send_message.assert_called_once_with(
+            chat_id=mock_tg_view_f.tg_user_id,
+            text=(
+                f"{constants.Search.Result.SEARCH_STAGES.format(SEARCHES_COUNT=2, )}\n"
+                f"covotes: 1.0 / 2.2 / 3.0, 4, 1.5\n"
+                f"total: 1.0 / 2.2 / 3.0, 4, 1.5"
+            ),
+        )
+        assert result == mock_tg_view_f.bot.send_message.return_value
+
+
 def test_say_search_hello(mock_tg_view_f: MagicMock, ):
     result = View.Search.say_search_hello(self=mock_tg_view_f, )
     mock_tg_view_f.bot.send_message.assert_called_once_with(